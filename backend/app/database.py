@@ -1,5 +1,11 @@
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from collections import deque
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # 1. BUSCAR URL DE LA NUBE O USAR LOCAL
@@ -12,15 +18,127 @@ SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./crm_database.db
 if SQLALCHEMY_DATABASE_URL and SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
     SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-# 3. CREAR EL MOTOR (DETECTANDO SI ES SQLITE O POSTGRES)
-if "sqlite" in SQLALCHEMY_DATABASE_URL:
-    # Configuración específica para SQLite (local)
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-    )
-else:
-    # Configuración para PostgreSQL (nube)
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# 3. PERFILES DEL MOTOR (DB_PERFIL: "produccion" por defecto, "desarrollo" para trabajar en local)
+# Cualquier valor se puede ajustar con su variable: DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+# DB_POOL_RECYCLE y DB_STATEMENT_TIMEOUT_MS (solo PostgreSQL; 0 = sin límite)
+PERFILES = {
+    "desarrollo": {"pool_size": 5, "max_overflow": 5, "pool_timeout": 10, "pool_recycle": 1800, "statement_timeout_ms": 0},
+    # 10 + 20 conexiones: por debajo de los 40 hilos de FastAPI y de los 97 que da el plan básico de Render
+    "produccion": {"pool_size": 10, "max_overflow": 20, "pool_timeout": 10, "pool_recycle": 1800, "statement_timeout_ms": 30000},
+}
+DB_PERFIL = os.getenv("DB_PERFIL", "produccion")
+
+def perfil_motor(nombre: str = DB_PERFIL) -> dict:
+    if nombre not in PERFILES:
+        raise ValueError(f"DB_PERFIL desconocido: {nombre} (opciones: {', '.join(PERFILES)})")
+    return {clave: int(os.getenv(f"DB_{clave.upper()}", valor)) for clave, valor in PERFILES[nombre].items()}
+
+# SQLite: WAL para que las lecturas no esperen a las escrituras, synchronous=NORMAL (seguro con WAL),
+# ficheros mapeados en memoria y espera en vez de "database is locked" si otro hilo está escribiendo
+PRAGMAS_SQLITE = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+}
+
+
+# 4. MÉTRICAS DEL POOL (GET /db/metricas): cuánto se espera por una conexión y cuánto se llena
+class PoolMedido(QueuePool):
+    """QueuePool que mide la espera de cada checkout, los que se quedan sin conexión y el máximo en uso"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.medidas = MedidasPool()
+
+    def connect(self):
+        inicio = time.perf_counter()
+        try:
+            conexion = super().connect()
+        except TimeoutError:
+            self.medidas.agotado()
+            raise
+        self.medidas.checkout(time.perf_counter() - inicio, self.checkedout())
+        return conexion
+
+    def recreate(self):
+        nuevo = super().recreate()
+        nuevo.medidas = self.medidas
+        return nuevo
+
+    def metricas(self) -> dict:
+        capacidad = self.size() + self._max_overflow
+        return {
+            "pool_size": self.size(),
+            "max_overflow": self._max_overflow,
+            "en_uso": self.checkedout(),
+            "saturacion": round(self.checkedout() / capacidad, 3),
+            **self.medidas.resumen(capacidad),
+        }
+
+
+class MedidasPool:
+    def __init__(self, ventana: int = 2000):
+        self._lock = threading.Lock()
+        self._esperas = deque(maxlen=ventana)  # Las últimas, para el p95
+        self.checkouts = 0
+        self.agotados = 0
+        self.espera_total = 0.0
+        self.maximo_en_uso = 0
+
+    def checkout(self, espera: float, en_uso: int):
+        with self._lock:
+            self.checkouts += 1
+            self.espera_total += espera
+            self._esperas.append(espera)
+            self.maximo_en_uso = max(self.maximo_en_uso, en_uso)
+
+    def agotado(self):
+        with self._lock:
+            self.agotados += 1
+
+    def resumen(self, capacidad: int) -> dict:
+        with self._lock:
+            esperas = sorted(self._esperas)
+            return {
+                "maximo_en_uso": self.maximo_en_uso,
+                "saturacion_maxima": round(self.maximo_en_uso / capacidad, 3),
+                "checkouts": self.checkouts,
+                "agotados": self.agotados,
+                "espera_media_ms": round(self.espera_total / (self.checkouts or 1) * 1000, 3),
+                "espera_p95_ms": round(esperas[int(len(esperas) * 0.95)] * 1000, 3) if esperas else 0.0,
+            }
+
+
+# 5. CREAR EL MOTOR (DETECTANDO SI ES SQLITE O POSTGRES)
+def aplicar_pragmas_sqlite(motor):
+    @event.listens_for(motor, "connect")
+    def _pragmas_sqlite(conexion_dbapi, registro):
+        cursor = conexion_dbapi.cursor()
+        for pragma, valor in PRAGMAS_SQLITE.items():
+            cursor.execute(f"PRAGMA {pragma}={valor}")
+        cursor.close()
+
+def crear_motor(url: str = SQLALCHEMY_DATABASE_URL, perfil: str = DB_PERFIL):
+    opciones = perfil_motor(perfil)
+    pool = dict(poolclass=PoolMedido, pool_size=opciones["pool_size"], max_overflow=opciones["max_overflow"],
+                pool_timeout=opciones["pool_timeout"])
+    if "sqlite" in url:
+        # Configuración específica para SQLite (local)
+        if ":memory:" in url or url.rstrip("/").endswith("sqlite:"):
+            return create_engine(url, connect_args={"check_same_thread": False})
+        motor = create_engine(url, connect_args={"check_same_thread": False}, **pool)
+        aplicar_pragmas_sqlite(motor)
+        return motor
+
+    # Configuración para PostgreSQL (nube): comprobar la conexión antes de usarla (Render corta las inactivas)
+    # y renovarla cada pool_recycle segundos; ninguna consulta puede pasar de statement_timeout
+    argumentos = {}
+    if opciones["statement_timeout_ms"]:
+        argumentos["options"] = f"-c statement_timeout={opciones['statement_timeout_ms']}"
+    return create_engine(url, pool_pre_ping=True, pool_recycle=opciones["pool_recycle"], connect_args=argumentos, **pool)
+
+engine = crear_motor()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -30,4 +148,89 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# 6. ACCESO ASÍNCRONO (get_async_db): las lecturas más pedidas (clientes, contratos, facturas,
+# renovaciones, dashboard) esperan a la base de datos sin ocupar un hilo del pool de FastAPI.
+# Mismo perfil, pragmas y métricas que el motor síncrono; drivers aiosqlite y asyncpg.
+# El motor se crea con la primera petición que lo usa.
+# SQLite va sin pool (NullPool): aiosqlite abre un hilo que no es daemon por conexión, y las que
+# se quedan en el pool impiden que termine un proceso que use get_async_db fuera del lifespan
+# (scripts, benchmarks). Abrir un fichero SQLite es barato; sin pool no hay métricas ({}).
+class PoolMedidoAsync(PoolMedido, AsyncAdaptedQueuePool):
+    pass
+
+def url_async(url: str):
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    consulta = dict(url.query)
+    if "sslmode" in consulta:  # asyncpg lo llama "ssl"
+        consulta["ssl"] = consulta.pop("sslmode")
+    return url.set(drivername="postgresql+asyncpg", query=consulta)
+
+def crear_motor_async(url: str = SQLALCHEMY_DATABASE_URL, perfil: str = DB_PERFIL):
+    opciones = perfil_motor(perfil)
+    pool = dict(poolclass=PoolMedidoAsync, pool_size=opciones["pool_size"], max_overflow=opciones["max_overflow"],
+                pool_timeout=opciones["pool_timeout"])
+    url = url_async(url)
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            return create_async_engine(url)
+        motor = create_async_engine(url, poolclass=NullPool)
+        aplicar_pragmas_sqlite(motor.sync_engine)
+        return motor
+
+    argumentos = {}
+    if opciones["statement_timeout_ms"]:
+        argumentos["server_settings"] = {"statement_timeout": str(opciones["statement_timeout_ms"])}
+    return create_async_engine(url, pool_pre_ping=True, pool_recycle=opciones["pool_recycle"],
+                               connect_args=argumentos, **pool)
+
+_motor_async = None
+_SesionAsync = None
+
+def motor_async():
+    global _motor_async, _SesionAsync
+    if _motor_async is None:
+        _motor_async = crear_motor_async()
+        _SesionAsync = async_sessionmaker(_motor_async, autoflush=False, expire_on_commit=False)
+    return _motor_async
+
+async def get_async_db():
+    motor_async()
+    async with _SesionAsync() as db:
+        yield db
+
+def metricas_motor_async() -> dict:
+    """Métricas del pool asíncrono ({} si todavía no se ha usado)"""
+    if _motor_async is None or not hasattr(_motor_async.pool, "metricas"):
+        return {}
+    return _motor_async.pool.metricas()
+
+async def cerrar_motor_async():
+    global _motor_async, _SesionAsync
+    if _motor_async is not None:
+        await _motor_async.dispose()
+        _motor_async, _SesionAsync = None, None
+
+
+# 7. MIGRACIONES (Alembic, carpeta migrations/): sustituyen a models.Base.metadata.create_all.
+# La API y los scripts de importación llaman a migrar_bd() al arrancar. Con varios workers de
+# PostgreSQL solo migra uno (bloqueo en migrations/env.py); el resto espera y no encuentra nada.
+CARPETA_BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def configuracion_alembic(conexion=None):
+    from alembic.config import Config
+    config = Config(os.path.join(CARPETA_BACKEND, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(CARPETA_BACKEND, "migrations"))
+    config.attributes["connection"] = conexion
+    return config
+
+def migrar_bd(motor=None, revision: str = "head"):
+    """Aplica las migraciones pendientes hasta `revision` sobre `motor` (por defecto, el de la API)"""
+    from alembic import command
+    with (motor or engine).connect() as conexion:
+        command.upgrade(configuracion_alembic(conexion), revision)
+        conexion.commit()
@@ -0,0 +1,164 @@
+"""
+Caché del asistente text-to-SQL (/ia/consultar)
+Cada pregunta cuesta dos llamadas a Gemini (generar el SQL y explicar el resultado)
+y el equipo repite a menudo las mismas preguntas. Dos niveles, compartidos entre usuarios:
+  • SQL: clave = pregunta normalizada + versión del esquema. No caduca (LRU acotada):
+    el SQL solo cambia si cambian las tablas, y entonces cambia la versión.
+  • Respuesta: clave = pregunta normalizada + versión del esquema + sello de datos.
+    El sello sube con cada commit del ORM que toque datos (como la caché del dashboard)
+    y además caduca a los IA_CACHE_RESPUESTA_TTL segundos por las escrituras que no pasan
+    por el ORM (importaciones masivas, otros procesos).
+La normalización (minúsculas, sin tildes ni signos, sin fórmulas de cortesía) hace que
+"¿Cuántos clientes hay?" y "cuantos clientes hay por favor" compartan entrada.
+"""
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, Optional
+from cachetools import LRUCache, TTLCache
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from text_unidecode import unidecode
+from app.ia_sql import MODELOS_CONSULTABLES
+
+MAX_SQL = int(os.getenv("IA_CACHE_SQL_MAX", "512"))
+MAX_RESPUESTAS = int(os.getenv("IA_CACHE_RESPUESTAS_MAX", "256"))
+TTL_RESPUESTA = int(os.getenv("IA_CACHE_RESPUESTA_TTL", "300"))  # segundos
+
+# Fórmulas que no cambian la pregunta (ya sin tildes ni signos)
+_RELLENO = re.compile(
+    r"\b(por favor|porfa|hola|gracias|dime|me (puedes|podrias) decir|(puedes|podrias) decirme|"
+    r"quiero saber|necesito saber|me gustaria saber)\b"
+)
+_NO_ALFANUMERICO = re.compile(r"[^a-z0-9]+")
+
+
+def normalizar_pregunta(texto: str) -> str:
+    texto = unidecode(texto or "").lower()
+    texto = _NO_ALFANUMERICO.sub(" ", texto)
+    return " ".join(_RELLENO.sub(" ", texto).split())
+
+
+def version_esquema(descripcion: str) -> str:
+    """Huella del esquema que ve el modelo: si cambian las tablas, el SQL cacheado deja de valer"""
+    return hashlib.sha256(descripcion.encode("utf-8")).hexdigest()[:12]
+
+
+class _Contadores:
+    def __init__(self):
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def resumen(self, cache) -> Dict:
+        consultas = self.aciertos + self.fallos
+        return {
+            "entradas": len(cache), "capacidad": cache.maxsize,
+            "aciertos": self.aciertos, "fallos": self.fallos, "expulsiones": self.expulsiones,
+            "tasa_aciertos": round(self.aciertos / consultas, 3) if consultas else 0.0,
+        }
+
+
+class _LRU(LRUCache):
+    def __init__(self, maxsize, contadores: _Contadores):
+        super().__init__(maxsize)
+        self.contadores = contadores
+
+    def popitem(self):  # cachetools lo llama al expulsar la menos usada
+        self.contadores.expulsiones += 1
+        return super().popitem()
+
+
+class _TTL(TTLCache):
+    def __init__(self, maxsize, ttl, contadores: _Contadores):
+        super().__init__(maxsize, ttl)
+        self.contadores = contadores
+
+    def popitem(self):  # Llena: fuera la menos usada (las caducadas se descartan sin contar)
+        self.contadores.expulsiones += 1
+        return super().popitem()
+
+
+def _vaciar(cache):
+    # clear() de MutableMapping va llamando a popitem: se borra clave a clave para no contarlo como expulsiones
+    for clave in list(cache.keys()):
+        del cache[clave]
+
+
+class CacheTextoSQL:
+    def __init__(self, max_sql: int = MAX_SQL, max_respuestas: int = MAX_RESPUESTAS, ttl: int = TTL_RESPUESTA):
+        self._lock = threading.Lock()
+        self.stats_sql = _Contadores()
+        self.stats_respuestas = _Contadores()
+        self._sql = _LRU(max_sql, self.stats_sql)
+        self._respuestas = _TTL(max_respuestas, ttl, self.stats_respuestas)
+        self.version_datos = 0
+
+    def _buscar(self, cache, clave, contadores: _Contadores):
+        with self._lock:
+            valor = cache.get(clave)
+            if valor is None:
+                contadores.fallos += 1
+            else:
+                contadores.aciertos += 1
+            return valor
+
+    def sql(self, pregunta: str, version: str) -> Optional[str]:
+        return self._buscar(self._sql, (pregunta, version), self.stats_sql)
+
+    def guardar_sql(self, pregunta: str, version: str, sql: str):
+        with self._lock:
+            self._sql[(pregunta, version)] = sql
+
+    def respuesta(self, pregunta: str, version: str, sello: int) -> Optional[str]:
+        return self._buscar(self._respuestas, (pregunta, version, sello), self.stats_respuestas)
+
+    def guardar_respuesta(self, pregunta: str, version: str, sello: int, respuesta: str):
+        with self._lock:
+            if sello == self.version_datos:  # Si hubo escrituras mientras se respondía, ya nació vieja
+                self._respuestas[(pregunta, version, sello)] = respuesta
+
+    def datos_modificados(self):
+        """Sube el sello de datos: las respuestas anteriores dejan de encontrarse (el SQL se conserva)"""
+        with self._lock:
+            self.version_datos += 1
+            _vaciar(self._respuestas)
+
+    def vaciar(self):
+        with self._lock:
+            _vaciar(self._sql)
+            _vaciar(self._respuestas)
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            self._respuestas.expire()
+            return {
+                "sql": self.stats_sql.resumen(self._sql),
+                "respuestas": {**self.stats_respuestas.resumen(self._respuestas), "ttl_segundos": self._respuestas.ttl},
+                "version_datos": self.version_datos,
+            }
+
+
+cache_ia = CacheTextoSQL()
+
+
+# --- Sello de datos: cualquier commit del ORM que toque las tablas consultables lo sube ---
+# (escribir en otras, como trabajos o colas, no cambia las respuestas del asistente)
+@event.listens_for(Session, "after_flush")
+def _marcar_sesion_modificada(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, MODELOS_CONSULTABLES):
+            session.info["ia_datos_sucios"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _subir_sello_tras_commit(session):
+    if session.info.pop("ia_datos_sucios", False):
+        cache_ia.datos_modificados()
+
+
+@event.listens_for(Session, "after_rollback")
+def _limpiar_marca_tras_rollback(session):
+    session.info.pop("ia_datos_sucios", None)
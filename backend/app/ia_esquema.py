@@ -0,0 +1,183 @@
+"""
+Esquema que ve el modelo en /ia/consultar
+Antes el prompt solo decía "Tablas: clientes, contratos, ..." y Gemini adivinaba los
+nombres de las columnas; cada SQL fallido era una pregunta perdida. Aquí:
+  • describir_estructura(): columnas, tipos, claves primarias y foráneas de las
+    TABLAS_CONSULTABLES, sacadas de models.Base.metadata en una línea por tabla
+  • muestras de valores para las columnas de texto con pocos valores distintos
+    (estado, tipo_cliente, comercializadora...), leídas con el motor de solo lectura
+    sobre las últimas FILAS_MUESTRA filas
+  • esquema_ia(): se calcula una vez (al arrancar, desde el lifespan) y se guarda por
+    la huella de la estructura; su `version` es la que usa la caché de SQL
+  • metricas_ia: llamadas al modelo por pregunta respondida y reparaciones (el SQL
+    que falla se le devuelve al modelo con el error una sola vez)
+"""
+import datetime
+import decimal
+import functools
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from sqlalchemy import func, select
+from app.ia_cache import version_esquema
+from app.ia_sql import MODELOS_CONSULTABLES, motor_lectura
+
+logger = logging.getLogger(__name__)
+
+MAX_VALORES = int(os.getenv("IA_ESQUEMA_MAX_VALORES", "8"))  # Con más valores distintos la columna no se enumera
+FILAS_MUESTRA = int(os.getenv("IA_ESQUEMA_FILAS_MUESTRA", "5000"))
+LARGO_MAXIMO_VALOR = 40
+
+_TIPOS = {
+    bool: "bool", int: "int", float: "num", decimal.Decimal: "num", str: "texto",
+    datetime.date: "fecha", datetime.datetime: "fecha_hora",
+}
+_DIALECTOS = {"sqlite": "SQLite", "postgresql": "PostgreSQL"}
+
+
+def _tipo(columna) -> str:
+    try:
+        return _TIPOS.get(columna.type.python_type, columna.type.python_type.__name__)
+    except NotImplementedError:
+        return str(columna.type).lower()
+
+
+def _columnas(modelo):
+    return list(modelo.__table__.columns)
+
+
+def _describir_columna(columna, valores: Optional[List[str]] = None) -> str:
+    texto = f"{columna.name} {_tipo(columna)}"
+    if columna.primary_key:
+        texto += " PK"
+    for fk in columna.foreign_keys:
+        texto += f" FK→{fk.target_fullname}"
+    if valores:
+        texto += " (" + "|".join(f"'{v}'" for v in valores) + ")"
+    return texto
+
+
+def _describir(modelos, muestras: Dict[str, Dict[str, List[str]]]) -> str:
+    lineas = []
+    for modelo in modelos:
+        tabla = modelo.__tablename__
+        columnas = ", ".join(_describir_columna(c, muestras.get(tabla, {}).get(c.name)) for c in _columnas(modelo))
+        lineas.append(f"{tabla}({columnas})")
+    return "\n".join(lineas)
+
+
+@functools.lru_cache(maxsize=8)
+def describir_estructura(modelos=MODELOS_CONSULTABLES) -> str:
+    """Solo la estructura (sin datos): su huella identifica el esquema"""
+    return _describir(modelos, {})
+
+
+def _candidatas(modelo):
+    # Texto, sin clave única ni primaria: las que pueden ser categorías (estado, provincia...)
+    return [c for c in _columnas(modelo)
+            if _tipo(c) == "texto" and not c.primary_key and not c.unique and not c.foreign_keys]
+
+
+def muestrear_valores(engine, modelos=MODELOS_CONSULTABLES) -> Dict[str, Dict[str, List[str]]]:
+    """{tabla: {columna: valores}} de las columnas de texto con hasta MAX_VALORES valores distintos"""
+    muestras = {}
+    with engine.connect() as conn:
+        for modelo in modelos:
+            # Las últimas FILAS_MUESTRA filas por clave primaria (un LIMIT a secas recorrería el índice
+            # de la columna, si lo tiene, y solo vería su primer valor)
+            pk = list(modelo.__table__.primary_key.columns)[0]
+            ultimo = conn.execute(select(func.max(pk))).scalar() or 0
+            for columna in _candidatas(modelo):
+                recientes = select(columna).where(pk > ultimo - FILAS_MUESTRA).subquery()
+                c = recientes.c[columna.name]
+                consulta = select(c).where(c.isnot(None)).group_by(c).order_by(c).limit(MAX_VALORES + 1)
+                valores = [v for (v,) in conn.execute(consulta)]
+                if 0 < len(valores) <= MAX_VALORES and all(len(str(v)) <= LARGO_MAXIMO_VALOR for v in valores):
+                    muestras.setdefault(modelo.__tablename__, {})[columna.name] = [str(v).replace("'", "''") for v in valores]
+    return muestras
+
+
+@dataclass
+class EsquemaIA:
+    texto: str  # Lo que va en el prompt
+    version: str  # Clave de la caché de SQL: cambia si cambia la estructura o las muestras
+    huella: str  # Huella de la estructura
+    dialecto: str
+    segundos: float = 0.0
+
+
+_por_huella: Dict[str, EsquemaIA] = {}
+_lock = threading.Lock()
+
+
+def esquema_ia(engine=None, modelos=MODELOS_CONSULTABLES) -> EsquemaIA:
+    """Esquema precalculado; se calcula (una vez por huella) si aún no lo está"""
+    estructura = describir_estructura(modelos)
+    huella = version_esquema(estructura)
+    esquema = _por_huella.get(huella)
+    if esquema is not None:
+        return esquema
+    with _lock:
+        if huella in _por_huella:
+            return _por_huella[huella]
+        inicio = time.perf_counter()
+        dialecto = "SQL"
+        try:
+            engine = engine or motor_lectura()
+            dialecto = _DIALECTOS.get(engine.dialect.name, engine.dialect.name)
+            muestras = muestrear_valores(engine, modelos)
+        except Exception as e:
+            # Sin muestras también sirve; no se guarda para volver a intentarlo en la siguiente pregunta
+            logger.warning(f"⚠️ No se pudieron leer valores de ejemplo para el esquema de IA: {e}")
+            return EsquemaIA(estructura, version_esquema(estructura), huella, dialecto)
+        texto = _describir(modelos, muestras)
+        esquema = EsquemaIA(texto, version_esquema(texto), huella, dialecto, time.perf_counter() - inicio)
+        _por_huella[huella] = esquema
+        logger.info(f"🧭 Esquema de IA calculado en {esquema.segundos * 1000:.0f} ms "
+                    f"({len(texto)} caracteres, huella {huella})")
+        return esquema
+
+
+def olvidar_esquema():
+    """Para recalcular las muestras (p. ej. tras una importación que añade estados nuevos)"""
+    with _lock:
+        _por_huella.clear()
+
+
+class MetricasAsistente:
+    """Llamadas al modelo por pregunta respondida: lo que cuesta cada respuesta del asistente"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.preguntas = 0
+        self.respondidas = 0
+        self.desde_cache = 0
+        self.llamadas_modelo = 0
+        self.reparaciones = 0
+        self.reparaciones_ok = 0
+
+    def registrar(self, llamadas: int, respondida: bool, desde_cache: bool = False,
+                  reparada: Optional[bool] = None):
+        with self._lock:
+            self.preguntas += 1
+            self.respondidas += respondida
+            self.desde_cache += desde_cache
+            self.llamadas_modelo += llamadas
+            if reparada is not None:
+                self.reparaciones += 1
+                self.reparaciones_ok += reparada
+
+    def resumen(self) -> Dict:
+        with self._lock:
+            return {
+                "preguntas": self.preguntas, "respondidas": self.respondidas, "desde_cache": self.desde_cache,
+                "llamadas_modelo": self.llamadas_modelo,
+                "llamadas_por_respuesta": round(self.llamadas_modelo / self.respondidas, 3) if self.respondidas else None,
+                "reparaciones": self.reparaciones, "reparaciones_ok": self.reparaciones_ok,
+            }
+
+
+metricas_ia = MetricasAsistente()
@@ -0,0 +1,144 @@
+"""
+Capa asíncrona para los modelos de IA (Gemini y Claude)
+Los endpoints `async def` no deben llamar a ask_gemini/ask_claude: son síncronos y
+bloquean el bucle de eventos de uvicorn mientras el modelo responde (segundos), así
+que todas las demás peticiones esperan. Aquí:
+  • se usan los clientes asíncronos nativos (generate_content_async, AsyncAnthropic):
+    la espera no ocupa ni el bucle ni un hilo
+  • un semáforo por proveedor limita las llamadas simultáneas (cuota de la API)
+  • cada llamada tiene un timeout total (cola del semáforo incluida); al vencer, o si
+    el cliente HTTP se va, la tarea se cancela y el semáforo se libera
+  • el trabajo de CPU o bloqueante de estos endpoints (leer el PDF, la consulta SQL)
+    va a en_hilo(), un pool propio y acotado que no compite con los endpoints síncronos
+"""
+import asyncio
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+TIMEOUT_SEGUNDOS = float(os.getenv("IA_TIMEOUT_SEGUNDOS", "30"))
+HILOS = int(os.getenv("IA_HILOS", "4"))
+
+GEMINI = "gemini"
+CLAUDE = "claude"
+MODELO_CLAUDE = "claude-sonnet-4-5-20250929"
+
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+class ErrorIA(Exception):
+    """El modelo falló, no respondió a tiempo o no está configurado"""
+
+
+async def _llamar_gemini(prompt: str, max_tokens: int, timeout: float) -> str:
+    import google.generativeai as genai
+    from app.gemini_service import model  # Configura la API key al importarse
+
+    respuesta = await model.generate_content_async(
+        prompt,
+        generation_config=genai.types.GenerationConfig(max_output_tokens=max_tokens),
+        request_options={"timeout": timeout},
+    )
+    return respuesta.text
+
+
+@functools.lru_cache(maxsize=1)
+def _cliente_claude():
+    from anthropic import AsyncAnthropic
+    return AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+
+
+async def _llamar_claude(prompt: str, max_tokens: int, timeout: float) -> str:
+    respuesta = await _cliente_claude().messages.create(
+        model=MODELO_CLAUDE,
+        max_tokens=max_tokens,
+        messages=[{"role": "user", "content": prompt}],
+        timeout=timeout,
+    )
+    return respuesta.content[0].text
+
+
+@dataclass
+class Proveedor:
+    nombre: str
+    llamar: Callable[[str, int, float], Awaitable[str]]  # (prompt, max_tokens, timeout) -> texto
+    concurrencia: int
+    en_curso: int = 0
+    en_espera: int = 0
+    _semaforo: Optional[asyncio.Semaphore] = field(default=None, repr=False)
+    _bucle: Optional[asyncio.AbstractEventLoop] = field(default=None, repr=False)
+
+    def semaforo(self) -> asyncio.Semaphore:
+        # Un semáforo pertenece a un bucle de eventos: se crea con el primero que lo usa
+        # (y de nuevo si cambia, p. ej. entre TestClient y uvicorn)
+        bucle = asyncio.get_running_loop()
+        if self._bucle is not bucle:
+            self._semaforo, self._bucle = asyncio.Semaphore(self.concurrencia), bucle
+        return self._semaforo
+
+
+PROVEEDORES: Dict[str, Proveedor] = {
+    GEMINI: Proveedor("Gemini", _llamar_gemini, int(os.getenv("IA_GEMINI_CONCURRENCIA", "8"))),
+    CLAUDE: Proveedor("Claude", _llamar_claude, int(os.getenv("IA_CLAUDE_CONCURRENCIA", "4"))),
+}
+
+
+async def preguntar(proveedor: str, prompt: str, max_tokens: int = 1024, timeout: Optional[float] = None) -> str:
+    """Texto de la respuesta del modelo; lanza ErrorIA si falla o tarda más de `timeout` segundos"""
+    p = PROVEEDORES[proveedor]
+    timeout = timeout or TIMEOUT_SEGUNDOS
+    limite = time.monotonic() + timeout
+
+    async def con_semaforo():
+        p.en_espera += 1
+        try:
+            await p.semaforo().acquire()
+        finally:
+            p.en_espera -= 1
+        p.en_curso += 1
+        try:
+            return await p.llamar(prompt, max_tokens, max(limite - time.monotonic(), 0.1))
+        finally:
+            p.en_curso -= 1
+            p.semaforo().release()
+
+    try:
+        return await asyncio.wait_for(con_semaforo(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"⏱️ {p.nombre} no respondió en {timeout:g}s (quedan {p.en_curso} en curso, {p.en_espera} en cola)")
+        raise ErrorIA(f"{p.nombre} no respondió a tiempo")
+    except ErrorIA:
+        raise
+    except Exception as e:
+        raise ErrorIA(f"Error consultando a {p.nombre}: {str(e)}") from e
+
+
+async def preguntar_gemini(prompt: str, max_tokens: int = 1024, timeout: Optional[float] = None) -> str:
+    return await preguntar(GEMINI, prompt, max_tokens, timeout)
+
+
+async def preguntar_claude(prompt: str, max_tokens: int = 500, timeout: Optional[float] = None) -> str:
+    return await preguntar(CLAUDE, prompt, max_tokens, timeout)
+
+
+async def en_hilo(funcion: Callable, *args, **kwargs):
+    """Ejecuta código bloqueante (pypdf, consultas SQL) en el pool de IA sin parar el bucle de eventos"""
+    global _pool
+    if _pool is None:  # Se crea al primer uso (y de nuevo tras cerrar_pool)
+        _pool = ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix="ia")
+    return await asyncio.get_running_loop().run_in_executor(_pool, functools.partial(funcion, *args, **kwargs))
+
+
+def cerrar_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,351 @@
+"""
+Ejecución acotada del SQL que genera la IA (/ia/consultar)
+El SQL viene de un modelo: puede ser cualquier cosa. Antes se ejecutaba tal cual con
+la sesión de la API (solo se miraba si contenía DELETE o DROP). Ahora pasa por:
+  1. validar_select(): una sola sentencia SELECT/WITH, sin sentencias de escritura anidadas
+     (ej. un DELETE dentro de un CTE) ni funciones peligrosas (análisis léxico propio: respeta
+     cadenas y comentarios). Las palabras clave solo cuentan donde empieza una sentencia:
+     REPLACE(...) o un alias "do" son lecturas válidas
+  2. conexión de solo lectura (SQLite con mode=ro; PostgreSQL con la transacción en
+     READ ONLY) y solo las TABLAS_CONSULTABLES: en SQLite lo comprueba el autorizador
+     del propio motor; en PostgreSQL, las relaciones del plan (EXPLAIN)
+  3. coste estimado: en PostgreSQL el "Total Cost" del planificador; en SQLite las filas
+     que recorrería el plan (EXPLAIN QUERY PLAN y el tamaño de cada tabla). Por encima de
+     COSTE_MAXIMO_* se rechaza sin ejecutar (productos cartesianos, bucles sin índice)
+  4. timeout por sentencia (statement_timeout / progress handler de SQLite) y un LIMIT
+     envolvente; las filas se leen en streaming y nunca más de MAX_FILAS
+"""
+import math
+import os
+import re
+import sqlite3
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from app.modules.crm import models
+
+MAX_FILAS = int(os.getenv("IA_SQL_MAX_FILAS", "200"))
+TIMEOUT_SEGUNDOS = float(os.getenv("IA_SQL_TIMEOUT_SEGUNDOS", "5"))
+COSTE_MAXIMO_SQLITE = float(os.getenv("IA_SQL_COSTE_MAXIMO_SQLITE", "5000000"))  # Filas recorridas estimadas
+COSTE_MAXIMO_PG = float(os.getenv("IA_SQL_COSTE_MAXIMO_PG", "1000000"))  # Unidades de coste del planificador
+
+# Lo único que puede leer el asistente (users, colas, trabajos... quedan fuera)
+MODELOS_CONSULTABLES = (models.Cliente, models.Contrato, models.Factura, models.PuntoSuministro)
+TABLAS_CONSULTABLES = tuple(m.__tablename__ for m in MODELOS_CONSULTABLES)
+
+# Solo al principio de una (sub)sentencia; en cualquier otro sitio son nombres de función,
+# columnas o alias. Lo demás (SELECT ... INTO, escrituras que se escapen) lo paran la
+# conexión de solo lectura y el autorizador de SQLite
+SENTENCIAS_PROHIBIDAS = {
+    "insert", "update", "delete", "merge", "upsert", "replace", "drop", "alter", "create", "truncate",
+    "attach", "detach", "pragma", "vacuum", "reindex", "analyze", "grant", "revoke", "copy", "call",
+    "do", "execute", "lock", "listen", "notify", "savepoint", "release", "rollback", "commit",
+}
+FUNCIONES_PROHIBIDAS = {
+    "load_extension", "readfile", "writefile", "edit", "fts3_tokenizer", "zeroblob", "randomblob",
+    "pg_sleep", "pg_read_file", "pg_read_binary_file", "pg_ls_dir", "pg_stat_file", "lo_import", "lo_export",
+    "dblink", "dblink_exec", "pg_terminate_backend", "pg_cancel_backend", "set_config", "pg_reload_conf",
+    "query_to_xml", "current_setting",
+}
+
+_TOKEN = re.compile(r"""
+    (?P<comentario>--[^\n]*|/\*.*?\*/)
+  | (?P<cadena>'(?:[^']|'')*')
+  | (?P<identificador_citado>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+  | (?P<palabra>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<punto_y_coma>;)
+  | (?P<otro>\S)
+""", re.VERBOSE | re.DOTALL)
+
+
+class ConsultaRechazada(Exception):
+    """El SQL no es una consulta de lectura permitida, es demasiado costoso o tardó demasiado"""
+
+    def __init__(self, mensaje: str, reparable: bool = False):
+        super().__init__(mensaje)
+        self.reparable = reparable  # Error del propio SQL (columna inexistente, sintaxis...): el modelo puede corregirlo
+
+
+@dataclass
+class ResultadoConsulta:
+    columnas: List[str]
+    filas: List[tuple]
+    truncado: bool = False  # Había más de MAX_FILAS
+    coste: float = 0.0
+    segundos: float = 0.0
+    tablas: List[str] = field(default_factory=list)
+
+
+def extraer_sql(respuesta: str) -> str:
+    """El SQL de la respuesta del modelo, sin los ``` de markdown"""
+    return (respuesta or "").replace("```sql", "").replace("```", "").strip()
+
+
+def validar_select(sql: str) -> str:
+    """Devuelve la sentencia limpia (sin ';' final) o lanza ConsultaRechazada"""
+    sql = (sql or "").strip()
+    while sql.endswith(";"):
+        sql = sql[:-1].rstrip()
+    if not sql:
+        raise ConsultaRechazada("La consulta está vacía")
+
+    tokens = []  # (tipo, texto en minúsculas), sin comentarios
+    for token in _TOKEN.finditer(sql):
+        tipo = token.lastgroup
+        if tipo == "punto_y_coma":
+            raise ConsultaRechazada("Solo se admite una sentencia")
+        if tipo != "comentario":
+            tokens.append((tipo, token.group().lower()))
+    if not tokens or tokens[0] != ("palabra", "select") and tokens[0] != ("palabra", "with"):
+        raise ConsultaRechazada("Solo se admiten consultas SELECT")
+
+    profundidad = 0
+    for i, (tipo, texto) in enumerate(tokens):
+        siguiente = tokens[i + 1] if i + 1 < len(tokens) else (None, None)
+        if tipo == "palabra" and siguiente[1] == "(" and texto in FUNCIONES_PROHIBIDAS:
+            raise ConsultaRechazada(f"Función no permitida: {texto}")
+        if texto == "(":
+            profundidad += 1
+        elif texto == ")":
+            profundidad -= 1
+        # Empieza una sentencia: tras "(" (subconsulta o cuerpo de un CTE) o, en un WITH, tras
+        # el ")" del último CTE. Si le sigue otra palabra no es una llamada ni un alias suelto
+        anterior = tokens[i - 1][1] if i else None
+        inicio = anterior == "(" or (anterior == ")" and profundidad == 0)
+        if tipo == "palabra" and inicio and texto in SENTENCIAS_PROHIBIDAS and siguiente[0] == "palabra":
+            raise ConsultaRechazada(f"Sentencia no permitida en una consulta de lectura: {texto.upper()}")
+    return sql
+
+
+def _envolver(sql: str, limite: int) -> str:
+    # LIMIT por fuera: el motor deja de producir filas en cuanto tiene limite + 1 (para saber si se truncó)
+    # (saltos de línea: un comentario "--" al final de la consulta no se come el paréntesis)
+    return f"SELECT * FROM (\n{sql}\n) AS consulta_ia LIMIT {int(limite) + 1}"
+
+
+# --- Motor de solo lectura ---
+
+def crear_motor_lectura(url: str):
+    """SQLite: el mismo fichero abierto con mode=ro; PostgreSQL: sesiones en solo lectura por defecto"""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        ruta = url.database
+        if not ruta or ruta == ":memory:":
+            raise ValueError("El SQL de la IA necesita una base SQLite en fichero")
+        return create_engine(f"sqlite:///file:{os.path.abspath(ruta)}?mode=ro&uri=true",
+                             connect_args={"check_same_thread": False})
+    return create_engine(url, pool_pre_ping=True, pool_size=2, max_overflow=2,
+                         connect_args={"options": "-c default_transaction_read_only=on"})
+
+
+_motor = None
+
+
+def motor_lectura():
+    """IA_SQL_DATABASE_URL permite usar un rol de solo lectura o una réplica; si no, la base de la API"""
+    global _motor
+    if _motor is None:
+        from app.database import SQLALCHEMY_DATABASE_URL
+        _motor = crear_motor_lectura(os.getenv("IA_SQL_DATABASE_URL", SQLALCHEMY_DATABASE_URL))
+    return _motor
+
+
+# --- SQLite ---
+
+_ACCIONES_SQLITE = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+
+def nombres_cte(sql: str) -> set:
+    """Nombres definidos con WITH nombre [(columnas)] AS (...)"""
+    tokens = [(t.lastgroup, t.group()) for t in _TOKEN.finditer(sql) if t.lastgroup != "comentario"]
+    nombres = set()
+    for i, (tipo, texto) in enumerate(tokens):
+        if tipo != "palabra" or texto.lower() != "as" or i + 1 >= len(tokens) or tokens[i + 1][1] != "(":
+            continue
+        j = i - 1
+        if j >= 0 and tokens[j][1] == ")":  # Lista de columnas del CTE
+            while j >= 0 and tokens[j][1] != "(":
+                j -= 1
+            j -= 1
+        if j >= 0 and tokens[j][0] in ("palabra", "identificador_citado"):
+            nombres.add(tokens[j][1].strip('"`[]').lower())
+    return nombres
+
+
+def _autorizador(tablas_leidas: set, ctes: set):
+    def autorizar(accion, arg1, arg2, base, origen):
+        if accion not in _ACCIONES_SQLITE:
+            return sqlite3.SQLITE_DENY
+        if accion == sqlite3.SQLITE_READ:
+            if arg1 in TABLAS_CONSULTABLES:
+                tablas_leidas.add(arg1)
+            elif base is not None or arg1.lower() not in ctes:  # Los CTE de la propia consulta llegan sin base
+                return sqlite3.SQLITE_DENY
+        if accion == sqlite3.SQLITE_FUNCTION and (arg2 or "").lower() in FUNCIONES_PROHIBIDAS:
+            return sqlite3.SQLITE_DENY
+        return sqlite3.SQLITE_OK
+    return autorizar
+
+
+_FIN_FROM = {"where", "group", "order", "limit", "having", "union", "except", "intersect", "window", "on", "using",
+             "offset", "select"}
+_NO_ALIAS = _FIN_FROM | {"join", "inner", "left", "right", "full", "cross", "outer", "natural", "as"}
+
+
+def alias_tablas(sql: str) -> Dict[str, str]:
+    """
+    Nombre con el que aparece cada tabla en el plan de SQLite ("SCAN f" para FROM facturas f)
+    Recorre las listas FROM/JOIN (también las separadas por comas, el caso de los productos cartesianos).
+    """
+    tokens = [(t.lastgroup, t.group()) for t in _TOKEN.finditer(sql) if t.lastgroup != "comentario"]
+    alias, en_from, esperando_tabla = {}, False, False
+    for i, (tipo, texto) in enumerate(tokens):
+        baja = texto.lower()
+        if tipo == "palabra" and baja in ("from", "join"):
+            en_from = esperando_tabla = True
+        elif tipo == "palabra" and baja in _FIN_FROM:
+            en_from = esperando_tabla = False
+        elif texto == "," and en_from:
+            esperando_tabla = True
+        elif texto == "(":
+            esperando_tabla = False  # Subconsulta: sus tablas salen en su propio FROM
+        elif esperando_tabla and tipo in ("palabra", "identificador_citado"):
+            tabla = texto.strip('"`[]').lower()
+            alias[tabla] = tabla
+            siguiente = tokens[i + 1:i + 3]
+            if siguiente and siguiente[0][1].lower() == "as":
+                siguiente = siguiente[1:]
+            if siguiente and siguiente[0][0] in ("palabra", "identificador_citado") \
+                    and siguiente[0][1].lower() not in _NO_ALIAS:
+                alias[siguiente[0][1].strip('"`[]').lower()] = tabla
+            esperando_tabla = False
+    return alias
+
+
+def coste_plan_sqlite(plan: List[tuple], filas_tabla: Dict[str, int]) -> float:
+    """
+    Filas que recorrería el plan: los SCAN/SEARCH bajo un mismo padre son bucles anidados
+    (se multiplican); un SCAN cuesta las filas de la tabla, un SEARCH por índice ~log2(filas).
+    Las subconsultas correlacionadas se repiten por cada fila del bucle que las contiene.
+    `filas_tabla` va por el nombre que usa el plan (alias incluido); lo que no está (el resultado
+    de una subconsulta o CTE) cuenta como 1, porque su coste ya se suma en su propio subárbol.
+    """
+    hijos = defaultdict(list)
+    for id_, padre, _, detalle in plan:
+        hijos[padre].append((id_, detalle))
+
+    def coste(nodo: int) -> float:
+        bucle, extra = 1.0, 0.0
+        for id_, detalle in hijos[nodo]:
+            m = re.match(r"(SCAN|SEARCH) (?:TABLE )?(\w+)", detalle)
+            if m:
+                filas = max(filas_tabla.get(m.group(2).lower(), 1), 1)
+                bucle *= filas if m.group(1) == "SCAN" else math.log2(filas) + 1
+                extra += coste(id_)
+            else:
+                extra += coste(id_) * (bucle if "CORRELATED" in detalle else 1)
+        return bucle + extra
+    return coste(0)
+
+
+def _ejecutar_sqlite(conn, sql: str, limite: int, timeout: float, coste_maximo: float) -> ResultadoConsulta:
+    crudo = conn.connection.driver_connection
+    tablas_leidas, ctes = set(), nombres_cte(sql)
+    envuelta = _envolver(sql, limite)
+    try:
+        crudo.set_authorizer(_autorizador(tablas_leidas, ctes))
+        try:
+            plan = crudo.execute(f"EXPLAIN QUERY PLAN {envuelta}").fetchall()
+        finally:
+            crudo.set_authorizer(None)
+    except sqlite3.DatabaseError as e:
+        denegada = "not authorized" in str(e) or "prohibited" in str(e)
+        raise ConsultaRechazada(f"Consulta {'no permitida' if denegada else 'no válida'}: {str(e)}", reparable=not denegada)
+
+    # MAX(rowid) es una búsqueda en el árbol: tamaño aproximado de cada tabla sin contarla
+    filas_tabla = {t: crudo.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{t}"').fetchone()[0] for t in tablas_leidas}
+    coste = coste_plan_sqlite(plan, {nombre: filas_tabla[t] for nombre, t in alias_tablas(sql).items() if t in filas_tabla})
+    if coste > coste_maximo:
+        raise ConsultaRechazada(f"Consulta demasiado costosa (~{coste:,.0f} filas recorridas; máximo {coste_maximo:,.0f})",
+                                reparable=True)  # Casi siempre un JOIN sin condición
+
+    limite_tiempo = time.monotonic() + timeout
+    crudo.set_authorizer(_autorizador(set(), ctes))
+    crudo.set_progress_handler(lambda: 1 if time.monotonic() > limite_tiempo else 0, 10_000)
+    try:
+        cursor = crudo.execute(envuelta)
+        filas = cursor.fetchmany(limite + 1)
+        columnas = [c[0] for c in cursor.description or []]
+        cursor.close()
+    except sqlite3.OperationalError as e:
+        if "interrupted" in str(e):
+            raise ConsultaRechazada(f"La consulta superó {timeout:g}s")
+        raise ConsultaRechazada(f"Consulta no válida: {str(e)}", reparable=True)
+    finally:
+        crudo.set_progress_handler(None, 0)
+        crudo.set_authorizer(None)
+    return ResultadoConsulta(columnas, filas, coste=coste, tablas=sorted(tablas_leidas))
+
+
+# --- PostgreSQL ---
+
+def _relaciones(nodo: Dict) -> set:
+    relaciones = {nodo["Relation Name"]} if "Relation Name" in nodo else set()
+    for hijo in nodo.get("Plans", []):
+        relaciones |= _relaciones(hijo)
+    return relaciones
+
+
+def _ejecutar_postgres(conn, sql: str, limite: int, timeout: float, coste_maximo: float) -> ResultadoConsulta:
+    import json
+    envuelta = _envolver(sql, limite)
+    sin_parametros = conn.execution_options(no_parameters=True)  # Los '%' del SQL llegan tal cual al driver
+    with conn.begin():
+        conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout * 1000)}")
+        try:
+            plan = sin_parametros.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {envuelta}").scalar()
+        except Exception as e:
+            raise ConsultaRechazada(f"Consulta no válida: {str(e).splitlines()[0]}",
+                                    reparable="permission denied" not in str(e))
+        plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+        tablas = _relaciones(plan)
+        no_permitidas = sorted(tablas - set(TABLAS_CONSULTABLES))
+        if no_permitidas:
+            raise ConsultaRechazada(f"Tabla no permitida: {no_permitidas[0]}")
+        coste = float(plan["Total Cost"])
+        if coste > coste_maximo:
+            raise ConsultaRechazada(f"Consulta demasiado costosa (coste estimado {coste:,.0f}; máximo {coste_maximo:,.0f})",
+                                    reparable=True)
+        try:
+            resultado = sin_parametros.execution_options(stream_results=True).exec_driver_sql(envuelta)
+            filas = [tuple(f) for f in resultado.fetchmany(limite + 1)]
+            columnas = list(resultado.keys())
+            resultado.close()
+        except Exception as e:
+            if "statement timeout" in str(e):
+                raise ConsultaRechazada(f"La consulta superó {timeout:g}s")
+            raise ConsultaRechazada(f"Consulta no válida: {str(e).splitlines()[0]}", reparable=True)
+    return ResultadoConsulta(columnas, filas, coste=coste, tablas=sorted(tablas))
+
+
+def ejecutar_consulta_ia(sql: str, engine=None, limite: int = MAX_FILAS, timeout: float = TIMEOUT_SEGUNDOS,
+                         coste_maximo: Optional[float] = None) -> ResultadoConsulta:
+    """Valida y ejecuta el SQL del asistente; lanza ConsultaRechazada si no se puede ejecutar con seguridad"""
+    sql = validar_select(sql)
+    engine = engine or motor_lectura()
+    inicio = time.perf_counter()
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            resultado = _ejecutar_sqlite(conn, sql, limite, timeout, coste_maximo or COSTE_MAXIMO_SQLITE)
+        elif engine.dialect.name == "postgresql":
+            resultado = _ejecutar_postgres(conn, sql, limite, timeout, coste_maximo or COSTE_MAXIMO_PG)
+        else:
+            raise ConsultaRechazada(f"Motor no soportado para el asistente: {engine.dialect.name}")
+    resultado.truncado = len(resultado.filas) > limite
+    resultado.filas = resultado.filas[:limite]
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
@@ -1,17 +1,19 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Request
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Request, Query, Response, Body
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
 from datetime import date, timedelta
-from sqlalchemy import text
 
 import os
 import time
 import json
-import pypdf
-from io import BytesIO
+import shutil
+from contextlib import asynccontextmanager
 
 # Rate Limiting
 from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -19,20 +21,65 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
 # --- IMPORTS ---
-from app.database import engine, Base, get_db
+from app.database import engine, Base, get_db, get_async_db, cerrar_motor_async, metricas_motor_async, migrar_bd, DB_PERFIL
 from app.modules.crm import models, schemas
+from app.modules.crm.consultas import (
+    consulta_renovaciones_pendientes, consulta_procesos_atr, fila_renovacion, fila_proceso_atr, filtros_facturas
+)
+from app.modules.crm.dashboard import obtener_estadisticas_dashboard
+from app.modules.crm.pagination import paginar_keyset, filtros_rango_fechas, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
+from app.modules.dynamics365.escritura import encolar_cambio, escritura_activada, TrabajadorEscrituraD365
 from app.modules.auth import utils
 from app.modules.auth.utils import get_current_active_user, get_admin_user
+from app.modules.auth.hashing import hash_password, verificar_password, pool_hash
 # Asegúrate de tener estos archivos en sus carpetas (crm o erp)
-from app.modules.crm.pdf_generator import generar_pdf_factura
-from app.modules.crm.sepa_generator import generar_xml_sepa 
-from app.gemini_service import ask_gemini 
+from app.modules.crm.pdf_generator import datos_factura
+from app.modules.crm.cache_pdf import cache_pdf
+from app.modules.crm.facturas_lote import (
+    generar_lote, iterar_archivo, cerrar_pools, MAX_FACTURAS_LOTE, FORMATO_ZIP, FORMATO_PDF
+)
+from app.modules.crm.sepa_generator import generar_remesas, filtro_ids, EMPRESA_SEPA
+from app.modules.crm.sepa_validacion import validar_remesa
+from app.modules.trabajos.gestor import GestorTrabajos, encolar_trabajo, carpeta_entradas, ESTADO_COMPLETADO, ESTADO_ERROR
+from app.modules.trabajos.tipos import (
+    MANEJADORES, TIPO_REMESA_SEPA, TIPO_FACTURAS_PDF, TIPO_IMPORTAR_CARTERA, TIPO_IMPORTAR_DYNAMICS
+)
+from app.modules.dynamics365.sync import MODO_FULL, MODO_DELTA
+from app.ia_service import preguntar_gemini, en_hilo, cerrar_pool as cerrar_pool_ia
+from app.ia_cache import cache_ia, normalizar_pregunta
+from app.ia_sql import ConsultaRechazada, ejecutar_consulta_ia, extraer_sql
+from app.ia_esquema import esquema_ia, metricas_ia, olvidar_esquema
+from app.modules.energia.extractor_factura import analizar_pdf, UMBRAL_CONFIANZA as UMBRAL_CONFIANZA_FACTURA
+from app.modules.energia.tarifas import HORAS_EQUIVALENTES, comparar_cartera, ofertas_factura
 from datetime import date, timedelta 
 
-# Crear tablas (Esto actualizará la DB cuando reinicies)
-models.Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="ERP Modular Loviluz - Energy Suite")
+# Aplicar las migraciones pendientes (migrations/; esto actualizará la DB cuando reinicies)
+migrar_bd()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from app.database import SessionLocal
+    # Cola de salida a Dynamics 365: los endpoints solo encolan, este hilo envía
+    trabajador = None
+    if escritura_activada():
+        from app.modules.dynamics365.connector import Dynamics365Connector
+        trabajador = TrabajadorEscrituraD365(SessionLocal, Dynamics365Connector)
+        trabajador.start()
+    # Trabajos en segundo plano (/jobs): los endpoints encolan, este pool de hilos los ejecuta
+    gestor_trabajos = GestorTrabajos(SessionLocal, MANEJADORES)
+    gestor_trabajos.iniciar()
+    # Esquema del asistente de IA (columnas y valores de ejemplo): se calcula una vez, no en cada pregunta
+    await en_hilo(esquema_ia)
+    yield
+    gestor_trabajos.parar()
+    if trabajador:
+        trabajador.parar()
+    cerrar_pools()  # Procesos de los PDF en bloque
+    cerrar_pool_ia()
+    pool_hash.cerrar()
+    await cerrar_motor_async()
+
+app = FastAPI(title="ERP Modular Loviluz - Energy Suite", lifespan=lifespan)
 
 # --- 1. LOGS DE AUDITORÍA (Middleware) ---
 @app.middleware("http")
@@ -69,6 +116,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor"],  # Metadatos de paginación
 )
 
 # --- ESQUEMAS AUTH & CHAT ---
@@ -92,29 +140,52 @@ class UserRoleUpdate(BaseModel):
 # 🔐 ZONA AUTH & GOBERNANZA
 # ==========================================
 
+# /register y /login son async: argon2 va al pool de hash (app/modules/auth/hashing.py) y
+# la base de datos al pool de hilos, que así no se queda ocupado esperando a los hashes
+def buscar_usuario(db: Session, email: str) -> Optional[models.User]:
+    usuario = db.query(models.User).filter(models.User.email == email).first()
+    db.close()  # Suelta la conexión antes del hash: si no, cada login en cola retiene una del pool y el CRM se queda sin ellas
+    return usuario
+
+def respuesta_token(db: Session, usuario: models.User, guardar: bool = False) -> dict:
+    if guardar:
+        db.commit()
+    token = utils.create_access_token(data=utils.claims_usuario(usuario))
+    return {"access_token": token, "token_type": "bearer", "role": usuario.role, "email": usuario.email}
+
 @app.post("/register", response_model=Token)
 @limiter.limit("3/hour")  # Máximo 3 registros por hora por IP
-def register_user(request: Request, user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+async def register_user(request: Request, user: UserCreate, db: Session = Depends(get_db)):
+    db_user = await run_in_threadpool(buscar_usuario, db, user.email)
     if db_user: raise HTTPException(status_code=400, detail="Email ya registrado")
     
-    hashed_pwd = utils.get_password_hash(user.password)
+    hashed_pwd = await hash_password(user.password)
     new_user = models.User(email=user.email, hashed_password=hashed_pwd)
     db.add(new_user)
-    db.commit()
-    
-    token = utils.create_access_token(data={"sub": new_user.email})
-    return {"access_token": token, "token_type": "bearer", "role": new_user.role, "email": new_user.email}
+    return await run_in_threadpool(respuesta_token, db, new_user, True)
 
 @app.post("/login", response_model=Token)
 @limiter.limit("5/minute")  # Máximo 5 intentos de login por minuto por IP
-def login_for_access_token(request: Request, user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
-    if not db_user or not utils.verify_password(user.password, db_user.hashed_password):
+async def login_for_access_token(request: Request, user: UserCreate, db: Session = Depends(get_db)):
+    db_user = await run_in_threadpool(buscar_usuario, db, user.email)
+    valida, nuevo_hash = await verificar_password(user.password, db_user.hashed_password) if db_user else (False, None)
+    if not valida:
         raise HTTPException(status_code=400, detail="Credenciales incorrectas")
-    
-    token = utils.create_access_token(data={"sub": db_user.email})
-    return {"access_token": token, "token_type": "bearer", "role": db_user.role, "email": db_user.email}
+    if nuevo_hash:  # Parámetros de argon2 más fuertes desde que se guardó: se re-hashea ahora que tenemos la contraseña
+        db_user.hashed_password = nuevo_hash
+        db.add(db_user)
+    return await run_in_threadpool(respuesta_token, db, db_user, bool(nuevo_hash))
+
+@app.get("/db/metricas")
+def metricas_pool_conexiones(admin_user: models.User = Depends(get_admin_user)):
+    """Pools de conexiones (síncrono y asíncrono): en uso, saturación, esperas y peticiones que se quedaron sin conexión"""
+    metricas = engine.pool.metricas() if hasattr(engine.pool, "metricas") else {}
+    return {"perfil": DB_PERFIL, "dialecto": engine.dialect.name, **metricas, "asincrono": metricas_motor_async()}
+
+@app.get("/auth/metricas")
+def metricas_hash_contrasenas(admin_user: models.User = Depends(get_admin_user)):
+    """Cola del pool de hash de contraseñas (hilos, en cola, máximo de cola, tiempos medios)"""
+    return pool_hash.metricas()
 
 @app.get("/users/")
 def listar_usuarios(
@@ -158,16 +229,30 @@ def crear_cliente(
     
     nuevo = models.Cliente(**cliente.dict())
     db.add(nuevo)
+    encolar_cambio(db, nuevo, "crear")
     db.commit()
     db.refresh(nuevo)
     return nuevo
 
 @app.get("/clientes/", response_model=list[schemas.ClienteResponse])
-def leer_clientes(
-    db: Session = Depends(get_db),
+async def leer_clientes(
+    response: Response,
+    cursor: Optional[int] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    tipo_cliente: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    return db.query(models.Cliente).all()
+    """Listado paginado por cursor (ver X-Total-Count / X-Next-Cursor)"""
+    filtros = filtros_rango_fechas(models.Cliente.created_at, desde, hasta)
+    if tipo_cliente:
+        filtros.append(models.Cliente.tipo_cliente == tipo_cliente)
+    if is_active is not None:
+        filtros.append(models.Cliente.is_active == is_active)
+    return await db.run_sync(paginar_keyset, models.Cliente, filtros, cursor, limit, response)
 
 @app.put("/clientes/{cliente_id}")
 def actualizar_cliente(
@@ -182,6 +267,7 @@ def actualizar_cliente(
     for key, value in datos.dict().items():
         setattr(cliente, key, value)
     
+    encolar_cambio(db, cliente)
     db.commit()
     return {"msg": "Cliente actualizado"}
 
@@ -225,21 +311,21 @@ def crear_contrato(
     
     nuevo_contrato = models.Contrato(**contrato.dict())
     db.add(nuevo_contrato)
+    encolar_cambio(db, nuevo_contrato, "crear")
     db.commit()
     db.refresh(nuevo_contrato)
     return nuevo_contrato
 
 @app.get("/contratos/{cliente_id}", response_model=list[schemas.ContratoResponse])
-def leer_contratos_cliente(
+async def leer_contratos_cliente(
     cliente_id: int, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     # Buscamos contratos a través de los CUPS del cliente
-    # (Consulta un poco más compleja al tener relación indirecta Cliente -> CUPS -> Contrato)
-    # Para simplificar, podemos filtrar por los CUPS del cliente
-    cups_ids = [c.id for c in db.query(models.PuntoSuministro).filter(models.PuntoSuministro.cliente_id == cliente_id).all()]
-    return db.query(models.Contrato).filter(models.Contrato.punto_suministro_id.in_(cups_ids)).all()
+    # (relación indirecta Cliente -> CUPS -> Contrato: una consulta con subconsulta)
+    cups_ids = select(models.PuntoSuministro.id).where(models.PuntoSuministro.cliente_id == cliente_id)
+    return (await db.scalars(select(models.Contrato).where(models.Contrato.punto_suministro_id.in_(cups_ids)))).all()
 
 # ==========================================
 # 💶 ZONA FACTURACIÓN
@@ -261,125 +347,176 @@ def crear_factura(
     return nueva
 
 @app.get("/facturas/", response_model=list[schemas.FacturaResponse])
-def leer_facturas(
+async def leer_facturas(
+    response: Response,
+    cursor: Optional[int] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    estado: Optional[str] = None,
+    cliente_id: Optional[int] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Listado paginado por cursor (ver X-Total-Count / X-Next-Cursor)"""
+    filtros = filtros_facturas(estado, cliente_id, desde, hasta)
+    return await db.run_sync(paginar_keyset, models.Factura, filtros, cursor, limit, response)
+
+@app.get("/facturas/pdf-lote")
+def descargar_facturas_pdf_lote(
+    formato: str = Query(FORMATO_ZIP, pattern=f"^({FORMATO_ZIP}|{FORMATO_PDF})$"),
+    ids: Optional[List[int]] = Query(None),
+    estado: Optional[str] = None,
+    cliente_id: Optional[int] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    return db.query(models.Factura).all()
+    """
+    PDFs de varias facturas de una vez (ej. ?desde=2025-01-01&hasta=2025-01-31)
+    formato=zip: un PDF por factura; formato=pdf: un único PDF combinado
+    """
+    filtros = filtros_facturas(estado, cliente_id, desde, hasta)
+    if ids:
+        filtros.append(models.Factura.id.in_(ids))
+    consulta = db.query(models.Factura).filter(*filtros)
+    total = consulta.count()
+    if total == 0: raise HTTPException(404, "No hay facturas con esos filtros")
+    if total > MAX_FACTURAS_LOTE:
+        raise HTTPException(400, f"Demasiadas facturas ({total}); el máximo por lote es {MAX_FACTURAS_LOTE}")
+    
+    facturas = consulta.options(joinedload(models.Factura.cliente)).order_by(models.Factura.id).all()
+    archivo = generar_lote([datos_factura(f, f.cliente) for f in facturas], formato)
+    
+    nombre = f"Facturas_{len(facturas)}.{formato}"
+    return StreamingResponse(
+        iterar_archivo(archivo),
+        media_type="application/zip" if formato == FORMATO_ZIP else "application/pdf",
+        headers={"Content-Disposition": f"attachment; filename={nombre}"}
+    )
 
 @app.get("/facturas/{factura_id}/pdf")
 def descargar_factura_pdf(
     factura_id: int, 
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    factura = db.query(models.Factura).filter(models.Factura.id == factura_id).first()
+    factura = db.query(models.Factura).options(joinedload(models.Factura.cliente)) \
+        .filter(models.Factura.id == factura_id).first()
     if not factura: raise HTTPException(404, "Factura no encontrada")
     
-    # OJO: factura.cliente funciona porque está definido en el modelo Factura
-    pdf_buffer = generar_pdf_factura(factura, factura.cliente)
-    
-    return StreamingResponse(
-        pdf_buffer, 
-        media_type="application/pdf", 
-        headers={"Content-Disposition": f"attachment; filename=Factura_{factura.id}.pdf"}
+    # Caché por contenido: solo se pinta si la factura o el cliente han cambiado
+    ruta, huella = cache_pdf.obtener(datos_factura(factura, factura.cliente))
+    etag = f'"{huella}"'
+    cabeceras = {"ETag": etag, "Cache-Control": "private, no-cache"}  # no-cache = revalidar con el ETag
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=cabeceras)
+    
+    # FileResponse atiende también peticiones Range (descargas parciales / reanudadas)
+    return FileResponse(
+        ruta,
+        media_type="application/pdf",
+        filename=f"Factura_{factura.id}.pdf",
+        headers=cabeceras,
     )
 
+MAX_RECHAZOS_EN_ERROR = 1000  # El resto se consulta en /facturas/validar-remesa
+
+def filtros_remesa(factura_ids, estado, cliente_id, desde, hasta):
+    filtros = filtros_facturas(estado, cliente_id, desde, hasta)
+    if factura_ids is not None:
+        filtros.append(filtro_ids(factura_ids))
+    if not filtros: raise HTTPException(400, "Indica las facturas o algún filtro")
+    return filtros
+
+@app.post("/facturas/validar-remesa", response_model=schemas.ValidacionRemesaResponse)
+def validar_remesa_sepa(
+    factura_ids: Optional[List[int]] = Body(None), 
+    estado: Optional[str] = None,
+    cliente_id: Optional[int] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    fecha_cobro: Optional[date] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Revisa IBAN, mandatos e importes de la remesa sin generarla (mismos parámetros que generar-remesa)"""
+    filtros = filtros_remesa(factura_ids, estado, cliente_id, desde, hasta)
+    resultado = validar_remesa(db, filtros, EMPRESA_SEPA, fecha_cobro or date.today() + timedelta(days=1))
+    return resultado.resumen()
+
 @app.post("/facturas/generar-remesa")
 def generar_remesa_sepa(
-    factura_ids: List[int], 
+    factura_ids: Optional[List[int]] = Body(None), 
+    estado: Optional[str] = None,
+    cliente_id: Optional[int] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    fecha_cobro: Optional[date] = None,
+    excluir_rechazadas: bool = False,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    facturas = db.query(models.Factura).filter(models.Factura.id.in_(factura_ids)).all()
-    if not facturas: raise HTTPException(400, "Sin facturas")
-    
-    mi_empresa = {
-        "nombre": "LOVILUZ ENERGIA S.L.",
-        "iban": "ES4521000418450200051332", 
-        "bic": "CAIXESBBXXX",
-        "creditor_id": "ES02000G12345678"
-    }
+    """
+    Remesa SEPA de las facturas indicadas (lista de ids) o de las que cumplan los filtros
+    (ej. ?estado=Pendiente&desde=2025-01-01&hasta=2025-01-31 para remesar un mes entero)
+    Antes de escribir el XML se validan todos los adeudos: si alguno falla se devuelve 422
+    con los rechazos, salvo con excluir_rechazadas=true (se remesa el resto).
+    """
+    filtros = filtros_remesa(factura_ids, estado, cliente_id, desde, hasta)
+    fecha_cobro = fecha_cobro or date.today() + timedelta(days=1)  # CORE: como pronto D-1
+    
+    validacion = validar_remesa(db, filtros, EMPRESA_SEPA, fecha_cobro)
+    for aviso in validacion.avisos:
+        print(f"⚠️ Remesa SEPA: {aviso}")
+    if validacion.rechazos:
+        if not excluir_rechazadas:
+            raise HTTPException(422, detail={
+                "mensaje": f"{len(validacion.facturas_rechazadas)} facturas no superan la validación SEPA",
+                **validacion.resumen(MAX_RECHAZOS_EN_ERROR),
+            })
+        filtros.append(filtro_ids(validacion.facturas_rechazadas, excluir=True))
     
-    # Usamos el generador seguro que hicimos antes
-    xml_buffer = generar_xml_sepa(facturas, mi_empresa)
-    return StreamingResponse(xml_buffer, media_type="application/xml", headers={"Content-Disposition": f"attachment; filename=Remesa_{date.today()}.xml"})
+    # El XML se escribe en streaming desde la BD; con FRST y RCUR llega un ZIP con un fichero por secuencia
+    archivo, nombre, tipo, grupos = generar_remesas(db, filtros, EMPRESA_SEPA, fecha_cobro)
+    if not grupos:
+        archivo.close()
+        raise HTTPException(400, "Sin facturas")
+    return StreamingResponse(
+        iterar_archivo(archivo),
+        media_type=tipo,
+        headers={
+            "Content-Disposition": f"attachment; filename={nombre}",
+            "X-Remesa-Operaciones": str(sum(g.num_operaciones for g in grupos)),
+            "X-Remesa-Rechazadas": str(len(validacion.facturas_rechazadas)),
+        },
+    )
 
 # ==========================================
 # 🧠 ZONA IA & DASHBOARD
 # ==========================================
 
 @app.get("/dashboard-stats/")
-def obtener_estadisticas(
-    db: Session = Depends(get_db),
+async def obtener_estadisticas(
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    total_clientes = db.query(models.Cliente).count()
-    total_facturas = db.query(models.Factura).count()
-    total_dinero = sum(f.monto for f in db.query(models.Factura).all())
-    
-    # Calcular activos (clientes con al menos un contrato activo)
-    # Simplificado: Clientes marcados como is_active
-    activos = db.query(models.Cliente).filter(models.Cliente.is_active == True).count()
-    
-    # Lógica de Renovaciones (Próximos 45 días)
-    hoy = date.today()
-    limite = hoy + timedelta(days=45)
-    
-    # Contamos contratos activos que vencen pronto
-    por_vencer = db.query(models.Contrato).filter(
-        models.Contrato.estado == "Activo",
-        models.Contrato.fecha_fin >= hoy,
-        models.Contrato.fecha_fin <= limite
-    ).count()
-    
-    return {
-        "total_clientes": total_clientes,
-        "total_facturas": total_facturas,
-        "total_dinero": total_dinero,
-        "activos": activos,
-        "inactivos": total_clientes - activos,
-        "nuevos_hoy": 0,
-        "por_vencer": por_vencer  # DATO NUEVO CLAVE para alertas
-    }
+    # KPIs + desgloses en 3 consultas agregadas, cacheados unos segundos
+    # (ver app/modules/crm/dashboard.py)
+    return await db.run_sync(obtener_estadisticas_dashboard)
 
 @app.get("/renovaciones/pendientes")
-def leer_renovaciones_pendientes(
-    db: Session = Depends(get_db),
+async def leer_renovaciones_pendientes(
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     """Devuelve la lista detallada de contratos que vencen pronto"""
     hoy = date.today()
-    limite = hoy + timedelta(days=45)  # Ventana de 45 días
-    
-    contratos = db.query(models.Contrato).filter(
-        models.Contrato.estado == "Activo",
-        models.Contrato.fecha_fin >= hoy,
-        models.Contrato.fecha_fin <= limite
-    ).order_by(models.Contrato.fecha_fin).all()  # Ordenados por urgencia
-    
-    # Enriquecemos la respuesta con datos del cliente para la tabla
-    resultado = []
-    for c in contratos:
-        dias_restantes = (c.fecha_fin - hoy).days
-        
-        # Obtener datos del cliente a través del punto de suministro
-        punto = db.query(models.PuntoSuministro).filter(
-            models.PuntoSuministro.id == c.punto_suministro_id
-        ).first()
-        
-        if punto and punto.cliente:
-            resultado.append({
-                "id": c.id,
-                "cliente": punto.cliente.nombre,
-                "telefono": punto.cliente.telefono or "N/A",
-                "cups": punto.cups,
-                "comercializadora": c.comercializadora,
-                "fecha_fin": c.fecha_fin.isoformat() if c.fecha_fin else None,
-                "dias_restantes": dias_restantes
-            })
-    
-    return resultado
+    # Una sola consulta Contrato -> CUPS -> Cliente (ventana de 45 días)
+    filas = (await db.execute(consulta_renovaciones_pendientes(hoy))).all()
+    return [fila_renovacion(f, hoy) for f in filas]
 
 # ==========================================
 # 🆘 ZONA SOPORTE & TICKETS
@@ -399,10 +536,23 @@ def crear_ticket(
 
 @app.get("/tickets/", response_model=List[schemas.TicketResponse])
 def listar_tickets(
+    response: Response,
+    cursor: Optional[int] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    estado: Optional[str] = None,
+    cliente_id: Optional[int] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    return db.query(models.Ticket).order_by(models.Ticket.fecha_creacion.desc()).all()
+    """Listado paginado por cursor, los más recientes primero (el id crece con fecha_creacion)"""
+    filtros = filtros_rango_fechas(models.Ticket.fecha_creacion, desde, hasta)
+    if estado:
+        filtros.append(models.Ticket.estado == estado)
+    if cliente_id is not None:
+        filtros.append(models.Ticket.cliente_id == cliente_id)
+    return paginar_keyset(db, models.Ticket, filtros, cursor, limit, response)
 
 @app.post("/tickets/mensaje", response_model=schemas.MensajeResponse)
 def enviar_mensaje_ticket(
@@ -439,62 +589,129 @@ def cambiar_estado_ticket(
 
 @app.post("/energia/analizar-factura")
 @limiter.limit("20/hour")  # Máximo 20 análisis de facturas por hora
-async def analizar_factura(request: Request, factura: UploadFile = File(...)):
-    # Lógica de lectura PDF + Gemini
+async def analizar_factura(request: Request, factura: UploadFile = File(...), db: Session = Depends(get_db)):
+    # Lectura local del PDF (app/modules/energia/extractor_factura.py); Gemini solo si no se fía de lo leído
     try:
         content = await factura.read()
-        pdf_file = BytesIO(content)
-        reader = pypdf.PdfReader(pdf_file)
-        texto = ""
-        for i in range(min(2, len(reader.pages))): texto += reader.pages[i].extract_text()
+        datos, texto = await en_hilo(analizar_pdf, content)
+        consumo, potencia, origen = datos.consumo, datos.potencia, "extractor"
         
-        prompt = f"Extrae JSON {{'consumo': float, 'potencia': float}} de: {texto[:3000]}"
-        res_ia = ask_gemini(prompt)
+        if datos.confianza < UMBRAL_CONFIANZA_FACTURA:
+            print(f"🤖 Factura con confianza {datos.confianza:.2f}: se consulta a la IA ({'; '.join(datos.avisos) or 'faltan datos'})")
+            prompt = f"Extrae JSON {{'consumo': float, 'potencia': float}} de: {texto[:3000]}"
+            res_ia = await preguntar_gemini(prompt)
+            
+            if "{" in res_ia:
+                res_ia = res_ia[res_ia.find("{"):res_ia.rfind("}")+1]
+            
+            datos_ia = json.loads(res_ia)
+            consumo, potencia, origen = datos_ia.get("consumo", 0), datos_ia.get("potencia", 0), "ia"
         
-        # Limpieza simple (puedes mejorarla con regex si falla mucho)
-        if "{" in res_ia:
-            res_ia = res_ia[res_ia.find("{"):res_ia.rfind("}")+1]
-        
-        datos = json.loads(res_ia)
-        
-        # Ofertas simuladas
-        ofertas = [
-            {"nombre": "Plan Estable", "compania": "Loviluz", "ahorro": "120€"},
-            {"nombre": "Indexada Pro", "compania": "Mercado", "ahorro": "80€"}
-        ]
+        # Las tarifas activas más baratas para este consumo (app/modules/energia/tarifas.py)
+        ofertas = await en_hilo(ofertas_factura, db, datos, consumo, potencia)
         
         return {
-            "consumo": datos.get("consumo", 0),
-            "potencia": datos.get("potencia", 0),
-            "ofertas": ofertas
+            "consumo": consumo or 0,
+            "potencia": potencia or 0,
+            "ofertas": ofertas,
+            "origen": origen,
+            **datos.a_dict(),
         }
     except Exception as e:
         print(e)
         return {"consumo": 0, "potencia": 0, "ofertas": []}
 
+@app.post("/energia/comparar-cartera", response_model=schemas.ComparativaCarteraResponse)
+def comparar_cartera_tarifas(
+    contrato_ids: Optional[List[int]] = Body(None),
+    horas_equivalentes: float = Query(HORAS_EQUIVALENTES, gt=0),
+    solo_con_ahorro: bool = False,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Mejor tarifa activa para cada contrato (o los indicados), con el ahorro frente a su tarifa actual"""
+    return comparar_cartera(db, contrato_ids, horas_equivalentes, solo_con_ahorro)
+
 @app.post("/ia/consultar")
 @limiter.limit("10/minute")  # Limitar consultas a IA
-async def consultar_base_datos(request: Request, req: ClaudeRequest, db: Session = Depends(get_db)):
-    # Lógica Text-to-SQL con Gemini
+async def consultar_base_datos(request: Request, req: ClaudeRequest):
+    # Lógica Text-to-SQL con Gemini (con caché compartida: ver app/ia_cache.py)
+    llamadas, reparada = 0, None
+
+    async def modelo(prompt):
+        nonlocal llamadas
+        llamadas += 1
+        return await preguntar_gemini(prompt)
+
     try:
-        # 1. Generar SQL
-        schema_info = "Tablas: clientes, contratos, facturas, puntos_suministro"
-        prompt_sql = f"Genera solo SQL (SQLite) para: {req.prompt}. Schema: {schema_info}"
-        sql = ask_gemini(prompt_sql).replace("```sql", "").replace("```", "").strip()
+        esquema = await en_hilo(esquema_ia)  # Precalculado al arrancar (app/ia_esquema.py)
+        pregunta = normalizar_pregunta(req.prompt)
+        sello = cache_ia.version_datos  # Antes de consultar: si alguien escribe mientras tanto, no se guarda
+        reply = cache_ia.respuesta(pregunta, esquema.version, sello)
+        if reply is not None:
+            metricas_ia.registrar(0, True, desde_cache=True)
+            return {"reply": reply, "cache": "respuesta"}
         
-        if "DELETE" in sql.upper() or "DROP" in sql.upper(): return {"reply": "No puedo borrar datos."}
+        # 1. Generar SQL (o reutilizar el de la misma pregunta)
+        sql = cache_ia.sql(pregunta, esquema.version)
+        sql_nuevo = sql is None
+        if sql_nuevo:
+            prompt_sql = f"Genera solo SQL ({esquema.dialecto}) para: {req.prompt}. Schema:\n{esquema.texto}"
+            sql = extraer_sql(await modelo(prompt_sql))
         
-        # 2. Ejecutar
-        res = db.execute(text(sql)).fetchall()
+        # 2. Ejecutar en el sandbox de solo lectura (app/ia_sql.py), fuera del bucle de eventos
+        try:
+            res = await en_hilo(ejecutar_consulta_ia, sql)
+        except ConsultaRechazada as e:
+            if not (sql_nuevo and e.reparable):
+                metricas_ia.registrar(llamadas, False)
+                return {"reply": f"No puedo ejecutar esa consulta: {str(e)}"}
+            # Una sola reparación: el modelo recibe su SQL y el error
+            prompt_reparar = (f"Este SQL ({esquema.dialecto}) para '{req.prompt}' falló: {str(e)}\n{sql}\n"
+                              f"Schema:\n{esquema.texto}\nDevuelve solo el SQL corregido.")
+            sql = extraer_sql(await modelo(prompt_reparar))
+            try:
+                res = await en_hilo(ejecutar_consulta_ia, sql)
+                reparada = True
+            except ConsultaRechazada as e:
+                metricas_ia.registrar(llamadas, False, reparada=False)
+                return {"reply": f"No puedo ejecutar esa consulta: {str(e)}"}
+        if sql_nuevo:
+            cache_ia.guardar_sql(pregunta, esquema.version, sql)  # Solo el SQL que ha funcionado
         
         # 3. Explicar
-        prompt_final = f"Pregunta: {req.prompt}. Datos: {str(res)}. Responde natural."
-        reply = ask_gemini(prompt_final)
+        datos = str(res.filas) + (f" (solo las primeras {len(res.filas)} filas)" if res.truncado else "")
+        prompt_final = f"Pregunta: {req.prompt}. Datos: {datos}. Responde natural."
+        reply = await modelo(prompt_final)
+        cache_ia.guardar_respuesta(pregunta, esquema.version, sello, reply)
+        metricas_ia.registrar(llamadas, True, reparada=reparada)
         
-        return {"reply": reply}
+        return {"reply": reply, "cache": None if sql_nuevo else "sql"}
     except Exception as e:
+        metricas_ia.registrar(llamadas, False, reparada=reparada)
         return {"reply": f"No pude obtener esa información. ({str(e)})"}
 
+@app.get("/ia/metricas")
+def metricas_asistente_ia(current_user: models.User = Depends(get_admin_user)):
+    """Llamadas al modelo por pregunta respondida, reparaciones de SQL y esquema en uso"""
+    esquema = esquema_ia()
+    return {
+        **metricas_ia.resumen(),
+        "esquema": {"huella": esquema.huella, "version": esquema.version, "dialecto": esquema.dialecto,
+                    "caracteres": len(esquema.texto), "segundos_calculo": round(esquema.segundos, 3)},
+    }
+
+@app.get("/ia/cache")
+def estadisticas_cache_ia(current_user: models.User = Depends(get_admin_user)):
+    """Aciertos, fallos y expulsiones de la caché del asistente"""
+    return cache_ia.estadisticas()
+
+@app.delete("/ia/cache")
+def vaciar_cache_ia(current_user: models.User = Depends(get_admin_user)):
+    cache_ia.vaciar()
+    olvidar_esquema()  # Las muestras de valores se vuelven a leer en la siguiente pregunta
+    return {"msg": "Caché de IA vaciada"}
+
 # ==========================================
 # 📤 ZONA UPLOAD DE ARCHIVOS
 # ==========================================
@@ -611,33 +828,9 @@ def listar_procesos_atr(
     current_user: models.User = Depends(get_current_active_user)
 ):
     """Endpoint optimizado para listar procesos ATR con datos cruzados"""
-    # Traemos todos los procesos ATR ordenados por fecha (los más nuevos primero)
-    procesos = db.query(models.ProcesoATR).order_by(models.ProcesoATR.fecha_solicitud.desc()).all()
-    
-    # Preparamos una lista limpia con datos cruzados (Nombre Cliente, CUPS, etc.)
-    resultado = []
-    for p in procesos:
-        # Navegamos por las relaciones: Proceso -> Contrato -> Cliente / Punto
-        nombre_cliente = "Desconocido"
-        cups_cliente = "N/A"
-        
-        if p.contrato:
-            if p.contrato.cliente:
-                nombre_cliente = p.contrato.cliente.nombre
-            if p.contrato.punto_suministro:
-                cups_cliente = p.contrato.punto_suministro.cups
-
-        resultado.append({
-            "id": p.id,
-            "codigo": p.codigo_solicitud,
-            "tipo": p.tipo,  # C1 = Alta, C2 = Cambio
-            "estado": p.estado_atr,
-            "fecha": p.fecha_solicitud,
-            "cliente": nombre_cliente,
-            "cups": cups_cliente
-        })
-    
-    return resultado
+    # Proceso -> Contrato -> Punto -> Cliente resuelto en un único SELECT con OUTER JOIN
+    filas = db.execute(consulta_procesos_atr()).all()
+    return [fila_proceso_atr(f) for f in filas]
 
 @app.get("/procesos-atr/{proceso_id}", response_model=schemas.ProcesoATRResponse)
 def obtener_proceso_atr(
@@ -679,3 +872,127 @@ def actualizar_proceso_atr(
     db.commit()
     db.refresh(proceso)
     return proceso
+
+# ==========================================
+# ⏳ ZONA TRABAJOS EN SEGUNDO PLANO (/jobs)
+# ==========================================
+# Las exportaciones e importaciones largas se encolan (202 + id) y se consultan después:
+# GET /jobs/{id} para el progreso y GET /jobs/{id}/resultado para descargar el fichero
+
+def fechas_iso(**fechas) -> dict:
+    return {k: v.isoformat() if v else None for k, v in fechas.items()}
+
+def obtener_trabajo(db: Session, trabajo_id: int, current_user: models.User) -> models.Trabajo:
+    trabajo = db.query(models.Trabajo).filter(models.Trabajo.id == trabajo_id).first()
+    # Cada usuario ve sus trabajos (el admin, todos); a los demás les parece que no existe
+    if not trabajo or (current_user.role != "admin" and trabajo.usuario_id != current_user.id):
+        raise HTTPException(404, "Trabajo no encontrado")
+    return trabajo
+
+@app.post("/jobs/remesa-sepa", response_model=schemas.TrabajoResponse, status_code=202)
+def encolar_remesa_sepa(
+    factura_ids: Optional[List[int]] = Body(None), 
+    estado: Optional[str] = None,
+    cliente_id: Optional[int] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    fecha_cobro: Optional[date] = None,
+    excluir_rechazadas: bool = False,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Como POST /facturas/generar-remesa, pero en segundo plano (remesas de decenas de miles de adeudos)"""
+    filtros_remesa(factura_ids, estado, cliente_id, desde, hasta)  # Mismas comprobaciones antes de encolar
+    parametros = {
+        "factura_ids": factura_ids, "estado": estado, "cliente_id": cliente_id,
+        "excluir_rechazadas": excluir_rechazadas, **fechas_iso(desde=desde, hasta=hasta, fecha_cobro=fecha_cobro),
+    }
+    return encolar_trabajo(db, TIPO_REMESA_SEPA, parametros, current_user.id)
+
+@app.post("/jobs/facturas-pdf", response_model=schemas.TrabajoResponse, status_code=202)
+def encolar_facturas_pdf(
+    formato: str = Query(FORMATO_ZIP, pattern=f"^({FORMATO_ZIP}|{FORMATO_PDF})$"),
+    ids: Optional[List[int]] = Query(None),
+    estado: Optional[str] = None,
+    cliente_id: Optional[int] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Como GET /facturas/pdf-lote, en segundo plano y con progreso por facturas pintadas"""
+    parametros = {
+        "formato": formato, "factura_ids": ids, "estado": estado, "cliente_id": cliente_id,
+        **fechas_iso(desde=desde, hasta=hasta),
+    }
+    return encolar_trabajo(db, TIPO_FACTURAS_PDF, parametros, current_user.id)
+
+@app.post("/jobs/importar-cartera", response_model=schemas.TrabajoResponse, status_code=202)
+def encolar_importar_cartera(
+    archivo: UploadFile = File(...),
+    reanudar: bool = True,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_admin_user)
+):
+    """Importa un .xlsx/.csv/.parquet de cartera en streaming (ver import_cartera.py --streaming)"""
+    extension = os.path.splitext(archivo.filename or "")[1].lower()
+    if extension not in (".xlsx", ".xls", ".csv", ".parquet"):
+        raise HTTPException(400, "Formato no soportado (usa .xlsx, .csv o .parquet)")
+    # Se guarda en disco antes de encolar: el trabajo lo lee por bloques (y lo relee si hay que reanudar)
+    ruta = carpeta_entradas() / f"{int(time.time() * 1000)}_{os.path.basename(archivo.filename)}"
+    with open(ruta, "wb") as destino:
+        shutil.copyfileobj(archivo.file, destino, 1024 * 1024)
+    parametros = {"ruta": str(ruta), "nombre": archivo.filename, "reanudar": reanudar}
+    return encolar_trabajo(db, TIPO_IMPORTAR_CARTERA, parametros, current_user.id)
+
+@app.post("/jobs/importar-dynamics", response_model=schemas.TrabajoResponse, status_code=202)
+def encolar_importar_dynamics(
+    modo: str = Query(MODO_DELTA, pattern=f"^({MODO_DELTA}|{MODO_FULL})$"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_admin_user)
+):
+    """Sincroniza cuentas y contactos desde Dynamics 365 (como import_dynamics365.py)"""
+    return encolar_trabajo(db, TIPO_IMPORTAR_DYNAMICS, {"modo": modo}, current_user.id)
+
+@app.get("/jobs/", response_model=List[schemas.TrabajoResponse])
+def leer_trabajos(
+    response: Response,
+    cursor: Optional[int] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    tipo: Optional[str] = None,
+    estado: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Trabajos del usuario (el admin ve todos), los más recientes primero"""
+    filtros = []
+    if current_user.role != "admin":
+        filtros.append(models.Trabajo.usuario_id == current_user.id)
+    if tipo:
+        filtros.append(models.Trabajo.tipo == tipo)
+    if estado:
+        filtros.append(models.Trabajo.estado == estado)
+    return paginar_keyset(db, models.Trabajo, filtros, cursor, limit, response)
+
+@app.get("/jobs/{trabajo_id}", response_model=schemas.TrabajoResponse)
+def leer_trabajo(
+    trabajo_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Estado y progreso (0 a 1) del trabajo; al terminar, su resultado o el error"""
+    return obtener_trabajo(db, trabajo_id, current_user)
+
+@app.get("/jobs/{trabajo_id}/resultado")
+def descargar_resultado_trabajo(
+    trabajo_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    trabajo = obtener_trabajo(db, trabajo_id, current_user)
+    # Solo trabajos terminados: los completados y los fallidos (su informe de rechazos)
+    if trabajo.estado not in (ESTADO_COMPLETADO, ESTADO_ERROR):
+        raise HTTPException(409, f"El trabajo está {trabajo.estado.lower()}")
+    if not trabajo.archivo or not os.path.exists(trabajo.archivo):
+        raise HTTPException(404, "El trabajo no tiene fichero (o ya ha caducado)")
+    return FileResponse(trabajo.archivo, media_type=trabajo.archivo_tipo, filename=trabajo.archivo_nombre)
@@ -0,0 +1,92 @@
+"""
+Hash de contraseñas (argon2) fuera de los hilos de las peticiones
+Cada hash de argon2 tarda ~0,25 s de CPU y reserva 64 MB. /login y /register lo hacían en el
+pool de hilos que comparten todos los endpoints síncronos: una ráfaga de logins (inicio de
+turno) dejaba sin hilos al resto del CRM. Ahora va a un pool propio de AUTH_HASH_HILOS hilos
+(por defecto, uno por CPU): los logins hacen cola entre ellos y el resto de peticiones no espera.
+argon2-cffi suelta el GIL, así que esos hilos hashean en paralelo de verdad.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+from app.modules.auth.utils import pwd_context
+
+HILOS = int(os.getenv("AUTH_HASH_HILOS", os.cpu_count() or 2))
+
+
+class PoolHash:
+    """Pool de hilos acotado con métricas de cola (GET /auth/metricas)"""
+
+    def __init__(self, hilos: int):
+        self.hilos = hilos
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.en_cola = 0
+        self.en_curso = 0
+        self.maximo_cola = 0
+        self.completados = 0
+        self.espera_total = 0.0
+        self.calculo_total = 0.0
+
+    def _ejecutar(self, encolado: float, funcion: Callable, args: tuple):
+        inicio = time.perf_counter()
+        with self._lock:
+            self.en_cola -= 1
+            self.en_curso += 1
+            self.espera_total += inicio - encolado
+        try:
+            return funcion(*args)
+        finally:
+            with self._lock:
+                self.en_curso -= 1
+                self.completados += 1
+                self.calculo_total += time.perf_counter() - inicio
+
+    def _descartado(self, futuro):
+        if futuro.cancelled():  # El cliente se fue antes de que le tocara: sale de la cola sin ejecutarse
+            with self._lock:
+                self.en_cola -= 1
+
+    async def ejecutar(self, funcion: Callable, *args):
+        with self._lock:
+            if self._pool is None:  # Se crea al primer uso (y de nuevo tras cerrar)
+                self._pool = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="hash")
+            self.en_cola += 1
+            self.maximo_cola = max(self.maximo_cola, self.en_cola)
+            futuro = self._pool.submit(self._ejecutar, time.perf_counter(), funcion, args)
+        futuro.add_done_callback(self._descartado)
+        return await asyncio.wrap_future(futuro)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            hechos = self.completados or 1
+            return {
+                "hilos": self.hilos,
+                "en_cola": self.en_cola,
+                "en_curso": self.en_curso,
+                "maximo_cola": self.maximo_cola,
+                "completados": self.completados,
+                "espera_media_ms": round(self.espera_total / hechos * 1000, 1),
+                "hash_medio_ms": round(self.calculo_total / hechos * 1000, 1),
+            }
+
+    def cerrar(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+pool_hash = PoolHash(HILOS)
+
+
+async def hash_password(password: str) -> str:
+    return await pool_hash.ejecutar(pwd_context.hash, password)
+
+
+async def verificar_password(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """(contraseña válida, hash nuevo si cambiaron los parámetros de argon2 y hay que guardarlo)"""
+    return await pool_hash.ejecutar(pwd_context.verify_and_update, password, hashed_password)
@@ -1,11 +1,18 @@
 import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from cachetools import TTLCache
 from passlib.context import CryptContext
 from jose import jwt
 from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import get_async_db
 from app.modules.crm import models
 from dotenv import load_dotenv
 
@@ -18,8 +25,23 @@ SECRET_KEY = os.getenv("SECRET_KEY", "clave_insegura_por_defecto_cambiar_en_prod
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 
+# --- Usuario autenticado sin ir a la base de datos ---
+# El token lleva id, rol y estado firmados. Durante AUTH_CACHE_TTL segundos desde su emisión
+# basta con el token; después, una caché por email (mismo TTL) evita la consulta a `users`.
+# Así un cambio hecho en otro proceso tarda como mucho AUTH_CACHE_TTL en notarse; en este
+# proceso se nota al momento (ver los eventos de sesión al final del archivo).
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_MAX = int(os.getenv("AUTH_CACHE_MAX", 10000))
+
 # Gestor de encriptación
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Parámetros de argon2 (por defecto, los de passlib). Si se cambian, cada usuario se re-hashea
+# con los nuevos en su siguiente login (ver app/modules/auth/hashing.py)
+pwd_context = CryptContext(
+    schemes=["argon2"], deprecated="auto",
+    argon2__memory_cost=int(os.getenv("AUTH_ARGON2_MEMORIA_KB", 65536)),
+    argon2__time_cost=int(os.getenv("AUTH_ARGON2_ITERACIONES", 3)),
+    argon2__parallelism=int(os.getenv("AUTH_ARGON2_PARALELISMO", 4)),
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 # 1. Función para verificar contraseña
@@ -33,13 +55,56 @@ def get_password_hash(password):
 # 3. Función para crear el Token
 def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    ahora = datetime.utcnow()
+    expire = ahora + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire, "iat": ahora})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# 4. Dependencias para proteger rutas
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def claims_usuario(user: models.User) -> dict:
+    """Datos del usuario que viajan firmados en el token (login y registro)"""
+    return {"sub": user.email, "uid": user.id, "role": user.role, "act": bool(user.is_active)}
+
+# 4. Usuario autenticado (lo que reciben las rutas protegidas)
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    email: str
+    role: str
+    is_active: bool
+
+_principales = TTLCache(maxsize=AUTH_CACHE_MAX, ttl=AUTH_CACHE_TTL)
+# email -> momento del último cambio: los tokens emitidos antes ya no valen por sí solos
+_cambios = TTLCache(maxsize=AUTH_CACHE_MAX, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+_lock = threading.Lock()
+
+def invalidar_usuario(email: str):
+    """Olvida al usuario en caché y deja sin valor los claims de sus tokens anteriores"""
+    with _lock:
+        _principales.pop(email, None)
+        _cambios[email] = time.time()
+
+def vaciar_cache_usuarios():
+    with _lock:
+        _principales.clear()
+        _cambios.clear()
+
+def _principal_de_claims(payload: dict) -> Optional[Principal]:
+    emitido = payload.get("iat")
+    if emitido is None or not {"uid", "role", "act"} <= payload.keys():
+        return None  # Token antiguo, sin claims
+    if time.time() - emitido > AUTH_CACHE_TTL:
+        return None
+    with _lock:
+        cambio = _cambios.get(payload["sub"])
+    if cambio is not None and emitido <= cambio:
+        return None
+    return Principal(payload["uid"], payload["sub"], payload["role"], bool(payload["act"]))
+
+# 5. Dependencias para proteger rutas
+# Son async para no ocupar un hilo del pool de FastAPI en cada petición: con claims o caché no
+# hay E/S, y si hay que leer el usuario se hace con la sesión asíncrona (app/database.py)
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudieron validar las credenciales",
@@ -52,18 +117,56 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except Exception:
         raise credentials_exception
-        
-    user = db.query(models.User).filter(models.User.email == email).first()
+
+    principal = _principal_de_claims(payload)
+    if principal is not None:
+        return principal
+    with _lock:
+        principal = _principales.get(email)
+    if principal is not None:
+        return principal
+
+    consultado = time.time()
+    user = (await db.execute(select(models.User).where(models.User.email == email))).scalars().first()
     if user is None:
         raise credentials_exception
-    return user
+    principal = Principal(user.id, user.email, user.role, bool(user.is_active))
+    with _lock:
+        if _cambios.get(email, 0) < consultado:  # Si cambió mientras leíamos, no guardar lo viejo
+            _principales[email] = principal
+    return principal
 
-def get_current_active_user(current_user: models.User = Depends(get_current_user)):
+async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Usuario inactivo")
     return current_user
 
-def get_admin_user(current_user: models.User = Depends(get_current_active_user)):
+async def get_admin_user(current_user: models.User = Depends(get_current_active_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Se requieren permisos de Administrador")
-    return current_user
\ No newline at end of file
+    return current_user
+
+
+# --- Cualquier commit del ORM que cambie el rol, el estado o el email de un usuario (o lo borre) lo invalida ---
+# (re-hashear la contraseña en el login no cambia nada de lo que va en el token)
+_CAMPOS_TOKEN = ("email", "role", "is_active")
+
+@event.listens_for(Session, "after_flush")
+def _marcar_usuarios_modificados(session, flush_context):
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, models.User):
+            estado = inspect(obj)
+            if obj not in session.deleted and not any(estado.attrs[c].history.has_changes() for c in _CAMPOS_TOKEN):
+                continue
+            emails = session.info.setdefault("usuarios_modificados", set())
+            emails.add(obj.email)
+            emails.update(estado.attrs.email.history.deleted or ())
+
+@event.listens_for(Session, "after_commit")
+def _invalidar_usuarios_tras_commit(session):
+    for email in session.info.pop("usuarios_modificados", ()):
+        invalidar_usuario(email)
+
+@event.listens_for(Session, "after_rollback")
+def _limpiar_usuarios_tras_rollback(session):
+    session.info.pop("usuarios_modificados", None)
@@ -0,0 +1 @@
+# Módulo de importación de cartera (Excel de contratos)
@@ -0,0 +1,314 @@
+"""
+Importador masivo de cartera (Excel de contratos de energía)
+Limpia el DataFrame con operaciones vectorizadas de pandas, precarga en memoria
+los NIF y CUPS que ya existen y escribe clientes, puntos de suministro y
+contratos con INSERT masivos, un lote por transacción. Las filas descartadas
+se acumulan en un informe de rechazos (fila del Excel + motivo).
+"""
+import logging
+import os
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert, select
+from app.modules.crm import models
+from app.modules.crm.dashboard import invalidar_cache_dashboard
+
+logger = logging.getLogger(__name__)
+
+HOJA_CARTERA = "2-Contratos-Listado-energía"
+FILA_CABECERA = 1  # header=1: la fila 2 del Excel son los encabezados
+TAMANO_LOTE = 5000
+
+MOTIVO_SIN_NIF = "Sin NIF/CIF válido"
+MOTIVO_SIN_CUPS = "Sin CUPS válido"
+MOTIVO_CONTRATO_DUPLICADO = "Contrato duplicado (el CUPS ya tiene contrato)"
+
+# Columna destino -> columna del Excel
+COLUMNAS_TEXTO = {
+    "nombre": "Cliente",
+    "email": "Email",
+    "telefono": "Teléfono",
+    "iban": "IBAN",
+    "persona_contacto": "Firmante",
+    "direccion": "Domicilio CUPS",
+    "codigo_postal": "Código postal CUPS",
+    "provincia": "Provincia CUPS",
+    "tarifa_acceso": "Tarifa",
+    "comercializadora": "Comercializadora",
+    "producto": "Producto",
+}
+COLUMNAS_FECHA = {"fecha_inicio": "F. alta", "fecha_fin": "F. vencimiento"}
+FORMATO_FECHA = "%d/%m/%Y"  # Fechas escritas como texto en la hoja o en su exportación a CSV
+COLUMNAS_POTENCIA = {f"p{i}": f"Potencia (P{i})" for i in range(1, 7)}
+COLUMNAS_RECHAZO = ["fila_excel", "nif_cif", "cups", "motivo"]
+VALORES_POR_DEFECTO = {"nombre": "Desconocido", "comercializadora": "Desconocida"}
+TIPOS_SIN_TEXTO = {"integer", "floating", "mixed-integer-float", "decimal", "boolean", "empty"}
+
+
+# ==========================================
+# LIMPIEZA VECTORIZADA
+# ==========================================
+
+def _columna(df: pd.DataFrame, nombre: str) -> pd.Series:
+    if nombre in df.columns:
+        return df[nombre]
+    return pd.Series(np.nan, index=df.index, dtype=object)
+
+
+def limpiar_texto(serie: pd.Series, defecto: Optional[str] = None) -> pd.Series:
+    """str() + strip de toda la columna; las celdas vacías pasan a `defecto`"""
+    return serie.astype(str).str.strip().where(serie.notna(), defecto)
+
+
+def _fecha_celda(valor):
+    """Una fecha en cualquier otro formato, como hacía limpiar_fecha (día primero: 05/03 es 5 de marzo)"""
+    try:
+        return pd.to_datetime(valor, dayfirst=True)
+    except (ValueError, TypeError, OverflowError):
+        return pd.NaT
+
+
+def limpiar_fechas(serie: pd.Series) -> pd.Series:
+    """
+    Columna de fechas -> date; vacías o inválidas -> None
+    Las celdas de fecha se convierten tal cual. Los textos se leen con FORMATO_FECHA, luego
+    como ISO (2025-01-20) y los que queden celda a celda: pd.to_datetime sobre la columna
+    entera deduce un único formato de la primera celda y anula el resto (13/02/2025 -> NaT).
+    """
+    es_texto = serie.map(lambda valor: isinstance(valor, str))
+    fechas = pd.Series(pd.NaT, index=serie.index, dtype="datetime64[ns]")
+    try:
+        fechas[~es_texto] = pd.to_datetime(serie[~es_texto], errors="coerce")
+    except (ValueError, TypeError, OverflowError):  # Tipos mezclados (números y fechas)
+        fechas[~es_texto] = serie[~es_texto].map(_fecha_celda)
+
+    texto = serie[es_texto].astype(str).str.strip()
+    convertidas = pd.to_datetime(texto, format=FORMATO_FECHA, errors="coerce")
+    faltan = convertidas.isna() & (texto != "")
+    convertidas[faltan] = pd.to_datetime(texto[faltan], format="ISO8601", errors="coerce")
+    faltan = convertidas.isna() & (texto != "")
+    convertidas[faltan] = texto[faltan].map(_fecha_celda)
+    fechas[es_texto] = convertidas
+    return fechas.dt.date.astype(object).where(fechas.notna(), None)
+
+
+def limpiar_numeros(serie: pd.Series) -> pd.Series:
+    """
+    Equivalente vectorizado de limpiar_float
+    Los números se respetan; en los textos se quitan 'kW', '€' y los puntos de
+    miles y la coma decimal pasa a punto. Lo que no se pueda convertir vale 0.0
+    """
+    if pd.api.types.infer_dtype(serie, skipna=True) in TIPOS_SIN_TEXTO:
+        return pd.to_numeric(serie, errors="coerce").fillna(0.0).astype(float)
+
+    es_texto = serie.str.len().notna()  # .str devuelve NaN en las celdas que no son texto
+    texto = (
+        serie[es_texto]
+        .str.replace("kW", "", regex=False)
+        .str.replace("€", "", regex=False)
+        .str.replace(".", "", regex=False)
+        .str.replace(",", ".", regex=False)
+        .str.strip()
+    )
+    resultado = pd.to_numeric(serie.where(~es_texto), errors="coerce")
+    resultado[es_texto] = pd.to_numeric(texto, errors="coerce")
+    return resultado.fillna(0.0).astype(float)
+
+
+def limpiar_dataframe(df: pd.DataFrame, primera_fila: int = FILA_CABECERA + 2) -> pd.DataFrame:
+    """
+    Convierte la hoja de cartera en columnas listas para insertar
+    Añade 'fila_excel' (para el informe) y 'motivo_rechazo' (None si la fila es válida).
+    `primera_fila` es el número de fila del fichero que corresponde al índice 0.
+    """
+    df = df.rename(columns=lambda c: str(c).strip())
+    limpio = pd.DataFrame(index=df.index)
+    limpio["fila_excel"] = df.index + primera_fila
+
+    nif = limpiar_texto(_columna(df, "CIF/NIF"))
+    limpio["nif_cif"] = nif.where(nif.notna() & (nif != "") & (nif.str.lower() != "nan"), None)
+
+    cups = limpiar_texto(_columna(df, "CUPS"))
+    cups_valido = cups.notna() & (cups.str.len() >= 10) & (cups.str.lower() != "nan")
+    limpio["cups"] = cups.where(cups_valido, None)
+
+    for destino, origen in COLUMNAS_TEXTO.items():
+        limpio[destino] = limpiar_texto(_columna(df, origen), VALORES_POR_DEFECTO.get(destino))
+    for destino, origen in COLUMNAS_FECHA.items():
+        limpio[destino] = limpiar_fechas(_columna(df, origen))
+    for destino, origen in COLUMNAS_POTENCIA.items():
+        limpio[destino] = limpiar_numeros(_columna(df, origen))
+
+    motivo = pd.Series(None, index=df.index, dtype=object)
+    motivo[limpio["cups"].isna()] = MOTIVO_SIN_CUPS
+    motivo[limpio["nif_cif"].isna()] = MOTIVO_SIN_NIF  # El NIF manda: sin NIF no hay nada
+    limpio["motivo_rechazo"] = motivo
+    return limpio
+
+
+# ==========================================
+# ESCRITURA MASIVA
+# ==========================================
+
+@dataclass
+class ResumenImportacion:
+    contratos_nuevos: int = 0
+    clientes_nuevos: int = 0
+    clientes_existentes: int = 0
+    puntos_nuevos: int = 0
+    puntos_existentes: int = 0
+    contratos_duplicados: int = 0
+    sin_nif: int = 0
+    sin_cups: int = 0
+
+    def sumar(self, otro: "ResumenImportacion"):
+        for campo, valor in asdict(otro).items():
+            setattr(self, campo, getattr(self, campo) + valor)
+
+    def imprimir(self):
+        print(f"\n{'='*80}")
+        print(f"✅ ¡IMPORTACIÓN FINALIZADA!")
+        print(f"{'='*80}")
+        print(f"📊 RESUMEN:")
+        print(f"   • Contratos nuevos importados: {self.contratos_nuevos}")
+        print(f"   • Clientes nuevos: {self.clientes_nuevos}")
+        print(f"   • Clientes ya existentes: {self.clientes_existentes}")
+        print(f"   • Puntos de suministro nuevos: {self.puntos_nuevos}")
+        print(f"   • Puntos de suministro ya existentes: {self.puntos_existentes}")
+        print(f"   • Contratos duplicados (ya existían): {self.contratos_duplicados}")
+        print(f"\n⚠️  FILAS IGNORADAS:")
+        print(f"   • Sin NIF/CIF válido: {self.sin_nif}")
+        print(f"   • Sin CUPS válido: {self.sin_cups}")
+        print(f"{'='*80}")
+
+
+class ImportadorCartera:
+    """
+    Escribe DataFrames limpios (ver limpiar_dataframe) en la base de datos
+
+    Al crearse precarga NIF -> id, CUPS -> id y los puntos que ya tienen contrato,
+    de modo que cada lote se resuelve en memoria y solo hace 3 INSERT masivos.
+    """
+
+    def __init__(self, engine, tamano_lote: int = TAMANO_LOTE):
+        self.engine = engine
+        self.tamano_lote = tamano_lote
+        self.resumen = ResumenImportacion()
+        self.rechazos: List[Dict] = []
+        self.total_rechazos = 0
+        self._precargar_claves()
+
+    def _precargar_claves(self):
+        with self.engine.connect() as conn:
+            self.clientes: Dict[str, int] = dict(
+                conn.execute(select(models.Cliente.nif_cif, models.Cliente.id)).all()
+            )
+            self.puntos: Dict[str, int] = dict(
+                conn.execute(select(models.PuntoSuministro.cups, models.PuntoSuministro.id)).all()
+            )
+            self.puntos_con_contrato = set(
+                conn.execute(select(models.Contrato.punto_suministro_id).distinct()).scalars()
+            )
+        logger.info(
+            f"🔑 Claves precargadas: {len(self.clientes)} NIF, {len(self.puntos)} CUPS, "
+            f"{len(self.puntos_con_contrato)} puntos con contrato"
+        )
+
+    def importar(self, df: pd.DataFrame) -> ResumenImportacion:
+        """Limpia un DataFrame crudo del Excel y lo escribe por lotes"""
+        limpio = limpiar_dataframe(df)
+        for inicio in range(0, len(limpio), self.tamano_lote):
+            self.procesar_lote(limpio.iloc[inicio:inicio + self.tamano_lote])
+        return self.resumen
+
+    def procesar_lote(self, lote: pd.DataFrame,
+                      al_confirmar: Optional[Callable] = None) -> ResumenImportacion:
+        """
+        Escribe un lote limpio en una sola transacción y devuelve su resumen parcial
+        `al_confirmar(conn)` se ejecuta dentro de esa misma transacción (ej. guardar
+        el punto de control), así lote y checkpoint se confirman o fallan juntos.
+        """
+        resumen = ResumenImportacion()
+        self._rechazar(lote[lote["motivo_rechazo"].notna()])
+        resumen.sin_nif = int((lote["motivo_rechazo"] == MOTIVO_SIN_NIF).sum())
+        resumen.sin_cups = int((lote["motivo_rechazo"] == MOTIVO_SIN_CUPS).sum())
+
+        with self.engine.begin() as conn:
+            # --- 1. CLIENTES (toda fila con NIF, aunque luego falle el CUPS) ---
+            con_nif = lote[lote["nif_cif"].notna()]
+            nuevos = con_nif[~con_nif["nif_cif"].isin(self.clientes.keys())].drop_duplicates("nif_cif")
+            if len(nuevos):
+                filas = nuevos[["nombre", "nif_cif", "email", "telefono", "iban", "persona_contacto"]] \
+                    .assign(tipo_cliente="Cartera 2025", is_active=True).to_dict("records")
+                tabla = models.Cliente.__table__
+                self.clientes.update(
+                    (nif, id_) for id_, nif in conn.execute(insert(tabla).returning(tabla.c.id, tabla.c.nif_cif), filas)
+                )
+            resumen.clientes_nuevos = len(nuevos)
+            resumen.clientes_existentes = len(con_nif) - len(nuevos)
+
+            # --- 2. PUNTOS DE SUMINISTRO ---
+            validas = lote[lote["motivo_rechazo"].isna()].copy()
+            validas["cliente_id"] = validas["nif_cif"].map(self.clientes)
+            nuevos = validas[~validas["cups"].isin(self.puntos.keys())].drop_duplicates("cups")
+            if len(nuevos):
+                filas = nuevos[["cups", "direccion", "codigo_postal", "provincia", "tarifa_acceso", "cliente_id"]] \
+                    .to_dict("records")
+                tabla = models.PuntoSuministro.__table__
+                self.puntos.update(
+                    (cups, id_) for id_, cups in conn.execute(insert(tabla).returning(tabla.c.id, tabla.c.cups), filas)
+                )
+            resumen.puntos_nuevos = len(nuevos)
+            resumen.puntos_existentes = len(validas) - len(nuevos)
+
+            # --- 3. CONTRATOS (uno por punto de suministro) ---
+            validas["punto_suministro_id"] = validas["cups"].map(self.puntos)
+            duplicado = validas["punto_suministro_id"].isin(self.puntos_con_contrato) | \
+                validas["punto_suministro_id"].duplicated()
+            self._rechazar(validas[duplicado], MOTIVO_CONTRATO_DUPLICADO)
+            nuevos = validas[~duplicado]
+            if len(nuevos):
+                filas = nuevos[
+                    ["punto_suministro_id", "comercializadora", "producto", "fecha_inicio", "fecha_fin",
+                     *COLUMNAS_POTENCIA.keys()]
+                ].assign(estado="Activo").to_dict("records")
+                conn.execute(insert(models.Contrato.__table__), filas)
+                self.puntos_con_contrato.update(nuevos["punto_suministro_id"])
+            resumen.contratos_nuevos = len(nuevos)
+            resumen.contratos_duplicados = int(duplicado.sum())
+
+            if al_confirmar:
+                al_confirmar(conn)
+
+        # INSERT de Core: no pasa por los eventos de sesión que invalidan el dashboard
+        if resumen.clientes_nuevos or resumen.contratos_nuevos:
+            invalidar_cache_dashboard()
+        self.resumen.sumar(resumen)
+        logger.info(f"⏳ Lote escrito: {resumen.contratos_nuevos} contratos nuevos "
+                    f"(total {self.resumen.contratos_nuevos})")
+        return resumen
+
+    def _rechazar(self, filas: pd.DataFrame, motivo: Optional[str] = None):
+        self.total_rechazos += len(filas)
+        for fila in filas[["fila_excel", "nif_cif", "cups", "motivo_rechazo"]].itertuples(index=False):
+            self.rechazos.append({
+                "fila_excel": fila.fila_excel,
+                "nif_cif": fila.nif_cif,
+                "cups": fila.cups,
+                "motivo": motivo or fila.motivo_rechazo,
+            })
+
+    def volcar_rechazos(self, ruta: str) -> int:
+        """
+        Añade los rechazos pendientes al CSV `ruta` (lo crea con cabecera si no existe)
+        y vacía la lista en memoria. Devuelve cuántas filas se escribieron.
+        """
+        nuevo = not os.path.exists(ruta)
+        pd.DataFrame(self.rechazos, columns=COLUMNAS_RECHAZO).to_csv(
+            ruta, mode="a", header=nuevo, index=False, encoding="utf-8-sig" if nuevo else "utf-8"
+        )
+        escritas = len(self.rechazos)
+        self.rechazos.clear()
+        return escritas
@@ -0,0 +1,182 @@
+"""
+Lectura por bloques de ficheros de cartera (Excel, CSV o Parquet)
+Nunca se carga la hoja entera: cada lector devuelve DataFrames de como mucho
+`tamano_bloque` filas, con el índice = posición de la fila de datos (0, 1, 2...)
+para que el informe de rechazos pueda señalar la fila original.
+"""
+import csv
+import hashlib
+import os
+import queue
+import threading
+from itertools import islice
+from typing import Iterator
+import pandas as pd
+from openpyxl import load_workbook
+from app.modules.cartera.importador import (
+    HOJA_CARTERA, FILA_CABECERA, COLUMNAS_FECHA, COLUMNAS_POTENCIA, FORMATO_FECHA
+)
+
+TAMANO_BLOQUE = 5000
+EXTENSIONES_SOPORTADAS = (".xlsx", ".xlsm", ".csv", ".parquet")
+
+
+def primera_fila_de_datos(ruta: str) -> int:
+    """Número (1-based) de la primera fila de datos en el fichero original"""
+    if ruta.lower().endswith(".csv"):
+        return 2  # Línea 1 = cabeceras
+    if ruta.lower().endswith(".parquet"):
+        return 1  # Parquet no tiene filas de cabecera: numeramos desde 1
+    return FILA_CABECERA + 2  # Excel: fila 1 título, fila 2 cabeceras
+
+
+def huella_archivo(ruta: str) -> str:
+    """SHA-256 del fichero (leído a trozos) para reconocerlo al reanudar"""
+    sha = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for trozo in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(trozo)
+    return sha.hexdigest()
+
+
+def leer_excel_por_bloques(ruta: str, tamano_bloque: int = TAMANO_BLOQUE, hoja: str = HOJA_CARTERA,
+                           saltar_filas: int = 0) -> Iterator[pd.DataFrame]:
+    """Lector openpyxl en modo read-only: memoria constante sea cual sea el tamaño del libro"""
+    libro = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        filas = libro[hoja].iter_rows(min_row=FILA_CABECERA + 1, values_only=True)
+        cabeceras = [str(c).strip() if c is not None else "" for c in next(filas, ())]
+        for _ in islice(filas, saltar_filas):
+            pass
+
+        posicion = saltar_filas
+        while True:
+            bloque = list(islice(filas, tamano_bloque))
+            if not bloque:
+                break
+            indice = pd.RangeIndex(posicion, posicion + len(bloque))
+            yield pd.DataFrame.from_records(bloque, columns=cabeceras, index=indice, coerce_float=False)
+            posicion += len(bloque)
+    finally:
+        libro.close()
+
+
+def separador_csv(ruta: str) -> str:
+    """Separador de la cabecera: ';' (Excel en español) o ','"""
+    with open(ruta, encoding="utf-8-sig", newline="") as f:
+        cabecera = f.readline()
+    try:
+        return csv.Sniffer().sniff(cabecera, delimiters=";,\t|").delimiter
+    except csv.Error:
+        return ","
+
+
+def numeros_csv(serie: pd.Series, decimal: str) -> pd.Series:
+    """
+    Potencias de un CSV con su convención de decimales; lo que no es número queda NaN
+    decimal ',': 1.234,5 kW -> 1234.5; decimal '.': 10.5 kW -> 10.5
+    """
+    texto = serie.astype(str).str.replace("kW", "", regex=False).str.replace("€", "", regex=False).str.strip()
+    if decimal == ",":
+        texto = texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    return pd.to_numeric(texto.where(serie.notna()), errors="coerce")
+
+
+def leer_csv_por_bloques(ruta: str, tamano_bloque: int = TAMANO_BLOQUE,
+                         saltar_filas: int = 0) -> Iterator[pd.DataFrame]:
+    """
+    CSV exportado de la hoja de cartera (cabeceras en la primera línea)
+    Todo se lee como texto para no perder ceros (CUPS, códigos postales). Las potencias se
+    convierten aquí según el separador: con ';' decimales con coma y puntos de miles (Excel
+    en español), con ',' decimales con punto. Las fechas se leen como dd/mm/aaaa (FORMATO_FECHA);
+    las que vengan en otro formato siguen como texto y las resuelve limpiar_fechas.
+    """
+    separador = separador_csv(ruta)
+    decimal = "," if separador == ";" else "."
+    lector = pd.read_csv(
+        ruta, chunksize=tamano_bloque, dtype=object, skiprows=range(1, saltar_filas + 1),
+        sep=separador, encoding="utf-8-sig",
+    )
+    posicion = saltar_filas
+    for bloque in lector:
+        bloque.index = pd.RangeIndex(posicion, posicion + len(bloque))
+        posicion += len(bloque)
+        for columna in COLUMNAS_POTENCIA.values():
+            if columna in bloque.columns:
+                bloque[columna] = numeros_csv(bloque[columna], decimal)
+        for columna in COLUMNAS_FECHA.values():
+            if columna in bloque.columns:
+                fechas = pd.to_datetime(bloque[columna], format=FORMATO_FECHA, errors="coerce")
+                bloque[columna] = fechas.astype(object).where(fechas.notna(), bloque[columna])
+        yield bloque
+
+
+def leer_parquet_por_bloques(ruta: str, tamano_bloque: int = TAMANO_BLOQUE,
+                             saltar_filas: int = 0) -> Iterator[pd.DataFrame]:
+    """Parquet por row batches (requiere pyarrow, dependencia opcional)"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Para leer Parquet instala pyarrow: pip install pyarrow")
+
+    posicion = 0
+    for lote in pq.ParquetFile(ruta).iter_batches(batch_size=tamano_bloque):
+        bloque = lote.to_pandas()
+        bloque.index = pd.RangeIndex(posicion, posicion + len(bloque))
+        posicion += len(bloque)
+        if posicion <= saltar_filas:
+            continue
+        yield bloque[bloque.index >= saltar_filas]
+
+
+def leer_por_bloques(ruta: str, tamano_bloque: int = TAMANO_BLOQUE,
+                     saltar_filas: int = 0) -> Iterator[pd.DataFrame]:
+    """Elige el lector según la extensión del fichero"""
+    extension = os.path.splitext(ruta)[1].lower()
+    if extension not in EXTENSIONES_SOPORTADAS:
+        raise ValueError(f"Formato no soportado: {extension} (usa {', '.join(EXTENSIONES_SOPORTADAS)})")
+    if extension == ".csv":
+        return leer_csv_por_bloques(ruta, tamano_bloque, saltar_filas)
+    if extension == ".parquet":
+        return leer_parquet_por_bloques(ruta, tamano_bloque, saltar_filas)
+    return leer_excel_por_bloques(ruta, tamano_bloque, saltar_filas=saltar_filas)
+
+
+def leer_en_segundo_plano(bloques: Iterator[pd.DataFrame], max_pendientes: int = 2) -> Iterator[pd.DataFrame]:
+    """
+    Parsea el siguiente bloque en un hilo mientras el actual se escribe en la base
+    La cola acotada limita la memoria a `max_pendientes` bloques por delante.
+    """
+    cola: queue.Queue = queue.Queue(maxsize=max_pendientes)
+    fin = object()
+    parar = threading.Event()
+
+    def productor():
+        try:
+            for bloque in bloques:
+                if parar.is_set():
+                    return
+                cola.put(bloque)
+        except Exception as e:  # Se relanza en el hilo consumidor
+            cola.put(e)
+            return
+        cola.put(fin)
+
+    hilo = threading.Thread(target=productor, name="lector-cartera", daemon=True)
+    hilo.start()
+    try:
+        while True:
+            elemento = cola.get()
+            if elemento is fin:
+                break
+            if isinstance(elemento, Exception):
+                raise elemento
+            yield elemento
+    finally:
+        parar.set()
+        # Liberar al productor si está bloqueado en put()
+        while hilo.is_alive():
+            try:
+                cola.get_nowait()
+            except queue.Empty:
+                hilo.join(timeout=0.1)
@@ -0,0 +1,90 @@
+"""
+Importación en streaming de ficheros de cartera
+lector (bloques de N filas, parseados en un hilo aparte) -> limpieza vectorizada
+-> ImportadorCartera (un bloque = una transacción). El punto de control
+(filas confirmadas) se guarda en importaciones_cartera dentro de la misma
+transacción que el bloque, así tras una caída se reanuda desde el último
+bloque confirmado sin repetir ni perder filas.
+"""
+import logging
+import os
+from typing import Callable, Optional
+from sqlalchemy import insert, select, update
+from app.modules.crm import models
+from app.modules.cartera.importador import ImportadorCartera, ResumenImportacion, limpiar_dataframe
+from app.modules.cartera.lector import (
+    TAMANO_BLOQUE, huella_archivo, leer_por_bloques, leer_en_segundo_plano, primera_fila_de_datos
+)
+
+logger = logging.getLogger(__name__)
+
+COLUMNAS_OBLIGATORIAS = ("CIF/NIF", "CUPS")
+ESTADO_EN_CURSO = "En curso"
+ESTADO_COMPLETADA = "Completada"
+
+
+def _abrir_checkpoint(engine, ruta: str, reanudar: bool):
+    """Devuelve (id, filas ya confirmadas, estado) del fichero, creando el registro si no existe"""
+    tabla = models.ImportacionCartera.__table__
+    huella = huella_archivo(ruta)
+    with engine.begin() as conn:
+        fila = conn.execute(
+            select(tabla.c.id, tabla.c.filas_confirmadas, tabla.c.estado).where(tabla.c.huella == huella)
+        ).first()
+        if fila is None:
+            id_ = conn.execute(insert(tabla).values(
+                archivo=os.path.basename(ruta), huella=huella, filas_confirmadas=0, estado=ESTADO_EN_CURSO
+            )).inserted_primary_key[0]
+            return id_, 0, ESTADO_EN_CURSO
+        if not reanudar:
+            conn.execute(update(tabla).where(tabla.c.id == fila.id).values(
+                filas_confirmadas=0, estado=ESTADO_EN_CURSO
+            ))
+            return fila.id, 0, ESTADO_EN_CURSO
+        return fila.id, fila.filas_confirmadas or 0, fila.estado
+
+
+def importar_archivo(engine, ruta: str, tamano_bloque: int = TAMANO_BLOQUE, reanudar: bool = True,
+                     informe_rechazos: Optional[str] = None,
+                     al_avanzar: Optional[Callable[[int], None]] = None) -> Optional[ResumenImportacion]:
+    """
+    Importa un .xlsx/.csv/.parquet de cartera con memoria acotada
+
+    Con reanudar=True salta las filas ya confirmadas en una ejecución anterior del
+    mismo fichero (identificado por su SHA-256). Devuelve None si ya estaba completo.
+    al_avanzar(filas_confirmadas) se llama tras confirmar cada bloque.
+    """
+    tabla = models.ImportacionCartera.__table__
+    id_importacion, ya_confirmadas, estado = _abrir_checkpoint(engine, ruta, reanudar)
+    if estado == ESTADO_COMPLETADA:
+        logger.info(f"✅ {ruta} ya se importó completo (usa reanudar=False para repetir)")
+        return None
+    if ya_confirmadas:
+        logger.info(f"↩️  Reanudando {ruta} desde la fila de datos {ya_confirmadas}")
+
+    importador = ImportadorCartera(engine, tamano_lote=tamano_bloque)
+    primera_fila = primera_fila_de_datos(ruta)
+    confirmadas = ya_confirmadas
+
+    for bloque in leer_en_segundo_plano(leer_por_bloques(ruta, tamano_bloque, saltar_filas=ya_confirmadas)):
+        faltan = [c for c in COLUMNAS_OBLIGATORIAS if c not in bloque.columns.str.strip()]
+        if faltan:
+            raise ValueError(f"No encuentro las columnas {faltan}. Disponibles: {list(bloque.columns)}")
+
+        confirmadas += len(bloque)
+
+        def guardar_checkpoint(conn, filas=confirmadas):
+            conn.execute(update(tabla).where(tabla.c.id == id_importacion).values(filas_confirmadas=filas))
+
+        importador.procesar_lote(limpiar_dataframe(bloque, primera_fila), al_confirmar=guardar_checkpoint)
+        if informe_rechazos:
+            importador.volcar_rechazos(informe_rechazos)
+        else:
+            importador.rechazos.clear()
+        if al_avanzar:
+            al_avanzar(confirmadas)
+
+    with engine.begin() as conn:
+        conn.execute(update(tabla).where(tabla.c.id == id_importacion).values(estado=ESTADO_COMPLETADA))
+    logger.info(f"✅ Importación en streaming completada: {confirmadas} filas de datos")
+    return importador.resumen
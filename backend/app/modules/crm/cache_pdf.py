@@ -0,0 +1,100 @@
+"""
+Caché en disco de PDFs de facturas, direccionada por contenido
+La clave es el SHA-256 de lo que se pinta (datos_factura) más la versión de la
+plantilla: si cambia la factura o el cliente, cambia la clave y se genera otro PDF;
+si no, se sirve el fichero ya generado sin volver a pintarlo.
+  • ruta: <PDF_CACHE_DIR>/<2 primeros caracteres>/<hash>.pdf
+  • tamaño acotado (PDF_CACHE_MAX_MB): al pasarse se borran los menos usados (LRU)
+  • el hash sirve también de ETag (If-None-Match -> 304)
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+from app.modules.crm.pdf_generator import renderizar_facturas
+
+logger = logging.getLogger(__name__)
+
+# Subir al cambiar el diseño del PDF: invalida todo lo cacheado
+VERSION_PLANTILLA = "1"
+CARPETA_CACHE_PDF = os.getenv("PDF_CACHE_DIR", os.path.join("uploads", "cache_pdf"))
+TAMANO_MAXIMO_BYTES = int(float(os.getenv("PDF_CACHE_MAX_MB", "200")) * 1024 * 1024)
+
+
+def huella_factura(datos: Dict) -> str:
+    contenido = json.dumps(datos, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{VERSION_PLANTILLA}:{contenido}".encode("utf-8")).hexdigest()
+
+
+class CachePDF:
+    def __init__(self, carpeta: str = CARPETA_CACHE_PDF, tamano_maximo: int = TAMANO_MAXIMO_BYTES):
+        self.carpeta = carpeta
+        self.tamano_maximo = tamano_maximo
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[str, int]" = OrderedDict()  # huella -> bytes (de menos a más reciente)
+        self._total = 0
+        self._cargada = False
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _ruta(self, huella: str) -> str:
+        return os.path.join(self.carpeta, huella[:2], f"{huella}.pdf")
+
+    def _cargar(self):
+        """Al arrancar, reconstruye el índice con lo que haya en disco (orden LRU por mtime)"""
+        encontrados = []
+        if os.path.isdir(self.carpeta):
+            for raiz, _, ficheros in os.walk(self.carpeta):
+                for nombre in ficheros:
+                    if nombre.endswith(".pdf"):
+                        info = os.stat(os.path.join(raiz, nombre))
+                        encontrados.append((info.st_mtime, nombre[:-4], info.st_size))
+        for _, huella, tamano in sorted(encontrados):
+            self._entradas[huella] = tamano
+            self._total += tamano
+        self._cargada = True
+
+    def _expulsar(self):
+        while self._total > self.tamano_maximo and len(self._entradas) > 1:
+            huella, tamano = self._entradas.popitem(last=False)
+            self._total -= tamano
+            try:
+                os.remove(self._ruta(huella))
+            except FileNotFoundError:
+                pass
+
+    def obtener(self, datos: Dict) -> Tuple[str, str]:
+        """Devuelve (ruta del PDF, huella), pintándolo solo si no estaba en la caché"""
+        huella = huella_factura(datos)
+        ruta = self._ruta(huella)
+        with self._lock:
+            if not self._cargada:
+                self._cargar()
+            if huella in self._entradas and os.path.exists(ruta):
+                self._entradas.move_to_end(huella)
+                self.aciertos += 1
+                return ruta, huella
+
+        # Se pinta fuera del lock; se escribe a un temporal y se renombra (atómico)
+        contenido = renderizar_facturas([datos])
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        fd, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(contenido)
+        os.replace(temporal, ruta)
+
+        with self._lock:
+            self.fallos += 1
+            if huella not in self._entradas:
+                self._total += len(contenido)
+            self._entradas[huella] = len(contenido)
+            self._entradas.move_to_end(huella)
+            self._expulsar()
+        return ruta, huella
+
+
+cache_pdf = CachePDF()
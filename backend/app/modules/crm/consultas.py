@@ -0,0 +1,101 @@
+"""
+Consultas de proyección para los listados con datos cruzados
+Cada función devuelve una sentencia SELECT con los JOIN ya resueltos, de modo
+que el endpoint hace una sola consulta y recibe tuplas planas (no objetos ORM).
+"""
+from datetime import date, timedelta
+from typing import Optional
+from sqlalchemy import literal, select
+from app.modules.crm import models
+from app.modules.crm.pagination import filtros_rango_fechas
+
+DIAS_VENTANA_RENOVACION = 45
+ESTADO_ACTIVO = "Activo"
+
+
+def contrato_activo():
+    """
+    Contrato.estado = 'Activo' con el valor escrito en el SQL
+
+    Como parámetro (estado = ?) el planificador no puede saber que coincide con la condición
+    de los índices parciales de contratos (models.SOLO_ACTIVOS) y no los usa.
+    """
+    return models.Contrato.estado == literal(ESTADO_ACTIVO, literal_execute=True)
+
+
+def consulta_renovaciones_pendientes(hoy: date, dias: int = DIAS_VENTANA_RENOVACION):
+    """Contratos activos que vencen en los próximos `dias`, con cliente y CUPS"""
+    Contrato, Punto, Cliente = models.Contrato, models.PuntoSuministro, models.Cliente
+    return (
+        select(
+            Contrato.id,
+            Cliente.nombre.label("cliente"),
+            Cliente.telefono,
+            Punto.cups,
+            Contrato.comercializadora,
+            Contrato.fecha_fin,
+        )
+        .join(Punto, Contrato.punto_suministro_id == Punto.id)
+        .join(Cliente, Punto.cliente_id == Cliente.id)
+        .where(
+            contrato_activo(),
+            Contrato.fecha_fin >= hoy,
+            Contrato.fecha_fin <= hoy + timedelta(days=dias),
+        )
+        .order_by(Contrato.fecha_fin)  # Ordenados por urgencia
+    )
+
+
+def consulta_procesos_atr():
+    """Procesos ATR (más nuevos primero) con nombre de cliente y CUPS del contrato"""
+    ATR, Contrato, Punto, Cliente = models.ProcesoATR, models.Contrato, models.PuntoSuministro, models.Cliente
+    return (
+        select(
+            ATR.id,
+            ATR.codigo_solicitud,
+            ATR.tipo,
+            ATR.estado_atr,
+            ATR.fecha_solicitud,
+            Cliente.nombre.label("cliente"),
+            Punto.cups,
+        )
+        # OUTER JOIN: un proceso sin contrato/punto/cliente se sigue listando
+        .outerjoin(Contrato, ATR.contrato_id == Contrato.id)
+        .outerjoin(Punto, Contrato.punto_suministro_id == Punto.id)
+        .outerjoin(Cliente, Punto.cliente_id == Cliente.id)
+        .order_by(ATR.fecha_solicitud.desc())
+    )
+
+
+def fila_renovacion(fila, hoy: date) -> dict:
+    return {
+        "id": fila.id,
+        "cliente": fila.cliente,
+        "telefono": fila.telefono or "N/A",
+        "cups": fila.cups,
+        "comercializadora": fila.comercializadora,
+        "fecha_fin": fila.fecha_fin.isoformat() if fila.fecha_fin else None,
+        "dias_restantes": (fila.fecha_fin - hoy).days,
+    }
+
+
+def fila_proceso_atr(fila) -> dict:
+    return {
+        "id": fila.id,
+        "codigo": fila.codigo_solicitud,
+        "tipo": fila.tipo,  # C1 = Alta, C2 = Cambio
+        "estado": fila.estado_atr,
+        "fecha": fila.fecha_solicitud,
+        "cliente": fila.cliente or "Desconocido",
+        "cups": fila.cups or "N/A",
+    }
+
+
+def filtros_facturas(estado: Optional[str], cliente_id: Optional[int], desde: Optional[date], hasta: Optional[date]):
+    """Condiciones de los listados y exportaciones de facturas (también las usan los trabajos en segundo plano)"""
+    filtros = filtros_rango_fechas(models.Factura.created_at, desde, hasta)
+    if estado:
+        filtros.append(models.Factura.estado == estado)
+    if cliente_id is not None:
+        filtros.append(models.Factura.cliente_id == cliente_id)
+    return filtros
@@ -0,0 +1,142 @@
+"""
+Agregados del dashboard (/dashboard-stats/)
+Todos los KPIs salen de una sola sentencia SQL con subconsultas escalares y los
+desgloses (por comercializadora y por mes) de una consulta agrupada cada uno.
+El resultado se guarda en una caché de vida corta que se invalida en cuanto se
+confirma una escritura sobre clientes, facturas o contratos.
+"""
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict
+from cachetools import TTLCache
+from sqlalchemy import event, func, select, case
+from sqlalchemy.orm import Session
+from app.modules.crm import models
+from app.modules.crm.consultas import DIAS_VENTANA_RENOVACION, contrato_activo
+
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", 30))  # segundos
+
+# Modelos cuyas escrituras invalidan los agregados
+MODELOS_OBSERVADOS = (models.Cliente, models.Factura, models.Contrato)
+
+_cache = TTLCache(maxsize=8, ttl=DASHBOARD_CACHE_TTL)
+_cache_lock = threading.Lock()
+
+
+def invalidar_cache_dashboard():
+    """Vacía la caché de agregados (la siguiente petición recalcula)"""
+    with _cache_lock:
+        _cache.clear()
+
+
+# --- Invalidación automática ---
+# En cada flush marcamos la sesión si tocó algún modelo observado; al hacer
+# commit de esa sesión vaciamos la caché. Así cualquier escritura ORM (API,
+# scripts de importación...) invalida sin tener que acordarse en cada endpoint.
+@event.listens_for(Session, "after_flush")
+def _marcar_sesion_modificada(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, MODELOS_OBSERVADOS):
+            session.info["dashboard_sucio"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidar_tras_commit(session):
+    if session.info.pop("dashboard_sucio", False):
+        invalidar_cache_dashboard()
+
+
+@event.listens_for(Session, "after_rollback")
+def _limpiar_marca_tras_rollback(session):
+    session.info.pop("dashboard_sucio", None)
+
+
+def _expresion_mes(db: Session, columna):
+    """Agrupa una columna DateTime por 'YYYY-MM' según el motor"""
+    if db.get_bind().dialect.name == "sqlite":
+        return func.strftime("%Y-%m", columna)
+    return func.to_char(columna, "YYYY-MM")
+
+
+def _kpis(db: Session, hoy: date) -> Dict[str, Any]:
+    limite = hoy + timedelta(days=DIAS_VENTANA_RENOVACION)
+    inicio_hoy = datetime.combine(hoy, datetime.min.time())
+    Cliente, Factura, Contrato = models.Cliente, models.Factura, models.Contrato
+
+    # Una sola ida y vuelta: cada KPI es una subconsulta escalar
+    fila = db.execute(select(
+        select(func.count(Cliente.id)).scalar_subquery().label("total_clientes"),
+        select(func.count(Cliente.id)).where(Cliente.is_active == True).scalar_subquery().label("activos"),
+        select(func.count(Cliente.id)).where(Cliente.created_at >= inicio_hoy).scalar_subquery().label("nuevos_hoy"),
+        select(func.count(Factura.id)).scalar_subquery().label("total_facturas"),
+        select(func.coalesce(func.sum(Factura.monto), 0.0)).scalar_subquery().label("total_dinero"),
+        select(func.count(Contrato.id)).where(
+            contrato_activo(),
+            Contrato.fecha_fin >= hoy,
+            Contrato.fecha_fin <= limite,
+        ).scalar_subquery().label("por_vencer"),
+    )).one()
+    return dict(fila._mapping)
+
+
+def _por_comercializadora(db: Session, hoy: date):
+    limite = hoy + timedelta(days=DIAS_VENTANA_RENOVACION)
+    Contrato = models.Contrato
+    vence_pronto = case(
+        ((Contrato.fecha_fin >= hoy) & (Contrato.fecha_fin <= limite), 1), else_=0
+    )
+    filas = db.execute(
+        select(
+            Contrato.comercializadora,
+            func.count(Contrato.id),
+            func.sum(vence_pronto),
+        )
+        .where(contrato_activo())
+        .group_by(Contrato.comercializadora)
+        .order_by(func.count(Contrato.id).desc())
+    ).all()
+    return [
+        {"comercializadora": nombre or "Desconocida", "contratos_activos": total, "por_vencer": int(vencen or 0)}
+        for nombre, total, vencen in filas
+    ]
+
+
+def _por_mes(db: Session, hoy: date):
+    Factura = models.Factura
+    desde = datetime(hoy.year - 1, hoy.month, 1)  # Últimos 12 meses completos + el actual
+    mes = _expresion_mes(db, Factura.created_at).label("mes")
+    filas = db.execute(
+        select(mes, func.count(Factura.id), func.coalesce(func.sum(Factura.monto), 0.0))
+        .where(Factura.created_at >= desde)
+        .group_by(mes)
+        .order_by(mes)
+    ).all()
+    return [{"mes": m, "facturas": n, "importe": float(total)} for m, n, total in filas]
+
+
+def obtener_estadisticas_dashboard(db: Session) -> Dict[str, Any]:
+    """Devuelve los KPIs del dashboard, recalculando solo si la caché expiró o se invalidó"""
+    hoy = date.today()
+    with _cache_lock:
+        cacheado = _cache.get(hoy)
+    if cacheado is not None:
+        return cacheado
+
+    kpis = _kpis(db, hoy)
+    resultado = {
+        "total_clientes": kpis["total_clientes"],
+        "total_facturas": kpis["total_facturas"],
+        "total_dinero": float(kpis["total_dinero"]),
+        "activos": kpis["activos"],
+        "inactivos": kpis["total_clientes"] - kpis["activos"],
+        "nuevos_hoy": kpis["nuevos_hoy"],
+        "por_vencer": kpis["por_vencer"],
+        "por_comercializadora": _por_comercializadora(db, hoy),
+        "por_mes": _por_mes(db, hoy),
+    }
+
+    with _cache_lock:
+        _cache[hoy] = resultado
+    return resultado
@@ -0,0 +1,116 @@
+"""
+PDFs de facturas en bloque (ej. toda la facturación de un mes)
+Las facturas se convierten a dicts (datos_factura) y se reparten en trozos entre
+un pool de procesos; cada trozo se pinta con la plantilla compartida (Form XObject).
+El resultado se escribe en un fichero temporal (en memoria hasta 20 MB, luego a
+disco) y se devuelve por trozos, así la memoria no crece con el número de facturas:
+  • formato "zip": un PDF por factura (Factura_<id>.pdf)
+  • formato "pdf": un único PDF con una página por factura
+"""
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
+from pypdf import PdfWriter
+from app.modules.crm.pdf_generator import renderizar_facturas
+
+logger = logging.getLogger(__name__)
+
+FORMATO_ZIP = "zip"
+FORMATO_PDF = "pdf"
+TAMANO_TAREA = 50  # Facturas por tarea enviada a cada proceso
+MAX_FACTURAS_LOTE = int(os.getenv("PDF_MAX_FACTURAS_LOTE", "5000"))
+WORKERS_PDF = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+TAMANO_EN_MEMORIA = 20 * 1024 * 1024
+
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def obtener_pool(workers: int) -> ProcessPoolExecutor:
+    """Pool reutilizado entre peticiones (arrancar procesos cuesta más que pintar un lote pequeño)"""
+    with _pools_lock:
+        if workers not in _pools:
+            # spawn: el proceso de la API tiene hilos (cola de Dynamics, etc.) y fork no es seguro
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pools[workers]
+
+
+def cerrar_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _pools.clear()
+
+
+def _pdfs_individuales(trozo: List[Dict]) -> List[tuple]:
+    return [(f"Factura_{datos['id']}.pdf", renderizar_facturas([datos])) for datos in trozo]
+
+
+def _resultados(funcion, lista_datos: List[Dict], workers: int) -> Iterator:
+    """Aplica `funcion` a trozos de TAMANO_TAREA facturas, en orden, en el pool o en este proceso"""
+    trozos = [lista_datos[i:i + TAMANO_TAREA] for i in range(0, len(lista_datos), TAMANO_TAREA)]
+    if workers <= 1 or len(trozos) == 1:
+        return map(funcion, trozos)
+    return obtener_pool(workers).map(funcion, trozos)
+
+
+def generar_lote(lista_datos: List[Dict], formato: str = FORMATO_ZIP, workers: Optional[int] = None,
+                 al_avanzar: Optional[Callable[[int], None]] = None):
+    """
+    Devuelve un fichero temporal (posicionado al inicio) con el ZIP o el PDF combinado
+    al_avanzar(facturas_pintadas) se llama tras cada trozo (progreso de los trabajos en segundo plano)
+    """
+    workers = workers or WORKERS_PDF
+    al_avanzar = al_avanzar or (lambda hechas: None)
+    destino = tempfile.SpooledTemporaryFile(max_size=TAMANO_EN_MEMORIA)
+    hechas = 0
+
+    if formato == FORMATO_ZIP:
+        # Los PDF ya van comprimidos: ZIP_STORED evita recomprimirlos
+        with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_STORED) as zip_:
+            for pdfs in _resultados(_pdfs_individuales, lista_datos, workers):
+                for nombre, contenido in pdfs:
+                    zip_.writestr(nombre, contenido)
+                hechas += len(pdfs)
+                al_avanzar(hechas)
+    elif formato == FORMATO_PDF:
+        if workers > 1:
+            partes = []
+            for parte, inicio in zip(_resultados(renderizar_facturas, lista_datos, workers),
+                                     range(0, len(lista_datos), TAMANO_TAREA)):
+                partes.append(parte)
+                al_avanzar(min(inicio + TAMANO_TAREA, len(lista_datos)))
+        else:  # En un solo proceso se pinta todo de una vez (sin trocear ni combinar con pypdf)
+            partes = [renderizar_facturas(lista_datos)]
+            al_avanzar(len(lista_datos))
+        if len(partes) == 1:
+            destino.write(partes[0])
+        else:
+            writer = PdfWriter()
+            for parte in partes:
+                writer.append(io.BytesIO(parte))
+            writer.write(destino)
+    else:
+        raise ValueError(f"Formato no soportado: {formato}")
+
+    destino.seek(0)
+    logger.info(f"📄 Lote de {len(lista_datos)} facturas generado ({formato}, {workers} procesos)")
+    return destino
+
+
+def iterar_archivo(archivo, tamano: int = 64 * 1024) -> Iterator[bytes]:
+    """Lee el fichero por trozos para StreamingResponse y lo cierra al terminar"""
+    try:
+        while True:
+            trozo = archivo.read(tamano)
+            if not trozo:
+                break
+            yield trozo
+    finally:
+        archivo.close()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Date, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Date, ForeignKey, Index, JSON, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.database import Base
@@ -22,9 +22,14 @@ class Cliente(Base):
     email = Column(String, index=True)
     telefono = Column(String, nullable=True)
     iban = Column(String, nullable=True)
-    tipo_cliente = Column(String, default="PYME")
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    direccion = Column(String, nullable=True)
+    ciudad = Column(String, nullable=True)
+    codigo_postal = Column(String, nullable=True)
+    provincia = Column(String, nullable=True)
+    tipo_cliente = Column(String, default="PYME", index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     is_active = Column(Boolean, default=True)
+    dynamics_id = Column(String, unique=True, index=True, nullable=True) # accountid/contactid en Dynamics 365
     
     puntos_suministro = relationship("PuntoSuministro", back_populates="cliente")
     facturas = relationship("Factura", back_populates="cliente")
@@ -41,13 +46,25 @@ class PuntoSuministro(Base):
     provincia = Column(String)
     tarifa_acceso = Column(String)
     distribuidora = Column(String, nullable=True)
-    cliente_id = Column(Integer, ForeignKey("clientes.id"))
+    cliente_id = Column(Integer, ForeignKey("clientes.id"), index=True) # Contratos de un cliente (/contratos/{cliente_id})
     cliente = relationship("Cliente", back_populates="puntos_suministro")
     contratos = relationship("Contrato", back_populates="punto_suministro")
 
 # 4. CONTRATO
+# Casi todas las consultas por estado piden los activos: índices parciales (solo filas "Activo"),
+# más pequeños que uno sobre toda la tabla. Para que se usen, la consulta debe llevar el valor
+# escrito en el SQL y no como parámetro (consultas.contrato_activo)
+SOLO_ACTIVOS = text("estado = 'Activo'")
+
 class Contrato(Base):
     __tablename__ = "contratos"
+    __table_args__ = (
+        # Ventana de renovaciones y KPI "por vencer": estado = 'Activo' AND fecha_fin BETWEEN ...
+        Index("ix_contratos_activos_fecha_fin", "fecha_fin", sqlite_where=SOLO_ACTIVOS, postgresql_where=SOLO_ACTIVOS),
+        # Activos por comercializadora (dashboard): el índice ya lleva fecha_fin, no se lee la tabla
+        Index("ix_contratos_activos_comercializadora", "comercializadora", "fecha_fin",
+              sqlite_where=SOLO_ACTIVOS, postgresql_where=SOLO_ACTIVOS),
+    )
     id = Column(Integer, primary_key=True, index=True)
     fecha_firma = Column(Date, nullable=True)
     fecha_inicio = Column(Date, nullable=True)
@@ -61,8 +78,18 @@ class Contrato(Base):
     p5 = Column(Float, default=0.0)
     p6 = Column(Float, default=0.0)
     estado = Column(String, default="Borrador")
-    punto_suministro_id = Column(Integer, ForeignKey("puntos_suministro.id"))
+    dynamics_id = Column(String, unique=True, index=True, nullable=True) # contractid en Dynamics 365 (tras enviarlo)
+    punto_suministro_id = Column(Integer, ForeignKey("puntos_suministro.id"), index=True)
     punto_suministro = relationship("PuntoSuministro", back_populates="contratos")
+    # Cliente del contrato a través de su CUPS (solo lectura: Contrato -> PuntoSuministro -> Cliente)
+    cliente = relationship(
+        "Cliente",
+        secondary="puntos_suministro",
+        primaryjoin="Contrato.punto_suministro_id == PuntoSuministro.id",
+        secondaryjoin="PuntoSuministro.cliente_id == Cliente.id",
+        uselist=False,
+        viewonly=True,
+    )
     
     atr = relationship("ProcesoATR", back_populates="contrato", uselist=False) # 1 a 1
 
@@ -76,7 +103,7 @@ class ProcesoATR(Base):
     motivo_rechazo = Column(String, nullable=True)
     fecha_solicitud = Column(DateTime(timezone=True), server_default=func.now())
     
-    contrato_id = Column(Integer, ForeignKey("contratos.id"))
+    contrato_id = Column(Integer, ForeignKey("contratos.id"), index=True)
     contrato = relationship("Contrato", back_populates="atr")
 
 # 6. NUEVO: DOCUMENTOS
@@ -88,17 +115,22 @@ class Documento(Base):
     url_archivo = Column(String) # Ruta local o URL nube
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
     
-    cliente_id = Column(Integer, ForeignKey("clientes.id"))
+    cliente_id = Column(Integer, ForeignKey("clientes.id"), index=True)
     cliente = relationship("Cliente", back_populates="documentos")
 
 # 7. FACTURAS & TARIFAS (Sin cambios)
 class Factura(Base):
     __tablename__ = "facturas"
+    # Listados paginados (WHERE cliente_id/estado = ? ORDER BY id DESC): el índice ya da el orden
+    __table_args__ = (
+        Index("ix_facturas_cliente_id_id", "cliente_id", "id"),
+        Index("ix_facturas_estado_id", "estado", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     monto = Column(Float)
     concepto = Column(String)
-    estado = Column(String, default="Pendiente") 
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    estado = Column(String, default="Pendiente")
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     cliente_id = Column(Integer, ForeignKey("clientes.id"))
     cliente = relationship("Cliente", back_populates="facturas")
 
@@ -107,9 +139,9 @@ class Tarifa(Base):
     id = Column(Integer, primary_key=True, index=True)
     nombre = Column(String, index=True)
     compania = Column(String, index=True)
-    precio_potencia = Column(Float)
-    precio_energia = Column(Float)
-    tipo = Column(String)
+    precio_potencia = Column(Float) # €/kW y día
+    precio_energia = Column(Float) # €/kWh
+    tipo = Column(String) # Peaje al que se ofrece (2.0TD, 3.0TD...); vacío = cualquiera
     is_active = Column(Boolean, default=True)
 
 # 8. SOPORTE (Tickets)
@@ -120,16 +152,17 @@ class Ticket(Base):
     asunto = Column(String)
     descripcion = Column(String)
     prioridad = Column(String, default="Media") # Baja, Media, Alta, Urgente
-    estado = Column(String, default="Abierto") # Abierto, En Proceso, Resuelto
-    fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
+    estado = Column(String, default="Abierto", index=True) # Abierto, En Proceso, Resuelto
+    fecha_creacion = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     
-    cliente_id = Column(Integer, ForeignKey("clientes.id"))
+    cliente_id = Column(Integer, ForeignKey("clientes.id"), index=True)
     cliente = relationship("Cliente", back_populates="tickets")
     
     mensajes = relationship("MensajeTicket", back_populates="ticket")
 
 class MensajeTicket(Base):
     __tablename__ = "mensajes_ticket"
+    __table_args__ = (Index("ix_mensajes_ticket_ticket_fecha", "ticket_id", "fecha"),) # Hilo de un ticket, en orden
 
     id = Column(Integer, primary_key=True, index=True)
     texto = Column(String)
@@ -139,3 +172,66 @@ class MensajeTicket(Base):
     
     ticket_id = Column(Integer, ForeignKey("tickets.id"))
     ticket = relationship("Ticket", back_populates="mensajes")
+
+# 9. IMPORTACIONES DE CARTERA (punto de control para reanudar)
+class ImportacionCartera(Base):
+    __tablename__ = "importaciones_cartera"
+
+    id = Column(Integer, primary_key=True, index=True)
+    archivo = Column(String)
+    huella = Column(String(64), unique=True, index=True) # SHA-256 del fichero importado
+    filas_confirmadas = Column(Integer, default=0) # Filas de datos ya escritas (bloques confirmados)
+    estado = Column(String, default="En curso") # En curso, Completada
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# 10. SINCRONIZACIÓN CON DYNAMICS 365 (estado por entidad)
+class SincronizacionD365(Base):
+    __tablename__ = "sincronizacion_d365"
+
+    id = Column(Integer, primary_key=True, index=True)
+    entidad = Column(String, unique=True, index=True) # accounts, contacts
+    delta_link = Column(String, nullable=True) # @odata.deltaLink (change tracking)
+    ultima_modificacion = Column(String, nullable=True) # Marca de agua: mayor modifiedon aplicado (ISO 8601)
+    ultimo_modo = Column(String, nullable=True) # full, delta
+    ultima_ejecucion = Column(DateTime(timezone=True), nullable=True)
+    registros_cambiados = Column(Integer, default=0)
+    registros_borrados = Column(Integer, default=0)
+
+# 11. COLA DE ESCRITURA HACIA DYNAMICS 365 (cambios locales pendientes de enviar)
+class CambioPendienteD365(Base):
+    __tablename__ = "cola_dynamics365"
+    __table_args__ = (Index("ix_cola_dynamics365_estado_siguiente", "estado", "siguiente_intento"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    tabla = Column(String) # clientes, contratos
+    registro_id = Column(Integer, index=True) # id local; el contenido se lee al enviar
+    operacion = Column(String) # crear, actualizar
+    estado = Column(String, default="Pendiente") # Pendiente, Enviado, Error
+    intentos = Column(Integer, default=0)
+    siguiente_intento = Column(DateTime(timezone=True), server_default=func.now())
+    ultimo_error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    enviado_at = Column(DateTime(timezone=True), nullable=True)
+
+# 12. TRABAJOS EN SEGUNDO PLANO (remesas, PDFs en bloque, importaciones)
+class Trabajo(Base):
+    __tablename__ = "trabajos"
+    __table_args__ = (Index("ix_trabajos_estado_created", "estado", "created_at"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    tipo = Column(String, index=True) # remesa_sepa, facturas_pdf, importar_cartera, importar_dynamics
+    estado = Column(String, default="Pendiente") # Pendiente, En curso, Completado, Error
+    parametros = Column(JSON, nullable=True)
+    progreso = Column(Float, default=0) # 0 a 1
+    mensaje = Column(String, nullable=True) # Último paso (ej. "Bloque 3: 15000 filas")
+    resultado = Column(JSON, nullable=True) # Resumen (contadores, rechazos...)
+    archivo = Column(String, nullable=True) # Ruta del fichero generado, para descargarlo después
+    archivo_nombre = Column(String, nullable=True)
+    archivo_tipo = Column(String, nullable=True) # MIME
+    error = Column(String, nullable=True)
+    intentos = Column(Integer, default=0)
+    reservado_hasta = Column(DateTime(timezone=True), nullable=True) # Si vence "En curso", el proceso murió
+    usuario_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    iniciado_at = Column(DateTime(timezone=True), nullable=True)
+    terminado_at = Column(DateTime(timezone=True), nullable=True)
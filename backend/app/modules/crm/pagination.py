@@ -0,0 +1,56 @@
+"""
+Paginación por cursor (keyset) para los listados del CRM
+El cursor es el último id devuelto: la siguiente página se pide con ?cursor=<id>
+y se resuelve con un "WHERE id < cursor ORDER BY id DESC LIMIT n", que usa la
+clave primaria en SQLite y PostgreSQL sin importar lo profunda que sea la página.
+"""
+from typing import Any, List, Optional, Sequence
+from datetime import date, timedelta
+from fastapi import Response
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+LIMITE_POR_DEFECTO = 100
+LIMITE_MAXIMO = 1000
+
+
+def filtros_rango_fechas(columna, desde: Optional[date], hasta: Optional[date]) -> List[Any]:
+    """Devuelve los filtros [desde, hasta] (ambos incluidos) sobre una columna DateTime"""
+    filtros = []
+    if desde:
+        filtros.append(columna >= desde)
+    if hasta:
+        # "hasta" incluye todo el día: comparamos contra el inicio del día siguiente
+        filtros.append(columna < hasta + timedelta(days=1))
+    return filtros
+
+
+def paginar_keyset(
+    db: Session,
+    modelo,
+    filtros: Sequence[Any],
+    cursor: Optional[int],
+    limit: int,
+    response: Response,
+) -> list:
+    """
+    Devuelve una página de `modelo` ordenada por id descendente (los más nuevos primero)
+
+    El total (con los mismos filtros) y el cursor de la siguiente página se envían
+    en las cabeceras X-Total-Count y X-Next-Cursor, así el cuerpo sigue siendo una lista.
+    """
+    total = db.query(func.count(modelo.id)).filter(*filtros).scalar()
+
+    query = db.query(modelo).filter(*filtros)
+    if cursor is not None:
+        query = query.filter(modelo.id < cursor)
+
+    # Pedimos una fila de más para saber si hay página siguiente sin otra consulta
+    filas = query.order_by(modelo.id.desc()).limit(limit + 1).all()
+
+    response.headers["X-Total-Count"] = str(total)
+    if len(filas) > limit:
+        filas = filas[:limit]
+        response.headers["X-Next-Cursor"] = str(filas[-1].id)
+
+    return filas
@@ -3,81 +3,131 @@ from reportlab.pdfgen import canvas
 from reportlab.lib import colors
 from reportlab.lib.colors import HexColor # Importamos para usar Hex
 from datetime import datetime
+from typing import Dict, List
 import io
 
-def generar_pdf_factura(factura, cliente):
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
+AZUL_LOVILUZ = HexColor('#1e3a8a')
+GRIS_CABECERA_TABLA = HexColor('#f3f4f6')
+NOMBRE_PLANTILLA = "plantilla_factura"
+
+
+def datos_factura(factura, cliente) -> Dict:
+    """
+    Extrae de la factura y su cliente solo lo que se pinta en el PDF
+    (un dict simple: se puede mandar a otro proceso y sirve para calcular hashes)
+    """
+    fecha = factura.created_at.strftime("%d/%m/%Y") if factura.created_at else datetime.now().strftime("%d/%m/%Y")
+    return {
+        "id": factura.id,
+        "fecha": fecha,
+        "concepto": factura.concepto or "",
+        "monto": float(factura.monto or 0),
+        "cliente_nombre": cliente.nombre if cliente else "",
+        "cliente_nif": cliente.nif_cif if cliente else "",
+        "cliente_email": (cliente.email or "") if cliente else "",
+        "cliente_telefono": (cliente.telefono or "") if cliente else "",
+    }
+
+
+def _dibujar_plantilla(c):
+    """Cabecera, rótulos y pie: lo que es igual en todas las facturas"""
     width, height = A4
 
-    # 1. CABECERA (Azul Oscuro) - CAMBIO AQUÍ
-    # Usamos HexColor en lugar de MidnightBlue para evitar errores
-    c.setFillColor(HexColor('#1e3a8a')) 
+    # 1. CABECERA (Azul Oscuro)
+    c.setFillColor(AZUL_LOVILUZ)
     c.rect(0, height - 120, width, 120, fill=True, stroke=False)
-    
+
     # Texto Logo
     c.setFillColor(colors.white)
     c.setFont("Helvetica-Bold", 30)
     c.drawString(40, height - 50, "LOVILUZ")
     c.setFont("Helvetica", 12)
     c.drawString(40, height - 70, "Gestión Energética Integral")
-
-    # Datos Factura
     c.setFont("Helvetica-Bold", 16)
     c.drawRightString(width - 40, height - 50, "FACTURA")
-    c.setFont("Helvetica", 12)
-    c.drawRightString(width - 40, height - 70, f"Nº: {factura.id:05d}")
-    
-    fecha = factura.created_at.strftime("%d/%m/%Y") if factura.created_at else datetime.now().strftime("%d/%m/%Y")
-    c.drawRightString(width - 40, height - 90, f"Fecha: {fecha}")
 
-    # 2. CLIENTE
+    # 2. CLIENTE (rótulo)
     c.setFillColor(colors.black)
     c.setFont("Helvetica-Bold", 10)
     c.drawString(40, height - 160, "FACTURAR A:")
-    
-    c.setFont("Helvetica", 12)
-    c.drawString(40, height - 180, f"{cliente.nombre}")
-    c.setFont("Helvetica", 10)
-    c.setFillColor(colors.gray)
-    c.drawString(40, height - 195, f"{cliente.empresa}")
-    c.drawString(40, height - 210, f"{cliente.email}")
-    if cliente.telefono:
-        c.drawString(40, height - 225, f"Tel: {cliente.telefono}")
 
-    # 3. TABLA
+    # 3. TABLA (encabezados con fondo gris claro)
     y_inicio = height - 280
-    
-    # Fondo gris claro para encabezados
-    c.setFillColor(HexColor('#f3f4f6')) 
+    c.setFillColor(GRIS_CABECERA_TABLA)
     c.rect(40, y_inicio, width - 80, 25, fill=True, stroke=False)
-    
     c.setFillColor(colors.black)
     c.setFont("Helvetica-Bold", 10)
     c.drawString(50, y_inicio + 8, "DESCRIPCIÓN")
     c.drawRightString(width - 50, y_inicio + 8, "IMPORTE")
 
-    # Items
-    y_item = y_inicio - 30
+    # 5. PIE
+    c.setFont("Helvetica", 8)
+    c.setFillColor(colors.gray)
+    c.drawCentredString(width / 2, 30, "Documento generado por ERP Modular - Powered by Crazy Digital 🚀")
+
+
+def _dibujar_factura(c, datos: Dict, con_form: bool):
+    """Pinta una factura en la página actual"""
+    width, height = A4
+    if con_form:
+        c.doForm(NOMBRE_PLANTILLA)
+    else:
+        _dibujar_plantilla(c)
+
+    # Datos Factura
+    c.setFillColor(colors.white)
+    c.setFont("Helvetica", 12)
+    c.drawRightString(width - 40, height - 70, f"Nº: {datos['id']:05d}")
+    c.drawRightString(width - 40, height - 90, f"Fecha: {datos['fecha']}")
+
+    # 2. CLIENTE
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica", 12)
+    c.drawString(40, height - 180, f"{datos['cliente_nombre']}")
+    c.setFont("Helvetica", 10)
+    c.setFillColor(colors.gray)
+    c.drawString(40, height - 195, f"NIF/CIF: {datos['cliente_nif']}")
+    c.drawString(40, height - 210, f"{datos['cliente_email']}")
+    if datos["cliente_telefono"]:
+        c.drawString(40, height - 225, f"Tel: {datos['cliente_telefono']}")
+
+    # 3. TABLA (items)
+    y_item = height - 280 - 30
+    c.setFillColor(colors.black)
     c.setFont("Helvetica", 11)
-    c.drawString(50, y_item, factura.concepto)
-    c.drawRightString(width - 50, y_item, f"{factura.monto:.2f} €")
-    
+    c.drawString(50, y_item, datos["concepto"])
+    c.drawRightString(width - 50, y_item, f"{datos['monto']:.2f} €")
+
     c.setStrokeColor(colors.lightgrey)
     c.line(40, y_item - 15, width - 40, y_item - 15)
 
     # 4. TOTALES
     y_total = y_item - 60
     c.setFont("Helvetica-Bold", 14)
-    c.setFillColor(HexColor('#1e3a8a')) # Azul otra vez
-    c.drawRightString(width - 50, y_total, f"TOTAL: {factura.monto:.2f} €")
-
-    # 5. PIE
-    c.setFont("Helvetica", 8)
-    c.setFillColor(colors.gray)
-    c.drawCentredString(width / 2, 30, "Documento generado por ERP Modular - Powered by Crazy Digital 🚀")
+    c.setFillColor(AZUL_LOVILUZ) # Azul otra vez
+    c.drawRightString(width - 50, y_total, f"TOTAL: {datos['monto']:.2f} €")
 
     c.showPage()
+
+
+def renderizar_facturas(lista_datos: List[Dict]) -> bytes:
+    """
+    Un único PDF con una página por factura
+    Con varias facturas la plantilla se dibuja una sola vez como Form XObject y cada
+    página solo la referencia (doForm); con una sola no compensa y se pinta directa.
+    """
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    con_form = len(lista_datos) > 1
+    if con_form:
+        c.beginForm(NOMBRE_PLANTILLA)
+        _dibujar_plantilla(c)
+        c.endForm()
+    for datos in lista_datos:
+        _dibujar_factura(c, datos, con_form)
     c.save()
-    buffer.seek(0)
-    return buffer
\ No newline at end of file
+    return buffer.getvalue()
+
+
+def generar_pdf_factura(factura, cliente):
+    return io.BytesIO(renderizar_facturas([datos_factura(factura, cliente)]))
@@ -20,6 +20,11 @@ class ClienteCreate(ClienteBase):
 class ClienteResponse(ClienteBase):
     id: int
     is_active: bool
+    # Dirección fiscal (llega de Dynamics 365; no se edita desde el formulario)
+    direccion: Optional[str] = None
+    ciudad: Optional[str] = None
+    codigo_postal: Optional[str] = None
+    provincia: Optional[str] = None
     created_at: datetime
     
     class Config:
@@ -118,6 +123,24 @@ class TarifaResponse(TarifaBase):
     class Config:
         from_attributes = True
 
+class ComparativaContrato(BaseModel):
+    contrato_id: int
+    peaje: str # 2.0TD, 3.0TD...
+    consumo_estimado: float # kWh al año
+    coste_actual: Optional[float] = None # Si su tarifa actual (comercializadora + producto) está en tarifas
+    tarifa_id: int
+    tarifa: str
+    compania: str
+    coste_anual: float # € al año con impuestos
+    ahorro_anual: Optional[float] = None
+
+class ComparativaCarteraResponse(BaseModel):
+    contratos: int
+    comparados: int
+    tarifas: int
+    ahorro_total: float
+    resultados: List[ComparativaContrato] = []
+
 # =======================
 # 6. ESQUEMAS DE DOCUMENTO
 # =======================
@@ -189,3 +212,38 @@ class MensajeResponse(MensajeCreate):
     fecha: datetime
     class Config:
         from_attributes = True
+
+# =======================
+# 9. ESQUEMAS DE REMESA SEPA (validación previa)
+# =======================
+class RechazoRemesa(BaseModel):
+    factura_id: int
+    cliente_id: int
+    campo: str # iban, mandato, importe o nombre
+    motivo: str
+
+class ValidacionRemesaResponse(BaseModel):
+    revisados: int
+    rechazados: int
+    rechazos: List[RechazoRemesa] = []
+    avisos: List[str] = [] # Problemas del acreedor o de la fecha de cobro (afectan a todo el fichero)
+    segundos: float
+
+# =======================
+# 10. ESQUEMAS DE TRABAJOS EN SEGUNDO PLANO
+# =======================
+class TrabajoResponse(BaseModel):
+    id: int
+    tipo: str
+    estado: str # Pendiente, En curso, Completado, Error
+    progreso: float = 0 # 0 a 1
+    mensaje: Optional[str] = None
+    resultado: Optional[dict] = None
+    error: Optional[str] = None
+    intentos: int = 0
+    archivo_nombre: Optional[str] = None # Si hay fichero: GET /jobs/{id}/resultado
+    created_at: Optional[datetime] = None
+    iniciado_at: Optional[datetime] = None
+    terminado_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
@@ -1,52 +1,193 @@
-from sepaxml import SepaDD
-from datetime import date
-import io
-
-def generar_xml_sepa(facturas, empresa_emisora):
-    # Configuración de la remesa
-    sepa = SepaDD(
-        {
-            "name": empresa_emisora["nombre"],
-            "IBAN": empresa_emisora["iban"],
-            "BIC": empresa_emisora["bic"],
-            "batch": True,
-            "creditor_id": empresa_emisora["creditor_id"],
-            "currency": "EUR",
-        },
-        schema="pain.008.001.02",
+"""
+Remesas SEPA de adeudos directos (pain.008.001.02) en streaming
+En vez de montar todo el árbol XML en memoria (sepaxml), se escribe el fichero
+según se leen las facturas de la base de datos con un cursor en servidor:
+  1. Una consulta agregada previa (GROUP BY) da NbOfTxs y CtrlSum de cada grupo,
+     que van en la cabecera antes que los adeudos.
+  2. Se genera un fichero por tipo de secuencia (FRST primer adeudo del cliente,
+     RCUR recurrente) y fecha de cobro, cada uno con un único PmtInf.
+  3. Cada DrctDbtTxInf se escribe y se olvida: la memoria no crece con el número
+     de facturas (el fichero va a un temporal que pasa a disco al crecer).
+"""
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from functools import lru_cache
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Iterator, List
+from xml.sax.saxutils import escape
+from sqlalchemy import Integer, case, cast, false, func, select, text, true
+from sqlalchemy.orm import Session, aliased
+from text_unidecode import unidecode
+from app.modules.crm import models
+
+ESQUEMA = "pain.008.001.02"
+SECUENCIA_PRIMERO = "FRST"
+SECUENCIA_RECURRENTE = "RCUR"
+ESTADO_COBRADA = "Pagada"  # Una factura ya cobrada implica que el mandato se ha usado antes
+FILAS_POR_LOTE_CURSOR = 2000
+TAMANO_EN_MEMORIA = 20 * 1024 * 1024
+
+EMPRESA_SEPA = {
+    "nombre": "LOVILUZ ENERGIA S.L.",
+    "iban": "ES4521000418450200051332",
+    "bic": "CAIXESBBXXX",
+    "creditor_id": "ES02000G12345678"
+}
+
+
+@dataclass
+class GrupoRemesa:
+    secuencia: str
+    fecha_cobro: date
+    num_operaciones: int
+    suma_centimos: int
+
+    @property
+    def nombre_fichero(self) -> str:
+        return f"Remesa_{self.fecha_cobro}_{self.secuencia}.xml"
+
+
+def _secuencia():
+    """FRST si el cliente no tiene ninguna factura cobrada antes; si no, RCUR"""
+    # IN con subconsulta no correlacionada: se evalúa una vez (un EXISTS correlacionado deja
+    # al planificador de SQLite recorrer todas las facturas cobradas por cada fila)
+    anterior = aliased(models.Factura)
+    con_cobros = select(anterior.cliente_id).where(anterior.estado == ESTADO_COBRADA)
+    return case(
+        (models.Factura.cliente_id.in_(con_cobros), SECUENCIA_RECURRENTE),
+        else_=SECUENCIA_PRIMERO,
+    )
+
+
+def _importe_centimos():
+    # Mismo redondeo en el agregado y en cada adeudo: CtrlSum siempre cuadra
+    return cast(func.round(models.Factura.monto * 100), Integer)
+
+
+def consulta_adeudos(filtros: List):
+    """Una fila por factura (según `filtros`) con los datos del cliente ya unidos"""
+    return (
+        select(
+            models.Factura.id.label("factura_id"),
+            _importe_centimos().label("importe"),
+            _secuencia().label("secuencia"),
+            models.Cliente.id.label("cliente_id"),
+            models.Cliente.nombre.label("cliente_nombre"),
+            models.Cliente.iban.label("cliente_iban"),
+            models.Cliente.created_at.label("cliente_alta"),
+        )
+        .join(models.Cliente, models.Factura.cliente_id == models.Cliente.id)
+        .where(*filtros)
+    )
+
+
+def filtro_ids(factura_ids: List[int], excluir: bool = False):
+    """
+    Facturas de la lista (o todas menos esas, con excluir=True)
+    Miles de ids: se incrustan en el SQL en vez de un parámetro por id (SQLite admite ~32k).
+    Son enteros validados, así que se unen directamente (los literales de SQLAlchemy son lentos con 100k)
+    """
+    ids = sorted({int(i) for i in factura_ids})
+    if not ids:
+        return true() if excluir else false()
+    return text(f"facturas.id {'NOT IN' if excluir else 'IN'} ({','.join(map(str, ids))})")
+
+
+def resumen_grupos(db: Session, filtros: List, fecha_cobro: date) -> List[GrupoRemesa]:
+    """Pre-pasada agregada: NbOfTxs y CtrlSum por tipo de secuencia"""
+    adeudos = consulta_adeudos(filtros).subquery()
+    filas = db.execute(
+        select(adeudos.c.secuencia, func.count(), func.sum(adeudos.c.importe))
+        .group_by(adeudos.c.secuencia).order_by(adeudos.c.secuencia)
+    ).all()
+    return [GrupoRemesa(secuencia, fecha_cobro, n, int(suma or 0)) for secuencia, n, suma in filas]
+
+
+def _texto(valor, maximo: int) -> str:
+    """Juego de caracteres SEPA (latino básico), recortado y escapado para XML"""
+    valor = str(valor or "")
+    if not valor.isascii():
+        valor = unidecode(valor)
+    return escape(valor[:maximo])
+
+
+@lru_cache(maxsize=4096)
+def _nombre_deudor(nombre: str) -> str:
+    # Un cliente tiene muchas facturas: su nombre se limpia una vez (caché acotada, no crece con la remesa)
+    return _texto(nombre, 70)
+
+
+def _importe(centimos: int) -> str:
+    return f"{centimos // 100}.{centimos % 100:02d}"
+
+
+def escribir_remesa(grupo: GrupoRemesa, adeudos: Iterable, empresa: Dict) -> Iterator[str]:
+    """Genera el XML de un grupo trozo a trozo; `adeudos` son filas de consulta_adeudos"""
+    ahora = datetime.now()
+    msg_id = f"REM-{ahora:%Y%m%d%H%M%S}-{grupo.secuencia}-{grupo.fecha_cobro:%Y%m%d}"
+    acreedor = _texto(empresa["nombre"], 70)
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<Document xmlns="urn:iso:std:iso:20022:tech:xsd:{ESQUEMA}" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><CstmrDrctDbtInitn>'
+        f'<GrpHdr><MsgId>{msg_id}</MsgId><CreDtTm>{ahora:%Y-%m-%dT%H:%M:%S}</CreDtTm>'
+        f'<NbOfTxs>{grupo.num_operaciones}</NbOfTxs><CtrlSum>{_importe(grupo.suma_centimos)}</CtrlSum>'
+        f'<InitgPty><Nm>{acreedor}</Nm><Id><OrgId><Othr><Id>{empresa["creditor_id"]}</Id></Othr></OrgId></Id>'
+        '</InitgPty></GrpHdr>'
+        f'<PmtInf><PmtInfId>{msg_id}</PmtInfId><PmtMtd>DD</PmtMtd><BtchBookg>true</BtchBookg>'
+        f'<NbOfTxs>{grupo.num_operaciones}</NbOfTxs><CtrlSum>{_importe(grupo.suma_centimos)}</CtrlSum>'
+        '<PmtTpInf><SvcLvl><Cd>SEPA</Cd></SvcLvl><LclInstrm><Cd>CORE</Cd></LclInstrm>'
+        f'<SeqTp>{grupo.secuencia}</SeqTp></PmtTpInf><ReqdColltnDt>{grupo.fecha_cobro.isoformat()}</ReqdColltnDt>'
+        f'<Cdtr><Nm>{acreedor}</Nm></Cdtr><CdtrAcct><Id><IBAN>{empresa["iban"]}</IBAN></Id></CdtrAcct>'
+        f'<CdtrAgt><FinInstnId><BIC>{empresa["bic"]}</BIC></FinInstnId></CdtrAgt><ChrgBr>SLEV</ChrgBr>'
+        f'<CdtrSchmeId><Id><PrvtId><Othr><Id>{empresa["creditor_id"]}</Id><SchmeNm><Prtry>SEPA</Prtry>'
+        '</SchmeNm></Othr></PrvtId></Id></CdtrSchmeId>'
     )
+    for fila in adeudos:
+        # Los adeudos ya vienen validados (sepa_validacion): aquí solo se normaliza el IBAN
+        iban = (fila.cliente_iban or "").replace(" ", "").upper()
+        fecha_mandato = fila.cliente_alta.date() if fila.cliente_alta else grupo.fecha_cobro
+        yield (
+            f'<DrctDbtTxInf><PmtId><EndToEndId>FAC-{fila.factura_id}</EndToEndId></PmtId>'
+            f'<InstdAmt Ccy="EUR">{_importe(fila.importe)}</InstdAmt>'
+            f'<DrctDbtTx><MndtRltdInf><MndtId>MANDATO-{fila.cliente_id}</MndtId>'
+            f'<DtOfSgntr>{fecha_mandato.isoformat()}</DtOfSgntr></MndtRltdInf></DrctDbtTx>'
+            '<DbtrAgt><FinInstnId><Othr><Id>NOTPROVIDED</Id></Othr></FinInstnId></DbtrAgt>'
+            f'<Dbtr><Nm>{_nombre_deudor(fila.cliente_nombre)}</Nm></Dbtr>'
+            f'<DbtrAcct><Id><IBAN>{iban}</IBAN></Id></DbtrAcct>'
+            f'<RmtInf><Ustrd>Factura {fila.factura_id} - Loviluz</Ustrd></RmtInf>'
+            '</DrctDbtTxInf>'
+        )
+    yield '</PmtInf></CstmrDrctDbtInitn></Document>'
+
+
+def _adeudos_del_grupo(db: Session, filtros: List, grupo: GrupoRemesa):
+    adeudos = consulta_adeudos(filtros).subquery()
+    consulta = select(adeudos).where(adeudos.c.secuencia == grupo.secuencia).order_by(adeudos.c.factura_id)
+    # Cursor en servidor: las filas llegan en bloques, nunca todas a la vez
+    return db.execute(consulta.execution_options(yield_per=FILAS_POR_LOTE_CURSOR))
+
 
-    for factura in facturas:
-        cliente = factura.cliente
-        
-        # --- LÓGICA DE SEGURIDAD PARA EL IBAN ---
-        # Si el cliente tiene un IBAN guardado, intentamos usarlo.
-        # Si no, o si es corto, usamos uno de prueba válido para que no falle la demo.
-        iban_a_usar = cliente.iban
-        
-        if not iban_a_usar or len(iban_a_usar) < 10:
-             # IBAN DE RESPALDO (Válido de Openbank/Santander para pruebas)
-             iban_a_usar = "ES6000491500051234567892" 
-
-        try:
-            sepa.add_payment(
-                {
-                    "name": cliente.nombre,
-                    "IBAN": iban_a_usar,
-                    "amount": int(factura.monto * 100), # En céntimos
-                    "description": f"Factura {factura.id} - Loviluz",
-                    "mandate_id": f"MANDATO-{cliente.id}",
-                    "mandate_date": date.today(),
-                    "collection_date": date.today(),
-                }
-            )
-        except Exception as e:
-            print(f"Error al añadir factura {factura.id}: {e}")
-            # Continuamos con la siguiente factura en vez de romper todo
-            continue
-
-    buffer = io.BytesIO()
-    # validate=False permite descargar el XML aunque tenga pequeños errores de formato
-    buffer.write(sepa.export(validate=False))
-    buffer.seek(0)
-    return buffer
\ No newline at end of file
+def generar_remesas(db: Session, filtros: List, empresa: Dict, fecha_cobro: date = None):
+    """
+    Remesa de las facturas que cumplen `filtros` (condiciones sobre Factura; filtro_ids para una lista)
+    Escribe la remesa en un fichero temporal y devuelve (fichero, nombre, tipo MIME, grupos)
+    Un solo grupo -> un XML; varios (FRST y RCUR) -> un ZIP con un XML por grupo.
+    """
+    fecha_cobro = fecha_cobro or date.today() + timedelta(days=1)  # CORE: como pronto D-1
+    grupos = resumen_grupos(db, filtros, fecha_cobro)
+    destino = tempfile.SpooledTemporaryFile(max_size=TAMANO_EN_MEMORIA)
+    if len(grupos) == 1:
+        for trozo in escribir_remesa(grupos[0], _adeudos_del_grupo(db, filtros, grupos[0]), empresa):
+            destino.write(trozo.encode("utf-8"))
+        nombre, tipo = grupos[0].nombre_fichero, "application/xml"
+    else:
+        with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_DEFLATED) as zip_:
+            for grupo in grupos:
+                with zip_.open(grupo.nombre_fichero, "w") as xml:
+                    for trozo in escribir_remesa(grupo, _adeudos_del_grupo(db, filtros, grupo), empresa):
+                        xml.write(trozo.encode("utf-8"))
+        nombre, tipo = f"Remesa_{fecha_cobro}.zip", "application/zip"
+    destino.seek(0)
+    return destino, nombre, tipo, grupos
@@ -3,9 +3,16 @@ Conector para Microsoft Dynamics 365
 Permite autenticación y consultas a la API Web de Dynamics 365
 """
 import os
+import json
+import time
+import uuid
+import queue
+import threading
 import msal
 import requests
-from typing import Dict, List, Optional, Any
+from itertools import islice
+from requests.adapters import HTTPAdapter
+from typing import Dict, Iterator, List, Optional, Any
 from dotenv import load_dotenv
 import logging
 
@@ -15,6 +22,66 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Renovar el token este margen (segundos) antes de que caduque
+MARGEN_RENOVACION_TOKEN = 300
+# Tamaño de página pedido a Dynamics (Prefer: odata.maxpagesize) y páginas precargadas
+TAMANO_PAGINA = 5000
+PAGINAS_PRECARGADAS = 2
+TIMEOUT_PETICION = 30
+
+CAMPOS_CUENTA = [
+    "accountid",
+    "name",
+    "accountnumber",
+    "emailaddress1",
+    "telephone1",
+    "address1_line1",
+    "address1_city",
+    "address1_postalcode",
+    "address1_stateorprovince"
+]
+CAMPOS_CONTACTO = [
+    "contactid",
+    "fullname",
+    "firstname",
+    "lastname",
+    "emailaddress1",
+    "telephone1",
+    "mobilephone",
+    "address1_line1",
+    "address1_city",
+    "address1_postalcode",
+    "address1_stateorprovince"
+]
+
+
+
+def _parsear_respuesta_batch(content_type: str, texto: str) -> List[Dict]:
+    """Separa una respuesta multipart/mixed de $batch en [{status, headers, body}] (en orden)"""
+    if "boundary=" not in content_type:
+        return []
+    boundary = content_type.split("boundary=")[1].split(";")[0].strip().strip('"')
+    respuestas = []
+    for parte in texto.split(f"--{boundary}")[1:]:
+        if parte.startswith("--"):
+            break  # Fin del multipart
+        cabeceras_mime, _, http = parte.lstrip("\r\n").partition("\r\n\r\n")
+        tipo_parte = next((l.split(":", 1)[1].strip() for l in cabeceras_mime.split("\r\n")
+                           if l.lower().startswith("content-type:")), "")
+        if tipo_parte.startswith("multipart/mixed"):  # Changeset anidado
+            respuestas.extend(_parsear_respuesta_batch(tipo_parte, http))
+            continue
+        cabecera_http, _, cuerpo = http.partition("\r\n\r\n")
+        lineas = cabecera_http.split("\r\n")
+        estado = int(lineas[0].split(" ")[1])
+        headers = dict(l.split(":", 1) for l in lineas[1:] if ":" in l)
+        respuestas.append({
+            "status": estado,
+            "headers": {k.strip(): v.strip() for k, v in headers.items()},
+            "body": cuerpo.strip(),
+        })
+    return respuestas
+
 
 class Dynamics365Connector:
     """Clase para conectar y consultar Dynamics 365 CRM"""
@@ -43,21 +110,36 @@ class Dynamics365Connector:
         self.scope = [f"{self.dynamics_url}/.default"]
         
         self.access_token = None
+        self.token_expira_en = 0.0  # time.time() a partir del cual hay que renovar
+        self._msal_app = None
+        self._token_lock = threading.Lock()
+        
+        # Sesión HTTP con keep-alive y pool de conexiones (reutilizada por todas las peticiones)
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self.session.mount("https://", adaptador)
+        self.session.mount("http://", adaptador)
+        
         logger.info(f"✅ Dynamics365Connector inicializado para: {self.dynamics_url}")
     
-    def _get_access_token(self) -> str:
-        """Obtiene un token de acceso usando MSAL"""
-        try:
-            app = msal.ConfidentialClientApplication(
+    def _solicitar_token(self) -> Dict[str, Any]:
+        """Pide un token a Azure AD (la aplicación MSAL se crea una sola vez)"""
+        if self._msal_app is None:
+            self._msal_app = msal.ConfidentialClientApplication(
                 self.client_id,
                 authority=self.authority,
                 client_credential=self.client_secret
             )
-            
-            result = app.acquire_token_for_client(scopes=self.scope)
+        return self._msal_app.acquire_token_for_client(scopes=self.scope)
+    
+    def _get_access_token(self) -> str:
+        """Obtiene un token de acceso usando MSAL y apunta cuándo caduca"""
+        try:
+            result = self._solicitar_token()
             
             if "access_token" in result:
                 logger.info("✅ Token de acceso obtenido correctamente")
+                self.token_expira_en = time.time() + int(result.get("expires_in", 3600)) - MARGEN_RENOVACION_TOKEN
                 return result["access_token"]
             else:
                 error_msg = result.get("error_description", result.get("error", "Unknown error"))
@@ -68,9 +150,10 @@ class Dynamics365Connector:
             raise
     
     def _get_headers(self) -> Dict[str, str]:
-        """Devuelve los headers necesarios para las peticiones"""
-        if not self.access_token:
-            self.access_token = self._get_access_token()
+        """Devuelve los headers necesarios para las peticiones (renueva el token si está por caducar)"""
+        with self._token_lock:
+            if not self.access_token or time.time() >= self.token_expira_en:
+                self.access_token = self._get_access_token()
         
         return {
             "Authorization": f"Bearer {self.access_token}",
@@ -81,30 +164,33 @@ class Dynamics365Connector:
             "Prefer": "return=representation"
         }
     
-    def query(self, endpoint: str, params: Optional[Dict] = None) -> Dict[str, Any]:
+    def query(self, endpoint: str, params: Optional[Dict] = None,
+              extra_headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
         """
         Realiza una consulta GET a Dynamics 365
         
         Args:
-            endpoint: El endpoint a consultar (ej: 'accounts', 'contacts')
+            endpoint: El endpoint a consultar (ej: 'accounts', 'contacts') o una URL
+                      completa (ej: el @odata.nextLink de la página anterior)
             params: Parámetros adicionales de la query
+            extra_headers: Cabeceras adicionales (ej: Prefer: odata.maxpagesize=...)
         
         Returns:
             Diccionario con la respuesta JSON
         """
         try:
-            url = f"{self.api_url}/{endpoint}"
-            headers = self._get_headers()
+            url = endpoint if endpoint.startswith("http") else f"{self.api_url}/{endpoint}"
+            headers = {**self._get_headers(), **(extra_headers or {})}
             
             logger.info(f"🔍 Consultando: {url}")
-            response = requests.get(url, headers=headers, params=params, timeout=30)
+            response = self.session.get(url, headers=headers, params=params, timeout=TIMEOUT_PETICION)
             
             # Si el token expiró, renovarlo e intentar de nuevo
             if response.status_code == 401:
                 logger.warning("⚠️ Token expirado, renovando...")
                 self.access_token = None
-                headers = self._get_headers()
-                response = requests.get(url, headers=headers, params=params, timeout=30)
+                headers = {**self._get_headers(), **(extra_headers or {})}
+                response = self.session.get(url, headers=headers, params=params, timeout=TIMEOUT_PETICION)
             
             response.raise_for_status()
             return response.json()
@@ -115,51 +201,117 @@ class Dynamics365Connector:
                 logger.error(f"Detalles: {e.response.text}")
             raise
     
-    def get_all_records(self, endpoint: str, select_fields: Optional[List[str]] = None, 
-                       filter_query: Optional[str] = None, max_records: int = 5000) -> List[Dict]:
+    def iter_pages(self, endpoint: str, params: Optional[Dict] = None,
+                   page_size: int = TAMANO_PAGINA, track_changes: bool = False) -> Iterator[Dict[str, Any]]:
         """
-        Obtiene todos los registros de una entidad (con paginación automática)
+        Recorre las páginas de una consulta siguiendo @odata.nextLink (en serie)
+        
+        Devuelve cada respuesta JSON completa, por si el llamante necesita
+        metadatos de la página (ej. @odata.deltaLink).
+        Con track_changes=True se pide seguimiento de cambios: la última página trae
+        un @odata.deltaLink que, consultado más tarde (como `endpoint`), devuelve
+        solo lo creado/modificado/borrado desde entonces.
+        """
+        preferencias = [f"odata.maxpagesize={page_size}"]
+        if track_changes:
+            preferencias.insert(0, "odata.track-changes")
+        extra_headers = {"Prefer": ", ".join(preferencias)}
+        siguiente: Optional[str] = endpoint
+        while siguiente:
+            result = self.query(siguiente, params, extra_headers)
+            yield result
+            # Los parámetros ya van dentro del nextLink
+            siguiente, params = result.get("@odata.nextLink"), None
+    
+    def iter_records(self, endpoint: str, select_fields: Optional[List[str]] = None,
+                     filter_query: Optional[str] = None, page_size: int = TAMANO_PAGINA,
+                     prefetch: int = PAGINAS_PRECARGADAS, params: Optional[Dict] = None) -> Iterator[Dict]:
+        """
+        Generador de registros con precarga de páginas
+        
+        Un hilo productor descarga las páginas siguientes mientras el llamante
+        procesa la actual; la cola acotada (`prefetch` páginas) limita la memoria,
+        así nunca hay más de (prefetch + 1) páginas cargadas a la vez.
         
         Args:
             endpoint: Nombre de la entidad (ej: 'accounts', 'contacts')
             select_fields: Lista de campos a seleccionar
             filter_query: Filtro OData (ej: "statecode eq 0")
-            max_records: Número máximo de registros a obtener
-        
-        Returns:
-            Lista de registros
+            page_size: Registros por página
+            prefetch: Páginas que se pueden descargar por adelantado (0 = sin hilo)
+            params: Parámetros OData adicionales
         """
-        records = []
-        params = {}
-        
+        params = dict(params or {})
         if select_fields:
             params["$select"] = ",".join(select_fields)
-        
         if filter_query:
             params["$filter"] = filter_query
         
-        # Limitar registros por página
-        params["$top"] = min(max_records, 5000)
+        paginas = self.iter_pages(endpoint, params, page_size)
+        if prefetch <= 0:
+            for pagina in paginas:
+                yield from pagina.get("value", [])
+            return
+        
+        cola: queue.Queue = queue.Queue(maxsize=prefetch)
+        fin = object()
+        parar = threading.Event()
+        
+        def productor():
+            try:
+                for pagina in paginas:
+                    if parar.is_set():
+                        return
+                    cola.put(pagina.get("value", []))
+            except Exception as e:  # Se relanza en el hilo del llamante
+                cola.put(e)
+                return
+            cola.put(fin)
         
+        hilo = threading.Thread(target=productor, name=f"d365-{endpoint}", daemon=True)
+        hilo.start()
+        total = 0
         try:
             while True:
-                result = self.query(endpoint, params)
-                
-                if "value" in result:
-                    records.extend(result["value"])
-                    logger.info(f"📊 Obtenidos {len(records)} registros hasta ahora...")
-                
-                # Verificar si hay más páginas
-                if "@odata.nextLink" in result and len(records) < max_records:
-                    # Extraer solo el query string del nextLink
-                    next_url = result["@odata.nextLink"]
-                    endpoint = next_url.replace(f"{self.api_url}/", "")
-                    params = {}  # Los parámetros ya están en el nextLink
-                else:
+                elemento = cola.get()
+                if elemento is fin:
                     break
-            
+                if isinstance(elemento, Exception):
+                    raise elemento
+                total += len(elemento)
+                logger.info(f"📊 Obtenidos {total} registros hasta ahora...")
+                yield from elemento
+        finally:
+            # Si el llamante deja de iterar, desbloqueamos y paramos al productor
+            parar.set()
+            while hilo.is_alive():
+                try:
+                    cola.get_nowait()
+                except queue.Empty:
+                    hilo.join(timeout=0.1)
+    
+    def get_all_records(self, endpoint: str, select_fields: Optional[List[str]] = None, 
+                       filter_query: Optional[str] = None, max_records: int = 5000) -> List[Dict]:
+        """
+        Obtiene todos los registros de una entidad (con paginación automática)
+        Para volúmenes grandes usa iter_records, que no carga todo en memoria.
+        
+        Args:
+            endpoint: Nombre de la entidad (ej: 'accounts', 'contacts')
+            select_fields: Lista de campos a seleccionar
+            filter_query: Filtro OData (ej: "statecode eq 0")
+            max_records: Número máximo de registros a obtener
+        
+        Returns:
+            Lista de registros
+        """
+        try:
+            records = list(islice(
+                self.iter_records(endpoint, select_fields, filter_query, page_size=min(max_records, TAMANO_PAGINA)),
+                max_records
+            ))
             logger.info(f"✅ Total de registros obtenidos: {len(records)}")
-            return records[:max_records]
+            return records
             
         except Exception as e:
             logger.error(f"❌ Error obteniendo registros: {str(e)}")
@@ -175,21 +327,14 @@ class Dynamics365Connector:
         Returns:
             Lista de cuentas
         """
-        fields = [
-            "accountid",
-            "name",
-            "accountnumber",
-            "emailaddress1",
-            "telephone1",
-            "address1_line1",
-            "address1_city",
-            "address1_postalcode",
-            "address1_stateorprovince"
-        ]
-        
         filter_query = "statecode eq 0" if active_only else None
         
-        return self.get_all_records("accounts", select_fields=fields, filter_query=filter_query)
+        return self.get_all_records("accounts", select_fields=CAMPOS_CUENTA, filter_query=filter_query)
+    
+    def iter_accounts(self, active_only: bool = True) -> Iterator[Dict]:
+        """Como get_accounts, pero como generador (sin límite y sin cargar todo en memoria)"""
+        filter_query = "statecode eq 0" if active_only else None
+        return self.iter_records("accounts", select_fields=CAMPOS_CUENTA, filter_query=filter_query)
     
     def get_contacts(self, active_only: bool = True) -> List[Dict]:
         """
@@ -201,19 +346,14 @@ class Dynamics365Connector:
         Returns:
             Lista de contactos
         """
-        fields = [
-            "contactid",
-            "fullname",
-            "firstname",
-            "lastname",
-            "emailaddress1",
-            "telephone1",
-            "mobilephone"
-        ]
-        
         filter_query = "statecode eq 0" if active_only else None
         
-        return self.get_all_records("contacts", select_fields=fields, filter_query=filter_query)
+        return self.get_all_records("contacts", select_fields=CAMPOS_CONTACTO, filter_query=filter_query)
+    
+    def iter_contacts(self, active_only: bool = True) -> Iterator[Dict]:
+        """Como get_contacts, pero como generador (sin límite y sin cargar todo en memoria)"""
+        filter_query = "statecode eq 0" if active_only else None
+        return self.iter_records("contacts", select_fields=CAMPOS_CONTACTO, filter_query=filter_query)
     
     def get_opportunities(self, active_only: bool = True) -> List[Dict]:
         """
@@ -253,7 +393,7 @@ class Dynamics365Connector:
             url = f"{self.api_url}/{entity}"
             headers = self._get_headers()
             
-            response = requests.post(url, headers=headers, json=data, timeout=30)
+            response = self.session.post(url, headers=headers, json=data, timeout=TIMEOUT_PETICION)
             response.raise_for_status()
             
             logger.info(f"✅ Registro creado en {entity}")
@@ -281,7 +421,7 @@ class Dynamics365Connector:
             url = f"{self.api_url}/{entity}({record_id})"
             headers = self._get_headers()
             
-            response = requests.patch(url, headers=headers, json=data, timeout=30)
+            response = self.session.patch(url, headers=headers, json=data, timeout=TIMEOUT_PETICION)
             response.raise_for_status()
             
             logger.info(f"✅ Registro actualizado en {entity}")
@@ -293,6 +433,48 @@ class Dynamics365Connector:
                 logger.error(f"Detalles: {e.response.text}")
             raise
     
+    def execute_batch(self, operations: List[Dict]) -> List[Dict]:
+        """
+        Envía varias operaciones en una sola petición OData $batch
+        
+        Cada operación va como petición independiente (sin changeset) y con
+        "Prefer: odata.continue-on-error", así un error no bloquea al resto.
+        
+        Args:
+            operations: [{"method": "POST"|"PATCH"|"DELETE", "url": "accounts(<id>)", "data": {...}}]
+        
+        Returns:
+            Una respuesta por operación, en el mismo orden:
+            [{"status": 204, "headers": {...}, "body": "..."}]
+        """
+        boundary = f"batch_{uuid.uuid4().hex}"
+        partes = []
+        for i, op in enumerate(operations, start=1):
+            cuerpo = json.dumps(op["data"]) if op.get("data") is not None else ""
+            partes.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                "Content-Transfer-Encoding: binary\r\n"
+                f"Content-ID: {i}\r\n\r\n"
+                f"{op['method']} {self.api_url}/{op['url']} HTTP/1.1\r\n"
+                "Content-Type: application/json; type=entry\r\n\r\n"
+                f"{cuerpo}\r\n"
+            )
+        partes.append(f"--{boundary}--\r\n")
+        
+        headers = self._get_headers()
+        headers["Content-Type"] = f"multipart/mixed; boundary={boundary}"
+        headers["Prefer"] = "odata.continue-on-error"
+        response = self.session.post(
+            f"{self.api_url}/$batch", data="".join(partes).encode("utf-8"),
+            headers=headers, timeout=TIMEOUT_PETICION
+        )
+        response.raise_for_status()
+        
+        respuestas = _parsear_respuesta_batch(response.headers.get("Content-Type", ""), response.text)
+        logger.info(f"✅ $batch: {len(operations)} operaciones enviadas, {len(respuestas)} respuestas")
+        return respuestas
+    
     def delete_record(self, entity: str, record_id: str) -> bool:
         """
         Elimina un registro
@@ -308,7 +490,7 @@ class Dynamics365Connector:
             url = f"{self.api_url}/{entity}({record_id})"
             headers = self._get_headers()
             
-            response = requests.delete(url, headers=headers, timeout=30)
+            response = self.session.delete(url, headers=headers, timeout=TIMEOUT_PETICION)
             response.raise_for_status()
             
             logger.info(f"✅ Registro eliminado de {entity}")
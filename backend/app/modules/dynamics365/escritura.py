@@ -0,0 +1,304 @@
+"""
+Escritura asíncrona ERP -> Dynamics 365 (cola de salida)
+Los endpoints que crean o modifican clientes y contratos solo añaden una fila a
+cola_dynamics365 dentro de su propia transacción (encolar_cambio): la respuesta
+de la API no espera nunca a Dynamics. Un hilo en segundo plano
+(TrabajadorEscrituraD365) vacía la cola:
+  • reserva las filas vencidas (FOR UPDATE SKIP LOCKED en PostgreSQL) con un plazo,
+    así si el proceso muere se vuelven a enviar al vencer el plazo
+  • agrupa las filas del mismo registro: se envía su estado actual una sola vez
+    (POST si aún no tiene dynamics_id, PATCH si ya lo tiene)
+  • manda todo en una petición OData $batch y reintenta los fallos con
+    espera exponencial (con jitter) hasta MAX_INTENTOS
+"""
+import logging
+import os
+import random
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+import requests
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import Session
+from app.modules.crm import models
+
+logger = logging.getLogger(__name__)
+
+ESTADO_PENDIENTE = "Pendiente"
+ESTADO_ENVIADO = "Enviado"
+ESTADO_ERROR = "Error"
+
+TAMANO_LOTE = 100               # Registros distintos por $batch (Dataverse admite hasta 1000 operaciones)
+INTERVALO_SEGUNDOS = 5          # Espera del trabajador cuando la cola está vacía
+PLAZO_RESERVA = timedelta(minutes=5)
+MAX_INTENTOS = 8
+ESPERA_BASE_SEGUNDOS = 10       # 10s, 20s, 40s... hasta ESPERA_MAXIMA_SEGUNDOS
+ESPERA_MAXIMA_SEGUNDOS = 3600
+ESTADOS_REINTENTABLES = {408, 429, 500, 502, 503, 504}
+
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def calcular_espera(intentos: int) -> timedelta:
+    """Espera exponencial con jitter (50%-100%) para no reintentar todos a la vez"""
+    segundos = min(ESPERA_BASE_SEGUNDOS * 2 ** max(intentos - 1, 0), ESPERA_MAXIMA_SEGUNDOS)
+    return timedelta(seconds=segundos * random.uniform(0.5, 1.0))
+
+
+def escritura_activada() -> bool:
+    """Solo se encola si hay credenciales de Dynamics (y no se ha desactivado con D365_ESCRITURA=0)"""
+    return bool(os.getenv("DYNAMICS_CLIENT_ID")) and os.getenv("D365_ESCRITURA", "1") != "0"
+
+
+def encolar_cambio(db: Session, objeto, operacion: str = "actualizar"):
+    """
+    Apunta un cliente/contrato para enviarlo a Dynamics 365
+    Se añade a la sesión del endpoint: se confirma (o se descarta) junto con el cambio.
+    """
+    if not escritura_activada():
+        return
+    if objeto.id is None:
+        db.flush()  # Necesitamos el id del registro nuevo
+    db.add(models.CambioPendienteD365(
+        tabla=objeto.__tablename__, registro_id=objeto.id, operacion=operacion,
+        estado=ESTADO_PENDIENTE, intentos=0, siguiente_intento=_ahora(),
+    ))
+
+
+# --- Mapeo de registros locales a entidades de Dynamics ---
+
+def _datos_cliente(cliente: models.Cliente) -> Tuple[str, Dict]:
+    datos = {
+        "name": cliente.nombre,
+        "accountnumber": cliente.nif_cif,
+        "emailaddress1": cliente.email,
+        "telephone1": cliente.telefono,
+        "address1_line1": cliente.direccion,
+        "address1_city": cliente.ciudad,
+        "address1_postalcode": cliente.codigo_postal,
+        "address1_stateorprovince": cliente.provincia,
+    }
+    return "accounts", {k: v for k, v in datos.items() if v is not None}
+
+
+def _datos_contrato(contrato: models.Contrato) -> Tuple[str, Dict]:
+    datos = {
+        "title": f"{contrato.comercializadora or ''} {contrato.producto or ''}".strip() or f"Contrato {contrato.id}",
+        "activeon": contrato.fecha_inicio.isoformat() if contrato.fecha_inicio else None,
+        "expireson": contrato.fecha_fin.isoformat() if contrato.fecha_fin else None,
+    }
+    cliente = contrato.cliente
+    if cliente is not None and cliente.dynamics_id:
+        datos["customerid_account@odata.bind"] = f"/accounts({cliente.dynamics_id})"
+    return "contracts", {k: v for k, v in datos.items() if v is not None}
+
+
+@dataclass
+class TablaSalida:
+    modelo: type
+    mapear: Callable          # registro -> (entidad OData, datos)
+    depende_de_cliente: bool  # Esperar a que el cliente tenga dynamics_id antes de enviarlo
+
+
+TABLAS = {
+    "clientes": TablaSalida(models.Cliente, _datos_cliente, False),
+    "contratos": TablaSalida(models.Contrato, _datos_contrato, True),
+}
+
+
+@dataclass
+class ResultadoEnvio:
+    filas: int = 0          # Filas de la cola procesadas
+    operaciones: int = 0    # Operaciones enviadas en el $batch (tras agrupar)
+    enviadas: int = 0
+    reintentos: int = 0
+    errores: int = 0
+
+
+def _reservar(db: Session, tamano_lote: int) -> Dict[Tuple[str, int], List[models.CambioPendienteD365]]:
+    """
+    Reserva los registros con cambios vencidos y devuelve sus filas agrupadas por (tabla, id)
+    Se toman todas las filas pendientes de cada registro, así N cambios -> 1 envío.
+    """
+    ahora = _ahora()
+    cola = models.CambioPendienteD365
+    claves = db.query(cola.tabla, cola.registro_id).filter(
+        cola.estado == ESTADO_PENDIENTE, cola.siguiente_intento <= ahora,
+    ).group_by(cola.tabla, cola.registro_id).order_by(func.min(cola.id)).limit(tamano_lote).all()
+    if not claves:
+        return {}
+
+    # Se vuelve a exigir siguiente_intento <= ahora: entre las dos consultas otro trabajador
+    # (uno por worker de uvicorn) puede haber reservado estas claves y confirmado; sus filas ya
+    # tienen siguiente_intento en el futuro y no deben enviarse dos veces
+    consulta = db.query(cola).filter(
+        cola.estado == ESTADO_PENDIENTE, cola.siguiente_intento <= ahora,
+        tuple_(cola.tabla, cola.registro_id).in_(claves),
+    ).order_by(cola.id)
+    if db.get_bind().dialect.name == "postgresql":
+        consulta = consulta.with_for_update(skip_locked=True)
+
+    grupos: Dict[Tuple[str, int], List[models.CambioPendienteD365]] = {}
+    for fila in consulta:
+        grupos.setdefault((fila.tabla, fila.registro_id), []).append(fila)
+        fila.siguiente_intento = ahora + PLAZO_RESERVA
+    db.commit()
+    return grupos
+
+
+def _id_desde_entity_id(cabeceras: Dict[str, str]) -> Optional[str]:
+    """OData-EntityId: https://org.crm4.dynamics.com/api/data/v9.2/accounts(<guid>)"""
+    entity_id = next((v for k, v in cabeceras.items() if k.lower() == "odata-entityid"), "")
+    if "(" not in entity_id:
+        return None
+    return entity_id.rsplit("(", 1)[1].rstrip(")")
+
+
+def _marcar_fallo(filas: List[models.CambioPendienteD365], error: str, reintentable: bool,
+                  resultado: ResultadoEnvio):
+    intentos = max(f.intentos or 0 for f in filas) + 1
+    definitivo = not reintentable or intentos >= MAX_INTENTOS
+    siguiente = _ahora() + calcular_espera(intentos)
+    for fila in filas:
+        fila.intentos = intentos
+        fila.ultimo_error = error[:500]
+        fila.siguiente_intento = siguiente
+        if definitivo:
+            fila.estado = ESTADO_ERROR
+    if definitivo:
+        resultado.errores += 1
+        logger.error(f"❌ {filas[0].tabla} {filas[0].registro_id}: no se enviará a Dynamics ({error[:200]})")
+    else:
+        resultado.reintentos += 1
+
+
+def procesar_pendientes(db: Session, dynamics, tamano_lote: int = TAMANO_LOTE) -> ResultadoEnvio:
+    """Envía un lote de la cola a Dynamics 365 en un único $batch"""
+    resultado = ResultadoEnvio()
+    grupos = _reservar(db, tamano_lote)
+    if not grupos:
+        return resultado
+    resultado.filas = sum(len(f) for f in grupos.values())
+
+    # Estado actual de cada registro (un IN por tabla)
+    registros = {}
+    for tabla, salida in TABLAS.items():
+        ids = [id_ for (t, id_) in grupos if t == tabla]
+        if ids:
+            for registro in db.query(salida.modelo).filter(salida.modelo.id.in_(ids)):
+                registros[(tabla, registro.id)] = registro
+
+    operaciones, destinos, en_espera = [], [], []
+    ahora = _ahora()
+    for clave, filas in grupos.items():
+        registro = registros.get(clave)
+        salida = TABLAS.get(clave[0])
+        if registro is None or salida is None:
+            for fila in filas:  # Registro borrado en local o tabla desconocida: nada que enviar
+                fila.estado, fila.ultimo_error, fila.enviado_at = ESTADO_ENVIADO, "Registro no encontrado", ahora
+            continue
+        if salida.depende_de_cliente and not (registro.cliente and registro.cliente.dynamics_id):
+            pendiente_cliente = registro.cliente is not None and db.query(models.CambioPendienteD365.id).filter(
+                models.CambioPendienteD365.tabla == "clientes",
+                models.CambioPendienteD365.registro_id == registro.cliente.id,
+                models.CambioPendienteD365.estado == ESTADO_PENDIENTE,
+            ).first() is not None
+            if pendiente_cliente:  # Esperamos a que el cliente exista en Dynamics (no cuenta como intento)
+                en_espera.append((registro, filas))
+                continue
+        entidad, datos = salida.mapear(registro)
+        if registro.dynamics_id:
+            operaciones.append({"method": "PATCH", "url": f"{entidad}({registro.dynamics_id})", "data": datos})
+        else:
+            operaciones.append({"method": "POST", "url": entidad, "data": datos})
+        destinos.append((registro, filas))
+
+    resultado.operaciones = len(operaciones)
+    if operaciones:
+        try:
+            respuestas = dynamics.execute_batch(operaciones)
+        except requests.exceptions.RequestException as e:
+            estado = e.response.status_code if getattr(e, "response", None) is not None else None
+            reintentable = estado is None or estado in ESTADOS_REINTENTABLES or estado == 401
+            logger.warning(f"⚠️ $batch a Dynamics falló ({estado or e.__class__.__name__}): se reintentará")
+            for _, filas in destinos:
+                _marcar_fallo(filas, str(e), reintentable, resultado)
+            respuestas = None
+
+        if respuestas is not None:
+            for i, (registro, filas) in enumerate(destinos):
+                respuesta = respuestas[i] if i < len(respuestas) else None
+                if respuesta is None:
+                    _marcar_fallo(filas, "Sin respuesta en el $batch", True, resultado)
+                elif respuesta["status"] < 300:
+                    nuevo_id = _id_desde_entity_id(respuesta["headers"])
+                    if nuevo_id and not registro.dynamics_id:
+                        registro.dynamics_id = nuevo_id
+                    for fila in filas:
+                        fila.estado, fila.enviado_at, fila.ultimo_error = ESTADO_ENVIADO, ahora, None
+                    resultado.enviadas += 1
+                else:
+                    _marcar_fallo(filas, f"HTTP {respuesta['status']}: {respuesta['body']}",
+                                  respuesta["status"] in ESTADOS_REINTENTABLES, resultado)
+    for registro, filas in en_espera:
+        # Si el cliente acaba de crearse en este $batch, el registro vuelve a la cola ya mismo
+        espera = timedelta(0) if registro.cliente.dynamics_id else timedelta(seconds=INTERVALO_SEGUNDOS)
+        for fila in filas:
+            fila.siguiente_intento = _ahora() + espera
+    db.commit()
+    logger.info(f"📤 Dynamics 365: {resultado.filas} cambios -> {resultado.operaciones} operaciones "
+                f"({resultado.enviadas} ok, {resultado.reintentos} a reintentar, {resultado.errores} con error)")
+    return resultado
+
+
+class TrabajadorEscrituraD365(threading.Thread):
+    """Hilo que vacía la cola en segundo plano mientras la API sigue atendiendo"""
+
+    def __init__(self, session_factory, crear_conector, intervalo: float = INTERVALO_SEGUNDOS,
+                 tamano_lote: int = TAMANO_LOTE):
+        super().__init__(name="escritura-dynamics365", daemon=True)
+        self.session_factory = session_factory
+        self.crear_conector = crear_conector
+        self.intervalo = intervalo
+        self.tamano_lote = tamano_lote
+        self._parar = threading.Event()
+        self._dynamics = None
+
+    def run(self):
+        logger.info("🚀 Trabajador de escritura a Dynamics 365 iniciado")
+        while not self._parar.is_set():
+            lote_lleno = False
+            try:
+                if self._dynamics is None:
+                    self._dynamics = self.crear_conector()
+                db = self.session_factory()
+                try:
+                    resultado = procesar_pendientes(db, self._dynamics, self.tamano_lote)
+                    lote_lleno = resultado.operaciones >= self.tamano_lote
+                finally:
+                    db.close()
+            except Exception as e:  # El hilo no debe morir: se reintenta en la siguiente vuelta
+                logger.error(f"❌ Error en la cola de Dynamics 365: {str(e)}")
+            if not lote_lleno:
+                self._parar.wait(self.intervalo)
+
+    def parar(self, timeout: float = 10):
+        self._parar.set()
+        self.join(timeout)
+
+
+if __name__ == "__main__":
+    # Vaciar la cola una vez (ej. desde cron): python -m app.modules.dynamics365.escritura
+    from app.database import SessionLocal
+    from app.modules.dynamics365.connector import Dynamics365Connector
+
+    conector = Dynamics365Connector()
+    db = SessionLocal()
+    try:
+        while procesar_pendientes(db, conector).operaciones:
+            pass
+    finally:
+        db.close()
@@ -0,0 +1,327 @@
+"""
+Sincronización incremental Dynamics 365 -> clientes
+Guarda por entidad (accounts, contacts) un estado en sincronizacion_d365:
+  • delta_link: si la entidad tiene "change tracking" activado, el @odata.deltaLink
+    de la última ejecución devuelve solo lo creado, modificado o borrado desde entonces.
+  • ultima_modificacion: marca de agua (mayor modifiedon aplicado), usada como
+    alternativa con un filtro "modifiedon ge ..." cuando no hay change tracking.
+El modo "full" descarga todo y vuelve a fijar el estado; "delta" usa el estado
+guardado (y si no lo hay, hace una carga completa).
+"""
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+import requests
+from sqlalchemy import bindparam, func, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.modules.crm import models
+from app.modules.crm.dashboard import invalidar_cache_dashboard
+from app.modules.dynamics365.connector import Dynamics365Connector, CAMPOS_CUENTA, CAMPOS_CONTACTO
+
+logger = logging.getLogger(__name__)
+
+MODO_FULL = "full"
+MODO_DELTA = "delta"
+# Dataverse responde 410 Gone (o 400) cuando un deltaLink ha caducado
+ESTADOS_DELTA_CADUCADO = (400, 410)
+
+
+def datos_cliente_desde_cuenta(account: Dict) -> Optional[Dict]:
+    """Mapea una cuenta (account) a columnas de Cliente; None si no se puede identificar"""
+    identificador = account.get("accountnumber") or account.get("accountid")
+    if not identificador:
+        return None
+    return {
+        "nombre": account.get("name") or "Desconocido",
+        "nif_cif": identificador,
+        "email": account.get("emailaddress1") or "",
+        "telefono": account.get("telephone1") or "",
+        "direccion": account.get("address1_line1") or "",
+        "ciudad": account.get("address1_city") or "",
+        "codigo_postal": account.get("address1_postalcode") or "",
+        "provincia": account.get("address1_stateorprovince") or "",
+        "tipo_cliente": "Dynamics 365",
+    }
+
+
+def datos_cliente_desde_contacto(contact: Dict) -> Optional[Dict]:
+    """Mapea un contacto a columnas de Cliente; sin email no se importa"""
+    email = (contact.get("emailaddress1") or "").strip()
+    if not email:
+        return None
+    nombre_completo = contact.get("fullname") or \
+        f"{contact.get('firstname') or ''} {contact.get('lastname') or ''}".strip()
+    return {
+        "nombre": nombre_completo or "Sin nombre",
+        "nif_cif": contact.get("contactid", ""),
+        "email": email,
+        "telefono": contact.get("telephone1") or contact.get("mobilephone") or "",
+        "persona_contacto": nombre_completo,
+        "direccion": contact.get("address1_line1") or "",
+        "ciudad": contact.get("address1_city") or "",
+        "codigo_postal": contact.get("address1_postalcode") or "",
+        "provincia": contact.get("address1_stateorprovince") or "",
+        "tipo_cliente": "Contacto D365",
+    }
+
+
+@dataclass
+class EntidadSync:
+    nombre: str                             # Entidad OData (accounts, contacts)
+    campo_id: str                           # Clave primaria en Dynamics
+    campos: List[str]                       # $select
+    mapear: Callable[[Dict], Optional[Dict]]
+    clave_legado: str                       # Columna con la que se enlazaban los clientes importados antes de dynamics_id
+
+
+ENTIDADES = {
+    "accounts": EntidadSync("accounts", "accountid", CAMPOS_CUENTA + ["statecode", "modifiedon"],
+                            datos_cliente_desde_cuenta, "nif_cif"),
+    "contacts": EntidadSync("contacts", "contactid", CAMPOS_CONTACTO + ["statecode", "modifiedon"],
+                            datos_cliente_desde_contacto, "email"),
+}
+
+
+@dataclass
+class ResultadoSync:
+    entidad: str
+    modo: str
+    nuevos: int = 0
+    actualizados: int = 0
+    desactivados: int = 0
+    ignorados: int = 0
+    registros: int = 0
+    segundos: float = 0.0
+    segundos_escritura: float = 0.0  # Solo el upsert en la base local (sin esperar a Dynamics)
+
+    def log(self):
+        ritmo = self.registros / self.segundos_escritura if self.segundos_escritura else 0
+        logger.info(f"✅ {self.entidad} ({self.modo}): {self.nuevos} nuevos, {self.actualizados} actualizados, "
+                    f"{self.desactivados} desactivados, {self.ignorados} ignorados en {self.segundos:.1f}s "
+                    f"(escritura: {ritmo:,.0f} registros/s)")
+
+
+def _es_borrado(registro: Dict) -> bool:
+    return "$deletedEntity" in registro.get("@odata.context", "")
+
+
+# INSERT ... ON CONFLICT por dialecto; con los demás se escribe con INSERT y UPDATE por separado
+INSERT_CON_UPSERT = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _escribir_con_upsert(db: Session, insert_, filas: List[Dict]):
+    """Un único INSERT ... ON CONFLICT (dynamics_id) DO UPDATE para toda la página"""
+    tabla = models.Cliente.__table__
+    columnas = [c for c in filas[0] if c not in ("dynamics_id", "nif_cif", "is_active")]
+    db.execute(
+        insert_.on_conflict_do_update(
+            index_elements=[tabla.c.dynamics_id],
+            set_={
+                **{c: func.coalesce(func.nullif(insert_.excluded[c], ""), tabla.c[c]) for c in columnas},
+                "is_active": insert_.excluded.is_active,
+            },
+        ),
+        filas,
+    )
+
+
+def _escribir_sin_upsert(db: Session, nuevas: List[Dict], existentes: List[Dict]):
+    """Dialectos sin ON CONFLICT: INSERT en bloque de las nuevas y UPDATE en bloque de las que ya existen"""
+    tabla = models.Cliente.__table__
+    if nuevas:
+        db.execute(tabla.insert(), nuevas)
+    if existentes:
+        columnas = [c for c in existentes[0] if c not in ("dynamics_id", "nif_cif", "is_active")]
+        db.execute(
+            update(tabla).where(tabla.c.dynamics_id == bindparam("b_dynamics_id")).values(
+                **{c: func.coalesce(func.nullif(bindparam(f"b_{c}"), ""), tabla.c[c]) for c in columnas},
+                is_active=bindparam("b_is_active"),
+            ),
+            [{f"b_{c}": v for c, v in fila.items()} for fila in existentes],
+        )
+
+
+def aplicar_pagina(db: Session, entidad: EntidadSync, registros: List[Dict], resultado: ResultadoSync):
+    """
+    Crea, actualiza o desactiva los clientes de una página de Dynamics en bloque
+
+    1. Una sola consulta IN localiza los clientes existentes por dynamics_id, NIF
+       o la clave legado (clientes importados antes de guardar dynamics_id).
+    2. Un UPDATE en bloque enlaza con su dynamics_id los encontrados por NIF/clave.
+    3. Un único INSERT ... ON CONFLICT (dynamics_id) DO UPDATE escribe la página
+       (en dialectos sin él, un INSERT de las nuevas y un UPDATE de las existentes);
+       los campos vacíos no pisan lo que ya había y el NIF nunca se cambia.
+    """
+    tabla = models.Cliente.__table__
+    clave = entidad.clave_legado
+
+    filas: Dict[str, Dict] = {}  # dynamics_id -> columnas (si se repite en la página, gana el último)
+    for registro in registros:
+        datos = entidad.mapear(registro)
+        dynamics_id = registro.get(entidad.campo_id)
+        if datos is None or not dynamics_id:
+            resultado.ignorados += 1
+            continue
+        datos["dynamics_id"] = dynamics_id
+        datos["is_active"] = registro.get("statecode", 0) == 0
+        filas[dynamics_id] = datos
+    if not filas:
+        return
+
+    nifs = {d["nif_cif"] for d in filas.values()}
+    claves = {d[clave] for d in filas.values() if d[clave]}
+    existentes = db.execute(
+        select(tabla.c.id, tabla.c.dynamics_id, tabla.c.nif_cif, tabla.c[clave], tabla.c.is_active).where(or_(
+            tabla.c.dynamics_id.in_(list(filas)), tabla.c.nif_cif.in_(nifs), tabla.c[clave].in_(claves)
+        ))
+    ).all()
+    por_dynamics_id = {e.dynamics_id: e for e in existentes if e.dynamics_id}
+    por_nif = {e.nif_cif: e for e in existentes}
+    por_clave = {}
+    for e in existentes:
+        if e[3] and (e[3] not in por_clave or not e.dynamics_id):  # Preferimos los aún sin enlazar
+            por_clave[e[3]] = e
+
+    enlazados = set()  # Cada cliente local solo se enlaza con un registro de Dynamics
+    nifs_nuevos = set()
+    enlazar, nuevas, actualizar = [], [], []
+    for dynamics_id, datos in filas.items():
+        existente = por_dynamics_id.get(dynamics_id)
+        if existente is None:
+            for candidato in (por_nif.get(datos["nif_cif"]), por_clave.get(datos[clave])):
+                if candidato is not None and candidato.id not in enlazados \
+                        and candidato.dynamics_id not in filas:
+                    existente = candidato
+                    enlazar.append({"b_id": existente.id, "b_dynamics_id": dynamics_id})
+                    break
+
+        if existente is None:
+            if datos["nif_cif"] in por_nif or datos["nif_cif"] in nifs_nuevos:
+                # Mismo NIF que otro cliente ya enlazado (ej. dos cuentas con el mismo accountnumber)
+                logger.warning(f"⚠️ {entidad.nombre} {dynamics_id}: NIF {datos['nif_cif']} duplicado, se ignora")
+                resultado.ignorados += 1
+                continue
+            if not datos["is_active"]:
+                resultado.ignorados += 1  # No creamos clientes que ya están inactivos en Dynamics
+                continue
+            nifs_nuevos.add(datos["nif_cif"])
+            resultado.nuevos += 1
+            nuevas.append(datos)
+        else:
+            enlazados.add(existente.id)
+            datos["nif_cif"] = existente.nif_cif  # El NIF no se pisa
+            resultado.actualizados += 1
+            if existente.is_active and not datos["is_active"]:
+                resultado.desactivados += 1
+            actualizar.append(datos)
+
+    if enlazar:
+        db.execute(
+            update(tabla).where(tabla.c.id == bindparam("b_id")).values(dynamics_id=bindparam("b_dynamics_id")),
+            enlazar,
+        )
+    insert_ = INSERT_CON_UPSERT.get(db.get_bind().dialect.name)
+    if insert_ is None:
+        _escribir_sin_upsert(db, nuevas, actualizar)
+    elif nuevas or actualizar:
+        _escribir_con_upsert(db, insert_(tabla), nuevas + actualizar)
+
+
+def _desactivar_borrados(db: Session, ids: List[str]) -> int:
+    """Los registros borrados en Dynamics se desactivan (no se borran: tienen facturas/contratos)"""
+    if not ids:
+        return 0
+    return db.query(models.Cliente).filter(
+        models.Cliente.dynamics_id.in_(ids), models.Cliente.is_active == True
+    ).update({models.Cliente.is_active: False}, synchronize_session=False)
+
+
+def _paginas(dynamics: Dynamics365Connector, entidad: EntidadSync, estado, modo: str,
+             seguimiento: bool) -> Iterable[Dict]:
+    if modo == MODO_DELTA and estado.delta_link:
+        logger.info(f"🔄 {entidad.nombre}: delta por change tracking")
+        return dynamics.iter_pages(estado.delta_link)
+    params = {"$select": ",".join(entidad.campos)}
+    if modo == MODO_DELTA and estado.ultima_modificacion:
+        logger.info(f"🔄 {entidad.nombre}: delta por modifiedon >= {estado.ultima_modificacion}")
+        params["$filter"] = f"modifiedon ge {estado.ultima_modificacion}"
+        return dynamics.iter_pages(entidad.nombre, params)
+    logger.info(f"📥 {entidad.nombre}: carga completa{' (con seguimiento de cambios)' if seguimiento else ''}")
+    return dynamics.iter_pages(entidad.nombre, params, track_changes=seguimiento)
+
+
+def sincronizar_entidad(dynamics: Dynamics365Connector, db: Session, nombre: str,
+                        modo: str = MODO_DELTA, seguimiento: bool = True) -> ResultadoSync:
+    """
+    Aplica los cambios de una entidad de Dynamics 365 a la tabla clientes
+
+    Se confirma página a página; el nuevo estado (deltaLink / marca de agua) solo
+    se guarda al terminar, así una ejecución interrumpida se repite sin perder cambios.
+    """
+    entidad = ENTIDADES[nombre]
+    estado = db.query(models.SincronizacionD365).filter(models.SincronizacionD365.entidad == nombre).first()
+    if estado is None:
+        estado = models.SincronizacionD365(entidad=nombre)
+        db.add(estado)
+        db.commit()
+    if modo == MODO_DELTA and not (estado.delta_link or estado.ultima_modificacion):
+        modo = MODO_FULL  # Primera ejecución: no hay desde dónde calcular el delta
+
+    resultado = ResultadoSync(entidad=nombre, modo=modo)
+    inicio = time.perf_counter()
+    delta_link: Optional[str] = None
+    marca_agua = estado.ultima_modificacion
+
+    try:
+        for numero, pagina in enumerate(_paginas(dynamics, entidad, estado, modo, seguimiento), start=1):
+            t0 = time.perf_counter()
+            registros, borrados = [], []
+            for registro in pagina.get("value", []):
+                if _es_borrado(registro):
+                    borrados.append(registro.get("id"))
+                    continue
+                registros.append(registro)
+                modificado = registro.get("modifiedon")
+                if modificado and (marca_agua is None or modificado > marca_agua):
+                    marca_agua = modificado
+            aplicar_pagina(db, entidad, registros, resultado)
+            resultado.desactivados += _desactivar_borrados(db, borrados)
+            db.commit()
+            if registros or borrados:
+                invalidar_cache_dashboard()  # Upsert en bloque: los eventos de sesión del dashboard no lo ven
+            segundos = time.perf_counter() - t0
+            total = len(registros) + len(borrados)
+            resultado.registros += total
+            resultado.segundos_escritura += segundos
+            logger.info(f"⏳ {nombre} página {numero}: {total} registros en {segundos * 1000:.0f} ms "
+                        f"({total / segundos if segundos else 0:,.0f} registros/s)")
+            delta_link = pagina.get("@odata.deltaLink") or delta_link
+    except requests.exceptions.HTTPError as e:
+        db.rollback()
+        caducado = e.response is not None and e.response.status_code in ESTADOS_DELTA_CADUCADO
+        if modo == MODO_DELTA and estado.delta_link and caducado:
+            logger.warning(f"⚠️ El deltaLink de {nombre} ha caducado: se hace una carga completa")
+            estado.delta_link = None
+            db.commit()
+            return sincronizar_entidad(dynamics, db, nombre, MODO_FULL)
+        if modo == MODO_FULL and seguimiento and caducado:
+            logger.warning(f"⚠️ {nombre} no admite change tracking: se usará la marca de agua de modifiedon")
+            return sincronizar_entidad(dynamics, db, nombre, MODO_FULL, seguimiento=False)
+        raise
+
+    # Si la entidad no tiene change tracking, no llega deltaLink y la próxima
+    # ejecución delta usará la marca de agua de modifiedon
+    estado.delta_link = delta_link
+    estado.ultima_modificacion = marca_agua
+    estado.ultimo_modo = modo
+    estado.ultima_ejecucion = datetime.now(timezone.utc)
+    estado.registros_cambiados = resultado.nuevos + resultado.actualizados
+    estado.registros_borrados = resultado.desactivados
+    db.commit()
+
+    resultado.segundos = time.perf_counter() - inicio
+    resultado.log()
+    return resultado
@@ -0,0 +1 @@
+# Módulo de energía (lectura de facturas de luz)
@@ -0,0 +1,267 @@
+"""
+Extracción local de los datos de una factura de luz (PDF)
+/energia/analizar-factura mandaba el texto de las dos primeras páginas a Gemini solo
+para sacar consumo y potencia. Las facturas de las comercializadoras siguen unos
+pocos formatos, así que aquí se leen con reglas deterministas:
+  • lineas_pdf(): el texto de pypdf con su posición (x, y); los trozos a la misma
+    altura forman una línea, ordenada de izquierda a derecha
+  • reglas por expresiones regulares sobre esas líneas: CUPS (con sus letras de
+    control), potencia P1–P6 (o punta/valle), kWh por periodo (o punta/llano/valle),
+    consumo total, importe total y fechas (periodo de facturación y emisión)
+  • reglas posicionales para las tablas "P1 P2 ... P6": cada valor va al periodo
+    cuya cabecera tiene encima (misma columna)
+  • confianza 0–1 según lo encontrado y su coherencia (suma de periodos = total,
+    valores plausibles). Por debajo de UMBRAL_CONFIANZA el endpoint pregunta a la IA.
+"""
+import io
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+import pypdf
+
+UMBRAL_CONFIANZA = float(os.getenv("FACTURA_UMBRAL_CONFIANZA", "0.7"))
+PAGINAS = 2
+PERIODOS = ("P1", "P2", "P3", "P4", "P5", "P6")
+TOLERANCIA_LINEA = 2.0  # Puntos de diferencia en y para considerar dos trozos en la misma línea
+TOLERANCIA_COLUMNA = 45.0  # Puntos de diferencia en x entre un valor y la cabecera de su periodo
+
+# Nombres de los periodos en las tarifas 2.0TD: potencia punta/valle, energía punta/llano/valle
+POTENCIA_POR_NOMBRE = {"punta": "P1", "valle": "P2"}
+ENERGIA_POR_NOMBRE = {"punta": "P1", "llano": "P2", "valle": "P3"}
+
+# Pesos de la confianza: sin consumo o sin potencia nunca se llega al umbral
+PESOS = {"consumo": 0.35, "potencia": 0.35, "cups": 0.15, "fechas": 0.15}
+
+_LETRAS_CUPS = "TRWAGMYFPDXBNJZSQVHLCKE"
+_NUM = r"(\d{1,3}(?:\.\d{3})+(?:,\d+)?|\d+(?:[.,]\d+)?)"
+_FECHA = r"(\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4})"
+
+_RE_CUPS = re.compile(r"\bES[\s-]?((?:\d{4}[\s-]?){4})([A-Z]{2})(?:[\s-]?(\d[FPCRXYZ]))?\b")
+_RE_POTENCIA_PERIODO = re.compile(r"\b(P[1-6])\b[^\d\n]{0,20}?" + _NUM + r"\s*kW(?!h)", re.I)
+_RE_POTENCIA_NOMBRE = re.compile(r"potencia[^\n\d]{0,25}?\b(punta|valle)\b[^\d\n]{0,10}" + _NUM + r"\s*kW(?!h)", re.I)
+_RE_POTENCIA_UNICA = re.compile(r"potencia(?: contratada)?\b[^\d\n]{0,15}" + _NUM + r"\s*kW(?!h)", re.I)
+_RE_ENERGIA_PERIODO = re.compile(r"\b(P[1-6])\b[^\d\n]{0,20}?" + _NUM + r"\s*kWh", re.I)
+_RE_ENERGIA_NOMBRE = re.compile(r"\b(punta|llano|valle)\b[^\d\n]{0,10}" + _NUM + r"\s*kWh", re.I)
+_RE_CONSUMO_TOTAL = re.compile(
+    r"(?:consumo total|total consumo|total energ[ií]a|energ[ií]a (?:activa )?(?:total|consumida)|"
+    r"consumo (?:del periodo|facturado|en el periodo))[^\d\n]{0,25}" + _NUM + r"\s*kWh", re.I)
+_RE_PERIODO = re.compile(r"per[ií]odo(?: de (?:facturaci[oó]n|consumo))?[^\d\n]{0,25}" + _FECHA +
+                         r"[^\d\n]{1,12}" + _FECHA, re.I)
+_RE_IMPORTE = re.compile(r"(?:importe total|total (?:a pagar|factura|importe))[^\d\n]{0,20}" + _NUM + r"\s*(?:€|eur)", re.I)
+_RE_EMISION = re.compile(r"fecha (?:de )?(?:emisi[oó]n|(?:la )?factura)[^\d\n]{0,10}" + _FECHA, re.I)
+_RE_CABECERA_PERIODO = re.compile(r"^P[1-6]$")
+_RE_CELDA_NUMERO = re.compile(_NUM + r"\s*(?:kWh?|€)?", re.I)
+
+
+@dataclass
+class Linea:
+    y: float
+    celdas: List[Tuple[float, str]]  # (x, texto), de izquierda a derecha
+
+    @property
+    def texto(self) -> str:
+        return "  ".join(t for _, t in self.celdas)
+
+
+@dataclass
+class DatosFactura:
+    cups: Optional[str] = None
+    cups_valido: bool = False
+    potencias: Dict[str, float] = field(default_factory=dict)  # kW por periodo
+    consumos: Dict[str, float] = field(default_factory=dict)  # kWh por periodo
+    consumo_total: Optional[float] = None
+    fecha_inicio: Optional[date] = None
+    fecha_fin: Optional[date] = None
+    fecha_emision: Optional[date] = None
+    importe_total: Optional[float] = None  # € con impuestos
+    confianza: float = 0.0
+    avisos: List[str] = field(default_factory=list)
+
+    @property
+    def consumo(self) -> Optional[float]:
+        if self.consumo_total is not None:
+            return self.consumo_total
+        return round(sum(self.consumos.values()), 3) if self.consumos else None
+
+    @property
+    def potencia(self) -> Optional[float]:
+        return max(self.potencias.values()) if self.potencias else None
+
+    def a_dict(self) -> Dict:
+        return {
+            "cups": self.cups, "potencias": self.potencias, "consumos": self.consumos,
+            "fecha_inicio": self.fecha_inicio.isoformat() if self.fecha_inicio else None,
+            "fecha_fin": self.fecha_fin.isoformat() if self.fecha_fin else None,
+            "fecha_emision": self.fecha_emision.isoformat() if self.fecha_emision else None,
+            "importe_total": self.importe_total,
+            "confianza": self.confianza,
+        }
+
+
+# --- Texto con posiciones ---
+
+def lineas_pdf(contenido: bytes, paginas: int = PAGINAS) -> List[Linea]:
+    """Líneas de las primeras `paginas` páginas, de arriba abajo, reconstruidas por posición"""
+    reader = pypdf.PdfReader(io.BytesIO(contenido))
+    lineas = []
+    for numero in range(min(paginas, len(reader.pages))):
+        trozos = []
+
+        def visitar(texto, cm, tm, fuente, tamano):
+            if texto.strip():
+                # Posición = matriz de texto compuesta con la de la página
+                trozos.append((tm[4] * cm[0] + tm[5] * cm[2] + cm[4],
+                               tm[4] * cm[1] + tm[5] * cm[3] + cm[5], texto.strip()))
+
+        reader.pages[numero].extract_text(visitor_text=visitar)
+        pagina = []
+        for x, y, texto in sorted(trozos, key=lambda t: (-t[1], t[0])):
+            if pagina and abs(pagina[-1].y - y) <= TOLERANCIA_LINEA:
+                pagina[-1].celdas.append((x, texto))
+            else:
+                pagina.append(Linea(y, [(x, texto)]))
+        for linea in pagina:
+            linea.celdas.sort()
+        lineas.extend(pagina)
+    return lineas
+
+
+# --- Valores ---
+
+def numero_es(texto: str) -> float:
+    """'1.234,56' -> 1234.56; '15,000' -> 15.0; '1.234' -> 1234.0; '4.6' -> 4.6"""
+    if "," in texto:
+        return float(texto.replace(".", "").replace(",", "."))
+    if re.fullmatch(r"\d{1,3}(?:\.\d{3})+", texto):
+        return float(texto.replace(".", ""))
+    return float(texto)
+
+
+def fecha_es(texto: str) -> Optional[date]:
+    dia, mes, anio = (int(p) for p in re.split(r"[/.-]", texto))
+    if anio < 100:
+        anio += 2000
+    try:
+        return date(anio, mes, dia)
+    except ValueError:
+        return None
+
+
+def cups_valido(digitos: str, control: str) -> bool:
+    """Las dos letras de control del CUPS: resto de los 16 dígitos entre 529, en base 23"""
+    resto = int(digitos) % 529
+    return control == _LETRAS_CUPS[resto // 23] + _LETRAS_CUPS[resto % 23]
+
+
+# --- Reglas ---
+
+def _tablas_por_periodo(lineas: List[Linea], datos: DatosFactura):
+    """Cabecera "P1 P2 ... P6" y, debajo, filas de potencia (kW) o energía (kWh) alineadas con ella"""
+    for i, cabecera in enumerate(lineas):
+        if re.search(r"\d", re.sub(r"\bP[1-6]\b", "", cabecera.texto, flags=re.I)):
+            continue  # Una cabecera solo tiene etiquetas ("Periodo  P1  P2 ..."), no valores
+        columnas = [(x, t.upper()) for x, t in cabecera.celdas if _RE_CABECERA_PERIODO.match(t.upper())]
+        en_una_celda = [t.upper() for t in re.findall(r"\bP[1-6]\b", cabecera.texto, re.I)]
+        if len(en_una_celda) < 2:
+            continue
+        for fila in lineas[i + 1:i + 7]:
+            etiqueta = fila.celdas[0][1].lower()
+            if "kwh" in etiqueta or "consumo" in etiqueta or "energ" in etiqueta:
+                destino = datos.consumos
+            elif "potencia" in etiqueta or "kw" in etiqueta:
+                destino = datos.potencias
+            else:
+                continue
+            valores = [(x, m.group(1)) for x, m in ((x, _RE_CELDA_NUMERO.fullmatch(t)) for x, t in fila.celdas[1:]) if m]
+            if len(columnas) >= 2 and valores:
+                # Por posición: cada valor con la cabecera más cercana en x
+                for x, t in valores:
+                    x_cabecera, periodo = min(columnas, key=lambda c: abs(c[0] - x))
+                    if abs(x_cabecera - x) <= TOLERANCIA_COLUMNA:
+                        destino.setdefault(periodo, numero_es(t))
+            else:
+                # La fila en un solo trozo: los últimos números, en el orden de la cabecera
+                periodos = [p for _, p in columnas] if len(columnas) >= 2 else en_una_celda
+                numeros = re.findall(_NUM, fila.texto)[-len(periodos):]
+                if len(numeros) == len(periodos):
+                    for periodo, t in zip(periodos, numeros):
+                        destino.setdefault(periodo, numero_es(t))
+
+
+def _reglas_texto(texto: str, datos: DatosFactura):
+    m = _RE_CUPS.search(texto)
+    if m:
+        digitos = re.sub(r"[\s-]", "", m.group(1))
+        datos.cups = f"ES{digitos}{m.group(2)}{m.group(3) or ''}"
+        datos.cups_valido = cups_valido(digitos, m.group(2))
+
+    for linea in texto.splitlines():
+        baja = linea.lower()
+        if "potencia" in baja or re.search(r"\bkW(?!h)", linea):
+            for periodo, valor in _RE_POTENCIA_PERIODO.findall(linea):
+                datos.potencias.setdefault(periodo.upper(), numero_es(valor))
+            for nombre, valor in _RE_POTENCIA_NOMBRE.findall(linea):
+                datos.potencias.setdefault(POTENCIA_POR_NOMBRE[nombre.lower()], numero_es(valor))
+        if "potencia" not in baja:
+            for periodo, valor in _RE_ENERGIA_PERIODO.findall(linea):
+                datos.consumos.setdefault(periodo.upper(), numero_es(valor))
+            for nombre, valor in _RE_ENERGIA_NOMBRE.findall(linea):
+                datos.consumos.setdefault(ENERGIA_POR_NOMBRE[nombre.lower()], numero_es(valor))
+    if not datos.potencias:
+        m = _RE_POTENCIA_UNICA.search(texto)
+        if m:
+            datos.potencias["P1"] = numero_es(m.group(1))
+
+    m = _RE_CONSUMO_TOTAL.search(texto)
+    if m:
+        datos.consumo_total = numero_es(m.group(1))
+    m = _RE_PERIODO.search(texto)
+    if m:
+        datos.fecha_inicio, datos.fecha_fin = fecha_es(m.group(1)), fecha_es(m.group(2))
+    m = _RE_EMISION.search(texto)
+    if m:
+        datos.fecha_emision = fecha_es(m.group(1))
+    m = _RE_IMPORTE.search(texto)
+    if m:
+        datos.importe_total = numero_es(m.group(1))
+
+
+def _confianza(datos: DatosFactura) -> float:
+    puntos = 0.0
+    consumo, potencia = datos.consumo, datos.potencia
+    if consumo is not None and 0 < consumo < 10_000_000:
+        puntos += PESOS["consumo"]
+    elif consumo is not None:
+        datos.avisos.append(f"Consumo fuera de rango: {consumo}")
+    if potencia is not None and 0.1 <= potencia <= 5_000:
+        puntos += PESOS["potencia"]
+    elif potencia is not None:
+        datos.avisos.append(f"Potencia fuera de rango: {potencia}")
+    if datos.cups_valido:
+        puntos += PESOS["cups"]
+    elif datos.cups:
+        datos.avisos.append("CUPS con letras de control incorrectas")
+    if datos.fecha_inicio and datos.fecha_fin and datos.fecha_inicio < datos.fecha_fin:
+        puntos += PESOS["fechas"]
+    if datos.consumo_total is not None and datos.consumos:
+        suma = sum(datos.consumos.values())
+        if abs(suma - datos.consumo_total) > max(1.0, 0.02 * datos.consumo_total):
+            datos.avisos.append(f"Los periodos suman {suma:g} kWh y el total dice {datos.consumo_total:g}")
+            puntos -= 0.2
+    return round(max(puntos, 0.0), 3)
+
+
+def extraer_datos(lineas: List[Linea]) -> DatosFactura:
+    datos = DatosFactura()
+    _tablas_por_periodo(lineas, datos)
+    _reglas_texto("\n".join(l.texto for l in lineas), datos)
+    datos.confianza = _confianza(datos)
+    return datos
+
+
+def analizar_pdf(contenido: bytes, paginas: int = PAGINAS) -> Tuple[DatosFactura, str]:
+    """Datos extraídos y el texto (para la IA si la confianza no llega al umbral)"""
+    lineas = lineas_pdf(contenido, paginas)
+    return extraer_datos(lineas), "\n".join(l.texto for l in lineas)
@@ -0,0 +1,267 @@
+"""
+Comparador de tarifas (modelo Tarifa)
+Todas las tarifas activas se cargan una vez en matrices NumPy (una fila por tarifa,
+una columna por periodo P1–P6) y el coste anual de uno o muchos perfiles de consumo
+frente a todas ellas sale de dos productos de matrices:
+    coste = (potencia máxima ⊗ precio_potencia) × 365 + consumos · precio_energiaᵀ
+Tarifa guarda un solo precio de potencia (€/kW y día) y uno de energía (€/kWh). El de
+energía se repite en los seis periodos (el consumo de cada periodo se paga una vez); el de
+potencia se aplica una sola vez a la potencia contratada máxima: repetirlo en cada periodo
+con potencia cobraría la misma potencia dos (2.0TD) o seis veces (3.0TD).
+  • matriz_tarifas(): caché hasta que un commit del ORM toque la tabla tarifas (mismo
+    mecanismo que la caché del dashboard)
+  • mejores_tarifas(): las N más baratas para un perfil (la factura que se analiza)
+  • comparar_cartera(): todos los contratos de una vez, por bloques de BLOQUE_CARTERA
+Los costes incluyen impuestos (FACTOR_IMPUESTOS) para poder compararlos con el importe
+de una factura; una tarifa con `tipo` solo se ofrece a perfiles de ese peaje.
+"""
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from app.modules.crm import models
+from app.modules.energia.extractor_factura import DatosFactura
+
+N_PERIODOS = 6
+DIAS_ANIO = 365
+FACTOR_IMPUESTOS = float(os.getenv("TARIFAS_FACTOR_IMPUESTOS", "1.2718"))  # Impuesto eléctrico 5,11 % + IVA 21 %
+HORAS_EQUIVALENTES = float(os.getenv("TARIFAS_HORAS_EQUIVALENTES", "1500"))  # kWh al año por kW (contratos sin consumo)
+LIMITE_2_0TD = 15.0  # kW: por encima el peaje es 3.0TD
+DIAS_FACTURA = 30  # Si la factura no trae el periodo
+BLOQUE_CARTERA = 20_000  # Contratos por bloque: la matriz de costes es bloque × tarifas
+
+# Reparto del consumo anual entre periodos cuando solo se conoce el total
+REPARTO_CONSUMO = {
+    "2.0TD": (0.30, 0.25, 0.45, 0.0, 0.0, 0.0),
+    "3.0TD": (0.10, 0.15, 0.15, 0.15, 0.10, 0.35),
+    "6.1TD": (0.10, 0.15, 0.15, 0.15, 0.10, 0.35),
+}
+
+
+def normalizar_peaje(tarifa_acceso: Optional[str]) -> str:
+    """'2.0 TD', '2.0td' -> '2.0TD'; vacío si no se sabe"""
+    return "".join((tarifa_acceso or "").upper().split())
+
+
+def peaje_por_potencia(potencia_maxima: float) -> str:
+    return "2.0TD" if potencia_maxima <= LIMITE_2_0TD else "3.0TD"
+
+
+@dataclass
+class MatrizTarifas:
+    ids: np.ndarray
+    nombres: List[str]
+    companias: List[str]
+    peajes: np.ndarray  # '' = válida para cualquier peaje
+    precio_potencia: np.ndarray  # (tarifas,) €/kW y día, sobre la potencia máxima
+    precio_energia: np.ndarray  # (tarifas, 6) €/kWh
+    version: int
+    por_nombre: Dict[tuple, int] = field(default_factory=dict, repr=False)  # (compañía, nombre) -> fila
+
+    def __len__(self):
+        return len(self.ids)
+
+    def indice(self, compania: Optional[str], nombre: Optional[str]) -> Optional[int]:
+        """Fila de la tarifa (compañía + nombre): la tarifa actual de un contrato"""
+        return self.por_nombre.get(((compania or "").strip().lower(), (nombre or "").strip().lower()))
+
+    def costes(self, potencias: np.ndarray, consumos: np.ndarray, peajes: Optional[Sequence[str]] = None) -> np.ndarray:
+        """
+        (perfiles, tarifas) con el coste anual con impuestos; inf si la tarifa no es de su peaje
+        potencias: (perfiles, 6) kW; consumos: (perfiles, 6) kWh al año
+        """
+        coste = np.outer(potencias.max(axis=1), self.precio_potencia) * DIAS_ANIO + consumos @ self.precio_energia.T
+        coste *= FACTOR_IMPUESTOS
+        if peajes is not None:
+            peajes = np.asarray(peajes, dtype=object)
+            valida = (self.peajes[None, :] == peajes[:, None]) | (self.peajes == "")[None, :] | (peajes == "")[:, None]
+            coste[~valida] = np.inf
+        return coste
+
+
+def cargar_matriz(db: Session, version: int = 0) -> MatrizTarifas:
+    t = models.Tarifa
+    filas = db.execute(
+        select(t.id, t.nombre, t.compania, t.tipo, t.precio_potencia, t.precio_energia)
+        .where(t.is_active.is_(True)).order_by(t.id)
+    ).all()
+    precio_potencia = np.array([f.precio_potencia or 0.0 for f in filas], dtype=np.float64)
+    precio_energia = np.array([f.precio_energia or 0.0 for f in filas], dtype=np.float64)
+    return MatrizTarifas(
+        ids=np.array([f.id for f in filas], dtype=np.int64),
+        nombres=[f.nombre or "" for f in filas],
+        companias=[f.compania or "" for f in filas],
+        peajes=np.array([normalizar_peaje(f.tipo) for f in filas], dtype=object),
+        precio_potencia=precio_potencia,
+        precio_energia=np.repeat(precio_energia[:, None], N_PERIODOS, axis=1),
+        version=version,
+        por_nombre={((f.compania or "").strip().lower(), (f.nombre or "").strip().lower()): i for i, f in enumerate(filas)},
+    )
+
+
+# --- Caché de la matriz (se invalida con cualquier commit que toque tarifas) ---
+_version_tarifas = 0
+_matriz: Optional[MatrizTarifas] = None
+_lock = threading.Lock()
+
+
+def matriz_tarifas(db: Session) -> MatrizTarifas:
+    global _matriz
+    matriz = _matriz
+    if matriz is not None and matriz.version == _version_tarifas:
+        return matriz
+    with _lock:
+        version = _version_tarifas  # Antes de leer: si alguien escribe mientras tanto, la próxima vez se recarga
+        if _matriz is None or _matriz.version != version:
+            _matriz = cargar_matriz(db, version)
+        return _matriz
+
+
+def invalidar_tarifas():
+    global _version_tarifas
+    with _lock:
+        _version_tarifas += 1
+
+
+@event.listens_for(Session, "after_flush")
+def _marcar_tarifas_modificadas(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, models.Tarifa):
+            session.info["tarifas_sucias"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidar_tras_commit(session):
+    if session.info.pop("tarifas_sucias", False):
+        invalidar_tarifas()
+
+
+@event.listens_for(Session, "after_rollback")
+def _limpiar_marca_tras_rollback(session):
+    session.info.pop("tarifas_sucias", None)
+
+
+# --- Perfiles ---
+
+def vector_periodos(valores: Dict[str, float]) -> np.ndarray:
+    """{'P1': 4.6, 'P2': 4.6} -> [4.6, 4.6, 0, 0, 0, 0]"""
+    vector = np.zeros(N_PERIODOS)
+    for periodo, valor in (valores or {}).items():
+        vector[int(periodo[1:]) - 1] = valor or 0.0
+    return vector
+
+
+def reparto_consumo(peaje: str) -> np.ndarray:
+    return np.asarray(REPARTO_CONSUMO.get(peaje, REPARTO_CONSUMO["3.0TD"]), dtype=np.float64)
+
+
+def perfil_factura(datos: DatosFactura, consumo: Optional[float] = None, potencia: Optional[float] = None):
+    """
+    (potencias, consumos anuales, peaje, coste actual anual) de una factura analizada.
+    Los kWh y el importe se pasan a un año con los días del periodo facturado; `consumo` y
+    `potencia` sustituyen a lo extraído cuando lo ha leído la IA.
+    """
+    dias = DIAS_FACTURA
+    if datos.fecha_inicio and datos.fecha_fin and datos.fecha_fin > datos.fecha_inicio:
+        dias = (datos.fecha_fin - datos.fecha_inicio).days + 1
+    anual = DIAS_ANIO / dias
+
+    potencias = vector_periodos(datos.potencias)
+    if not potencias.any() and potencia:
+        potencias[:2 if potencia <= LIMITE_2_0TD else N_PERIODOS] = potencia
+    peaje = peaje_por_potencia(potencias.max())
+    consumos = vector_periodos(datos.consumos)
+    total = consumo if consumo is not None else datos.consumo
+    if not consumos.any() or (total and abs(consumos.sum() - total) > 0.02 * total):
+        consumos = reparto_consumo(peaje) * (total or 0.0)
+    coste_actual = datos.importe_total * anual if datos.importe_total else None
+    return potencias, consumos * anual, peaje, coste_actual
+
+
+def mejores_tarifas(matriz: MatrizTarifas, potencias: np.ndarray, consumos: np.ndarray, peaje: str = "",
+                    coste_actual: Optional[float] = None, top: int = 3) -> List[Dict]:
+    """Las `top` tarifas más baratas para un perfil (potencias en kW, consumos anuales en kWh, por periodo)"""
+    if not len(matriz):
+        return []
+    costes = matriz.costes(potencias[None, :], consumos[None, :], [peaje])[0]
+    validas = int(np.isfinite(costes).sum())
+    top = min(top, validas)
+    if not top:
+        return []
+    mejores = np.argpartition(costes, top - 1)[:top]
+    mejores = mejores[np.argsort(costes[mejores])]
+    return [{
+        "tarifa_id": int(matriz.ids[i]), "nombre": matriz.nombres[i], "compania": matriz.companias[i],
+        "coste_anual": round(float(costes[i]), 2),
+        "ahorro_anual": round(coste_actual - float(costes[i]), 2) if coste_actual is not None else None,
+    } for i in mejores]
+
+
+def ofertas_factura(db: Session, datos: DatosFactura, consumo: Optional[float] = None,
+                    potencia: Optional[float] = None, top: int = 3) -> List[Dict]:
+    """Ofertas de /energia/analizar-factura: las `top` tarifas más baratas y su ahorro frente a la factura"""
+    potencias, consumos, peaje, coste_actual = perfil_factura(datos, consumo, potencia)
+    if not potencias.any() and not consumos.any():
+        return []
+    ofertas = mejores_tarifas(matriz_tarifas(db), potencias, consumos, peaje, coste_actual, top)
+    for oferta in ofertas:
+        ahorro = oferta["ahorro_anual"]
+        oferta["ahorro"] = f"{ahorro:.0f}€" if ahorro is not None else "—"  # Texto que muestra el frontend
+    return ofertas
+
+
+def comparar_cartera(db: Session, contrato_ids: Optional[List[int]] = None, horas_equivalentes: float = HORAS_EQUIVALENTES,
+                     solo_con_ahorro: bool = False) -> Dict:
+    """
+    Mejor tarifa para cada contrato (potencias p1–p6 del contrato; consumo estimado con las horas
+    equivalentes y el reparto de su peaje). Si la tarifa actual (comercializadora + producto)
+    está en la tabla, se calcula el ahorro frente a ella.
+    """
+    matriz = matriz_tarifas(db)
+    c, ps = models.Contrato, models.PuntoSuministro
+    consulta = (select(c.id, c.comercializadora, c.producto, ps.tarifa_acceso,
+                       c.p1, c.p2, c.p3, c.p4, c.p5, c.p6)
+                .outerjoin(ps, ps.id == c.punto_suministro_id).order_by(c.id))
+    if contrato_ids:
+        consulta = consulta.where(c.id.in_(contrato_ids))
+    filas = db.execute(consulta).all()
+
+    resultados, ahorro_total = [], 0.0
+    for inicio in range(0, len(filas), BLOQUE_CARTERA):
+        bloque = filas[inicio:inicio + BLOQUE_CARTERA]
+        potencias = np.array([[f.p1, f.p2, f.p3, f.p4, f.p5, f.p6] for f in bloque], dtype=np.float64).reshape(-1, N_PERIODOS)
+        potencias = np.nan_to_num(potencias, nan=0.0)
+        maximas = potencias.max(axis=1)
+        peajes = [normalizar_peaje(f.tarifa_acceso) or peaje_por_potencia(m) for f, m in zip(bloque, maximas)]
+        # Consumo anual estimado = horas equivalentes × potencia máxima, repartido según el peaje
+        consumos = (maximas * horas_equivalentes)[:, None] * np.array([reparto_consumo(p) for p in peajes])
+        if not len(matriz):
+            break
+
+        costes = matriz.costes(potencias, consumos, peajes)
+        mejor = costes.argmin(axis=1)
+        coste_mejor = costes[np.arange(len(bloque)), mejor]
+        for k, f in enumerate(bloque):
+            if not np.isfinite(coste_mejor[k]) or maximas[k] <= 0:
+                continue  # Sin tarifas de su peaje o sin potencias
+            actual = matriz.indice(f.comercializadora, f.producto)
+            coste_actual = float(costes[k, actual]) if actual is not None and np.isfinite(costes[k, actual]) else None
+            ahorro = round(coste_actual - float(coste_mejor[k]), 2) if coste_actual is not None else None
+            if solo_con_ahorro and not (ahorro and ahorro > 0):
+                continue
+            ahorro_total += ahorro or 0.0
+            resultados.append({
+                "contrato_id": f.id, "peaje": peajes[k], "consumo_estimado": round(float(consumos[k].sum()), 1),
+                "coste_actual": round(coste_actual, 2) if coste_actual is not None else None,
+                "tarifa_id": int(matriz.ids[mejor[k]]), "tarifa": matriz.nombres[mejor[k]],
+                "compania": matriz.companias[mejor[k]], "coste_anual": round(float(coste_mejor[k]), 2),
+                "ahorro_anual": ahorro,
+            })
+    return {
+        "contratos": len(filas), "comparados": len(resultados), "tarifas": len(matriz),
+        "ahorro_total": round(ahorro_total, 2), "resultados": resultados,
+    }
@@ -0,0 +1 @@
+# Módulo de trabajos en segundo plano (exportaciones e importaciones largas)
@@ -0,0 +1,300 @@
+"""
+Trabajos en segundo plano (remesas, PDFs en bloque, importaciones)
+El endpoint solo inserta una fila en `trabajos` y responde 202 con su id; el
+GestorTrabajos la ejecuta en un pool de hilos dentro del mismo proceso:
+  • reserva atómica: UPDATE ... WHERE id = X AND estado = 'Pendiente'; si otro hilo
+    (u otro proceso de uvicorn) la cogió antes, rowcount = 0 y se prueba con la siguiente
+  • un latido renueva reservado_hasta de los trabajos en curso; si el proceso muere,
+    al vencer la reserva el trabajo vuelve a Pendiente (hasta MAX_INTENTOS)
+  • el manejador informa del progreso (fracción y mensaje) y deja el fichero
+    resultante en TRABAJOS_DIR/<id>/, que se descarga después en /jobs/{id}/resultado
+  • los ficheros de más de RETENCION_DIAS se borran
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from app.modules.crm import models
+
+logger = logging.getLogger(__name__)
+
+ESTADO_PENDIENTE = "Pendiente"
+ESTADO_EN_CURSO = "En curso"
+ESTADO_COMPLETADO = "Completado"
+ESTADO_ERROR = "Error"
+
+TRABAJOS_DIR = Path(os.getenv("TRABAJOS_DIR", "uploads/trabajos"))
+WORKERS = int(os.getenv("TRABAJOS_WORKERS", "2"))
+INTERVALO_SEGUNDOS = 2          # Espera de cada hilo cuando no hay trabajos (encolar_trabajo lo despierta antes)
+INTERVALO_PROGRESO = 1.0        # Como mucho una escritura de progreso por segundo y trabajo
+INTERVALO_LATIDO = 60           # Renovar reservas, recuperar abandonados y limpiar
+PLAZO_RESERVA = timedelta(minutes=5)
+MAX_INTENTOS = 3
+RETENCION_DIAS = int(os.getenv("TRABAJOS_RETENCION_DIAS", "7"))
+CANDIDATOS_POR_RESERVA = 5
+
+_hay_trabajo = threading.Event()
+
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ErrorTrabajo(Exception):
+    """Fallo esperado (datos que no validan, nada que exportar...): el trabajo acaba en Error sin traza"""
+
+    def __init__(self, mensaje: str, resultado: Optional[Dict] = None):
+        super().__init__(mensaje)
+        self.resultado = resultado
+
+
+def encolar_trabajo(db: Session, tipo: str, parametros: Dict, usuario_id: Optional[int] = None) -> models.Trabajo:
+    """Crea el trabajo (parámetros serializables en JSON) y despierta a los hilos del gestor"""
+    trabajo = models.Trabajo(tipo=tipo, estado=ESTADO_PENDIENTE, parametros=parametros,
+                             progreso=0.0, intentos=0, usuario_id=usuario_id)
+    db.add(trabajo)
+    db.commit()
+    db.refresh(trabajo)
+    _hay_trabajo.set()
+    return trabajo
+
+
+def carpeta_trabajo(trabajo_id: int) -> Path:
+    carpeta = TRABAJOS_DIR / str(trabajo_id)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    return carpeta
+
+
+def carpeta_entradas() -> Path:
+    """Ficheros subidos por el usuario antes de encolar (ej. la cartera a importar)"""
+    carpeta = TRABAJOS_DIR / "entradas"
+    carpeta.mkdir(parents=True, exist_ok=True)
+    return carpeta
+
+
+class ContextoTrabajo:
+    """Lo que recibe el manejador: sesión propia, avisos de progreso y dónde dejar el fichero"""
+
+    def __init__(self, trabajo_id: int, session_factory):
+        self.trabajo_id = trabajo_id
+        self.session_factory = session_factory
+        self.archivo: Optional[str] = None
+        self.archivo_nombre: Optional[str] = None
+        self.archivo_tipo: Optional[str] = None
+        self._ultimo_aviso = 0.0
+
+    @property
+    def carpeta(self) -> Path:
+        return carpeta_trabajo(self.trabajo_id)
+
+    def avanzar(self, progreso: Optional[float] = None, mensaje: Optional[str] = None, forzar: bool = False):
+        """Guarda el progreso (0 a 1) y/o el paso actual; los avisos muy seguidos se descartan"""
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo_aviso < INTERVALO_PROGRESO:
+            return
+        self._ultimo_aviso = ahora
+        valores = {}
+        if progreso is not None:
+            valores["progreso"] = max(0.0, min(float(progreso), 1.0))
+        if mensaje is not None:
+            valores["mensaje"] = mensaje
+        if not valores:
+            return
+        db = self.session_factory()
+        try:
+            db.execute(update(models.Trabajo).where(models.Trabajo.id == self.trabajo_id).values(**valores))
+            db.commit()
+        finally:
+            db.close()
+
+    def adjuntar(self, ruta, nombre: str, tipo: str):
+        """Registra un fichero ya escrito en self.carpeta como resultado descargable"""
+        self.archivo, self.archivo_nombre, self.archivo_tipo = str(ruta), nombre, tipo
+
+    def guardar_archivo(self, origen, nombre: str, tipo: str):
+        """Copia un fichero abierto (ej. el temporal de generar_remesas) a la carpeta del trabajo y lo cierra"""
+        ruta = self.carpeta / Path(nombre).name
+        try:
+            origen.seek(0)
+            with open(ruta, "wb") as destino:
+                shutil.copyfileobj(origen, destino, 1024 * 1024)
+        finally:
+            origen.close()
+        self.adjuntar(ruta, nombre, tipo)
+
+
+class GestorTrabajos:
+    """
+    Pool de hilos que ejecuta los trabajos pendientes
+    `manejadores` asocia cada tipo con una función (contexto, parametros) -> dict de resultado
+    """
+
+    def __init__(self, session_factory, manejadores: Dict[str, Callable], workers: int = WORKERS,
+                 intervalo: float = INTERVALO_SEGUNDOS, intervalo_latido: float = INTERVALO_LATIDO):
+        self.session_factory = session_factory
+        self.manejadores = manejadores
+        self.workers = workers
+        self.intervalo = intervalo
+        self.intervalo_latido = intervalo_latido
+        self._parar = threading.Event()
+        self._hilos = []
+        self._en_curso: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        self.latir()  # Recupera lo que quedó a medias si el proceso anterior murió
+        for i in range(self.workers):
+            hilo = threading.Thread(target=self._bucle, name=f"trabajos-{i + 1}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+        latido = threading.Thread(target=self._bucle_latido, name="trabajos-latido", daemon=True)
+        latido.start()
+        self._hilos.append(latido)
+        logger.info(f"🚀 Gestor de trabajos iniciado ({self.workers} hilos)")
+
+    def parar(self, timeout: float = 10):
+        """Deja de reservar; los trabajos en curso que no acaben a tiempo se recuperan al vencer su reserva"""
+        self._parar.set()
+        _hay_trabajo.set()
+        limite = time.monotonic() + timeout
+        for hilo in self._hilos:
+            hilo.join(max(0.0, limite - time.monotonic()))
+
+    # --- Hilos ---
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            trabajo_id = None
+            try:
+                trabajo_id = self._reservar()
+            except Exception as e:  # El hilo no debe morir (BD caída, bloqueo...): se reintenta
+                logger.error(f"❌ Error reservando trabajos: {str(e)}")
+            if trabajo_id is None:
+                _hay_trabajo.wait(self.intervalo)
+                _hay_trabajo.clear()
+                continue
+            self._ejecutar(trabajo_id)
+
+    def _bucle_latido(self):
+        while not self._parar.wait(self.intervalo_latido):
+            try:
+                self.latir()
+            except Exception as e:
+                logger.error(f"❌ Error en el latido de trabajos: {str(e)}")
+
+    # --- Reserva y recuperación ---
+
+    def _reservar(self) -> Optional[int]:
+        T = models.Trabajo
+        db = self.session_factory()
+        try:
+            candidatos = db.scalars(
+                select(T.id).where(T.estado == ESTADO_PENDIENTE).order_by(T.created_at, T.id)
+                .limit(CANDIDATOS_POR_RESERVA)
+            ).all()
+            for trabajo_id in candidatos:
+                ahora = _ahora()
+                reservado = db.execute(
+                    update(T).where(T.id == trabajo_id, T.estado == ESTADO_PENDIENTE).values(
+                        estado=ESTADO_EN_CURSO, intentos=T.intentos + 1, iniciado_at=ahora,
+                        reservado_hasta=ahora + PLAZO_RESERVA, error=None,
+                    )
+                ).rowcount
+                db.commit()
+                if reservado == 1:
+                    with self._lock:
+                        self._en_curso.add(trabajo_id)
+                    return trabajo_id
+            return None
+        finally:
+            db.close()
+
+    def latir(self):
+        """Renueva las reservas propias, devuelve a la cola los trabajos abandonados y limpia los antiguos"""
+        T = models.Trabajo
+        ahora = _ahora()
+        with self._lock:
+            propios = list(self._en_curso)
+        db = self.session_factory()
+        try:
+            if propios:
+                db.execute(update(T).where(T.id.in_(propios), T.estado == ESTADO_EN_CURSO)
+                           .values(reservado_hasta=ahora + PLAZO_RESERVA))
+            vencidos = [T.estado == ESTADO_EN_CURSO, T.reservado_hasta < ahora]
+            recuperados = db.execute(update(T).where(*vencidos, T.intentos < MAX_INTENTOS).values(
+                estado=ESTADO_PENDIENTE, reservado_hasta=None, mensaje="Reintentando tras una interrupción",
+            )).rowcount
+            abandonados = db.execute(update(T).where(*vencidos, T.intentos >= MAX_INTENTOS).values(
+                estado=ESTADO_ERROR, reservado_hasta=None, terminado_at=ahora,
+                error=f"Interrumpido {MAX_INTENTOS} veces (el proceso se detuvo mientras se ejecutaba)",
+            )).rowcount
+            db.commit()
+            if recuperados or abandonados:
+                logger.warning(f"⚠️ Trabajos interrumpidos: {recuperados} vuelven a la cola, {abandonados} en error")
+                _hay_trabajo.set()
+            self._limpiar(db, ahora)
+        finally:
+            db.close()
+
+    def _limpiar(self, db: Session, ahora: datetime):
+        """Borra los ficheros de los trabajos terminados hace más de RETENCION_DIAS (la fila se conserva)"""
+        T = models.Trabajo
+        limite = ahora - timedelta(days=RETENCION_DIAS)
+        caducados = db.scalars(select(T.id).where(T.terminado_at < limite, T.archivo.is_not(None))).all()
+        for trabajo_id in caducados:
+            shutil.rmtree(TRABAJOS_DIR / str(trabajo_id), ignore_errors=True)
+        if caducados:
+            db.execute(update(T).where(T.id.in_(caducados)).values(archivo=None))
+            db.commit()
+            logger.info(f"🧹 Ficheros de {len(caducados)} trabajos caducados borrados")
+        entradas = TRABAJOS_DIR / "entradas"
+        if entradas.is_dir():
+            for ruta in entradas.iterdir():
+                if ruta.stat().st_mtime < limite.timestamp():
+                    ruta.unlink(missing_ok=True)
+
+    # --- Ejecución ---
+
+    def _ejecutar(self, trabajo_id: int):
+        db = self.session_factory()
+        try:
+            trabajo = db.get(models.Trabajo, trabajo_id)
+            tipo, parametros = trabajo.tipo, dict(trabajo.parametros or {})
+        finally:
+            db.close()
+
+        contexto = ContextoTrabajo(trabajo_id, self.session_factory)
+        inicio = time.perf_counter()
+        try:
+            manejador = self.manejadores.get(tipo)
+            if manejador is None:
+                raise ErrorTrabajo(f"Tipo de trabajo desconocido: {tipo}")
+            resultado = manejador(contexto, parametros)
+            valores = {"estado": ESTADO_COMPLETADO, "progreso": 1.0, "mensaje": "Terminado", "resultado": resultado}
+            logger.info(f"✅ Trabajo {trabajo_id} ({tipo}) terminado en {time.perf_counter() - inicio:.1f}s")
+        except ErrorTrabajo as e:
+            valores = {"estado": ESTADO_ERROR, "error": str(e), "resultado": e.resultado}
+            logger.warning(f"⚠️ Trabajo {trabajo_id} ({tipo}): {str(e)}")
+        except Exception as e:
+            valores = {"estado": ESTADO_ERROR, "error": f"{type(e).__name__}: {str(e)}"}
+            logger.exception(f"❌ Trabajo {trabajo_id} ({tipo}) ha fallado")
+        finally:
+            with self._lock:
+                self._en_curso.discard(trabajo_id)
+
+        valores.update(
+            terminado_at=_ahora(), reservado_hasta=None, archivo=contexto.archivo,
+            archivo_nombre=contexto.archivo_nombre, archivo_tipo=contexto.archivo_tipo,
+        )
+        db = self.session_factory()
+        try:
+            db.execute(update(models.Trabajo).where(models.Trabajo.id == trabajo_id).values(**valores))
+            db.commit()
+        finally:
+            db.close()
@@ -0,0 +1,143 @@
+"""
+Manejadores de cada tipo de trabajo: (contexto, parametros) -> resultado (dict JSON)
+Los parámetros llegan tal como los guardó el endpoint (fechas en ISO 8601) y cada
+manejador reutiliza el mismo código que la versión síncrona del endpoint.
+"""
+import os
+from dataclasses import asdict
+from datetime import date, timedelta
+from typing import Dict, Optional
+from sqlalchemy.orm import joinedload
+from app.modules.crm import models
+from app.modules.crm.consultas import filtros_facturas
+from app.modules.crm.facturas_lote import generar_lote, FORMATO_ZIP
+from app.modules.crm.pdf_generator import datos_factura
+from app.modules.crm.sepa_generator import generar_remesas, filtro_ids, EMPRESA_SEPA
+from app.modules.crm.sepa_validacion import validar_remesa
+from app.modules.cartera.pipeline import importar_archivo
+from app.modules.dynamics365.sync import MODO_DELTA
+from app.modules.trabajos.gestor import ContextoTrabajo, ErrorTrabajo
+
+TIPO_REMESA_SEPA = "remesa_sepa"
+TIPO_FACTURAS_PDF = "facturas_pdf"
+TIPO_IMPORTAR_CARTERA = "importar_cartera"
+TIPO_IMPORTAR_DYNAMICS = "importar_dynamics"
+
+MAX_FACTURAS_TRABAJO = int(os.getenv("PDF_MAX_FACTURAS_TRABAJO", "50000"))  # Sin esperar a la respuesta cabe más que en pdf-lote
+MAX_RECHAZOS_EN_RESULTADO = 1000
+
+
+def _fecha(valor: Optional[str]) -> Optional[date]:
+    return date.fromisoformat(valor) if valor else None
+
+
+def _filtros(parametros: Dict):
+    filtros = filtros_facturas(parametros.get("estado"), parametros.get("cliente_id"),
+                               _fecha(parametros.get("desde")), _fecha(parametros.get("hasta")))
+    if parametros.get("factura_ids") is not None:
+        filtros.append(filtro_ids(parametros["factura_ids"]))
+    return filtros
+
+
+def remesa_sepa(contexto: ContextoTrabajo, parametros: Dict) -> Dict:
+    """Igual que POST /facturas/generar-remesa: valida, excluye rechazadas (si se pidió) y escribe el XML/ZIP"""
+    filtros = _filtros(parametros)
+    fecha_cobro = _fecha(parametros.get("fecha_cobro")) or date.today() + timedelta(days=1)  # CORE: como pronto D-1
+    db = contexto.session_factory()
+    try:
+        contexto.avanzar(0.0, "Validando adeudos", forzar=True)
+        validacion = validar_remesa(db, filtros, EMPRESA_SEPA, fecha_cobro)
+        resultado = validacion.resumen(MAX_RECHAZOS_EN_RESULTADO)
+        if validacion.rechazos:
+            if not parametros.get("excluir_rechazadas"):
+                raise ErrorTrabajo(f"{resultado['rechazados']} facturas no superan la validación SEPA", resultado)
+            filtros.append(filtro_ids(validacion.facturas_rechazadas, excluir=True))
+
+        contexto.avanzar(0.3, "Escribiendo la remesa", forzar=True)
+        archivo, nombre, tipo, grupos = generar_remesas(db, filtros, EMPRESA_SEPA, fecha_cobro)
+        if not grupos:
+            archivo.close()
+            raise ErrorTrabajo("Sin facturas", resultado)
+        contexto.guardar_archivo(archivo, nombre, tipo)
+    finally:
+        db.close()
+    resultado.update(
+        operaciones=sum(g.num_operaciones for g in grupos),
+        grupos=[{"secuencia": g.secuencia, "fecha_cobro": g.fecha_cobro.isoformat(),
+                 "operaciones": g.num_operaciones, "importe_centimos": g.suma_centimos} for g in grupos],
+    )
+    return resultado
+
+
+def facturas_pdf(contexto: ContextoTrabajo, parametros: Dict) -> Dict:
+    """Igual que GET /facturas/pdf-lote, con progreso por trozo de facturas"""
+    formato = parametros.get("formato", FORMATO_ZIP)
+    db = contexto.session_factory()
+    try:
+        consulta = db.query(models.Factura).filter(*_filtros(parametros))
+        total = consulta.count()
+        if total == 0:
+            raise ErrorTrabajo("No hay facturas con esos filtros")
+        if total > MAX_FACTURAS_TRABAJO:
+            raise ErrorTrabajo(f"Demasiadas facturas ({total}); el máximo por trabajo es {MAX_FACTURAS_TRABAJO}")
+        facturas = consulta.options(joinedload(models.Factura.cliente)).order_by(models.Factura.id).all()
+        lista_datos = [datos_factura(f, f.cliente) for f in facturas]
+    finally:
+        db.close()
+
+    contexto.avanzar(0.0, f"0/{total} facturas", forzar=True)
+    archivo = generar_lote(lista_datos, formato,
+                           al_avanzar=lambda hechas: contexto.avanzar(hechas / total, f"{hechas}/{total} facturas"))
+    tipo = "application/zip" if formato == FORMATO_ZIP else "application/pdf"
+    contexto.guardar_archivo(archivo, f"Facturas_{total}.{formato}", tipo)
+    return {"facturas": total, "formato": formato}
+
+
+def importar_cartera(contexto: ContextoTrabajo, parametros: Dict) -> Dict:
+    """
+    Importación en streaming de un fichero ya subido (parametros["ruta"])
+    Si el proceso muere, el reintento reanuda desde el último bloque confirmado (importaciones_cartera).
+    No se conoce el total de filas sin leer el fichero entero: el progreso va en el mensaje.
+    """
+    ruta = parametros["ruta"]
+    if not os.path.exists(ruta):
+        raise ErrorTrabajo("El fichero subido ya no existe")
+    informe = contexto.carpeta / "rechazos_cartera.csv"
+    db = contexto.session_factory()
+    try:
+        engine = db.get_bind()
+    finally:
+        db.close()
+
+    contexto.avanzar(0.0, "Leyendo el fichero", forzar=True)
+    resumen = importar_archivo(
+        engine, ruta, reanudar=parametros.get("reanudar", True), informe_rechazos=str(informe),
+        al_avanzar=lambda filas: contexto.avanzar(None, f"{filas} filas confirmadas"),
+    )
+    if informe.exists():
+        contexto.adjuntar(informe, informe.name, "text/csv")
+    os.remove(ruta)  # Importado: la entrada ya no hace falta (tras un fallo se conserva para reanudar)
+    if resumen is None:
+        return {"archivo": parametros.get("nombre"), "ya_importado": True}
+    return {"archivo": parametros.get("nombre"), **asdict(resumen)}
+
+
+def importar_dynamics(contexto: ContextoTrabajo, parametros: Dict) -> Dict:
+    """importar_todo (import_dynamics365.py) con la sesión del trabajo; un fallo deja el trabajo en Error"""
+    from import_dynamics365 import importar_todo  # Script de la raíz del backend (configura logging al importarse)
+
+    db = contexto.session_factory()
+    try:
+        resultados = importar_todo(parametros.get("modo") or MODO_DELTA, db=db, lanzar_errores=True,
+                                   al_avanzar=lambda fraccion, mensaje: contexto.avanzar(fraccion, mensaje, forzar=True))
+    finally:
+        db.close()
+    return {entidad: asdict(resultado) for entidad, resultado in resultados.items()}
+
+
+MANEJADORES = {
+    TIPO_REMESA_SEPA: remesa_sepa,
+    TIPO_FACTURAS_PDF: facturas_pdf,
+    TIPO_IMPORTAR_CARTERA: importar_cartera,
+    TIPO_IMPORTAR_DYNAMICS: importar_dynamics,
+}
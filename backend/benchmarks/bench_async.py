@@ -0,0 +1,221 @@
+"""
+Lecturas del CRM por la ruta síncrona y por la asíncrona (app/database.py: get_async_db)
+Levanta la API con uvicorn en otro proceso y la carga con CONCURRENCIA clientes a la vez,
+rotando por los endpoints portados: /clientes/, /facturas/, /contratos/{id},
+/renovaciones/pendientes y /dashboard-stats/.
+  • síncrona: el mismo código que antes (def + Session), registrado bajo /sync/...
+  • asíncrona: los endpoints de app/main.py (async def + AsyncSession, aiosqlite)
+Con SQLite cada consulta tarda microsegundos. Para simular la ida y vuelta de red de
+PostgreSQL, se añade una espera de --latencia-ms por sentencia en el hilo que la ejecuta:
+en la ruta síncrona es un hilo del pool de FastAPI (40 por defecto) y en la asíncrona el
+hilo de aiosqlite, mientras el bucle de eventos sigue atendiendo peticiones.
+
+Uso:
+    python -m benchmarks.bench_async
+    python -m benchmarks.bench_async --latencia-ms 0 --segundos 5
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench_async.db")
+os.environ.setdefault("GOOGLE_API_KEY", "stub")
+
+PUERTO = 8766
+CONCURRENCIAS = (10, 50, 100, 200)
+SIN_ERRORES_HASTA = 100  # Por encima, con 1 CPU, se agota el pool de conexiones (timeout de 10 s)
+
+
+def sembrar(args):
+    from datetime import date, datetime, timedelta
+    from app.database import engine
+    from app.modules.crm import models
+    from benchmarks.comun import insertar_en_lotes
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    rnd = random.Random(24)
+    hoy = date.today()
+    insertar_en_lotes(engine, models.Cliente.__table__, [
+        {"id": i, "nombre": f"Cliente {i}", "nif_cif": f"B{i:08d}", "is_active": rnd.random() > 0.2,
+         "tipo_cliente": rnd.choice(["Particular", "Empresa"]), "created_at": datetime.now() - timedelta(days=rnd.randrange(700))}
+        for i in range(1, args.clientes + 1)
+    ])
+    insertar_en_lotes(engine, models.PuntoSuministro.__table__, [
+        {"id": i, "cups": f"ES{i:020d}", "cliente_id": rnd.randint(1, args.clientes)} for i in range(1, args.clientes + 1)
+    ])
+    insertar_en_lotes(engine, models.Contrato.__table__, [
+        {"id": i, "punto_suministro_id": i, "comercializadora": rnd.choice(["Loviluz", "Endesa", "Naturgy"]),
+         "producto": "Fijo 24h", "p1": 4.6, "p2": 4.6, "p3": 0, "p4": 0, "p5": 0, "p6": 0, "estado": "Activo",
+         "fecha_fin": hoy + timedelta(days=rnd.randrange(-30, 3000))}
+        for i in range(1, args.clientes + 1)
+    ])
+    insertar_en_lotes(engine, models.Factura.__table__, [
+        {"id": i, "numero_factura": f"F{i:08d}", "cliente_id": rnd.randint(1, args.clientes), "monto": rnd.uniform(20, 400),
+         "concepto": "Suministro eléctrico", "estado": rnd.choice(["Pendiente", "Pagada"]), "created_at": datetime.now() - timedelta(days=rnd.randrange(400))}
+        for i in range(1, args.clientes * 3 + 1)
+    ])
+
+
+def servir(latencia_ms: float):
+    """Proceso del servidor: la app real + las versiones síncronas de antes bajo /sync/..."""
+    from datetime import date
+    from typing import Optional
+    import uvicorn
+    from fastapi import Depends, Query, Response
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    from app import database
+    from app.database import get_db
+    from app.main import app, limiter, models, schemas, get_current_active_user
+    from app.modules.crm.consultas import consulta_renovaciones_pendientes, fila_renovacion, filtros_facturas
+    from app.modules.crm.dashboard import obtener_estadisticas_dashboard
+    from app.modules.crm.pagination import paginar_keyset, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
+
+    def pausa(_sql):
+        time.sleep(latencia_ms / 1000)
+
+    if latencia_ms:
+        @event.listens_for(database.engine, "connect")
+        def _latencia_sync(conexion, registro):
+            conexion.set_trace_callback(pausa)
+
+        motor = database.motor_async()
+
+        @event.listens_for(motor.sync_engine, "connect")
+        def _latencia_async(conexion, registro):
+            conexion.run_async(lambda c: c.set_trace_callback(pausa))
+
+    @app.get("/sync/clientes/", response_model=list[schemas.ClienteResponse])
+    def clientes_sync(response: Response, cursor: Optional[int] = None,
+                      limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+                      db: Session = Depends(get_db), current_user=Depends(get_current_active_user)):
+        return paginar_keyset(db, models.Cliente, [], cursor, limit, response)
+
+    @app.get("/sync/facturas/", response_model=list[schemas.FacturaResponse])
+    def facturas_sync(response: Response, cursor: Optional[int] = None,
+                      limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO), estado: Optional[str] = None,
+                      db: Session = Depends(get_db), current_user=Depends(get_current_active_user)):
+        return paginar_keyset(db, models.Factura, filtros_facturas(estado, None, None, None), cursor, limit, response)
+
+    @app.get("/sync/contratos/{cliente_id}", response_model=list[schemas.ContratoResponse])
+    def contratos_sync(cliente_id: int, db: Session = Depends(get_db), current_user=Depends(get_current_active_user)):
+        cups_ids = [c.id for c in db.query(models.PuntoSuministro).filter(models.PuntoSuministro.cliente_id == cliente_id).all()]
+        return db.query(models.Contrato).filter(models.Contrato.punto_suministro_id.in_(cups_ids)).all()
+
+    @app.get("/sync/renovaciones/pendientes")
+    def renovaciones_sync(db: Session = Depends(get_db), current_user=Depends(get_current_active_user)):
+        hoy = date.today()
+        return [fila_renovacion(f, hoy) for f in db.execute(consulta_renovaciones_pendientes(hoy)).all()]
+
+    @app.get("/sync/dashboard-stats/")
+    def dashboard_sync(db: Session = Depends(get_db), current_user=Depends(get_current_active_user)):
+        return obtener_estadisticas_dashboard(db)
+
+    limiter.enabled = False
+    uvicorn.run(app, host="127.0.0.1", port=PUERTO, log_level="warning", access_log=False)
+
+
+RUTAS = ("/clientes/?limit=50", "/facturas/?limit=50&estado=Pendiente", "/contratos/{id}",
+         "/renovaciones/pendientes", "/dashboard-stats/")
+
+
+async def carga(prefijo, concurrencia, segundos, cabeceras, clientes):
+    import httpx
+
+    latencias, errores = [], 0
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PUERTO}", headers=cabeceras, timeout=60, limits=limites) as http:
+        fin = time.perf_counter() + segundos
+
+        async def cliente(n):
+            nonlocal errores
+            rnd = random.Random(n)
+            while time.perf_counter() < fin:
+                ruta = RUTAS[rnd.randrange(len(RUTAS))].replace("{id}", str(rnd.randint(1, clientes)))
+                inicio = time.perf_counter()
+                try:
+                    respuesta = await http.get(prefijo + ruta)
+                    respuesta.raise_for_status()
+                    latencias.append(time.perf_counter() - inicio)
+                except httpx.HTTPError:
+                    errores += 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(cliente(n) for n in range(concurrencia)))
+        duracion = time.perf_counter() - inicio
+    latencias.sort()
+    return len(latencias) / duracion, statistics.median(latencias), latencias[int(len(latencias) * 0.95)], errores
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clientes", type=int, default=20_000)
+    parser.add_argument("--segundos", type=float, default=4.0)
+    parser.add_argument("--latencia-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    import httpx
+    sembrar(args)
+    from app.database import SessionLocal
+    from app.modules.auth import utils
+    from app.modules.crm import models
+
+    db = SessionLocal()
+    db.add(models.User(email="bench@loviluz.es", hashed_password="x", is_active=True, role="comercial"))
+    db.commit()
+    usuario = db.query(models.User).filter(models.User.email == "bench@loviluz.es").one()
+    utils.ACCESS_TOKEN_EXPIRE_MINUTES = 60
+    cabeceras = {"Authorization": f"Bearer {utils.create_access_token(utils.claims_usuario(usuario))}"}
+    db.close()
+
+    servidor = multiprocessing.get_context("fork").Process(target=servir, args=(args.latencia_ms,), daemon=True)
+    servidor.start()
+    for _ in range(200):
+        try:
+            httpx.get(f"http://127.0.0.1:{PUERTO}/")
+            break
+        except httpx.HTTPError:
+            time.sleep(0.1)
+
+    print(f"⚡ {len(RUTAS)} endpoints de lectura, {args.segundos:.0f}s por nivel, "
+          f"{args.latencia_ms:g} ms por sentencia, {os.cpu_count()} CPU, un worker de uvicorn")
+    print(f"   {'clientes':>8} | {'síncrona req/s':>14} {'p50':>8} {'p95':>8} | {'asíncrona req/s':>15} {'p50':>8} {'p95':>8}")
+    ok = True
+    mejor = []
+    for concurrencia in CONCURRENCIAS:
+        sync = asyncio.run(carga("/sync", concurrencia, args.segundos, cabeceras, args.clientes))
+        asyn = asyncio.run(carga("", concurrencia, args.segundos, cabeceras, args.clientes))
+        if concurrencia <= SIN_ERRORES_HASTA:
+            ok &= sync[3] == 0 and asyn[3] == 0
+        mejor.append(asyn[0] / sync[0])
+        print(f"   {concurrencia:>8} | {sync[0]:>14.0f} {sync[1] * 1000:>6.0f}ms {sync[2] * 1000:>6.0f}ms | "
+              f"{asyn[0]:>15.0f} {asyn[1] * 1000:>6.0f}ms {asyn[2] * 1000:>6.0f}ms"
+              + (f"  ({sync[3]} / {asyn[3]} errores)" if sync[3] or asyn[3] else ""))
+    print(f"{'✅' if ok else '❌'} Sin errores en ninguna de las dos rutas hasta {SIN_ERRORES_HASTA} clientes")
+    if args.latencia_ms:
+        correcto = mejor[-1] > 1
+        ok &= correcto
+        print(f"{'✅' if correcto else '❌'} Con {CONCURRENCIAS[-1]} clientes la ruta asíncrona atiende "
+              f"{mejor[-1]:.1f}x peticiones por segundo")
+
+    with httpx.Client(base_url=f"http://127.0.0.1:{PUERTO}", headers=cabeceras) as http:
+        a = http.get("/clientes/?limit=3")
+        b = http.get("/sync/clientes/?limit=3")
+        correcto = a.json() == b.json() and a.headers["X-Total-Count"] == b.headers["X-Total-Count"]
+        c = http.get("/contratos/7").json() == http.get("/sync/contratos/7").json()
+        d = http.get("/renovaciones/pendientes").json() == http.get("/sync/renovaciones/pendientes").json()
+        correcto = correcto and c and d
+        ok &= correcto
+        print(f"{'✅' if correcto else '❌'} Mismas respuestas y cabeceras de paginación por las dos rutas")
+    servidor.terminate()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
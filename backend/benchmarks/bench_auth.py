@@ -0,0 +1,163 @@
+"""
+Coste de autenticar cada petición (get_current_user en app/modules/auth/utils.py)
+Compara, por petición:
+  • antes: decodificar el JWT + SELECT del usuario por email (una ida a la base de datos)
+  • claims: token nuevo con id/rol/estado firmados (sin base de datos)
+  • caché: token sin claims o ya fuera de la ventana de claims (caché por email)
+y de punta a punta por HTTP (GET /ia/metricas, que no toca la base de datos por sí misma).
+Comprueba además que cambiar el rol o desactivar un usuario se nota en la siguiente petición.
+
+Uso:
+    python -m benchmarks.bench_auth
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_auth
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench_auth.db")
+os.environ.setdefault("GOOGLE_API_KEY", "stub")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--usuarios", type=int, default=5_000)
+    parser.add_argument("--peticiones", type=int, default=3_000)
+    args = parser.parse_args()
+
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from app.database import SessionLocal, engine, motor_async, cerrar_motor_async
+    from app.modules.auth import utils
+    from app.modules.crm import models
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    clave = utils.get_password_hash("bench")
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [
+            {"id": i, "email": f"user{i}@loviluz.es", "hashed_password": clave, "is_active": True,
+             "role": "admin" if i <= 2 else "comercial"}
+            for i in range(1, args.usuarios + 1)
+        ])
+
+    consultas = [0]
+    contar = lambda *a: consultas.__setitem__(0, consultas[0] + 1)
+    event.listen(engine, "before_cursor_execute", contar)
+    event.listen(motor_async().sync_engine, "before_cursor_execute", contar)
+    SesionAsync = async_sessionmaker(motor_async(), expire_on_commit=False)
+
+    def usuario_antes(token, db):
+        """get_current_user tal y como estaba: decodificar y consultar siempre"""
+        payload = utils.jwt.decode(token, utils.SECRET_KEY, algorithms=[utils.ALGORITHM])
+        return db.query(models.User).filter(models.User.email == payload["sub"]).first()
+
+    # get_current_user es async y, si tiene que leer el usuario, usa la sesión asíncrona
+    bucle = asyncio.new_event_loop()
+
+    def usuario_ahora(token, _db):
+        async def resolver():
+            async with SesionAsync() as db:
+                return await utils.get_current_user(token, db)
+        return bucle.run_until_complete(resolver())
+
+    def medir(funcion, tokens):
+        consultas[0] = 0
+        inicio = time.perf_counter()
+        for i in range(args.peticiones):
+            db = SessionLocal()  # Como get_db(): una sesión por petición
+            try:
+                funcion(tokens[i % len(tokens)], db)
+            finally:
+                db.close()
+        return (time.perf_counter() - inicio) / args.peticiones, consultas[0] / args.peticiones
+
+    db = SessionLocal()
+    usuarios = db.query(models.User).order_by(models.User.id).limit(200).all()
+    tokens_antiguos = [utils.create_access_token({"sub": u.email}) for u in usuarios]
+    tokens_claims = [utils.create_access_token(utils.claims_usuario(u)) for u in usuarios]
+    db.close()
+
+    utils.vaciar_cache_usuarios()
+    antes = medir(usuario_antes, tokens_antiguos)
+    claims = medir(usuario_ahora, tokens_claims)
+    utils.vaciar_cache_usuarios()
+    medir(usuario_ahora, tokens_antiguos)  # Llena la caché
+    cache = medir(usuario_ahora, tokens_antiguos)
+    print(f"🔐 get_current_user, {args.peticiones} peticiones sobre {len(usuarios)} usuarios ({engine.dialect.name})")
+    for nombre, (segundos, por_peticion) in (("antes", antes), ("claims", claims), ("caché", cache)):
+        print(f"   {nombre:<7} {segundos * 1e6:>8.1f} µs/petición, {por_peticion:.2f} consultas/petición "
+              f"({antes[0] / segundos:.1f}x)")
+
+    ok = claims[1] == 0 and cache[1] == 0
+    print(f"{'✅' if ok else '❌'} Con claims o caché no se consulta la base de datos")
+    bucle.run_until_complete(cerrar_motor_async())
+    bucle.close()
+    event.listen(motor_async().sync_engine, "before_cursor_execute", contar)  # El motor nuevo, el que usará la app
+
+    # --- Punta a punta por HTTP ---
+    from fastapi import Depends
+    from fastapi.testclient import TestClient
+    from app.database import get_db
+    from app.main import app, limiter
+
+    limiter.enabled = False
+    admin = {"Authorization": f"Bearer {tokens_claims[0]}"}
+    with TestClient(app) as cliente:
+        def http(cabeceras, n=1000):
+            consultas[0] = 0
+            inicio = time.perf_counter()
+            for _ in range(n):
+                respuesta = cliente.get("/ia/metricas", headers=cabeceras)
+            return (time.perf_counter() - inicio) / n, consultas[0] / n, respuesta.status_code
+
+        def antes_http(token: str = Depends(utils.oauth2_scheme), db=Depends(get_db)):
+            return usuario_antes(token, db)
+
+        app.dependency_overrides[utils.get_current_user] = antes_http
+        t_antes, q_antes, _ = http(admin)
+        del app.dependency_overrides[utils.get_current_user]
+        t_ahora, q_ahora, _ = http(admin)
+        print(f"🌐 GET /ia/metricas: antes {t_antes * 1000:.2f} ms ({q_antes:.1f} consultas), "
+              f"ahora {t_ahora * 1000:.2f} ms ({q_ahora:.1f} consultas)")
+
+        # --- Invalidación: el rol y la desactivación se notan en la siguiente petición ---
+        segundo_admin = {"Authorization": f"Bearer {tokens_claims[1]}"}
+        paso_1 = cliente.get("/ia/metricas", headers=segundo_admin).status_code == 200
+        cliente.put(f"/users/{usuarios[1].id}/role", json={"role": "comercial"}, headers=admin)
+        paso_2 = cliente.get("/ia/metricas", headers=segundo_admin).status_code == 403
+        correcto = paso_1 and paso_2
+        ok &= correcto
+        print(f"{'✅' if correcto else '❌'} Rol cambiado con un token emitido antes: 200 -> 403 al momento")
+
+        comercial = {"Authorization": f"Bearer {tokens_antiguos[5]}"}
+        paso_1 = cliente.get("/jobs/", headers=comercial).status_code == 200  # Queda en caché
+        db = SessionLocal()
+        db.get(models.User, usuarios[5].id).is_active = False
+        db.commit()
+        db.close()
+        paso_2 = cliente.get("/jobs/", headers=comercial).status_code == 400
+        correcto = paso_1 and paso_2
+        ok &= correcto
+        print(f"{'✅' if correcto else '❌'} Usuario desactivado estando en caché: 200 -> 400 al momento")
+
+        # Un token viejo no vale por sus claims: pasa a caché/base de datos
+        utils.vaciar_cache_usuarios()
+        viejo = utils.jwt.encode({**utils.claims_usuario(usuarios[6]), "iat": int(time.time()) - utils.AUTH_CACHE_TTL - 5,
+                                  "exp": int(time.time()) + 600}, utils.SECRET_KEY, algorithm=utils.ALGORITHM)
+        consultas[0] = 0
+        cliente.get("/jobs/", headers={"Authorization": f"Bearer {viejo}"})
+        consulta_usuario = consultas[0]
+        consultas[0] = 0
+        cliente.get("/jobs/", headers={"Authorization": f"Bearer {tokens_claims[6]}"})
+        correcto = consulta_usuario == consultas[0] + 1
+        ok &= correcto
+        print(f"{'✅' if correcto else '❌'} Claims fuera de la ventana de {utils.AUTH_CACHE_TTL}s: "
+              f"se vuelve a leer el usuario ({consulta_usuario} vs {consultas[0]} consultas)")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Caché del asistente text-to-SQL (/ia/consultar)
+Simula al equipo haciendo las mismas preguntas con distinta redacción (tildes,
+mayúsculas, signos, "por favor") y, cada cierto número de preguntas, una escritura
+en facturas. Con Gemini sustituido por un stub (LATENCIA segundos por llamada) cuenta
+las llamadas al modelo y el tiempo frente a no tener caché (2 llamadas por pregunta),
+y muestra las métricas de /ia/cache.
+
+Uso:
+    python -m benchmarks.bench_cache_ia
+    python -m benchmarks.bench_cache_ia --preguntas 1000 --escritura-cada 100
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench_cache_ia.db")
+os.environ.setdefault("GOOGLE_API_KEY", "stub")
+
+PREGUNTAS = [
+    ("¿Cuántos clientes hay?", "SELECT COUNT(*) FROM clientes"),
+    ("¿Cuántas facturas pendientes tenemos?", "SELECT COUNT(*) FROM facturas WHERE estado = 'Pendiente'"),
+    ("Importe total facturado", "SELECT SUM(monto) FROM facturas"),
+    ("¿Qué clientes son de Madrid?", "SELECT nombre FROM clientes WHERE provincia = 'Madrid'"),
+    ("Contratos activos por comercializadora",
+     "SELECT comercializadora, COUNT(*) FROM contratos WHERE estado = 'Activo' GROUP BY comercializadora"),
+    ("¿Cuántos puntos de suministro hay?", "SELECT COUNT(*) FROM puntos_suministro"),
+    ("Factura más alta", "SELECT MAX(monto) FROM facturas"),
+    ("¿Cuántos clientes son PYME?", "SELECT COUNT(*) FROM clientes WHERE tipo_cliente = 'PYME'"),
+]
+VARIANTES = [
+    lambda p: p,
+    lambda p: p.lower(),
+    lambda p: p.upper(),
+    lambda p: f"Hola, {p.lower()} por favor",
+    lambda p: f"dime {p.replace('¿', '').replace('?', '')}",
+    lambda p: p.replace("á", "a").replace("é", "e").replace("í", "i").replace("ó", "o").replace("ú", "u"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--preguntas", type=int, default=400)
+    parser.add_argument("--latencia", type=float, default=0.05, help="Segundos por llamada al modelo simulado")
+    parser.add_argument("--escritura-cada", type=int, default=50)
+    args = parser.parse_args()
+
+    from fastapi.testclient import TestClient
+    from app.main import app, limiter
+    from app.database import SessionLocal, engine
+    from app.modules.auth.utils import get_admin_user
+    from app.modules.crm import models
+    from app import ia_service
+    from app.ia_cache import cache_ia, normalizar_pregunta
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    limiter.enabled = False
+    app.dependency_overrides[get_admin_user] = lambda: None
+    sql_de = {normalizar_pregunta(p): sql for p, sql in PREGUNTAS}
+    llamadas = {"sql": 0, "respuesta": 0}
+
+    async def stub(prompt, max_tokens, timeout):
+        await asyncio.sleep(args.latencia)
+        if prompt.startswith("Genera solo SQL"):
+            llamadas["sql"] += 1
+            pregunta = prompt[len("Genera solo SQL (SQLite) para: "):prompt.rindex(". Schema:")]
+            return f"```sql\n{sql_de[normalizar_pregunta(pregunta)]}\n```"
+        llamadas["respuesta"] += 1
+        return "Respuesta en lenguaje natural"
+
+    ia_service.PROVEEDORES[ia_service.GEMINI].llamar = stub
+    ok = True
+
+    distintas = {normalizar_pregunta(v(p)) for p, _ in PREGUNTAS for v in VARIANTES}
+    correcto = len(distintas) == len(PREGUNTAS)
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} {len(PREGUNTAS) * len(VARIANTES)} redacciones -> {len(distintas)} preguntas normalizadas")
+
+    rnd = random.Random(16)
+    pesos = [1 / (i + 1) for i in range(len(PREGUNTAS))]  # Unas pocas preguntas concentran casi todo
+    cache_ia.vaciar()
+    with TestClient(app) as cliente:
+        inicio = time.perf_counter()
+        escrituras = 0
+        for i in range(1, args.preguntas + 1):
+            pregunta, _ = rnd.choices(PREGUNTAS, pesos)[0]
+            respuesta = cliente.post("/ia/consultar", json={"prompt": rnd.choice(VARIANTES)(pregunta)}).json()
+            ok &= not respuesta["reply"].startswith("No pude")
+            if i % args.escritura_cada == 0:
+                db = SessionLocal()
+                db.add(models.Factura(monto=10, concepto="bench", estado="Pendiente"))
+                db.commit()
+                db.close()
+                escrituras += 1
+        segundos = time.perf_counter() - inicio
+        estadisticas = cliente.get("/ia/cache").json()
+
+    total = llamadas["sql"] + llamadas["respuesta"]
+    sin_cache = 2 * args.preguntas
+    print(f"📊 {args.preguntas} preguntas, {escrituras} escrituras intercaladas, modelo a {args.latencia * 1000:.0f} ms/llamada")
+    print(f"   Llamadas a Gemini: {total} ({llamadas['sql']} SQL + {llamadas['respuesta']} respuestas) "
+          f"frente a {sin_cache} sin caché ({1 - total / sin_cache:.0%} menos)")
+    print(f"   Tiempo: {segundos:.2f}s (sin caché ≥ {sin_cache * args.latencia:.2f}s solo esperando al modelo)")
+    for nivel in ("sql", "respuestas"):
+        e = estadisticas[nivel]
+        print(f"   Caché {nivel:<10}: {e['aciertos']:>4} aciertos / {e['fallos']:>4} fallos "
+              f"(tasa {e['tasa_aciertos']:.0%}), {e['entradas']} entradas, {e['expulsiones']} expulsiones")
+
+    # El SQL solo se pide una vez por pregunta distinta; las respuestas, una vez por pregunta y sello de datos
+    correcto = llamadas["sql"] == len(PREGUNTAS) and llamadas["respuesta"] <= len(PREGUNTAS) * (escrituras + 1)
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} SQL generado una vez por pregunta; respuestas renovadas tras cada escritura")
+
+    from app.ia_cache import CacheTextoSQL
+    pequena = CacheTextoSQL(max_sql=4)
+    for i in range(10):
+        pequena.guardar_sql(f"pregunta {i}", "v", "SELECT 1")
+        pequena.sql("pregunta 0", "v")  # La más usada no debe salir
+    e = pequena.estadisticas()["sql"]
+    correcto = e["entradas"] == 4 and e["expulsiones"] == 6 and pequena.sql("pregunta 0", "v") is not None
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} LRU de 4 entradas con 10 preguntas: {e['expulsiones']} expulsiones, "
+          f"la más usada se conserva")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
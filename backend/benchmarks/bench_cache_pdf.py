@@ -0,0 +1,55 @@
+"""
+Caché de PDFs de facturas: pintar en cada descarga vs servir el fichero cacheado
+Comprueba también que la caché respeta su tamaño máximo (LRU) y que un cambio en
+los datos genera otra huella.
+
+Uso:
+    python -m benchmarks.bench_cache_pdf
+"""
+import os
+import sys
+import tempfile
+
+from benchmarks.bench_pdf_lote import facturas_sinteticas
+from benchmarks.comun import medir
+
+
+def main():
+    from app.modules.crm.cache_pdf import CachePDF, huella_factura
+    from app.modules.crm.pdf_generator import renderizar_facturas
+
+    datos = facturas_sinteticas(200)
+    cache = CachePDF(carpeta=tempfile.mkdtemp(prefix="bench_cache_pdf_"), tamano_maximo=100 * 1024)
+    ok = True
+
+    mediana_render, p95_render = medir(lambda: renderizar_facturas([datos[0]]), repeticiones=50)
+    cache.obtener(datos[0])
+
+    def descarga_cacheada():
+        ruta, _ = cache.obtener(datos[0])
+        with open(ruta, "rb") as f:  # Lo que haría FileResponse
+            f.read()
+
+    mediana_cache, p95_cache = medir(descarga_cacheada, repeticiones=200)
+    print("📊 Descarga de un PDF de factura")
+    print(f"   pintar cada vez : mediana {mediana_render:.2f} ms, p95 {p95_render:.2f} ms")
+    print(f"   desde la caché  : mediana {mediana_cache:.3f} ms, p95 {p95_cache:.3f} ms "
+          f"(x{mediana_render / mediana_cache:.0f})")
+
+    for d in datos:
+        cache.obtener(d)
+    en_disco = sum(os.path.getsize(os.path.join(r, f)) for r, _, fs in os.walk(cache.carpeta) for f in fs)
+    correcto = en_disco <= cache.tamano_maximo and cache._total == en_disco
+    ok &= correcto
+    print(f"   {'✅' if correcto else '❌'} LRU: {len(datos)} facturas -> {len(cache._entradas)} en caché, "
+          f"{en_disco / 1024:.0f} KB (máximo {cache.tamano_maximo / 1024:.0f} KB)")
+
+    cambiada = dict(datos[0], cliente_telefono="699999999")
+    correcto = huella_factura(cambiada) != huella_factura(datos[0])
+    ok &= correcto
+    print(f"   {'✅' if correcto else '❌'} un cambio en el cliente cambia la huella (y el ETag)")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Conector Dynamics 365 contra un servidor OData falso (local)
+Levanta un servidor HTTP que imita /api/data/v9.2/<entidad> con paginación por
+@odata.nextLink y latencia configurable, y comprueba/mide:
+  • que iter_records devuelve todos los registros, en orden y sin duplicados
+  • cuántas conexiones TCP y peticiones de token se usan (keep-alive + caché)
+  • el tiempo total en serie vs con precarga de páginas, con un consumidor lento
+
+Uso:
+    python -m benchmarks.bench_dynamics_odata
+    python -m benchmarks.bench_dynamics_odata --registros 50000 --latencia 0.08
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class ServidorODataFalso(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, registros: int, latencia: float):
+        super().__init__(("127.0.0.1", 0), ManejadorOData)
+        self.registros = registros
+        self.latencia = latencia
+        self.conexiones = 0
+        self.peticiones = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class ManejadorOData(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Necesario para keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.conexiones += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.peticiones += 1
+        time.sleep(self.server.latencia)
+        partes = urlparse(self.path)
+        entidad = partes.path.rsplit("/", 1)[-1]
+        query = parse_qs(partes.query)
+        inicio = int(query.get("$skiptoken", ["0"])[0])
+        tamano = 5000
+        prefer = self.headers.get("Prefer", "")
+        if "odata.maxpagesize=" in prefer:
+            tamano = int(prefer.split("odata.maxpagesize=")[1].split(",")[0])
+
+        fin = min(inicio + tamano, self.server.registros)
+        cuerpo = {"value": [
+            {f"{entidad[:-1]}id": f"{i:08d}", "name": f"Cuenta {i}", "emailaddress1": f"c{i}@mail.es"}
+            for i in range(inicio, fin)
+        ]}
+        if fin < self.server.registros:
+            cuerpo["@odata.nextLink"] = f"{self.server.url}/api/data/v9.2/{entidad}?$skiptoken={fin}"
+
+        datos = json.dumps(cuerpo).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+
+def crear_conector(url_servidor: str):
+    os.environ.update({
+        "DYNAMICS_CLIENT_ID": "cliente", "DYNAMICS_CLIENT_SECRET": "secreto",
+        "DYNAMICS_TENANT_ID": "tenant", "DYNAMICS_URL": url_servidor,
+    })
+    from app.modules.dynamics365.connector import Dynamics365Connector
+
+    class ConectorLocal(Dynamics365Connector):
+        """Igual que el real, pero el token lo 'emite' el benchmark en vez de Azure AD"""
+        peticiones_token = 0
+
+        def _solicitar_token(self):
+            ConectorLocal.peticiones_token += 1
+            return {"access_token": "token-falso", "expires_in": 3600}
+
+    return ConectorLocal()
+
+
+def recorrer(conector, prefetch: int, tamano_pagina: int, trabajo_por_pagina: float):
+    vistos, inicio = [], time.perf_counter()
+    for i, registro in enumerate(conector.iter_records("accounts", page_size=tamano_pagina, prefetch=prefetch)):
+        vistos.append(registro["accountid"])
+        if (i + 1) % tamano_pagina == 0:
+            time.sleep(trabajo_por_pagina)  # Simula el upsert de la página en la base local
+    return vistos, time.perf_counter() - inicio
+
+
+def main():
+    import logging
+    logging.disable(logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--registros", type=int, default=20_000)
+    parser.add_argument("--pagina", type=int, default=1_000)
+    parser.add_argument("--latencia", type=float, default=0.05, help="Segundos por página en el servidor")
+    parser.add_argument("--trabajo", type=float, default=0.05, help="Segundos de proceso por página en el cliente")
+    args = parser.parse_args()
+
+    servidor = ServidorODataFalso(args.registros, args.latencia)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    conector = crear_conector(servidor.url)
+    esperados = [f"{i:08d}" for i in range(args.registros)]
+
+    print(f"📊 {args.registros} registros, páginas de {args.pagina}, "
+          f"latencia {args.latencia * 1000:.0f} ms, proceso {args.trabajo * 1000:.0f} ms por página")
+    ok = True
+    for prefetch in (0, 2):
+        servidor.conexiones = servidor.peticiones = 0
+        vistos, segundos = recorrer(conector, prefetch, args.pagina, args.trabajo)
+        correcto = vistos == esperados
+        ok &= correcto
+        modo = "en serie" if prefetch == 0 else f"precarga {prefetch}"
+        print(f"   {'✅' if correcto else '❌'} {modo:<11}: {segundos:6.2f}s | "
+              f"{servidor.peticiones} peticiones en {servidor.conexiones} conexión/es TCP nuevas")
+
+    print(f"   🔑 Peticiones de token: {conector.peticiones_token}")
+    ok &= conector.peticiones_token == 1
+    servidor.shutdown()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
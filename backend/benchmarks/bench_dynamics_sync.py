@@ -0,0 +1,203 @@
+"""
+Sincronización Dynamics 365 full vs delta contra un servidor OData falso (local)
+El servidor imita change tracking: con "Prefer: odata.track-changes" la última
+página trae un @odata.deltaLink, y ese enlace devuelve solo lo cambiado o borrado
+(como $deletedEntity) desde entonces. Comprueba/mide:
+  • que una carga full crea todos los clientes y guarda el estado
+  • que el delta solo descarga y aplica los cambios (altas, modificaciones, bajas)
+  • que sin change tracking se usa la marca de agua de modifiedon
+  • el tiempo full vs delta
+
+Uso:
+    python -m benchmarks.bench_dynamics_sync
+    python -m benchmarks.bench_dynamics_sync --registros 50000 --cambios 500
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench_dynamics_sync.db")
+
+from benchmarks.bench_dynamics_odata import ServidorODataFalso, crear_conector
+
+
+class ServidorConCambios(ServidorODataFalso):
+    def __init__(self, registros: int, latencia: float, change_tracking: bool = True):
+        super().__init__(0, latencia)
+        self.RequestHandlerClass = ManejadorConCambios
+        self.change_tracking = change_tracking
+        self.version = 0
+        self.reloj = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        self.cuentas = {}  # accountid -> (versión, registro)
+        self.borrados = {}  # accountid -> versión
+        self.registros_enviados = 0
+        for i in range(registros):
+            self.guardar(f"{i:08d}", f"Cuenta {i}")
+
+    def guardar(self, id_: str, nombre: str, statecode: int = 0):
+        self.version += 1
+        self.reloj += timedelta(seconds=1)
+        self.cuentas[id_] = (self.version, {
+            "accountid": id_, "name": nombre, "accountnumber": f"B{id_}",
+            "emailaddress1": f"c{id_}@mail.es", "telephone1": "600000000",
+            "statecode": statecode, "modifiedon": self.reloj.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        })
+        self.borrados.pop(id_, None)
+
+    def borrar(self, id_: str):
+        self.version += 1
+        self.cuentas.pop(id_)
+        self.borrados[id_] = self.version
+
+
+class ManejadorConCambios(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        servidor = self.server
+        servidor.peticiones += 1
+        time.sleep(servidor.latencia)
+        partes = urlparse(self.path)
+        entidad = partes.path.rsplit("/", 1)[-1]
+        query = parse_qs(partes.query)
+        prefer = self.headers.get("Prefer", "")
+        tamano = 5000
+        if "odata.maxpagesize=" in prefer:
+            tamano = int(prefer.split("odata.maxpagesize=")[1].split(",")[0])
+
+        if entidad != "accounts":
+            return self.responder({"value": []})
+        if "$deltatoken" in query:
+            desde = int(query["$deltatoken"][0])
+            valores = [r for v, r in servidor.cuentas.values() if v > desde]
+            valores += [
+                {"@odata.context": f"{servidor.url}/api/data/v9.2/$metadata#accounts/$deletedEntity", "id": id_}
+                for id_, v in servidor.borrados.items() if v > desde
+            ]
+            servidor.registros_enviados += len(valores)
+            return self.responder({"value": valores, "@odata.deltaLink": self.delta_link()})
+
+        filas = [r for _, r in sorted(servidor.cuentas.values(), key=lambda vr: vr[1]["accountid"])]
+        filtro = query.get("$filter", [""])[0]
+        if filtro.startswith("modifiedon ge "):
+            marca = filtro.split("modifiedon ge ")[1]
+            filas = [r for r in filas if r["modifiedon"] >= marca]
+        inicio = int(query.get("$skiptoken", ["0"])[0])
+        fin = min(inicio + tamano, len(filas))
+        cuerpo = {"value": filas[inicio:fin]}
+        servidor.registros_enviados += fin - inicio
+        if fin < len(filas):
+            siguiente = dict((k, v[0]) for k, v in query.items())
+            siguiente["$skiptoken"] = str(fin)
+            cuerpo["@odata.nextLink"] = f"{servidor.url}/api/data/v9.2/accounts?" + \
+                "&".join(f"{k}={v}" for k, v in siguiente.items())
+        elif "odata.track-changes" in prefer and servidor.change_tracking:
+            cuerpo["@odata.deltaLink"] = self.delta_link()
+        self.responder(cuerpo)
+
+    def delta_link(self):
+        return f"{self.server.url}/api/data/v9.2/accounts?$deltatoken={self.server.version}"
+
+    def responder(self, cuerpo):
+        datos = json.dumps(cuerpo).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+
+def aplicar_cambios(servidor: ServidorConCambios, cambios: int):
+    """Un tercio altas, un tercio modificaciones, un tercio bajas (borrado o statecode=1)"""
+    ids = sorted(servidor.cuentas)
+    for i in range(cambios // 3):
+        servidor.guardar(f"N{i:07d}", f"Nueva {i}")
+        servidor.guardar(ids[i], f"Cuenta {ids[i]} (modificada)")
+        if i % 2:
+            servidor.borrar(ids[-(i + 1)])
+        else:
+            servidor.guardar(ids[-(i + 1)], f"Cuenta {ids[-(i + 1)]}", statecode=1)
+
+
+def ejecutar(servidor, modo: str):
+    from app.database import SessionLocal
+    from app.modules.dynamics365.sync import sincronizar_entidad
+    servidor.registros_enviados = 0
+    db = SessionLocal()
+    try:
+        resultado = sincronizar_entidad(conector, db, "accounts", modo)
+    finally:
+        db.close()
+    return resultado, servidor.registros_enviados
+
+
+def contar_clientes():
+    from app.database import SessionLocal
+    from app.modules.crm import models
+    db = SessionLocal()
+    try:
+        activos = db.query(models.Cliente).filter(models.Cliente.is_active == True).count()
+        return db.query(models.Cliente).count(), activos
+    finally:
+        db.close()
+
+
+def main():
+    global conector
+    import logging
+    logging.disable(logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--registros", type=int, default=20_000)
+    parser.add_argument("--cambios", type=int, default=300)
+    parser.add_argument("--latencia", type=float, default=0.02)
+    args = parser.parse_args()
+
+    from app.database import Base, engine
+    from app.modules.crm import models  # noqa: F401 (registra las tablas en Base)
+
+    ok = True
+    print(f"📊 {args.registros} cuentas, {args.cambios // 3 * 3} cambios entre ejecuciones")
+    for change_tracking in (True, False):
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        servidor = ServidorConCambios(args.registros, args.latencia, change_tracking)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        conector = crear_conector(servidor.url)
+        print(f"   {'change tracking' if change_tracking else 'marca de agua modifiedon'}:")
+
+        full, enviados_full = ejecutar(servidor, "full")
+        total, _ = contar_clientes()
+        correcto = full.nuevos == args.registros == total
+        ok &= correcto
+        print(f"      {'✅' if correcto else '❌'} full : {full.segundos:6.2f}s | {enviados_full} registros descargados | "
+              f"{full.nuevos} nuevos")
+
+        aplicar_cambios(servidor, args.cambios)
+        esperado_total = len(servidor.cuentas) + len(servidor.borrados)
+        esperado_activos = sum(1 for _, r in servidor.cuentas.values() if r["statecode"] == 0)
+        delta, enviados_delta = ejecutar(servidor, "delta")
+        total, activos = contar_clientes()
+        # Sin change tracking los borrados no llegan: solo se detectan las bajas por statecode
+        if not change_tracking:
+            esperado_activos += len(servidor.borrados)
+        correcto = (total, activos) == (esperado_total, esperado_activos) and enviados_delta < enviados_full
+        ok &= correcto
+        print(f"      {'✅' if correcto else '❌'} delta: {delta.segundos:6.2f}s | {enviados_delta} registros descargados | "
+              f"{delta.nuevos} nuevos, {delta.actualizados} actualizados, {delta.desactivados} desactivados")
+        servidor.shutdown()
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
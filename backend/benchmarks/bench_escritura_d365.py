@@ -0,0 +1,227 @@
+"""
+Cola de escritura ERP -> Dynamics 365 contra un servidor OData $batch falso (local)
+Comprueba/mide:
+  • latencia de un alta de cliente + encolado con Dynamics caído (no debe depender de él)
+  • agrupación: N clientes modificados M veces -> N operaciones en el $batch
+  • reintentos: el servidor responde 503 a los primeros $batch y luego acepta
+  • POST -> dynamics_id guardado a partir de OData-EntityId; los siguientes cambios van por PATCH
+  • un contrato espera a que su cliente exista en Dynamics para enlazarlo
+  • dos trabajadores que reservan a la vez no se quedan con las mismas filas
+
+Uso:
+    python -m benchmarks.bench_escritura_d365
+    python -m benchmarks.bench_escritura_d365 --clientes 2000 --cambios 5
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import date
+from http.server import BaseHTTPRequestHandler
+from sqlalchemy import event
+
+os.environ.setdefault("D365_ESCRITURA", "1")
+
+from benchmarks.bench_dynamics_odata import ServidorODataFalso, crear_conector
+from benchmarks.comun import crear_motor, medir
+
+
+class ServidorBatch(ServidorODataFalso):
+    def __init__(self, fallos_iniciales: int = 0):
+        super().__init__(0, 0)
+        self.RequestHandlerClass = ManejadorBatch
+        self.fallos_pendientes = fallos_iniciales
+        self.caido = False
+        self.batches = 0
+        self.operaciones = []  # (método, url, cuerpo)
+
+
+class ManejadorBatch(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        servidor = self.server
+        cuerpo = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        if servidor.caido or servidor.fallos_pendientes > 0:
+            servidor.fallos_pendientes -= 1
+            return self.responder(503, "text/plain", b"Service Unavailable")
+        servidor.batches += 1
+
+        boundary = self.headers["Content-Type"].split("boundary=")[1]
+        respuesta = []
+        for parte in cuerpo.split(f"--{boundary}")[1:]:
+            if parte.startswith("--"):
+                break
+            peticion = parte.split("\r\n\r\n", 1)[1]
+            linea, _, resto = peticion.partition("\r\n")
+            metodo, url, _ = linea.split(" ")
+            servidor.operaciones.append((metodo, url, resto.split("\r\n\r\n", 1)[1].strip()))
+            cabeceras = ""
+            if metodo == "POST":
+                cabeceras = f"OData-EntityId: {url}({uuid.uuid4()})\r\n"
+            respuesta.append(
+                "--batchresponse_1\r\nContent-Type: application/http\r\nContent-Transfer-Encoding: binary\r\n\r\n"
+                f"HTTP/1.1 204 No Content\r\nOData-Version: 4.0\r\n{cabeceras}\r\n\r\n"
+            )
+        respuesta.append("--batchresponse_1--\r\n")
+        self.responder(200, "multipart/mixed; boundary=batchresponse_1", "".join(respuesta).encode())
+
+    def responder(self, estado, tipo, datos):
+        self.send_response(estado)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+
+def vaciar_cola(SessionLocal, conector, procesar_pendientes):
+    """Procesa hasta que no quede nada vencido; cuenta las vueltas"""
+    vueltas = 0
+    db = SessionLocal()
+    try:
+        while procesar_pendientes(db, conector).filas:
+            vueltas += 1
+    finally:
+        db.close()
+    return vueltas
+
+
+def main():
+    import logging
+    logging.disable(logging.WARNING)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clientes", type=int, default=500)
+    parser.add_argument("--cambios", type=int, default=5, help="Modificaciones por cliente antes de enviar")
+    args = parser.parse_args()
+
+    servidor = ServidorBatch(fallos_iniciales=2)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    conector = crear_conector(servidor.url)  # También fija DYNAMICS_CLIENT_ID: la escritura queda activada
+
+    from app.modules.crm import models
+    from app.modules.dynamics365 import escritura
+    from app.modules.dynamics365.escritura import encolar_cambio, procesar_pendientes
+    escritura.calcular_espera = lambda intentos: escritura.timedelta(0)  # Sin esperas entre reintentos
+    engine, SessionLocal = crear_motor()
+    ok = True
+
+    # 1. Latencia del endpoint con Dynamics caído: solo INSERT + encolado en la misma transacción
+    servidor.caido = True
+    contador = iter(range(10**9))
+
+    def alta_cliente():
+        db = SessionLocal()
+        i = next(contador)
+        cliente = models.Cliente(nombre=f"Cliente {i}", nif_cif=f"X{i:08d}", email=f"c{i}@mail.es")
+        db.add(cliente)
+        encolar_cambio(db, cliente, "crear")
+        db.commit()
+        db.close()
+
+    mediana, p95 = medir(alta_cliente, repeticiones=50)
+    print(f"📊 Alta de cliente + encolado con Dynamics caído: mediana {mediana:.1f} ms, p95 {p95:.1f} ms")
+    servidor.caido = False
+    vaciar_cola(SessionLocal, conector, procesar_pendientes)
+    servidor.operaciones.clear()
+    servidor.batches = 0
+
+    # 2. Agrupación + reintentos
+    servidor.fallos_pendientes = 2
+    db = SessionLocal()
+    clientes = [models.Cliente(nombre=f"Nuevo {i}", nif_cif=f"N{i:08d}", email=f"n{i}@mail.es")
+                for i in range(args.clientes)]
+    db.add_all(clientes)
+    db.flush()
+    for cliente in clientes:
+        encolar_cambio(db, cliente, "crear")
+    for vuelta in range(args.cambios - 1):
+        for cliente in clientes:
+            cliente.telefono = f"6000000{vuelta:02d}"
+            encolar_cambio(db, cliente)
+    db.commit()
+    filas = db.query(models.CambioPendienteD365).filter(models.CambioPendienteD365.estado == "Pendiente").count()
+    db.close()
+
+    inicio = time.perf_counter()
+    vaciar_cola(SessionLocal, conector, procesar_pendientes)
+    segundos = time.perf_counter() - inicio
+    db = SessionLocal()
+    pendientes = db.query(models.CambioPendienteD365).filter(models.CambioPendienteD365.estado != "Enviado").count()
+    sin_id = db.query(models.Cliente).filter(models.Cliente.nif_cif.like("N%"), models.Cliente.dynamics_id.is_(None)).count()
+    db.close()
+    posts = sum(1 for m, _, _ in servidor.operaciones if m == "POST")
+    correcto = posts == len(servidor.operaciones) == args.clientes and pendientes == 0 and sin_id == 0
+    ok &= correcto
+    print(f"   {'✅' if correcto else '❌'} {filas} cambios en cola -> {len(servidor.operaciones)} operaciones en "
+          f"{servidor.batches} $batch ({segundos:.2f}s, tras 2 respuestas 503)")
+
+    # 3. Un cambio posterior va por PATCH al id que devolvió Dynamics
+    servidor.operaciones.clear()
+    db = SessionLocal()
+    cliente = db.query(models.Cliente).filter(models.Cliente.nif_cif == "N00000000").one()
+    cliente.nombre = "Nuevo 0 (renombrado)"
+    encolar_cambio(db, cliente)
+
+    # 4. Contrato de un cliente que aún no está en Dynamics: espera al cliente
+    otro = models.Cliente(nombre="Con contrato", nif_cif="C00000001", email="cc@mail.es")
+    db.add(otro)
+    encolar_cambio(db, otro, "crear")
+    punto = models.PuntoSuministro(cups="ES0000000000000001XX", direccion="Calle 1", codigo_postal="28001",
+                                   provincia="Madrid", tarifa_acceso="2.0TD", cliente=otro)
+    contrato = models.Contrato(comercializadora="Loviluz", producto="Fijo", fecha_inicio=date(2025, 1, 1),
+                               punto_suministro=punto)
+    db.add(contrato)
+    db.flush()
+    encolar_cambio(db, contrato, "crear")
+    db.commit()
+    db.close()
+    vaciar_cola(SessionLocal, conector, procesar_pendientes)
+    metodos = [(m, u.rsplit("/", 1)[-1].split("(")[0]) for m, u, _ in servidor.operaciones]
+    patch = next((u for m, u, _ in servidor.operaciones if m == "PATCH"), "")
+    bind_contrato = next((c for m, u, c in servidor.operaciones if u.endswith("/contracts")), "")
+    correcto = ("PATCH", "accounts") in metodos and ("POST", "contracts") in metodos \
+        and "customerid_account@odata.bind" in bind_contrato and patch.endswith(")")
+    ok &= correcto
+    print(f"   {'✅' if correcto else '❌'} PATCH tras el alta y contrato enlazado a su cuenta: {metodos}")
+
+    # 5. Carrera entre dos trabajadores: B reserva y confirma entre las dos consultas de A
+    # (claves pendientes y filas); A no debe quedarse con las filas que ya reservó B
+    db = SessionLocal()
+    for cliente in db.query(models.Cliente).filter(models.Cliente.nif_cif.like("N%")).limit(20):
+        cliente.telefono = "611111111"
+        encolar_cambio(db, cliente)
+    db.commit()
+    db.close()
+    reservas_b = {}
+
+    def reserva_de_b(conn, cursor, sql, *args):
+        if not reservas_b and sql.startswith("SELECT") and "FROM cola_dynamics365" in sql and "GROUP BY" not in sql:
+            reservas_b[None] = None  # Solo una vez (las consultas de B también pasan por aquí)
+            otra = SessionLocal()
+            reservas_b.update(escritura._reservar(otra, escritura.TAMANO_LOTE))
+            otra.close()
+
+    event.listen(engine, "before_cursor_execute", reserva_de_b)
+    db = SessionLocal()
+    reservas_a = escritura._reservar(db, escritura.TAMANO_LOTE)
+    db.close()
+    event.remove(engine, "before_cursor_execute", reserva_de_b)
+    del reservas_b[None]
+    comunes = set(reservas_a) & set(reservas_b)
+    correcto = len(reservas_b) == 20 and not comunes
+    ok &= correcto
+    print(f"   {'✅' if correcto else '❌'} Reserva concurrente: B se queda {len(reservas_b)} registros, "
+          f"A {len(reservas_a)}, en común {len(comunes)}")
+
+    servidor.shutdown()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
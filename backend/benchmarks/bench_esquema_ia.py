@@ -0,0 +1,165 @@
+"""
+Esquema en el prompt de /ia/consultar y reparación del SQL (app/ia_esquema.py)
+Gemini se sustituye por un stub que se comporta como un modelo que no ve la base:
+si el esquema del prompt trae las columnas (y valores) que necesita la pregunta
+escribe el SQL correcto; si no, adivina nombres plausibles (importe, status, tipo...)
+que fallan con "no such column". Con el error devuelto (reparación) acierta solo si el
+prompt de reparación trae el esquema. Dos escenarios sobre las mismas preguntas:
+  • solo tablas: el prompt de antes ("Tablas: clientes, contratos, ...")
+  • esquema: columnas, claves foráneas y valores de ejemplo precalculados
+Muestra preguntas respondidas, llamadas al modelo por respuesta y reparaciones
+(las métricas de /ia/metricas), y lo que cuesta el esquema precalculado frente a
+calcularlo en cada pregunta.
+
+Uso:
+    python -m benchmarks.bench_esquema_ia
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench_esquema_ia.db")
+os.environ.setdefault("GOOGLE_API_KEY", "stub")
+
+# (clave en la pregunta, lo que el esquema debe mostrar, SQL correcto, SQL adivinado sin ver columnas)
+PREGUNTAS = [
+    ("clientes hay", [], "SELECT COUNT(*) FROM clientes", "SELECT COUNT(*) FROM clientes"),
+    ("facturas pendientes", ["estado texto", "'Pendiente'"],
+     "SELECT COUNT(*) FROM facturas WHERE estado = 'Pendiente'",
+     "SELECT COUNT(*) FROM facturas WHERE status = 'pending'"),
+    ("importe total", ["monto num"], "SELECT SUM(monto) FROM facturas", "SELECT SUM(importe) FROM facturas"),
+    ("clientes por tipo", ["tipo_cliente"],
+     "SELECT tipo_cliente, COUNT(*) FROM clientes GROUP BY tipo_cliente",
+     "SELECT tipo, COUNT(*) FROM clientes GROUP BY tipo"),
+    ("contratos por comercializadora", ["comercializadora"],
+     "SELECT comercializadora, COUNT(*) FROM contratos GROUP BY comercializadora",
+     "SELECT compania, COUNT(*) FROM contratos GROUP BY compania"),
+    ("facturado en madrid", ["cliente_id int FK→clientes.id", "'Madrid'"],
+     "SELECT SUM(f.monto) FROM facturas f JOIN clientes c ON c.id = f.cliente_id WHERE c.provincia = 'Madrid'",
+     "SELECT SUM(f.total) FROM facturas f JOIN clientes c ON c.id = f.id_cliente WHERE c.provincia = 'Madrid'"),
+    ("tarifas de acceso", ["tarifa_acceso"],
+     "SELECT tarifa_acceso, COUNT(*) FROM puntos_suministro GROUP BY tarifa_acceso",
+     "SELECT tarifa, COUNT(*) FROM puntos_suministro GROUP BY tarifa"),
+    ("contratos activos", ["'Activo'"],
+     "SELECT COUNT(*) FROM contratos WHERE estado = 'Activo'",
+     "SELECT COUNT(*) FROM contratos WHERE activo = 1"),
+]
+
+
+def main():
+    from fastapi.testclient import TestClient
+    import app.main as main_app
+    from app.database import engine
+    from app.modules.auth.utils import get_admin_user
+    from app.modules.crm import models
+    from app import ia_service, ia_esquema
+    from app.ia_cache import cache_ia, version_esquema
+    from app.ia_esquema import EsquemaIA, esquema_ia, metricas_ia, olvidar_esquema
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(models.Cliente.__table__.insert(), [
+            {"nombre": f"Cliente {i}", "nif_cif": f"{i:08d}X", "provincia": ("Madrid", "Sevilla", "Valencia")[i % 3],
+             "tipo_cliente": ("PYME", "Residencial")[i % 2]} for i in range(1, 301)
+        ])
+        conn.execute(models.PuntoSuministro.__table__.insert(), [
+            {"cups": f"ES{i:020d}", "tarifa_acceso": ("2.0TD", "3.0TD")[i % 2], "cliente_id": i} for i in range(1, 301)
+        ])
+        conn.execute(models.Contrato.__table__.insert(), [
+            {"comercializadora": ("Loviluz", "Iberdrola", "Endesa")[i % 3], "estado": ("Activo", "Borrador")[i % 2],
+             "punto_suministro_id": i} for i in range(1, 301)
+        ])
+        conn.execute(models.Factura.__table__.insert(), [
+            {"cliente_id": i % 300 + 1, "monto": i % 90, "concepto": "Luz", "estado": ("Pendiente", "Pagada")[i % 2]}
+            for i in range(3000)
+        ])
+
+    olvidar_esquema()
+    inicio = time.perf_counter()
+    completo = esquema_ia()
+    calculo = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    for _ in range(1000):
+        esquema_ia()
+    precalculado = (time.perf_counter() - inicio) / 1000
+    print(f"🧭 Esquema: {len(completo.texto)} caracteres; calcularlo {calculo * 1000:.1f} ms, "
+          f"precalculado {precalculado * 1e6:.1f} µs por pregunta")
+    print(completo.texto)
+
+    main_app.limiter.enabled = False
+    main_app.app.dependency_overrides[get_admin_user] = lambda: None
+
+    def buscar(prompt):
+        return next(p for p in PREGUNTAS if p[0] in prompt.lower())
+
+    async def stub(prompt, max_tokens, timeout):
+        if prompt.startswith("Genera solo SQL") or prompt.startswith("Este SQL"):
+            _, necesita, correcto, adivinado = buscar(prompt)
+            esquema = prompt[prompt.index("Schema:"):]
+            return correcto if all(n in esquema for n in necesita) else adivinado
+        return "Respuesta en lenguaje natural"
+
+    ia_service.PROVEEDORES[ia_service.GEMINI].llamar = stub
+    solo_tablas = "Tablas: clientes, contratos, facturas, puntos_suministro"
+    escenarios = {
+        "solo tablas": lambda *a, **k: EsquemaIA(solo_tablas, version_esquema(solo_tablas), "antes", "SQLite"),
+        "esquema": esquema_ia,
+    }
+    ok = True
+    print(f"\n📊 {len(PREGUNTAS)} preguntas distintas, modelo simulado")
+    print(f"{'escenario':>12} | {'respondidas':>11} | {'a la 1ª':>7} | {'reparadas':>9} | {'llamadas':>8} | {'llamadas/resp.':>14}")
+    resultados = {}
+    for nombre, proveedor_esquema in escenarios.items():
+        main_app.esquema_ia = proveedor_esquema
+        cache_ia.vaciar()
+        metricas_ia.__init__()
+        with TestClient(main_app.app) as cliente:
+            for clave, *_ in PREGUNTAS:
+                cliente.post("/ia/consultar", json={"prompt": f"¿{clave}?"})
+            m = cliente.get("/ia/metricas").json()
+        resultados[nombre] = m
+        print(f"{nombre:>12} | {m['respondidas']:>11} | {m['respondidas'] - m['reparaciones_ok']:>7} | "
+              f"{m['reparaciones_ok']:>4}/{m['reparaciones']:<4} | {m['llamadas_modelo']:>8} | "
+              f"{m['llamadas_por_respuesta'] or 0:>14.2f}")
+    main_app.esquema_ia = esquema_ia
+
+    antes, ahora = resultados["solo tablas"], resultados["esquema"]
+    # Antes de esta capa no había reparación: solo contaban las acertadas a la primera, a 2 llamadas cada una
+    sin_reparar = antes["respondidas"] - antes["reparaciones_ok"]
+    print(f"   Sin reparación (como antes): {sin_reparar}/{len(PREGUNTAS)} respondidas, "
+          f"{2 * sin_reparar + (len(PREGUNTAS) - sin_reparar)} llamadas "
+          f"({(2 * sin_reparar + len(PREGUNTAS) - sin_reparar) / max(sin_reparar, 1):.2f} por respuesta)")
+    correcto = ahora["respondidas"] == len(PREGUNTAS) and ahora["llamadas_por_respuesta"] == 2.0
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} Con el esquema todas las preguntas se responden a la primera (2 llamadas)")
+
+    # Reparación: un SQL con una columna mal escrita se corrige con una llamada más
+    def esquema_con_errata(*a, **k):
+        texto = completo.texto.replace("monto num", "montos num")
+        return EsquemaIA(texto, version_esquema(texto), "errata", "SQLite")
+
+    async def stub_errata(prompt, max_tokens, timeout):
+        if prompt.startswith("Genera solo SQL"):
+            return "SELECT SUM(montos) FROM facturas"
+        if prompt.startswith("Este SQL"):
+            return "SELECT SUM(monto) FROM facturas" if "no such column: montos" in prompt else "SELECT 1"
+        return "Respuesta"
+
+    main_app.esquema_ia = esquema_con_errata
+    ia_service.PROVEEDORES[ia_service.GEMINI].llamar = stub_errata
+    cache_ia.vaciar()
+    metricas_ia.__init__()
+    with TestClient(main_app.app) as cliente:
+        respuesta = cliente.post("/ia/consultar", json={"prompt": "importe total"}).json()
+        m = cliente.get("/ia/metricas").json()
+    main_app.esquema_ia = esquema_ia
+    correcto = respuesta["reply"] == "Respuesta" and m["reparaciones_ok"] == 1 and m["llamadas_modelo"] == 3
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} Reparación con el error devuelto al modelo: {m['llamadas_modelo']} llamadas, "
+          f"{m['reparaciones_ok']}/{m['reparaciones']} reparadas")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Extracción local de facturas de luz (app/modules/energia/extractor_factura.py)
+Genera con reportlab un corpus de facturas sintéticas en varios formatos habituales
+(valores aleatorios con su verdad conocida):
+  • lineas: una línea por dato ("Potencia contratada P1: 4,600 kW  P2: ...", "Consumo punta: 85 kWh")
+  • tabla: 3.0TD con cabecera P1–P6 y cada valor en su celda, en la segunda página
+  • nombres: 2.0TD con etiqueta y valor en celdas separadas (punta/llano/valle)
+  • tabla_texto: la tabla entera escrita como una línea de texto por fila
+  • raro: "Término de potencia ... x 31 días", "Energía activa facturada" (sin reglas: IA)
+  • escaneada: sin capa de texto (IA)
+Mide facturas por segundo del extractor, cuántas pasan a la IA y si las que no pasan
+tienen consumo y potencia correctos. Después envía una muestra a /energia/analizar-factura
+con Gemini sustituido por un stub para contar las llamadas reales.
+
+Uso:
+    python -m benchmarks.bench_extractor_factura
+    python -m benchmarks.bench_extractor_factura --facturas 1000 --latencia-ia 3
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench_extractor_factura.db")
+os.environ.setdefault("GOOGLE_API_KEY", "stub")
+
+from reportlab.lib.pagesizes import A4  # noqa: E402
+from reportlab.pdfgen import canvas  # noqa: E402
+
+FORMATOS = {"lineas": 30, "tabla": 25, "nombres": 20, "tabla_texto": 10, "raro": 10, "escaneada": 5}
+LETRAS_CUPS = "TRWAGMYFPDXBNJZSQVHLCKE"
+
+
+def es(valor: float, decimales: int = 2) -> str:
+    """Número con formato español: 1.234,56"""
+    texto = f"{valor:,.{decimales}f}"
+    return texto.replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+def cups_aleatorio(rnd) -> str:
+    digitos = "".join(str(rnd.randint(0, 9)) for _ in range(16))
+    resto = int(digitos) % 529
+    return f"ES{digitos}{LETRAS_CUPS[resto // 23]}{LETRAS_CUPS[resto % 23]}"
+
+
+def factura_sintetica(rnd, formato: str):
+    """(bytes del PDF, verdad: consumo y potencia)"""
+    inicio = date(2025, 1, 1) + timedelta(days=rnd.randint(0, 300))
+    fin = inicio + timedelta(days=rnd.randint(27, 32))
+    cups = cups_aleatorio(rnd)
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    c.setFont("Helvetica", 9)
+    c.drawString(50, 800, f"{rnd.choice(['Loviluz', 'Iberdrola', 'Endesa', 'Naturgy'])} - FACTURA DE ELECTRICIDAD")
+    numero, precio_kwh = rnd.randint(10000, 99999), rnd.uniform(0.14, 0.26)
+
+    if formato in ("tabla", "tabla_texto"):
+        periodos = 6
+        potencias = [round(rnd.uniform(15, 60), 3)] * 5 + [round(rnd.uniform(15, 80), 3)]
+    else:
+        periodos = 3
+        p = round(rnd.choice([3.3, 3.45, 4.6, 5.75, 6.9]), 3)
+        potencias = [p, p]
+    consumos = [round(rnd.uniform(20, 2500 if periodos == 6 else 200), 2) for _ in range(periodos)]
+    total = round(sum(consumos), 2)
+    # Importe coherente con la potencia y el consumo (≈0,11 €/kW y día + energía, con impuestos)
+    importe = (max(potencias) * 0.11 * ((fin - inicio).days + 1) + total * precio_kwh) * 1.2718
+    c.drawString(50, 785, f"Nº factura: F{numero}   Importe total: {es(importe)} €")
+
+    if formato == "lineas":
+        c.drawString(50, 760, f"Fecha de emisión: {(fin + timedelta(days=5)).strftime('%d/%m/%Y')}")
+        c.drawString(50, 745, f"Periodo de facturación: del {inicio.strftime('%d/%m/%Y')} al {fin.strftime('%d/%m/%Y')}")
+        c.drawString(50, 730, f"CUPS: {cups}")
+        c.drawString(50, 700, f"Potencia contratada P1: {es(potencias[0], 3)} kW   P2: {es(potencias[1], 3)} kW")
+        for i, nombre in enumerate(("punta", "llano", "valle")):
+            c.drawString(50, 680 - 15 * i, f"Consumo {nombre}: {es(consumos[i])} kWh")
+        c.drawString(50, 630, f"Consumo total: {es(total)} kWh")
+    elif formato == "nombres":
+        c.drawString(50, 760, "Periodo:")
+        c.drawString(300, 760, f"{inicio.strftime('%d-%m-%Y')} a {fin.strftime('%d-%m-%Y')}")
+        c.drawString(50, 745, "Código CUPS")
+        c.drawString(300, 745, " ".join([cups[:2]] + [cups[i:i + 4] for i in range(2, 18, 4)] + [cups[18:]]) + " 0F")
+        for i, nombre in enumerate(("punta", "valle")):
+            c.drawString(50, 715 - 15 * i, f"Potencia {nombre}")
+            c.drawString(300, 715 - 15 * i, f"{es(potencias[i], 2)} kW")
+        for i, nombre in enumerate(("Punta", "Llano", "Valle")):
+            c.drawString(50, 670 - 15 * i, nombre)
+            c.drawString(300, 670 - 15 * i, f"{es(consumos[i])} kWh")
+        c.drawString(50, 620, "Consumo del periodo")
+        c.drawString(300, 620, f"{es(total)} kWh")
+    elif formato == "tabla":
+        c.drawString(50, 760, f"Periodo de consumo: {inicio.strftime('%d.%m.%Y')} - {fin.strftime('%d.%m.%Y')}")
+        c.drawString(50, 745, f"CUPS: {cups}")
+        c.drawString(50, 730, "Detalle por periodos en la página siguiente")
+        c.showPage()
+        c.setFont("Helvetica", 9)
+        c.drawString(50, 800, "Periodo")
+        for i in range(6):
+            c.drawRightString(250 + 55 * i, 800, f"P{i + 1}")
+        c.drawString(50, 785, "Potencia contratada (kW)")
+        for i in range(6):
+            c.drawRightString(250 + 55 * i, 785, es(potencias[i], 3))
+        c.drawString(50, 770, "Energía consumida (kWh)")
+        # Algunos periodos vacíos (sin consumo): la celda no existe, los demás no se desplazan
+        for i in range(6):
+            if consumos[i] > 100:
+                c.drawRightString(250 + 55 * i, 770, es(consumos[i], 0))
+            else:
+                consumos[i] = 0.0
+        consumos = [round(v) for v in consumos]
+        total = sum(consumos)
+    elif formato == "tabla_texto":
+        c.drawString(50, 760, f"Periodo de facturación {inicio.strftime('%d/%m/%y')} - {fin.strftime('%d/%m/%y')}")
+        c.drawString(50, 745, f"CUPS {cups}")
+        c.drawString(50, 715, "Periodo  " + "  ".join(f"P{i + 1}" for i in range(6)))
+        c.drawString(50, 700, "Potencia (kW)  " + "  ".join(es(v, 3) for v in potencias))
+        c.drawString(50, 685, "Consumo (kWh)  " + "  ".join(es(v) for v in consumos))
+    elif formato == "raro":
+        c.drawString(50, 760, f"Suministro {cups} desde {inicio.strftime('%d/%m/%Y')} hasta {fin.strftime('%d/%m/%Y')}")
+        c.drawString(50, 740, f"Término de potencia: {es(potencias[0], 3)} kW x {(fin - inicio).days} días")
+        c.drawString(50, 725, f"Energía activa facturada {es(total)} kWh x 0,1234 €/kWh")
+    else:  # escaneada: solo una imagen (aquí, rectángulos) sin capa de texto
+        c.rect(40, 400, 500, 380, fill=0)
+        c.rect(60, 700, 200, 40, fill=1)
+
+    c.showPage()
+    c.save()
+    potencia = max(potencias) if formato != "raro" else potencias[0]
+    return buffer.getvalue(), {"consumo": round(total, 2), "potencia": potencia, "cups": cups}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--facturas", type=int, default=400)
+    parser.add_argument("--latencia-ia", type=float, default=2.0, help="Segundos por llamada a Gemini (para estimar)")
+    parser.add_argument("--muestra-endpoint", type=int, default=40)
+    args = parser.parse_args()
+
+    from app.modules.energia.extractor_factura import UMBRAL_CONFIANZA, analizar_pdf
+
+    rnd = random.Random(19)
+    formatos = rnd.choices(list(FORMATOS), weights=list(FORMATOS.values()), k=args.facturas)
+    corpus = [(f, *factura_sintetica(rnd, f)) for f in formatos]
+
+    inicio = time.perf_counter()
+    resultados = [analizar_pdf(pdf)[0] for _, pdf, _ in corpus]
+    segundos = time.perf_counter() - inicio
+
+    print(f"📊 {args.facturas} facturas sintéticas: {segundos:.2f}s en el extractor "
+          f"({args.facturas / segundos:.0f} facturas/s, {segundos / args.facturas * 1000:.1f} ms por factura)")
+    print(f"{'formato':>12} | {'facturas':>8} | {'a la IA':>7} | {'correctas':>9} | {'CUPS':>5} | {'confianza media':>15}")
+    ok = True
+    errores_confiados = 0
+    por_formato = {}
+    for (formato, _, verdad), datos in zip(corpus, resultados):
+        fila = por_formato.setdefault(formato, {"n": 0, "ia": 0, "bien": 0, "cups": 0, "confianza": 0.0})
+        fila["n"] += 1
+        fila["confianza"] += datos.confianza
+        fila["cups"] += (datos.cups or "")[:20] == verdad["cups"]  # Sin el sufijo de frontera (0F)
+        if datos.confianza < UMBRAL_CONFIANZA:
+            fila["ia"] += 1
+            continue
+        bien = (datos.consumo is not None and abs(datos.consumo - verdad["consumo"]) < 0.01
+                and datos.potencia is not None and abs(datos.potencia - verdad["potencia"]) < 0.001)
+        fila["bien"] += bien
+        errores_confiados += not bien
+    for formato, fila in por_formato.items():
+        print(f"{formato:>12} | {fila['n']:>8} | {fila['ia']:>7} | {fila['bien']:>4}/{fila['n'] - fila['ia']:<4} | "
+              f"{fila['cups']:>5} | {fila['confianza'] / fila['n']:>15.2f}")
+    a_la_ia = sum(f["ia"] for f in por_formato.values())
+    print(f"   IA: {a_la_ia}/{args.facturas} facturas ({a_la_ia / args.facturas:.0%}); antes, todas. "
+          f"Con Gemini a {args.latencia_ia:g}s: {args.facturas * args.latencia_ia:.0f}s de espera -> "
+          f"{a_la_ia * args.latencia_ia + segundos:.0f}s")
+
+    correcto = errores_confiados == 0
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} Ninguna factura por encima del umbral con consumo o potencia erróneos "
+          f"({errores_confiados} errores)")
+    correcto = por_formato.get("escaneada", {}).get("ia", 0) == por_formato.get("escaneada", {}).get("n", 0)
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} Las escaneadas (sin texto) van siempre a la IA")
+
+    # De extremo a extremo: solo las de baja confianza llaman a Gemini
+    from fastapi.testclient import TestClient
+    from app.main import app, limiter
+    from app import ia_service
+
+    limiter.enabled = False
+    llamadas = []
+
+    async def stub(prompt, max_tokens, timeout):
+        llamadas.append(prompt)
+        return '{"consumo": 1.0, "potencia": 1.0}'
+
+    ia_service.PROVEEDORES[ia_service.GEMINI].llamar = stub
+    muestra = corpus[:args.muestra_endpoint]
+    esperadas = sum(r.confianza < UMBRAL_CONFIANZA for r in resultados[:args.muestra_endpoint])
+    origenes = {"extractor": 0, "ia": 0}
+    with TestClient(app) as cliente:
+        for formato, pdf, verdad in muestra:
+            r = cliente.post("/energia/analizar-factura", files={"factura": ("f.pdf", pdf, "application/pdf")}).json()
+            origenes[r.get("origen", "ia")] += 1
+    correcto = len(llamadas) == esperadas == origenes["ia"]
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} /energia/analizar-factura con {len(muestra)} facturas: "
+          f"{origenes['extractor']} resueltas en local, {len(llamadas)} llamadas a Gemini")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
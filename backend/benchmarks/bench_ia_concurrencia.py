@@ -0,0 +1,134 @@
+"""
+Endpoints de IA y latencia del resto de la API
+Con el modelo sustituido por un stub que tarda LATENCIA segundos, lanza 20 peticiones
+a /ia/consultar a la vez y, mientras están en vuelo, mide la latencia de otros
+endpoints (GET / y GET /facturas/). Tres escenarios:
+  • sin IA: línea base
+  • bloqueante: el stub hace time.sleep dentro del async def (lo que pasaba al
+    llamar a ask_gemini): el bucle de eventos se para y todo espera
+  • asíncrono: capa app/ia_service.py (semáforo por proveedor, await sin bloquear)
+Además comprueba que un timeout cancela la llamada y libera el semáforo.
+
+Uso:
+    python -m benchmarks.bench_ia_concurrencia
+    python -m benchmarks.bench_ia_concurrencia --latencia 2 --peticiones 40
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench_ia_concurrencia.db")
+os.environ.setdefault("GOOGLE_API_KEY", "stub")
+
+import httpx  # noqa: E402
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))] * 1000
+
+
+async def escenario(app, n_peticiones: int, duracion_minima: float):
+    """Devuelve (latencias de los otros endpoints, segundos hasta acabar las peticiones de IA)"""
+    transporte = httpx.ASGITransport(app=app)
+    latencias = []
+    async with httpx.AsyncClient(transport=transporte, base_url="http://test") as cliente:
+        async def sondear(fin):
+            while not fin.is_set():
+                for ruta in ("/", "/facturas/?limit=10"):
+                    inicio = time.perf_counter()
+                    respuesta = await cliente.get(ruta)
+                    respuesta.raise_for_status()
+                    latencias.append(time.perf_counter() - inicio)
+                await asyncio.sleep(0.02)
+
+        fin = asyncio.Event()
+        sonda = asyncio.create_task(sondear(fin))
+        inicio = time.perf_counter()
+        if n_peticiones:
+            respuestas = await asyncio.gather(*[
+                cliente.post("/ia/consultar", json={"prompt": f"¿Cuántas facturas? {i}"}) for i in range(n_peticiones)
+            ])
+            assert all("reply" in r.json() for r in respuestas)
+        else:
+            await asyncio.sleep(duracion_minima)
+        segundos = time.perf_counter() - inicio
+        fin.set()
+        await sonda
+    return latencias, segundos
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latencia", type=float, default=1.0, help="Segundos que tarda el modelo simulado")
+    parser.add_argument("--peticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    from app.main import app, limiter
+    from app.modules.auth.utils import get_current_active_user
+    from app import ia_service
+    from app.database import cerrar_motor_async
+    from app.ia_cache import cache_ia
+
+    limiter.enabled = False  # /ia/consultar admite 10/minuto
+    app.dependency_overrides[get_current_active_user] = lambda: None
+    gemini = ia_service.PROVEEDORES[ia_service.GEMINI]
+    original = gemini.llamar
+
+    def respuesta(prompt):
+        return "SELECT COUNT(*) FROM facturas" if prompt.startswith("Genera solo SQL") else "Hay 0 facturas."
+
+    async def stub_bloqueante(prompt, max_tokens, timeout):
+        time.sleep(args.latencia)  # Como ask_gemini dentro de un async def
+        return respuesta(prompt)
+
+    async def stub_asincrono(prompt, max_tokens, timeout):
+        await asyncio.sleep(args.latencia)
+        return respuesta(prompt)
+
+    ok = True
+    print(f"📊 {args.peticiones} consultas de IA simultáneas (modelo simulado: {args.latencia}s por llamada, "
+          f"2 llamadas por consulta, máx. {gemini.concurrencia} a la vez)")
+    print(f"{'escenario':>12} | {'IA total s':>10} | {'otras peticiones':>16} | {'p50 ms':>8} | {'p99 ms':>8} | {'máx ms':>8}")
+    resultados = {}
+    for nombre, stub, n in (("sin IA", None, 0), ("bloqueante", stub_bloqueante, args.peticiones),
+                            ("asíncrono", stub_asincrono, args.peticiones)):
+        gemini.llamar = stub or original
+        cache_ia.vaciar()  # Cada escenario pregunta de verdad al modelo
+        latencias, segundos = asyncio.run(escenario(app, n, duracion_minima=2.0))
+        resultados[nombre] = percentil(latencias, 0.99)
+        print(f"{nombre:>12} | {segundos if n else 0:>10.2f} | {len(latencias):>16} | {percentil(latencias, 0.5):>8.1f} | "
+              f"{percentil(latencias, 0.99):>8.1f} | {max(latencias) * 1000:>8.1f}")
+
+    # Con la capa asíncrona el p99 del resto no debe acercarse a la latencia del modelo
+    correcto = resultados["asíncrono"] < args.latencia * 1000 / 4
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} p99 del resto de endpoints con IA en vuelo: {resultados['asíncrono']:.1f} ms "
+          f"(bloqueante: {resultados['bloqueante']:.1f} ms)")
+
+    async def lento(prompt, max_tokens, timeout):
+        await asyncio.sleep(60)
+
+    async def comprobar_timeout():
+        gemini.llamar = lento
+        inicio = time.perf_counter()
+        resultados = await asyncio.gather(*[ia_service.preguntar_gemini("hola", timeout=0.3) for _ in range(20)],
+                                          return_exceptions=True)
+        segundos = time.perf_counter() - inicio
+        errores = sum(isinstance(r, ia_service.ErrorIA) for r in resultados)
+        return errores, segundos, gemini.en_curso, gemini.en_espera, gemini.semaforo()._value
+
+    errores, segundos, en_curso, en_espera, libres = asyncio.run(comprobar_timeout())
+    gemini.llamar = original
+    correcto = errores == 20 and en_curso == 0 and en_espera == 0 and libres == gemini.concurrencia and segundos < 1
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} Timeout de 0.3s sobre 20 llamadas colgadas: {errores} ErrorIA en {segundos:.2f}s, "
+          f"{en_curso} en curso, {en_espera} en cola, {libres}/{gemini.concurrencia} huecos libres")
+    asyncio.run(cerrar_motor_async())  # Sin lifespan nadie más lo cierra
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
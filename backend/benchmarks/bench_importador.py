@@ -0,0 +1,130 @@
+"""
+Benchmark del importador de cartera sobre un Excel sintético
+Genera un libro con la misma hoja/cabeceras que cartera.xlsx (con un 2% de filas
+sin NIF, sin CUPS o con CUPS repetido) y mide lectura, limpieza y escritura
+masiva. El importador clásico fila a fila se mide sobre una muestra y se extrapola.
+Antes comprueba la limpieza de fechas con textos de día > 12 y celdas de formatos mezclados.
+
+Uso:
+    python -m benchmarks.bench_importador                 # 100k filas
+    python -m benchmarks.bench_importador --filas 20000 --muestra-clasico 0
+"""
+import os
+import tempfile
+
+# El importador clásico usa el motor global: lo apuntamos a un SQLite temporal
+# antes de importar nada de la app
+_CARPETA = tempfile.mkdtemp(prefix="bench_cartera_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_CARPETA, 'clasico.db')}"
+
+import argparse
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+import pandas as pd
+from openpyxl import Workbook
+from app.modules.cartera.importador import (
+    ImportadorCartera, limpiar_dataframe, HOJA_CARTERA, FILA_CABECERA
+)
+from benchmarks.comun import crear_motor, cronometro
+
+CABECERAS = [
+    "Cliente", "CIF/NIF", "Email", "Teléfono", "IBAN", "Firmante", "CUPS", "Domicilio CUPS",
+    "Código postal CUPS", "Provincia CUPS", "Tarifa", "Comercializadora", "Producto",
+    "F. alta", "F. vencimiento", *[f"Potencia (P{i})" for i in range(1, 7)],
+]
+
+
+def generar_excel(ruta: str, filas: int):
+    """Escribe el libro en modo write-only (memoria constante)"""
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet(HOJA_CARTERA)
+    hoja.append(["Listado de contratos de energía"])  # Fila 1: título, como el original
+    hoja.append(CABECERAS)
+    hoy = date.today()
+    for i in range(filas):
+        nif = f"B{i // 2:08d}"  # Dos puntos de suministro por cliente
+        cups = f"ES{i:016d}AB0F"
+        azar = random.random()
+        if azar < 0.005:
+            nif = None
+        elif azar < 0.01:
+            cups = "ES12"
+        elif azar < 0.02 and i > 0:
+            cups = f"ES{i - 1:016d}AB0F"
+        potencia = f"{random.uniform(2, 15):.2f}".replace(".", ",") + " kW" if i % 3 else random.uniform(2, 15)
+        hoja.append([
+            f"Cliente {i // 2}", nif, f"cliente{i // 2}@mail.es", "600123123", "ES9121000418450200051332",
+            "Firmante", cups, "Calle Mayor 1", "28001", "Madrid", "2.0TD",
+            random.choice(["Loviluz", "Iberdrola", "Endesa"]), "Plan Estable",
+            hoy - timedelta(days=random.randint(30, 700)), hoy + timedelta(days=random.randint(1, 365)),
+            potencia, potencia, 0, 0, 0, 0,
+        ])
+    libro.save(ruta)
+
+
+def comprobar_fechas() -> bool:
+    """Cada celda se lee con su formato (día primero): ninguna fecha válida se queda en None"""
+    casos = [
+        (["05/03/2025", "13/02/2025", "28/11/2024", None],
+         [date(2025, 3, 5), date(2025, 2, 13), date(2024, 11, 28), None]),
+        (["05/03/2025", "13/02/2025", "2025-01-20", datetime(2025, 6, 1), None, " 7-3-2025", "sin fecha"],
+         [date(2025, 3, 5), date(2025, 2, 13), date(2025, 1, 20), date(2025, 6, 1), None, date(2025, 3, 7), None]),
+    ]
+    ok = True
+    for celdas, esperado in casos:
+        df = pd.DataFrame({"CIF/NIF": "B00000001", "CUPS": "ES0000000000000001AB0F", "F. alta": celdas})
+        obtenido = list(limpiar_dataframe(df)["fecha_inicio"])
+        correcto = obtenido == esperado
+        ok &= correcto
+        print(f"{'✅' if correcto else '❌'} Fechas {celdas[:4]}...: "
+              + ", ".join(str(f) for f in obtenido))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filas", type=int, default=100_000)
+    parser.add_argument("--muestra-clasico", type=int, default=2_000,
+                        help="Filas para medir el importador clásico (0 = no medir)")
+    args = parser.parse_args()
+
+    ok = comprobar_fechas()
+    ruta = os.path.join(_CARPETA, "cartera_sintetica.xlsx")
+    print(f"📊 Benchmark importador de cartera: {args.filas} filas")
+    with cronometro("Generar Excel sintético"):
+        generar_excel(ruta, args.filas)
+
+    inicio = time.perf_counter()
+    df = pd.read_excel(ruta, sheet_name=HOJA_CARTERA, engine="openpyxl", header=FILA_CABECERA)
+    lectura = time.perf_counter() - inicio
+    print(f"   ⏱️  Lectura read_excel: {lectura:.2f}s")
+
+    with cronometro("Limpieza vectorizada"):
+        limpiar_dataframe(df)
+
+    engine, _ = crear_motor()
+    importador = ImportadorCartera(engine)
+    inicio = time.perf_counter()
+    resumen = importador.importar(df)
+    escritura = time.perf_counter() - inicio
+    print(f"   ⏱️  Limpieza + escritura masiva: {escritura:.2f}s "
+          f"({args.filas / escritura:,.0f} filas/s)")
+    print(f"   • Contratos nuevos: {resumen.contratos_nuevos} | rechazos: {importador.total_rechazos}")
+
+    if args.muestra_clasico:
+        import import_cartera
+        muestra = os.path.join(_CARPETA, "muestra.xlsx")
+        generar_excel(muestra, args.muestra_clasico)
+        inicio = time.perf_counter()
+        import_cartera.importar_cartera(muestra)
+        clasico = time.perf_counter() - inicio
+        por_fila = clasico / args.muestra_clasico
+        print(f"   ⏱️  Importador clásico: {clasico:.2f}s para {args.muestra_clasico} filas "
+              f"→ ~{por_fila * args.filas / 60:.1f} min estimados para {args.filas}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
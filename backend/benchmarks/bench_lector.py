@@ -0,0 +1,139 @@
+"""
+Benchmark de memoria: read_excel completo vs lector por bloques
+Cada medición corre en un proceso aparte para leer su pico de RSS (ru_maxrss).
+Con el lector en streaming el pico no debería crecer con el tamaño del libro.
+Antes comprueba que el mismo libro exportado a CSV (con ';' y decimales con coma, y con ','
+y decimales con punto) y a Parquet da exactamente los mismos valores que el xlsx, también
+al reanudar a mitad de fichero.
+
+Uso:
+    python -m benchmarks.bench_lector                     # 10k, 50k y 100k filas
+    python -m benchmarks.bench_lector --tamanos 20000 200000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def pico_rss_mb() -> float:
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024  # macOS en bytes, Linux en KB
+
+
+def medir_en_este_proceso(modo: str, ruta: str):
+    inicio = time.perf_counter()
+    if modo == "pandas":
+        import pandas as pd
+        from app.modules.cartera.importador import HOJA_CARTERA, FILA_CABECERA, limpiar_dataframe
+        df = pd.read_excel(ruta, sheet_name=HOJA_CARTERA, engine="openpyxl", header=FILA_CABECERA)
+        filas = len(limpiar_dataframe(df))
+    else:
+        from app.modules.cartera.importador import limpiar_dataframe
+        from app.modules.cartera.lector import leer_por_bloques, leer_en_segundo_plano
+        filas = 0
+        for bloque in leer_en_segundo_plano(leer_por_bloques(ruta, tamano_bloque=5000)):
+            filas += len(limpiar_dataframe(bloque))
+    print(f"{filas} {time.perf_counter() - inicio:.2f} {pico_rss_mb():.1f}")
+
+
+def exportar(ruta_xlsx: str, carpeta: str):
+    """El libro como CSV español (;), CSV con punto decimal (,) y Parquet; {nombre: ruta}"""
+    import pandas as pd
+    from app.modules.cartera.importador import COLUMNAS_FECHA, COLUMNAS_POTENCIA, limpiar_numeros
+    from app.modules.cartera.lector import leer_excel_por_bloques
+
+    df = pd.concat(leer_excel_por_bloques(ruta_xlsx))
+    fechas = list(COLUMNAS_FECHA.values())
+    potencias = list(COLUMNAS_POTENCIA.values())
+    texto = df.copy()
+    for columna in fechas:
+        texto[columna] = df[columna].map(lambda f: f.strftime("%d/%m/%Y") if pd.notna(f) else None)
+
+    rutas = {}
+    espanol = texto.copy()  # Celdas de texto "10,50 kW" tal cual; los números con coma
+    for columna in potencias:
+        espanol[columna] = df[columna].map(lambda v: str(v).replace(".", ",") if isinstance(v, float) else v)
+    rutas["CSV ; (decimal ,)"] = os.path.join(carpeta, "cartera_es.csv")
+    espanol.to_csv(rutas["CSV ; (decimal ,)"], sep=";", index=False)
+
+    ingles = texto.copy()
+    for columna in potencias:
+        ingles[columna] = df[columna].map(lambda v: v.replace(",", ".") if isinstance(v, str) else v)
+    rutas["CSV , (decimal .)"] = os.path.join(carpeta, "cartera_en.csv")
+    ingles.to_csv(rutas["CSV , (decimal .)"], sep=",", index=False)
+
+    try:
+        import pyarrow  # noqa: F401
+        tipado = df.copy()
+        for columna in potencias:
+            tipado[columna] = limpiar_numeros(df[columna])
+        for columna in fechas:
+            tipado[columna] = pd.to_datetime(df[columna])
+        rutas["Parquet"] = os.path.join(carpeta, "cartera.parquet")
+        tipado.to_parquet(rutas["Parquet"], index=False)
+    except ImportError:
+        print("ℹ️  Parquet: falta pyarrow (dependencia opcional), se omite")
+    return rutas
+
+
+def comprobar_formatos(carpeta: str, filas: int = 3000, saltar: int = 1234) -> bool:
+    from benchmarks.bench_importador import generar_excel
+    from app.modules.cartera.importador import limpiar_dataframe
+    from app.modules.cartera.lector import leer_por_bloques
+
+    def valores(ruta, saltar_filas=0):
+        limpio = [limpiar_dataframe(b).drop(columns="fila_excel")
+                  for b in leer_por_bloques(ruta, tamano_bloque=1000, saltar_filas=saltar_filas)]
+        # Los decimales se comparan a 9 cifras: al pasar un float por texto puede cambiar el último bit
+        return [tuple(None if v != v else round(v, 9) if isinstance(v, float) else v for v in fila)
+                for b in limpio for fila in b.itertuples(index=False)]
+
+    ruta_xlsx = os.path.join(carpeta, "cartera_formatos.xlsx")
+    generar_excel(ruta_xlsx, filas)
+    referencia = valores(ruta_xlsx)
+    ok = True
+    for nombre, ruta in exportar(ruta_xlsx, carpeta).items():
+        completo, reanudado = valores(ruta), valores(ruta, saltar)
+        distintas = sum(a != b for a, b in zip(completo, referencia)) + abs(len(completo) - len(referencia))
+        correcto = not distintas and reanudado == referencia[saltar:]
+        ok &= correcto
+        print(f"{'✅' if correcto else '❌'} {nombre}: {len(completo)} filas, {distintas} distintas del xlsx; "
+              f"reanudado en la fila {saltar}: {'mismos valores' if reanudado == referencia[saltar:] else 'DISTINTO'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[10_000, 50_000, 100_000])
+    parser.add_argument("--medir", choices=["pandas", "streaming"], help=argparse.SUPPRESS)
+    parser.add_argument("--archivo", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        medir_en_este_proceso(args.medir, args.archivo)
+        return
+
+    from benchmarks.bench_importador import generar_excel
+    carpeta = tempfile.mkdtemp(prefix="bench_lector_")
+    ok = comprobar_formatos(carpeta)
+    print("📊 Pico de memoria leyendo + limpiando la cartera")
+    print(f"{'filas':>8} | {'modo':>9} | {'tiempo s':>8} | {'pico RSS MB':>11}")
+    for tamano in args.tamanos:
+        ruta = os.path.join(carpeta, f"cartera_{tamano}.xlsx")
+        generar_excel(ruta, tamano)
+        for modo in ("pandas", "streaming"):
+            salida = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_lector", "--medir", modo, "--archivo", ruta],
+                capture_output=True, text=True, check=True,
+            ).stdout.split()
+            _, segundos, rss = salida[-3:]
+            print(f"{tamano:>8} | {modo:>9} | {segundos:>8} | {rss:>11}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Ráfaga de logins contra el resto del CRM (app/modules/auth/hashing.py)
+Levanta la API con uvicorn y lanza LOGINS logins a la vez (inicio de turno) mientras un
+comercial va pidiendo GET /clientes/. Mide la latencia de esas peticiones del CRM:
+  • antes: /login síncrono, argon2 en el pool de hilos que comparten todos los endpoints
+    (se registra como /login-antes con el código de siempre)
+  • ahora: /login async, argon2 en su propio pool de AUTH_HASH_HILOS hilos
+Comprueba además el re-hash al cambiar los parámetros de argon2 y las métricas de la cola.
+
+Uso:
+    python -m benchmarks.bench_login
+    AUTH_HASH_HILOS=2 python -m benchmarks.bench_login --logins 100
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench_login.db")
+os.environ.setdefault("GOOGLE_API_KEY", "stub")
+
+PUERTO = 8765
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+async def escenario(url_login, logins, cabeceras, usuarios):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PUERTO}", timeout=120) as cliente:
+        reposo = []
+        for _ in range(20):
+            inicio = time.perf_counter()
+            (await cliente.get("/clientes/", headers=cabeceras)).raise_for_status()
+            reposo.append(time.perf_counter() - inicio)
+
+        terminado = asyncio.Event()
+        durante = []
+
+        async def comercial():
+            while not terminado.is_set():
+                inicio = time.perf_counter()
+                (await cliente.get("/clientes/", headers=cabeceras)).raise_for_status()
+                durante.append(time.perf_counter() - inicio)
+                await asyncio.sleep(0.05)
+
+        async def login(i):
+            r = await cliente.post(url_login, json={"email": usuarios[i], "password": "turno-de-mañana"})
+            r.raise_for_status()
+
+        tarea = asyncio.create_task(comercial())
+        inicio = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(logins)))
+        rafaga = time.perf_counter() - inicio
+        terminado.set()
+        await tarea
+    return reposo, durante, rafaga
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=50)
+    args = parser.parse_args()
+
+    import uvicorn
+    from passlib.context import CryptContext
+    from app.database import SessionLocal, engine, get_db
+    from app.modules.auth import utils
+    from app.modules.auth.hashing import pool_hash
+    from app.modules.crm import models
+    from app.main import app, limiter, UserCreate, Depends, HTTPException, Session
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    clave = utils.get_password_hash("turno-de-mañana")
+    usuarios = [f"comercial{i}@loviluz.es" for i in range(args.logins)]
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [
+            {"email": email, "hashed_password": clave, "is_active": True, "role": "comercial"} for email in usuarios
+        ] + [{"email": "admin@loviluz.es", "hashed_password": clave, "is_active": True, "role": "admin"}])
+        conn.execute(models.Cliente.__table__.insert(), [
+            {"nombre": f"Cliente {i}", "nif_cif": f"B{i:08d}", "is_active": True} for i in range(200)
+        ])
+    db = SessionLocal()
+    admin = db.query(models.User).filter(models.User.email == "admin@loviluz.es").one()
+    cabeceras = {"Authorization": f"Bearer {utils.create_access_token(utils.claims_usuario(admin))}"}
+    db.close()
+
+    @app.post("/login-antes")
+    def login_antes(user: UserCreate, db: Session = Depends(get_db)):
+        """/login tal y como estaba: síncrono, argon2 en el pool de hilos compartido"""
+        db_user = db.query(models.User).filter(models.User.email == user.email).first()
+        if not db_user or not utils.verify_password(user.password, db_user.hashed_password):
+            raise HTTPException(status_code=400, detail="Credenciales incorrectas")
+        return {"access_token": utils.create_access_token(data=utils.claims_usuario(db_user))}
+
+    limiter.enabled = False
+    servidor = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=PUERTO, log_level="warning"))
+    hilo = threading.Thread(target=servidor.run, daemon=True)
+    hilo.start()
+    while not servidor.started:
+        time.sleep(0.05)
+
+    print(f"🔑 {args.logins} logins a la vez + GET /clientes/ cada 50 ms "
+          f"(argon2 ~{pool_hash.hilos} hilo(s) de hash, {os.cpu_count()} CPU)")
+    resultados = {}
+    for nombre, url in (("antes", "/login-antes"), ("ahora", "/login")):
+        reposo, durante, rafaga = asyncio.run(escenario(url, args.logins, cabeceras, usuarios))
+        resultados[nombre] = durante
+        print(f"   {nombre}: CRM en reposo p50 {statistics.median(reposo) * 1000:6.1f} ms | durante la ráfaga "
+              f"p50 {statistics.median(durante) * 1000:7.1f} ms, p95 {percentil(durante, 0.95) * 1000:7.1f} ms, "
+              f"máx {max(durante) * 1000:7.1f} ms ({len(durante)} peticiones) | logins en {rafaga:.1f}s")
+
+    ok = percentil(resultados["ahora"], 0.95) * 2 < percentil(resultados["antes"], 0.95)
+    print(f"{'✅' if ok else '❌'} El p95 del CRM durante la ráfaga baja a menos de la mitad")
+
+    import httpx
+    with httpx.Client(base_url=f"http://127.0.0.1:{PUERTO}") as cliente:
+        metricas = cliente.get("/auth/metricas", headers=cabeceras).json()
+        correcto = metricas["completados"] >= args.logins and metricas["maximo_cola"] > pool_hash.hilos
+        ok &= correcto
+        print(f"{'✅' if correcto else '❌'} /auth/metricas: {metricas}")
+
+        # --- Re-hash: un hash con parámetros más flojos se actualiza en el siguiente login ---
+        flojo = CryptContext(schemes=["argon2"], argon2__memory_cost=8192, argon2__time_cost=1).hash("turno-de-mañana")
+        with engine.begin() as conn:
+            conn.execute(models.User.__table__.update().where(models.User.__table__.c.email == usuarios[0]),
+                         {"hashed_password": flojo})
+        r = cliente.post("/login", json={"email": usuarios[0], "password": "turno-de-mañana"})
+        db = SessionLocal()
+        guardado = db.query(models.User).filter(models.User.email == usuarios[0]).one().hashed_password
+        db.close()
+        correcto = (r.status_code == 200 and guardado != flojo and not utils.pwd_context.needs_update(guardado)
+                    and cliente.post("/login", json={"email": usuarios[0], "password": "otra"}).status_code == 400)
+        ok &= correcto
+        print(f"{'✅' if correcto else '❌'} Re-hash al subir los parámetros: {flojo[:30]}… -> {guardado[:30]}…")
+
+    servidor.should_exit = True
+    hilo.join(timeout=10)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
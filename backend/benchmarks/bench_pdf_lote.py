@@ -0,0 +1,64 @@
+"""
+Benchmark de PDFs de facturas en bloque: facturas/s con 1, 4 y 8 procesos
+Mide generar_lote en formato zip (un PDF por factura) y pdf (combinado), y
+comprueba que el ZIP trae una entrada por factura y el PDF una página por factura.
+La primera vuelta con cada tamaño de pool incluye arrancar los procesos; se
+repite una segunda vez para medir el pool ya caliente.
+
+Uso:
+    python -m benchmarks.bench_pdf_lote
+    python -m benchmarks.bench_pdf_lote --facturas 5000 --workers 1 2 4 8
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import zipfile
+
+
+def facturas_sinteticas(n: int):
+    return [{
+        "id": i, "fecha": "31/01/2025", "concepto": f"Suministro eléctrico enero 2025 - CUPS ES00{i:016d}",
+        "monto": 50 + (i % 300) * 1.37, "cliente_nombre": f"Cliente {i} S.L.", "cliente_nif": f"B{i:08d}",
+        "cliente_email": f"cliente{i}@mail.es", "cliente_telefono": "600000000" if i % 2 else "",
+    } for i in range(1, n + 1)]
+
+
+def main():
+    import logging
+    logging.disable(logging.INFO)
+    from pypdf import PdfReader
+    from app.modules.crm.facturas_lote import generar_lote, cerrar_pools
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--facturas", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    datos = facturas_sinteticas(args.facturas)
+    print(f"📊 {args.facturas} facturas | CPUs disponibles: {os.cpu_count()}")
+    print(f"{'formato':>7} | {'procesos':>8} | {'facturas/s (frío)':>17} | {'facturas/s (caliente)':>21} | {'MB':>6}")
+    ok = True
+    for formato in ("zip", "pdf"):
+        for workers in args.workers:
+            ritmos = []
+            for _ in range(2):
+                inicio = time.perf_counter()
+                archivo = generar_lote(datos, formato, workers)
+                ritmos.append(args.facturas / (time.perf_counter() - inicio))
+                contenido = archivo.read()
+                archivo.close()
+            if formato == "zip":
+                correcto = len(zipfile.ZipFile(io.BytesIO(contenido)).namelist()) == args.facturas
+            else:
+                correcto = len(PdfReader(io.BytesIO(contenido)).pages) == args.facturas
+            ok &= correcto
+            print(f"{formato:>7} | {workers:>8} | {ritmos[0]:>17,.0f} | {ritmos[1]:>21,.0f} | "
+                  f"{len(contenido) / 1e6:>6.1f} {'✅' if correcto else '❌'}")
+    cerrar_pools()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
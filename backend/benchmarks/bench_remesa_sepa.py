@@ -0,0 +1,155 @@
+"""
+Remesa SEPA en streaming: tiempo y pico de memoria según el número de adeudos
+Cada medición corre en un proceso aparte para leer su pico de RSS (ru_maxrss);
+con el escritor en streaming el pico no debería crecer con el tamaño de la remesa.
+Además valida una remesa pequeña contra el XSD pain.008.001.02 (el de sepaxml) y
+comprueba que NbOfTxs/CtrlSum de la cabecera cuadran con los adeudos escritos.
+
+Uso:
+    python -m benchmarks.bench_remesa_sepa                     # 10k y 100k adeudos
+    python -m benchmarks.bench_remesa_sepa --tamanos 20000 200000
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+
+from benchmarks.bench_lector import pico_rss_mb as pico_rss_mb_rusage
+from benchmarks.comun import crear_motor, insertar_en_lotes
+
+EMPRESA = {
+    "nombre": "LOVILUZ ENERGIA S.L.",
+    "iban": "ES4521000418450200051332",
+    "bic": "CAIXESBBXXX",
+    "creditor_id": "ES02000G12345678",
+}
+NS = "{urn:iso:std:iso:20022:tech:xsd:pain.008.001.02}"
+
+
+def poblar(engine, n_facturas: int):
+    """Clientes con IBAN y facturas pendientes; ~la mitad de clientes ya tienen una cobrada (RCUR)"""
+    from app.modules.crm import models
+    n_clientes = max(1, n_facturas // 4)
+    insertar_en_lotes(engine, models.Cliente.__table__, [
+        {"id": i, "nombre": f"Cliente Ñandú & Cía {i}", "nif_cif": f"B{i:08d}", "tipo_cliente": "PYME",
+         "iban": "ES9121000418450200051332", "created_at": datetime(2023, 1, 1)}
+        for i in range(1, n_clientes + 1)
+    ])
+    inicio = datetime(2024, 1, 1)
+    insertar_en_lotes(engine, models.Factura.__table__, [
+        {"id": i, "monto": round(random.uniform(20, 900), 2), "concepto": f"Factura {i}",
+         "estado": "Pagada" if i <= n_clientes // 2 else "Pendiente",
+         "created_at": inicio + timedelta(minutes=i), "cliente_id": (i - 1) % n_clientes + 1}
+        for i in range(1, n_facturas + n_clientes // 2 + 1)
+    ])
+    # Se remesan solo las pendientes
+    return list(range(n_clientes // 2 + 1, n_facturas + n_clientes // 2 + 1))
+
+
+def pico_rss_mb() -> float:
+    """
+    Pico de RSS de este proceso. ru_maxrss se hereda del padre a través de fork+exec (y el padre
+    acaba de generar los datos); VmHWM de /proc se reinicia en el exec, así que se usa si existe
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return pico_rss_mb_rusage()
+
+
+def _ficheros_xml(archivo, tipo: str):
+    if tipo == "application/xml":
+        yield archivo.read()
+    else:
+        with zipfile.ZipFile(archivo) as zip_:
+            for nombre in zip_.namelist():
+                yield zip_.read(nombre)
+
+
+def comprobar_totales(contenido: bytes) -> bool:
+    """NbOfTxs y CtrlSum de la cabecera frente a la suma de los InstdAmt escritos"""
+    raiz = ElementTree.fromstring(contenido)
+    cabecera = raiz.find(f"{NS}CstmrDrctDbtInitn/{NS}GrpHdr")
+    importes = [round(float(e.text) * 100) for e in raiz.iter(f"{NS}InstdAmt")]
+    return (int(cabecera.find(f"{NS}NbOfTxs").text) == len(importes)
+            and round(float(cabecera.find(f"{NS}CtrlSum").text) * 100) == sum(importes))
+
+
+def medir_en_este_proceso(url: str):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.modules.crm import models
+    from app.modules.crm.sepa_generator import generar_remesas
+
+    engine = create_engine(url)
+    db = sessionmaker(bind=engine)()
+    inicio = time.perf_counter()
+    # Como la API con ?estado=Pendiente (remesar todo lo pendiente)
+    archivo, _, _, grupos = generar_remesas(db, [models.Factura.estado == "Pendiente"], EMPRESA)
+    segundos = time.perf_counter() - inicio
+    operaciones = sum(g.num_operaciones for g in grupos)
+    archivo.seek(0, os.SEEK_END)
+    print(f"{operaciones} {len(grupos)} {archivo.tell() / (1024 * 1024):.1f} {segundos:.2f} {pico_rss_mb():.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--medir", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        medir_en_este_proceso(args.url)
+        return
+
+    from sepaxml.validation import ValidationError, try_valid_xml
+    from app.modules.crm.sepa_generator import generar_remesas, filtro_ids
+
+    ok = True
+    engine, SessionLocal = crear_motor()
+    ids = poblar(engine, 500)
+    db = SessionLocal()
+    archivo, nombre, tipo, grupos = generar_remesas(db, [filtro_ids(ids)], EMPRESA)
+    print(f"🔎 Remesa de prueba: {nombre} ({', '.join(f'{g.secuencia}: {g.num_operaciones}' for g in grupos)})")
+    for contenido in _ficheros_xml(archivo, tipo):
+        try:
+            try_valid_xml(contenido, "pain.008.001.02")
+            valido = True
+        except ValidationError as e:
+            valido = False
+            print(f"   {e.__cause__}")
+        totales = comprobar_totales(contenido)
+        ok &= valido and totales
+        print(f"   {'✅' if valido else '❌'} XSD pain.008.001.02   {'✅' if totales else '❌'} NbOfTxs/CtrlSum")
+    db.close()
+
+    print("📊 Remesa SEPA en streaming (proceso aparte por tamaño)")
+    print(f"{'adeudos':>8} | {'ficheros':>8} | {'MB fichero':>10} | {'tiempo s':>8} | {'pico RSS MB':>11}")
+    for tamano in args.tamanos:
+        carpeta = tempfile.mkdtemp(prefix="bench_remesa_")
+        url = f"sqlite:///{os.path.join(carpeta, 'bench.db')}"
+        engine, _ = crear_motor(url)
+        poblar(engine, tamano)
+        salida = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_remesa_sepa", "--medir", str(tamano), "--url", url],
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+        operaciones, ficheros, megas, segundos, rss = salida[-5:]
+        ok &= int(operaciones) == tamano
+        print(f"{operaciones:>8} | {ficheros:>8} | {megas:>10} | {segundos:>8} | {rss:>11}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Sandbox del SQL que genera la IA (app/ia_sql.py)
+Sobre una base SQLite con clientes y facturas sintéticos comprueba que:
+  • el validador rechaza escrituras, varias sentencias y funciones peligrosas, y deja
+    pasar lecturas que solo mencionan esas palabras dentro de cadenas o comentarios
+  • la tabla users no se puede leer (autorizador de SQLite) y la conexión es de solo lectura
+  • un producto cartesiano se rechaza por coste sin llegar a ejecutarse
+  • un CTE recursivo infinito se corta por timeout
+  • el LIMIT envolvente trunca y el tiempo/memoria no dependen del tamaño del resultado
+Y mide, a través de /ia/consultar con Gemini sustituido por un stub, que el endpoint
+devuelve la negativa en lugar de ejecutar.
+
+Uso:
+    python -m benchmarks.bench_sql_ia
+    python -m benchmarks.bench_sql_ia --clientes 50000 --facturas 200000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench_sql_ia.db")
+os.environ.setdefault("GOOGLE_API_KEY", "stub")
+
+RECHAZADAS = [
+    ("DELETE FROM facturas", "escritura"),
+    ("SELECT 1; DROP TABLE clientes", "dos sentencias"),
+    ("WITH x AS (SELECT 1) DELETE FROM facturas", "CTE con escritura"),
+    ("WITH x AS (DELETE FROM facturas RETURNING id) SELECT COUNT(*) FROM x", "escritura dentro del CTE"),
+    ("SELECT * INTO copia FROM clientes", "SELECT INTO"),
+    ("PRAGMA table_info(clientes)", "PRAGMA"),
+    ("ATTACH DATABASE '/tmp/x.db' AS x", "ATTACH"),
+    ("SELECT load_extension('/tmp/x.so')", "load_extension"),
+    ("SELECT pg_sleep(10)", "pg_sleep"),
+    ("SELECT * FROM users", "tabla users"),
+    ("SELECT c.nombre FROM clientes c JOIN users u ON u.id = c.id", "join con users"),
+    ("SELECT COUNT(*) FROM users", "contar users"),
+    ("WITH u AS (SELECT * FROM users) SELECT COUNT(*) FROM u", "users dentro de un CTE"),
+    ("SELECT * FROM sqlite_master", "catálogo"),
+    ("", "vacía"),
+]
+PERMITIDAS = [
+    "SELECT COUNT(*) FROM clientes;",
+    "SELECT nombre FROM clientes WHERE nombre = 'DELETE; DROP TABLE x'",
+    "SELECT COUNT(*) FROM facturas -- delete from facturas",
+    "WITH pendientes AS (SELECT * FROM facturas WHERE estado = 'Pendiente') SELECT COUNT(*) FROM pendientes",
+    "SELECT c.nombre, SUM(f.monto) FROM clientes c JOIN facturas f ON f.cliente_id = c.id GROUP BY c.id "
+    "ORDER BY 2 DESC LIMIT 5",
+    "SELECT REPLACE(nombre, 'Cliente', 'C') AS do FROM clientes LIMIT 3",
+    "SELECT nombre AS copy, provincia AS lock, (estado) AS release FROM facturas f JOIN clientes c "
+    "ON c.id = f.cliente_id LIMIT 3",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clientes", type=int, default=20_000)
+    parser.add_argument("--facturas", type=int, default=100_000)
+    args = parser.parse_args()
+
+    from app.database import SessionLocal, engine
+    from app.modules.crm import models
+    from app import ia_sql
+    from app.ia_sql import ConsultaRechazada, ejecutar_consulta_ia, validar_select
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(models.Cliente.__table__.insert(), [
+            {"nombre": f"Cliente {i}", "nif_cif": f"{i:08d}X", "provincia": "Madrid" if i % 3 else "Sevilla"}
+            for i in range(1, args.clientes + 1)
+        ])
+        conn.execute(models.Factura.__table__.insert(), [
+            {"cliente_id": i % args.clientes + 1, "monto": i % 500, "concepto": "bench",
+             "estado": "Pendiente" if i % 4 else "Pagada"}
+            for i in range(args.facturas)
+        ])
+        conn.execute(models.User.__table__.insert(), [{"email": "admin@x", "hashed_password": "secreto"}])
+    motor = ia_sql.crear_motor_lectura(str(engine.url))
+    ok = True
+
+    def probar(nombre, correcto, detalle=""):
+        nonlocal ok
+        ok &= correcto
+        print(f"{'✅' if correcto else '❌'} {nombre}{': ' + detalle if detalle else ''}")
+
+    rechazadas = []
+    for sql, motivo in RECHAZADAS:
+        try:
+            ejecutar_consulta_ia(sql, motor)
+            rechazadas.append(f"{motivo} (se ejecutó)")
+        except ConsultaRechazada:
+            pass
+    probar(f"{len(RECHAZADAS)} consultas peligrosas rechazadas", not rechazadas, ", ".join(rechazadas))
+
+    fallidas = []
+    for sql in PERMITIDAS:
+        try:
+            ejecutar_consulta_ia(sql, motor)
+        except ConsultaRechazada as e:
+            fallidas.append(f"{sql[:40]}… ({e})")
+    probar(f"{len(PERMITIDAS)} lecturas legítimas ejecutadas (palabras clave en cadenas, comentarios, "
+           f"funciones y alias)",
+           not fallidas, "; ".join(fallidas))
+
+    # Aunque el validador dejase pasar algo, la conexión no puede escribir
+    crudo = motor.raw_connection()
+    try:
+        crudo.execute("UPDATE facturas SET monto = 0")
+        probar("conexión de solo lectura", False, "el UPDATE se ejecutó")
+    except Exception as e:
+        probar("conexión de solo lectura", "readonly" in str(e), str(e))
+    finally:
+        crudo.close()
+
+    inicio = time.perf_counter()
+    try:
+        ejecutar_consulta_ia("SELECT COUNT(*) FROM facturas a, facturas b", motor)
+        probar("producto cartesiano rechazado por coste", False, "se ejecutó")
+    except ConsultaRechazada as e:
+        probar("producto cartesiano rechazado por coste", "costosa" in str(e),
+               f"{str(e)} en {(time.perf_counter() - inicio) * 1000:.1f} ms")
+
+    sql = "SELECT c.nombre FROM clientes c WHERE c.id IN (SELECT cliente_id FROM facturas WHERE monto > 490)"
+    coste = ejecutar_consulta_ia(sql, motor).coste
+    probar("subconsulta con índice por debajo del umbral", coste < ia_sql.COSTE_MAXIMO_SQLITE, f"~{coste:,.0f} filas")
+
+    inicio = time.perf_counter()
+    try:
+        ejecutar_consulta_ia("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+                             "SELECT COUNT(*) FROM n", motor, timeout=0.5)
+        probar("CTE recursivo infinito cortado por timeout", False, "terminó")
+    except ConsultaRechazada as e:
+        segundos = time.perf_counter() - inicio
+        probar("CTE recursivo infinito cortado por timeout", "superó" in str(e) and segundos < 1.5,
+               f"{str(e)} tras {segundos:.2f}s")
+
+    print(f"📊 SELECT * de {args.facturas} facturas (sin sandbox: se leía entero con fetchall)")
+    with engine.connect() as conn:
+        from sqlalchemy import text
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        todo = conn.execute(text("SELECT * FROM facturas")).fetchall()
+        segundos_sin = time.perf_counter() - inicio
+        pico_sin = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del todo
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    resultado = ejecutar_consulta_ia("SELECT * FROM facturas", motor)
+    segundos_con = time.perf_counter() - inicio
+    pico_con = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"   sin sandbox: {segundos_sin * 1000:>8.1f} ms, pico {pico_sin / 1e6:>7.1f} MB")
+    print(f"   con sandbox: {segundos_con * 1000:>8.1f} ms, pico {pico_con / 1e6:>7.1f} MB "
+          f"({len(resultado.filas)} filas, truncado={resultado.truncado})")
+    probar(f"LIMIT envolvente ({ia_sql.MAX_FILAS} filas)",
+           len(resultado.filas) == ia_sql.MAX_FILAS and resultado.truncado and pico_con < pico_sin / 10)
+
+    # De extremo a extremo: el endpoint contesta con la negativa y no toca la base
+    from fastapi.testclient import TestClient
+    from app.main import app, limiter
+    from app import ia_service
+    from app.ia_cache import cache_ia
+
+    ia_sql._motor = motor
+    limiter.enabled = False
+    cache_ia.vaciar()
+    sql_de = {"borra": "DELETE FROM facturas", "usuarios": "SELECT hashed_password FROM users",
+              "cuenta": "SELECT COUNT(*) FROM facturas"}
+
+    async def stub(prompt, max_tokens, timeout):
+        if prompt.startswith("Genera solo SQL"):
+            return next(sql for clave, sql in sql_de.items() if clave in prompt)
+        return prompt  # Devuelve los datos que recibió el modelo
+
+    ia_service.PROVEEDORES[ia_service.GEMINI].llamar = stub
+    with TestClient(app) as cliente:
+        respuestas = {clave: cliente.post("/ia/consultar", json={"prompt": clave}).json()["reply"] for clave in sql_de}
+    db = SessionLocal()
+    facturas = db.query(models.Factura).count()
+    db.close()
+    probar("/ia/consultar rechaza el DELETE y no borra nada",
+           respuestas["borra"].startswith("No puedo ejecutar") and facturas == args.facturas, respuestas["borra"])
+    probar("/ia/consultar no lee users", respuestas["usuarios"].startswith("No puedo ejecutar")
+           and "secreto" not in respuestas["usuarios"], respuestas["usuarios"])
+    probar("/ia/consultar responde una lectura normal", f"[({args.facturas},)]" in respuestas["cuenta"])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Comparador de tarifas (app/modules/energia/tarifas.py)
+Crea TARIFAS tarifas (2.0TD, 3.0TD y sin peaje) y una cartera de CONTRATOS contratos con
+sus puntos de suministro, y compara:
+  • bucle: lo que haría una implementación directa, contrato a contrato y tarifa a tarifa
+    (se mide sobre una muestra y se extrapola; también sirve para validar el resultado)
+  • vectorizado: comparar_cartera() (matriz de tarifas en NumPy, costes por bloques)
+Comprueba además la caché de la matriz (solo se recarga tras un commit que toque tarifas)
+y que /energia/analizar-factura devuelve ofertas calculadas con las tarifas.
+
+Uso:
+    python -m benchmarks.bench_tarifas
+    python -m benchmarks.bench_tarifas --contratos 200000 --tarifas 500
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench_tarifas.db")
+os.environ.setdefault("GOOGLE_API_KEY", "stub")
+
+
+def coste_bucle(contrato, tarifas, horas_equivalentes, tarifas_mod):
+    """Coste anual contra cada tarifa, sin NumPy (referencia)"""
+    potencias = [contrato.p1 or 0, contrato.p2 or 0, contrato.p3 or 0, contrato.p4 or 0, contrato.p5 or 0, contrato.p6 or 0]
+    maxima = max(potencias)
+    peaje = tarifas_mod.normalizar_peaje(contrato.tarifa_acceso) or tarifas_mod.peaje_por_potencia(maxima)
+    reparto = tarifas_mod.REPARTO_CONSUMO.get(peaje, tarifas_mod.REPARTO_CONSUMO["3.0TD"])
+    consumos = [maxima * horas_equivalentes * r for r in reparto]
+    costes = {}
+    for t in tarifas:
+        tipo = tarifas_mod.normalizar_peaje(t.tipo)
+        if tipo and tipo != peaje:
+            continue
+        coste = maxima * t.precio_potencia * 365 + sum(c * t.precio_energia for c in consumos)
+        costes[t.id] = coste * tarifas_mod.FACTOR_IMPUESTOS
+    return costes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--contratos", type=int, default=50_000)
+    parser.add_argument("--tarifas", type=int, default=300)
+    parser.add_argument("--muestra-bucle", type=int, default=2_000)
+    args = parser.parse_args()
+
+    from sqlalchemy import select
+    from app.database import SessionLocal, engine
+    from app.modules.crm import models
+    from app.modules.energia import tarifas as tarifas_mod
+    from app.modules.energia.tarifas import comparar_cartera, matriz_tarifas
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    rnd = random.Random(20)
+    companias = ["Loviluz", "Iberdrola", "Endesa", "Naturgy", "Repsol", "TotalEnergies"]
+    filas_tarifas = []
+    for i in range(1, args.tarifas + 1):
+        tipo = rnd.choice(["2.0TD", "3.0TD", "2.0 TD", ""])
+        filas_tarifas.append({
+            "id": i, "nombre": f"Plan {i}", "compania": rnd.choice(companias), "tipo": tipo,
+            "precio_potencia": round(rnd.uniform(0.06, 0.14), 6), "precio_energia": round(rnd.uniform(0.09, 0.22), 6),
+            "is_active": rnd.random() > 0.1,
+        })
+    with engine.begin() as conn:
+        conn.execute(models.Tarifa.__table__.insert(), filas_tarifas)
+        conn.execute(models.PuntoSuministro.__table__.insert(), [
+            {"id": i, "cups": f"ES{i:020d}", "tarifa_acceso": rnd.choice(["2.0TD", "3.0TD", "", None])}
+            for i in range(1, args.contratos + 1)
+        ])
+        contratos = []
+        for i in range(1, args.contratos + 1):
+            grande = rnd.random() < 0.3
+            p = round(rnd.uniform(15, 60) if grande else rnd.choice([3.3, 3.45, 4.6, 5.75, 6.9, 9.2]), 3)
+            actual = rnd.choice(filas_tarifas)
+            contratos.append({
+                "id": i, "punto_suministro_id": i, "comercializadora": actual["compania"], "producto": actual["nombre"],
+                "p1": p, "p2": p, "p3": p if grande else 0, "p4": p if grande else 0, "p5": p if grande else 0,
+                "p6": round(p * 1.2, 3) if grande else 0, "estado": "Activo",
+            })
+        conn.execute(models.Contrato.__table__.insert(), contratos)
+
+    ok = True
+    db = SessionLocal()
+    tarifas_mod.invalidar_tarifas()
+    inicio = time.perf_counter()
+    matriz = matriz_tarifas(db)
+    carga = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    for _ in range(1000):
+        matriz_tarifas(db)
+    en_cache = (time.perf_counter() - inicio) / 1000
+    print(f"🧮 Matriz de {len(matriz)} tarifas activas: carga {carga * 1000:.1f} ms, en caché {en_cache * 1e6:.1f} µs")
+
+    # --- Cartera entera, vectorizado ---
+    inicio = time.perf_counter()
+    resultado = comparar_cartera(db)
+    segundos_vector = time.perf_counter() - inicio
+
+    # --- Muestra en bucle (referencia) ---
+    c, ps = models.Contrato, models.PuntoSuministro
+    muestra = db.execute(
+        select(c.id, c.comercializadora, c.producto, ps.tarifa_acceso, c.p1, c.p2, c.p3, c.p4, c.p5, c.p6)
+        .join(ps, ps.id == c.punto_suministro_id).order_by(c.id).limit(args.muestra_bucle)
+    ).all()
+    activas = db.query(models.Tarifa).filter(models.Tarifa.is_active.is_(True)).all()
+    inicio = time.perf_counter()
+    referencia = {f.id: coste_bucle(f, activas, tarifas_mod.HORAS_EQUIVALENTES, tarifas_mod) for f in muestra}
+    segundos_bucle = (time.perf_counter() - inicio) * args.contratos / len(muestra)
+
+    print(f"📊 {args.contratos} contratos × {len(matriz)} tarifas")
+    print(f"   bucle (extrapolado de {len(muestra)}): {segundos_bucle:>8.2f}s")
+    print(f"   vectorizado:                  {segundos_vector:>8.2f}s ({segundos_bucle / segundos_vector:.0f}x), "
+          f"{resultado['comparados']} comparados, ahorro total {resultado['ahorro_total']:,.0f} €/año")
+
+    por_id = {r["contrato_id"]: r for r in resultado["resultados"]}
+    discrepancias = 0
+    for contrato_id, costes in referencia.items():
+        mejor_id = min(costes, key=costes.get)
+        r = por_id.get(contrato_id)
+        if r is None or abs(r["coste_anual"] - round(costes[mejor_id], 2)) > 0.01:
+            discrepancias += 1
+    correcto = discrepancias == 0
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} Mismo coste mínimo que el bucle en {len(referencia)} contratos "
+          f"({discrepancias} discrepancias)")
+
+    # --- Caché: solo un commit que toque tarifas la invalida ---
+    db.add(models.Ticket(asunto="bench", descripcion="x"))
+    db.commit()
+    sigue = matriz_tarifas(db) is matriz
+    tarifa = db.get(models.Tarifa, activas[0].id)
+    tarifa.precio_energia = 0.001  # La más barata con diferencia
+    db.commit()
+    nueva = matriz_tarifas(db)
+    correcto = sigue and nueva is not matriz and comparar_cartera(db, [muestra[0].id])["resultados"][0]["tarifa_id"] in (
+        tarifa.id, *[t.id for t in activas if not tarifas_mod.normalizar_peaje(t.tipo)])
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} Caché: un commit en tickets no la toca; cambiar un precio la recarga")
+    db.close()
+
+    # --- Ofertas de /energia/analizar-factura ---
+    from fastapi.testclient import TestClient
+    from app.main import app, limiter
+    from app.modules.auth.utils import get_current_active_user
+    from benchmarks.bench_extractor_factura import factura_sintetica
+
+    limiter.enabled = False
+    app.dependency_overrides[get_current_active_user] = lambda: None
+    pdf, verdad = factura_sintetica(random.Random(1), "lineas")
+    with TestClient(app) as cliente:
+        r = cliente.post("/energia/analizar-factura", files={"factura": ("f.pdf", pdf, "application/pdf")}).json()
+        cartera = cliente.post("/energia/comparar-cartera?solo_con_ahorro=true", json=[m.id for m in muestra[:50]]).json()
+    ofertas = r.get("ofertas", [])
+    correcto = (len(ofertas) == 3 and all(o["coste_anual"] <= p["coste_anual"] for o, p in zip(ofertas, ofertas[1:]))
+                and all(o["ahorro"].endswith("€") for o in ofertas))
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} /energia/analizar-factura: " +
+          ", ".join(f"{o['compania']} {o['nombre']} {o['coste_anual']:.0f} €/año (ahorro {o['ahorro']})" for o in ofertas))
+
+    correcto = (cartera.get("contratos") == 50 and all(x["ahorro_anual"] > 0 for x in cartera["resultados"])
+                and len(cartera["resultados"]) == cartera["comparados"])
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} /energia/comparar-cartera: {cartera.get('comparados')} de 50 contratos "
+          f"con ahorro, {cartera.get('ahorro_total', 0):,.0f} €/año")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
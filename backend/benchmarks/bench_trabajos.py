@@ -0,0 +1,182 @@
+"""
+Trabajos en segundo plano
+  1. Remesa SEPA de N adeudos: lo que tarda la petición síncrona frente a lo que
+     tarda encolarla (la API responde al instante) y el trabajo completo, con el
+     progreso que ve el usuario mientras tanto.
+  2. Reserva atómica: dos gestores (como dos procesos de uvicorn) sobre la misma
+     base con 200 trabajos cortos; cada uno debe ejecutarse exactamente una vez.
+  3. Recuperación: un trabajo "En curso" con la reserva vencida (proceso muerto)
+     vuelve a la cola y termina; tras MAX_INTENTOS queda en Error.
+  4. Descarga (/jobs/{id}/resultado): solo de trabajos terminados, completados o con
+     error (informe de rechazos); uno pendiente o en curso da 409 aunque tenga fichero.
+
+Uso:
+    python -m benchmarks.bench_trabajos
+    python -m benchmarks.bench_trabajos --adeudos 200000
+"""
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from pathlib import Path
+
+from benchmarks.bench_remesa_sepa import poblar
+from benchmarks.comun import crear_motor
+
+
+def esperar(SessionLocal, trabajo_id: int, timeout: float = 600, al_consultar=None):
+    from app.modules.crm import models
+    limite = time.perf_counter() + timeout
+    while time.perf_counter() < limite:
+        db = SessionLocal()
+        try:
+            trabajo = db.get(models.Trabajo, trabajo_id)
+            if al_consultar:
+                al_consultar(trabajo)
+            if trabajo.estado in ("Completado", "Error"):
+                return trabajo
+        finally:
+            db.close()
+        time.sleep(0.05)
+    raise TimeoutError(f"El trabajo {trabajo_id} no ha terminado")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--adeudos", type=int, default=100_000)
+    args = parser.parse_args()
+
+    from app.modules.crm import models
+    from app.modules.crm.sepa_generator import generar_remesas, EMPRESA_SEPA
+    from app.modules.crm.sepa_validacion import validar_remesa
+    from app.modules.trabajos import gestor
+    from app.modules.trabajos.tipos import MANEJADORES, TIPO_REMESA_SEPA
+
+    gestor.TRABAJOS_DIR = Path(tempfile.mkdtemp(prefix="bench_trabajos_"))
+    ok = True
+
+    # 1. Síncrono frente a encolado
+    engine, SessionLocal = crear_motor()
+    poblar(engine, args.adeudos)
+    db = SessionLocal()
+    inicio = time.perf_counter()
+    filtros = [models.Factura.estado == "Pendiente"]
+    validar_remesa(db, filtros, EMPRESA_SEPA, date.today() + timedelta(days=1))
+    archivo, _, _, grupos = generar_remesas(db, filtros, EMPRESA_SEPA)
+    archivo.close()
+    sincrono = time.perf_counter() - inicio
+    print(f"📊 Remesa de {args.adeudos} adeudos en la petición (síncrono): {sincrono:.2f}s")
+
+    gestor_trabajos = gestor.GestorTrabajos(SessionLocal, MANEJADORES, workers=2)
+    gestor_trabajos.iniciar()
+    inicio = time.perf_counter()
+    trabajo = gestor.encolar_trabajo(db, TIPO_REMESA_SEPA, {"estado": "Pendiente"})
+    encolar = time.perf_counter() - inicio
+    vistos = []
+
+    def apuntar(t):
+        if (t.progreso, t.mensaje) not in vistos:
+            vistos.append((t.progreso, t.mensaje))
+
+    terminado = esperar(SessionLocal, trabajo.id, al_consultar=apuntar)
+    total = time.perf_counter() - inicio
+    correcto = terminado.estado == "Completado" and terminado.resultado["operaciones"] == args.adeudos \
+        and Path(terminado.archivo).exists()
+    ok &= correcto
+    print(f"📊 Encolar: {encolar * 1000:.1f} ms (respuesta de la API); trabajo completo: {total:.2f}s")
+    print(f"   Progreso visto: {' -> '.join(f'{p:.0%} {m}' for p, m in vistos)}")
+    print(f"{'✅' if correcto else '❌'} {terminado.resultado.get('operaciones')} operaciones en {terminado.archivo_nombre}")
+    gestor_trabajos.parar()
+    db.close()
+
+    # 2. Dos gestores compitiendo por la misma cola
+    engine, SessionLocal = crear_motor()
+    ejecuciones = Counter()
+    lock = threading.Lock()
+
+    def corto(contexto, parametros):
+        with lock:
+            ejecuciones[contexto.trabajo_id] += 1
+        time.sleep(0.002)
+        return {"n": parametros["n"]}
+
+    db = SessionLocal()
+    ids = [gestor.encolar_trabajo(db, "corto", {"n": i}).id for i in range(200)]
+    gestores = [gestor.GestorTrabajos(SessionLocal, {"corto": corto}, workers=3, intervalo=0.05) for _ in range(2)]
+    inicio = time.perf_counter()
+    for g in gestores:
+        g.iniciar()
+    for trabajo_id in ids:
+        esperar(SessionLocal, trabajo_id)
+    segundos = time.perf_counter() - inicio
+    for g in gestores:
+        g.parar()
+    duplicados = sum(1 for n in ejecuciones.values() if n > 1)
+    correcto = len(ejecuciones) == len(ids) and duplicados == 0
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} 200 trabajos con 2 gestores x 3 hilos en {segundos:.2f}s: "
+          f"{len(ejecuciones)} ejecutados, {duplicados} repetidos")
+
+    # 3. Recuperación de trabajos abandonados
+    ahora = gestor._ahora()
+    abandonado = models.Trabajo(tipo="corto", estado=gestor.ESTADO_EN_CURSO, parametros={"n": -1}, intentos=1,
+                                reservado_hasta=ahora - timedelta(seconds=1))
+    agotado = models.Trabajo(tipo="corto", estado=gestor.ESTADO_EN_CURSO, parametros={"n": -2},
+                             intentos=gestor.MAX_INTENTOS, reservado_hasta=ahora - timedelta(seconds=1))
+    vigente = models.Trabajo(tipo="corto", estado=gestor.ESTADO_EN_CURSO, parametros={"n": -3}, intentos=1,
+                             reservado_hasta=ahora + timedelta(minutes=5))
+    db.add_all([abandonado, agotado, vigente])
+    db.commit()
+    g = gestor.GestorTrabajos(SessionLocal, {"corto": corto}, workers=1, intervalo=0.05)
+    g.iniciar()  # iniciar() late una vez: recupera lo vencido antes de reservar
+    recuperado = esperar(SessionLocal, abandonado.id, timeout=10)
+    g.parar()
+    db.expire_all()
+    correcto = (recuperado.estado == "Completado" and recuperado.intentos == 2
+                and db.get(models.Trabajo, agotado.id).estado == gestor.ESTADO_ERROR
+                and db.get(models.Trabajo, vigente.id).estado == gestor.ESTADO_EN_CURSO)
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} Reserva vencida -> reintento (intento {recuperado.intentos}); "
+          f"agotado -> {db.get(models.Trabajo, agotado.id).estado}; vigente sigue {db.get(models.Trabajo, vigente.id).estado}")
+
+    # 4. Descarga del fichero según el estado
+    from fastapi.testclient import TestClient
+    from app.database import get_db
+    from app.main import app, limiter
+    from app.modules.auth.utils import get_current_active_user
+
+    fichero = gestor.TRABAJOS_DIR / "informe.csv"
+    fichero.write_text("fila;motivo\n")
+    esperado = {gestor.ESTADO_PENDIENTE: 409, gestor.ESTADO_EN_CURSO: 409,
+                gestor.ESTADO_COMPLETADO: 200, gestor.ESTADO_ERROR: 200}
+    trabajos = {estado: models.Trabajo(tipo="corto", estado=estado, archivo=str(fichero), archivo_nombre="informe.csv",
+                                       archivo_tipo="text/csv") for estado in esperado}
+    db.add_all(trabajos.values())
+    db.commit()
+
+    def db_de_prueba():
+        sesion = SessionLocal()
+        try:
+            yield sesion
+        finally:
+            sesion.close()
+
+    limiter.enabled = False
+    app.dependency_overrides[get_db] = db_de_prueba
+    app.dependency_overrides[get_current_active_user] = lambda: models.User(id=0, role="admin")
+    cliente = TestClient(app)
+    obtenido = {estado: cliente.get(f"/jobs/{t.id}/resultado").status_code for estado, t in trabajos.items()}
+    app.dependency_overrides.clear()
+    correcto = obtenido == esperado
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} Descarga del resultado por estado: "
+          + ", ".join(f"{estado} {codigo}" for estado, codigo in obtenido.items()))
+    db.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Validación previa de remesas SEPA
+  1. Compara el mod-97 vectorizado con una comprobación IBAN a IBAN (referencia) sobre
+     IBAN válidos, con un dígito cambiado, con letras, vacíos y de otros países.
+  2. Mide la validación de 100k adeudos de extremo a extremo (consultas + cálculo),
+     con la caché de IBAN fría y caliente, y comprueba los rechazos por motivo.
+
+Uso:
+    python -m benchmarks.bench_validacion_sepa
+    python -m benchmarks.bench_validacion_sepa --adeudos 200000
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from benchmarks.bench_remesa_sepa import EMPRESA
+from benchmarks.comun import crear_motor, insertar_en_lotes
+
+
+def iban_espanol(rnd: random.Random) -> str:
+    bban = "".join(rnd.choice("0123456789") for _ in range(20))
+    control = 98 - int(bban + "142800") % 97  # "ES00" -> 14 28 00
+    return f"ES{control:02d}{bban}"
+
+
+def iban_valido_referencia(iban) -> bool:
+    from app.modules.crm.sepa_validacion import LONGITUD_IBAN
+    iban = str(iban or "").replace(" ", "").upper()
+    if len(iban) != LONGITUD_IBAN.get(iban[:2]) or not iban.isascii() or not iban.isalnum() or not iban[2:4].isdigit():
+        return False
+    return int("".join(str(int(c, 36)) for c in iban[4:] + iban[:4])) % 97 == 1
+
+
+def muestras(rnd: random.Random, n: int):
+    ibanes = []
+    for _ in range(n):
+        iban = iban_espanol(rnd)
+        tipo = rnd.random()
+        if tipo < 0.1:  # Un dígito cambiado
+            i = rnd.randrange(4, len(iban))
+            iban = iban[:i] + str((int(iban[i]) + 1) % 10) + iban[i + 1:]
+        elif tipo < 0.15:
+            iban = iban[:-1]
+        elif tipo < 0.18:
+            iban = None
+        elif tipo < 0.2:
+            iban = " ".join(iban[i:i + 4] for i in range(0, len(iban), 4)).lower()
+        ibanes.append(iban)
+    return ibanes + ["GB82WEST12345698765432", "DE89370400440532013000", "NL91ABNA0417164300",
+                     "XX00123", "ES91210004184502000513ÑÑ", ""]
+
+
+def poblar(engine, n_adeudos: int, rnd: random.Random):
+    """Clientes con IBAN (5% con errores), algunos mandatos futuros e importes a cero"""
+    from app.modules.crm import models
+    n_clientes = max(1, n_adeudos // 4)
+    clientes = []
+    for i in range(1, n_clientes + 1):
+        iban = iban_espanol(rnd)
+        if i % 20 == 0:
+            iban = iban[:-1] + str((int(iban[-1]) + 1) % 10)
+        clientes.append({"id": i, "nombre": f"Cliente {i}", "nif_cif": f"B{i:08d}", "tipo_cliente": "PYME",
+                         "iban": None if i % 97 == 0 else iban,
+                         "created_at": datetime(2030, 1, 1) if i % 101 == 0 else datetime(2023, 1, 1)})
+    insertar_en_lotes(engine, models.Cliente.__table__, clientes)
+    insertar_en_lotes(engine, models.Factura.__table__, [
+        {"id": i, "monto": 0 if i % 500 == 0 else round(rnd.uniform(20, 900), 2), "concepto": f"Factura {i}",
+         "estado": "Pendiente", "created_at": datetime(2024, 1, 1) + timedelta(minutes=i),
+         "cliente_id": (i - 1) % n_clientes + 1}
+        for i in range(1, n_adeudos + 1)
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--adeudos", type=int, default=100_000)
+    args = parser.parse_args()
+
+    from app.modules.crm import models
+    from app.modules.crm.sepa_validacion import ibanes_validos, invalidar_cache_ibanes, validar_remesa
+
+    rnd = random.Random(97)
+    ok = True
+
+    ibanes = muestras(rnd, 20_000)
+    vectorizado = ibanes_validos(ibanes).tolist()
+    referencia = [iban_valido_referencia(i) for i in ibanes]
+    distintos = sum(a != b for a, b in zip(vectorizado, referencia))
+    ok &= distintos == 0
+    print(f"{'✅' if distintos == 0 else '❌'} mod-97 vectorizado = referencia en {len(ibanes)} IBAN "
+          f"({sum(referencia)} válidos, {distintos} discrepancias)")
+
+    ibanes = [iban_espanol(rnd) for _ in range(args.adeudos)]
+    inicio = time.perf_counter()
+    [iban_valido_referencia(i) for i in ibanes]
+    uno_a_uno = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    ibanes_validos(ibanes)
+    en_bloque = time.perf_counter() - inicio
+    print(f"📊 {args.adeudos} IBAN distintos: uno a uno {uno_a_uno:.2f}s, vectorizado {en_bloque:.3f}s")
+
+    engine, SessionLocal = crear_motor()
+    poblar(engine, args.adeudos, rnd)
+    db = SessionLocal()
+    filtros = [models.Factura.estado == "Pendiente"]
+    fecha_cobro = date.today() + timedelta(days=1)
+
+    for etiqueta in ("caché fría", "caché caliente"):
+        if etiqueta == "caché fría":
+            invalidar_cache_ibanes()
+        resultado = validar_remesa(db, filtros, EMPRESA, fecha_cobro)
+        print(f"📊 {resultado.revisados} adeudos con la consulta ({etiqueta}): {resultado.segundos:.3f}s")
+
+    por_motivo = {}
+    for r in resultado.rechazos:
+        por_motivo[r.motivo] = por_motivo.get(r.motivo, 0) + 1
+    for motivo, n in sorted(por_motivo.items()):
+        print(f"   {n:>6}  {motivo}")
+    for aviso in resultado.avisos:
+        print(f"   ⚠️  {aviso}")
+
+    # Lo que se espera de poblar(): IBAN malos/vacíos cada 20/97 clientes, mandatos futuros cada 101, importes 0 cada 500
+    n_clientes = max(1, args.adeudos // 4)
+    esperados = {
+        "IBAN no válido (formato, longitud o dígitos de control)": sum(4 for c in range(1, n_clientes + 1) if c % 20 == 0 and c % 97),
+        "El cliente no tiene IBAN": sum(4 for c in range(1, n_clientes + 1) if c % 97 == 0),
+        "Mandato firmado después de la fecha de cobro": sum(4 for c in range(1, n_clientes + 1) if c % 101 == 0),
+        "El importe debe ser mayor que cero": args.adeudos // 500,
+    }
+    correcto = por_motivo == esperados
+    ok &= correcto
+    print(f"{'✅' if correcto else '❌'} rechazos esperados por motivo")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Utilidades compartidas por los benchmarks
+Ejecutar siempre desde la carpeta backend: python -m benchmarks.<nombre>
+"""
+import os
+import tempfile
+import time
+import statistics
+from contextlib import contextmanager
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.modules.crm import models
+
+
+def crear_motor(url: str = None):
+    """
+    Crea un motor aislado para el benchmark
+    Sin URL usa un SQLite temporal; con URL (ej. postgresql://...) usa esa base
+    """
+    if not url:
+        carpeta = tempfile.mkdtemp(prefix="bench_loviluz_")
+        url = f"sqlite:///{os.path.join(carpeta, 'bench.db')}"
+
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    engine = create_engine(url, connect_args=connect_args)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def insertar_en_lotes(engine, tabla, filas, tamano_lote: int = 20000):
+    """Inserta una lista de dicts con executemany, en transacciones de `tamano_lote` filas"""
+    for i in range(0, len(filas), tamano_lote):
+        with engine.begin() as conn:
+            conn.execute(tabla.insert(), filas[i:i + tamano_lote])
+
+
+def medir(funcion, repeticiones: int = 20):
+    """Ejecuta `funcion` varias veces y devuelve (mediana, p95) en milisegundos"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    p95 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]
+    return statistics.median(tiempos), p95
+
+
+@contextmanager
+def cronometro(etiqueta: str):
+    """Imprime cuánto tarda el bloque"""
+    inicio = time.perf_counter()
+    yield
+    print(f"   ⏱️  {etiqueta}: {time.perf_counter() - inicio:.2f}s")
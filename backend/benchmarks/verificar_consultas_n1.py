@@ -0,0 +1,94 @@
+"""
+Regresión N+1: /renovaciones/pendientes y /procesos-atr/
+Cuenta las sentencias SQL que lanza cada endpoint con 10 y con 1000 filas y
+falla (exit 1) si el número de consultas crece con el volumen de datos.
+
+Uso:
+    python -m benchmarks.verificar_consultas_n1
+"""
+import sys
+from datetime import date, timedelta
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from app.main import app
+from app.database import get_db, get_async_db, url_async
+from app.modules.auth.utils import get_current_active_user
+from app.modules.crm import models
+from benchmarks.comun import crear_motor, insertar_en_lotes
+
+ENDPOINTS = ["/renovaciones/pendientes", "/procesos-atr/"]
+
+
+def poblar(engine, n: int):
+    hoy = date.today()
+    insertar_en_lotes(engine, models.Cliente.__table__, [
+        {"id": i, "nombre": f"Cliente {i}", "nif_cif": f"B{i:08d}", "telefono": "600000000"} for i in range(1, n + 1)
+    ])
+    insertar_en_lotes(engine, models.PuntoSuministro.__table__, [
+        {"id": i, "cups": f"ES{i:018d}AA", "cliente_id": i} for i in range(1, n + 1)
+    ])
+    insertar_en_lotes(engine, models.Contrato.__table__, [
+        {"id": i, "punto_suministro_id": i, "estado": "Activo", "comercializadora": "Loviluz",
+         "fecha_fin": hoy + timedelta(days=i % 40)} for i in range(1, n + 1)
+    ])
+    insertar_en_lotes(engine, models.ProcesoATR.__table__, [
+        {"id": i, "contrato_id": i, "codigo_solicitud": f"ATR-{i}"} for i in range(1, n + 1)
+    ])
+
+
+def contar_consultas(n: int) -> dict:
+    engine, SessionLocal = crear_motor()
+    poblar(engine, n)
+
+    # Los endpoints async (get_async_db) van por otro motor sobre el mismo fichero; sin pool,
+    # porque TestClient abre un bucle de eventos por petición
+    motor_async = create_async_engine(url_async(str(engine.url)), poolclass=NullPool)
+    SesionAsync = async_sessionmaker(motor_async, autoflush=False, expire_on_commit=False)
+
+    sentencias = []
+    for motor in (engine, motor_async.sync_engine):
+        event.listen(motor, "before_cursor_execute", lambda *args: sentencias.append(args[2]))
+
+    def db_de_prueba():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def db_async_de_prueba():
+        async with SesionAsync() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = db_de_prueba
+    app.dependency_overrides[get_async_db] = db_async_de_prueba
+    app.dependency_overrides[get_current_active_user] = lambda: None
+    cliente = TestClient(app)
+
+    resultado = {}
+    try:
+        for url in ENDPOINTS:
+            sentencias.clear()
+            respuesta = cliente.get(url)
+            respuesta.raise_for_status()
+            resultado[url] = (len(sentencias), len(respuesta.json()))
+    finally:
+        app.dependency_overrides.clear()
+    return resultado
+
+
+def main():
+    pequeno, grande = contar_consultas(10), contar_consultas(1000)
+    ok = True
+    for url in ENDPOINTS:
+        (q1, f1), (q2, f2) = pequeno[url], grande[url]
+        estado = "✅" if q1 == q2 else "❌"
+        ok &= q1 == q2
+        print(f"{estado} {url}: {q1} consultas ({f1} filas) vs {q2} consultas ({f2} filas)")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
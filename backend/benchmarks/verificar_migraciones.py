@@ -0,0 +1,142 @@
+"""
+Migraciones sobre bases de datos de antes de Alembic (creadas con create_all, sin alembic_version)
+Para cada forma de partida crea la base de datos, mete datos y la actualiza; falla (exit 1) si
+no llega a head, si el esquema no queda igual que models.py o si se pierde algún dato.
+  • esquema inicial: el de 0001, tal cual (y sin tarifas.tipo, como las más antiguas);
+    la actualiza la propia API al arrancar (import app.main en otro proceso)
+  • create_all intermedio: parte de lo añadido después (sin la tabla trabajos ni algún índice);
+    migrar_bd()
+  • create_all con los modelos actuales: alembic upgrade head desde la línea de comandos
+
+Uso:
+    python -m benchmarks.verificar_migraciones
+"""
+import os
+import subprocess
+import sys
+
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/verificar_migraciones.db")
+os.environ.setdefault("GOOGLE_API_KEY", "stub")
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import sessionmaker
+from alembic import op
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from alembic.script import ScriptDirectory
+from app.database import CARPETA_BACKEND, configuracion_alembic, crear_motor, migrar_bd
+from app.modules.crm import models
+
+
+def sin_alembic(motor):
+    with motor.begin() as conn:
+        conn.execute(text("DROP TABLE alembic_version"))
+
+
+def esquema_inicial(motor):
+    migrar_bd(motor, "0001")
+    sin_alembic(motor)
+    with motor.begin() as conn:
+        with Operations.context(MigrationContext.configure(conn)):
+            with op.batch_alter_table("tarifas") as batch_op:
+                batch_op.drop_column("tipo")
+
+
+def create_all_intermedio(motor):
+    migrar_bd(motor, "0002")
+    sin_alembic(motor)
+    with motor.begin() as conn:
+        conn.execute(text("DROP TABLE trabajos"))
+        conn.execute(text("DROP INDEX ix_tickets_estado"))
+        conn.execute(text("DROP INDEX ix_clientes_dynamics_id"))
+
+
+def create_all_actual(motor):
+    models.Base.metadata.create_all(bind=motor)
+
+
+def poblar(motor):
+    with motor.begin() as conn:
+        conn.execute(text("INSERT INTO clientes (id, nombre, nif_cif, email, is_active) "
+                          "VALUES (1, 'Cliente 1', 'B00000001', 'c1@mail.es', 1)"))
+        conn.execute(text("INSERT INTO puntos_suministro (id, cups, cliente_id) VALUES (1, 'ES0000000000000001AA', 1)"))
+        conn.execute(text("INSERT INTO contratos (id, punto_suministro_id, estado, p1) VALUES (1, 1, 'Activo', 4.6)"))
+        conn.execute(text("INSERT INTO facturas (id, cliente_id, monto, estado) VALUES (1, 1, 50.0, 'Pendiente')"))
+        conn.execute(text("INSERT INTO tarifas (id, nombre, compania, precio_potencia, precio_energia, is_active) "
+                          "VALUES (1, 'Plan 1', 'Loviluz', 0.1, 0.15, 1)"))
+
+
+def arrancar_api(url: str):
+    """Importa app.main (aplica las migraciones al arrancar) y lee los clientes, en otro proceso"""
+    codigo = ("import app.main\n"
+              "from app.database import SessionLocal\n"
+              "from app.modules.crm import models\n"
+              "db = SessionLocal()\n"
+              "print([c.dynamics_id for c in db.query(models.Cliente).all()])\n")
+    return subprocess.run([sys.executable, "-c", codigo], cwd=CARPETA_BACKEND, capture_output=True, text=True,
+                          env={**os.environ, "DATABASE_URL": url})
+
+
+def migrar(url: str):
+    motor = crear_motor(url)
+    migrar_bd(motor)
+    motor.dispose()
+
+
+def alembic_cli(url: str):
+    return subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=CARPETA_BACKEND,
+                          capture_output=True, text=True, env={**os.environ, "DATABASE_URL": url})
+
+
+def verificar(nombre: str, preparar, actualizar, url: str) -> bool:
+    ruta = url.split("///", 1)[1]
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(ruta + sufijo):
+            os.remove(ruta + sufijo)
+    motor = crear_motor(url)
+    preparar(motor)
+    poblar(motor)
+    motor.dispose()
+
+    salida = actualizar(url)
+    if salida is not None and salida.returncode != 0:
+        print(f"❌ {nombre}: falla al actualizar\n      " + salida.stderr.strip().replace("\n", "\n      "))
+        return False
+
+    motor = crear_motor(url)
+    with motor.connect() as conn:
+        version = conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+        diferencias = compare_metadata(MigrationContext.configure(conn), models.Base.metadata)
+        heads = MigrationContext.configure(conn).get_current_heads()
+    db = sessionmaker(bind=motor)()
+    try:
+        cliente = db.get(models.Cliente, 1)
+        datos = (cliente is not None and cliente.nif_cif == "B00000001" and db.get(models.Contrato, 1).p1 == 4.6
+                 and db.get(models.Factura, 1).monto == 50.0 and db.get(models.Tarifa, 1).nombre == "Plan 1")
+        cliente.dynamics_id = "d365-1"  # Las columnas nuevas se pueden usar
+        db.add(models.Trabajo(tipo="remesa_sepa"))
+        db.commit()
+    finally:
+        db.close()
+    tablas = set(inspect(motor).get_table_names())
+    motor.dispose()
+
+    head = ScriptDirectory.from_config(configuracion_alembic()).get_current_head()
+    correcto = heads == (head,) and not diferencias and datos and {"trabajos", "cola_dynamics365"} <= tablas
+    print(f"{'✅' if correcto else '❌'} {nombre}: revisión {version}, "
+          f"{'mismo esquema que models.py' if not diferencias else f'diferencias: {diferencias}'}, "
+          f"{'datos intactos' if datos else 'DATOS PERDIDOS'}")
+    return correcto
+
+
+def main():
+    url = os.environ["DATABASE_URL"]
+    ok = verificar("Esquema inicial (arranque de la API)", esquema_inicial, arrancar_api, url)
+    ok &= verificar("create_all intermedio (migrar_bd)", create_all_intermedio, migrar, url)
+    ok &= verificar("create_all actual (alembic upgrade head)", create_all_actual, alembic_cli, url)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,19 @@
-import pandas as pd
+from openpyxl import load_workbook
+from app.modules.cartera.lector import leer_excel_por_bloques
 
 archivo = "cartera.xlsx"
 hoja = "2-Contratos-Listado-energía"
 
 print(f"📂 Analizando {archivo} - Hoja: {hoja}\n")
 
-# Leer la hoja correcta con header=1 (fila 2 son los encabezados)
-df = pd.read_excel(archivo, sheet_name=hoja, header=1)
+# Solo leemos las primeras filas en modo streaming (cabeceras en la fila 2);
+# el total de filas sale de las dimensiones de la hoja sin cargarla entera
+df = next(leer_excel_por_bloques(archivo, tamano_bloque=10, hoja=hoja))
+libro = load_workbook(archivo, read_only=True)
+total_filas = max((libro[hoja].max_row or 0) - 2, 0)
+libro.close()
 
-print(f"✅ Datos cargados: {len(df)} filas x {len(df.columns)} columnas\n")
+print(f"✅ Datos: {total_filas} filas x {len(df.columns)} columnas\n")
 
 print("📋 TODAS LAS COLUMNAS DISPONIBLES:")
 print("="*60)
@@ -1,11 +1,15 @@
+import argparse
+import time
 import pandas as pd
 from sqlalchemy.orm import Session
-from app.database import SessionLocal, engine
+from app.database import SessionLocal, engine, migrar_bd
 from app.modules.crm import models
+from app.modules.cartera.importador import ImportadorCartera, HOJA_CARTERA, FILA_CABECERA, TAMANO_LOTE
+from app.modules.cartera.pipeline import importar_archivo
 from datetime import datetime
 
-# Asegurar tablas
-models.Base.metadata.create_all(bind=engine)
+# Asegurar tablas (migraciones pendientes)
+migrar_bd()
 
 def limpiar_fecha(fecha):
     """Convierte fechas de Excel al formato de Python"""
@@ -26,13 +30,14 @@ def limpiar_float(valor):
     except:
         return 0.0
 
-def importar_cartera():
+def importar_cartera(archivo: str = "cartera.xlsx"):
+    """Modo clásico fila a fila (una consulta y un commit por fila)"""
     db: Session = SessionLocal()
     print("🚀 Iniciando migración de cartera desde EXCEL...")
 
     try:
         # LEER EXCEL - Hoja correcta con header=1 (fila 2 son los encabezados)
-        df = pd.read_excel("cartera.xlsx", sheet_name="2-Contratos-Listado-energía", engine="openpyxl", header=1)
+        df = pd.read_excel(archivo, sheet_name=HOJA_CARTERA, engine="openpyxl", header=FILA_CABECERA)
         
         # Limpiar nombres de columnas (quitar espacios extra)
         df.columns = df.columns.str.strip()
@@ -168,5 +173,79 @@ def importar_cartera():
     finally:
         db.close()
 
+def importar_cartera_masivo(archivo: str = "cartera.xlsx", tamano_lote: int = TAMANO_LOTE, informe_rechazos: str = None):
+    """
+    Modo masivo: limpieza vectorizada + INSERT por lotes (ver app/modules/cartera/importador.py)
+    Pensado para carteras de decenas de miles de filas.
+    """
+    print("🚀 Iniciando migración MASIVA de cartera desde EXCEL...")
+    inicio = time.perf_counter()
+
+    try:
+        df = pd.read_excel(archivo, sheet_name=HOJA_CARTERA, engine="openpyxl", header=FILA_CABECERA)
+        df.columns = df.columns.str.strip()
+        print(f"📊 Archivo cargado: {len(df)} filas x {len(df.columns)} columnas "
+              f"({time.perf_counter() - inicio:.1f}s)")
+
+        if "CIF/NIF" not in df.columns or "CUPS" not in df.columns:
+            print("❌ ERROR: No encuentro las columnas 'CIF/NIF' o 'CUPS'.")
+            print(f"Columnas disponibles: {list(df.columns)}")
+            return None
+
+        importador = ImportadorCartera(engine, tamano_lote=tamano_lote)
+        resumen = importador.importar(df)
+        resumen.imprimir()
+
+        informe = informe_rechazos or f"rechazos_cartera_{datetime.now():%Y%m%d_%H%M%S}.csv"
+        importador.volcar_rechazos(informe)
+        print(f"📝 Informe de rechazos: {informe} ({importador.total_rechazos} filas)")
+        print(f"⏱️  Tiempo total: {time.perf_counter() - inicio:.1f}s")
+        return resumen
+
+    except Exception as e:
+        print(f"❌ Error crítico en la importación masiva: {e}")
+        return None
+
+
+def importar_cartera_streaming(archivo: str = "cartera.xlsx", tamano_lote: int = TAMANO_LOTE,
+                               informe_rechazos: str = None, reanudar: bool = True):
+    """
+    Modo streaming: lee el fichero (.xlsx, .csv o .parquet) por bloques con memoria acotada
+    y, si se interrumpe, la siguiente ejecución continúa desde el último bloque confirmado.
+    """
+    print("🚀 Iniciando migración de cartera en STREAMING...")
+    inicio = time.perf_counter()
+    informe = informe_rechazos or f"rechazos_cartera_{datetime.now():%Y%m%d_%H%M%S}.csv"
+
+    try:
+        resumen = importar_archivo(engine, archivo, tamano_lote, reanudar=reanudar, informe_rechazos=informe)
+        if resumen is None:
+            print("ℹ️  Este fichero ya estaba importado por completo (usa --desde-cero para repetir)")
+            return None
+        resumen.imprimir()
+        print(f"📝 Informe de rechazos: {informe}")
+        print(f"⏱️  Tiempo total: {time.perf_counter() - inicio:.1f}s")
+        return resumen
+
+    except Exception as e:
+        print(f"❌ Error crítico en la importación (se reanudará desde el último bloque confirmado): {e}")
+        return None
+
+
 if __name__ == "__main__":
-    importar_cartera()
+    parser = argparse.ArgumentParser(description="Importa la cartera de contratos desde Excel")
+    parser.add_argument("archivo", nargs="?", default="cartera.xlsx")
+    parser.add_argument("--modo", choices=["masivo", "streaming", "filas"], default="masivo",
+                        help="masivo: INSERT por lotes (por defecto); streaming: por bloques y reanudable; "
+                             "filas: importador clásico fila a fila")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE, help="Filas por transacción")
+    parser.add_argument("--rechazos", help="Ruta del CSV con las filas rechazadas")
+    parser.add_argument("--desde-cero", action="store_true", help="streaming: ignorar el punto de control")
+    args = parser.parse_args()
+
+    if args.modo == "filas":
+        importar_cartera(args.archivo)
+    elif args.modo == "streaming":
+        importar_cartera_streaming(args.archivo, args.lote, args.rechazos, reanudar=not args.desde_cero)
+    else:
+        importar_cartera_masivo(args.archivo, args.lote, args.rechazos)
@@ -3,84 +3,36 @@ Script para importar datos desde Dynamics 365 a la base de datos local
 Importa cuentas (clientes), contactos y oportunidades
 """
 from sqlalchemy.orm import Session
-from app.database import SessionLocal, engine
+from app.database import SessionLocal, migrar_bd
 from app.modules.crm import models
 from app.modules.dynamics365.connector import Dynamics365Connector
+from app.modules.dynamics365.sync import sincronizar_entidad, MODO_FULL, MODO_DELTA
 from datetime import datetime
+from typing import Callable, Optional
 import logging
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Asegurar que las tablas existen
-models.Base.metadata.create_all(bind=engine)
+# Asegurar que las tablas existen (migraciones pendientes)
+migrar_bd()
 
 
-def importar_cuentas(dynamics: Dynamics365Connector, db: Session):
-    """Importa cuentas (clientes) desde Dynamics 365"""
-    logger.info("📊 Importando cuentas desde Dynamics 365...")
+def importar_cuentas(dynamics: Dynamics365Connector, db: Session, modo: str = MODO_DELTA):
+    """Sincroniza cuentas (clientes) desde Dynamics 365 (ver app/modules/dynamics365/sync.py)"""
+    logger.info(f"📊 Importando cuentas desde Dynamics 365 (modo {modo})...")
     
     try:
-        # Obtener todas las cuentas activas
-        accounts = dynamics.get_accounts(active_only=True)
-        logger.info(f"✅ Se obtuvieron {len(accounts)} cuentas de Dynamics 365")
-        
-        clientes_nuevos = 0
-        clientes_actualizados = 0
-        
-        for account in accounts:
-            try:
-                # Usar el número de cuenta o el ID como identificador único
-                identificador = account.get("accountnumber") or account.get("accountid")
-                
-                if not identificador:
-                    continue
-                
-                # Buscar si ya existe el cliente
-                cliente = db.query(models.Cliente).filter(
-                    models.Cliente.nif_cif == identificador
-                ).first()
-                
-                datos_cliente = {
-                    "nombre": account.get("name", "Desconocido"),
-                    "nif_cif": identificador,
-                    "email": account.get("emailaddress1", ""),
-                    "telefono": account.get("telephone1", ""),
-                    "direccion": account.get("address1_line1", ""),
-                    "ciudad": account.get("address1_city", ""),
-                    "codigo_postal": account.get("address1_postalcode", ""),
-                    "provincia": account.get("address1_stateorprovince", ""),
-                    "tipo_cliente": "Dynamics 365"
-                }
-                
-                if not cliente:
-                    # Crear nuevo cliente
-                    cliente = models.Cliente(**datos_cliente)
-                    db.add(cliente)
-                    clientes_nuevos += 1
-                else:
-                    # Actualizar cliente existente
-                    for key, value in datos_cliente.items():
-                        if value:  # Solo actualizar si hay valor
-                            setattr(cliente, key, value)
-                    clientes_actualizados += 1
-                
-                if (clientes_nuevos + clientes_actualizados) % 50 == 0:
-                    db.commit()
-                    logger.info(f"⏳ Procesados {clientes_nuevos + clientes_actualizados} clientes...")
-                    
-            except Exception as e:
-                logger.warning(f"⚠️ Error procesando cuenta {account.get('name')}: {str(e)}")
-                continue
-        
-        db.commit()
+        resultado = sincronizar_entidad(dynamics, db, "accounts", modo)
         
         logger.info(f"\n{'='*80}")
-        logger.info(f"✅ CUENTAS IMPORTADAS:")
-        logger.info(f"   • Clientes nuevos: {clientes_nuevos}")
-        logger.info(f"   • Clientes actualizados: {clientes_actualizados}")
+        logger.info(f"✅ CUENTAS IMPORTADAS ({resultado.modo}):")
+        logger.info(f"   • Clientes nuevos: {resultado.nuevos}")
+        logger.info(f"   • Clientes actualizados: {resultado.actualizados}")
+        logger.info(f"   • Clientes desactivados/borrados: {resultado.desactivados}")
         logger.info(f"{'='*80}\n")
+        return resultado
         
     except Exception as e:
         logger.error(f"❌ Error importando cuentas: {str(e)}")
@@ -88,71 +40,20 @@ def importar_cuentas(dynamics: Dynamics365Connector, db: Session):
         raise
 
 
-def importar_contactos(dynamics: Dynamics365Connector, db: Session):
-    """Importa contactos desde Dynamics 365"""
-    logger.info("📊 Importando contactos desde Dynamics 365...")
+def importar_contactos(dynamics: Dynamics365Connector, db: Session, modo: str = MODO_DELTA):
+    """Sincroniza contactos desde Dynamics 365 (ver app/modules/dynamics365/sync.py)"""
+    logger.info(f"📊 Importando contactos desde Dynamics 365 (modo {modo})...")
     
     try:
-        # Obtener todos los contactos activos
-        contacts = dynamics.get_contacts(active_only=True)
-        logger.info(f"✅ Se obtuvieron {len(contacts)} contactos de Dynamics 365")
-        
-        contactos_nuevos = 0
-        contactos_actualizados = 0
-        
-        for contact in contacts:
-            try:
-                email = contact.get("emailaddress1", "").strip()
-                
-                if not email:
-                    continue
-                
-                # Buscar si ya existe el cliente por email
-                cliente = db.query(models.Cliente).filter(
-                    models.Cliente.email == email
-                ).first()
-                
-                nombre_completo = contact.get("fullname") or \
-                                f"{contact.get('firstname', '')} {contact.get('lastname', '')}".strip()
-                
-                datos_contacto = {
-                    "nombre": nombre_completo or "Sin nombre",
-                    "email": email,
-                    "telefono": contact.get("telephone1") or contact.get("mobilephone", ""),
-                    "persona_contacto": nombre_completo,
-                    "tipo_cliente": "Contacto D365"
-                }
-                
-                if not cliente:
-                    # Crear nuevo cliente desde contacto
-                    cliente = models.Cliente(
-                        nif_cif=contact.get("contactid", ""),
-                        **datos_contacto
-                    )
-                    db.add(cliente)
-                    contactos_nuevos += 1
-                else:
-                    # Actualizar datos de contacto
-                    for key, value in datos_contacto.items():
-                        if value:
-                            setattr(cliente, key, value)
-                    contactos_actualizados += 1
-                
-                if (contactos_nuevos + contactos_actualizados) % 50 == 0:
-                    db.commit()
-                    logger.info(f"⏳ Procesados {contactos_nuevos + contactos_actualizados} contactos...")
-                    
-            except Exception as e:
-                logger.warning(f"⚠️ Error procesando contacto: {str(e)}")
-                continue
-        
-        db.commit()
+        resultado = sincronizar_entidad(dynamics, db, "contacts", modo)
         
         logger.info(f"\n{'='*80}")
-        logger.info(f"✅ CONTACTOS IMPORTADOS:")
-        logger.info(f"   • Contactos nuevos: {contactos_nuevos}")
-        logger.info(f"   • Contactos actualizados: {contactos_actualizados}")
+        logger.info(f"✅ CONTACTOS IMPORTADOS ({resultado.modo}):")
+        logger.info(f"   • Contactos nuevos: {resultado.nuevos}")
+        logger.info(f"   • Contactos actualizados: {resultado.actualizados}")
+        logger.info(f"   • Contactos desactivados/borrados: {resultado.desactivados}")
         logger.info(f"{'='*80}\n")
+        return resultado
         
     except Exception as e:
         logger.error(f"❌ Error importando contactos: {str(e)}")
@@ -188,9 +89,19 @@ def importar_oportunidades(dynamics: Dynamics365Connector, db: Session):
         raise
 
 
-def importar_todo():
-    """Ejecuta la importación completa desde Dynamics 365"""
-    db = SessionLocal()
+def importar_todo(modo: str = MODO_DELTA, db: Optional[Session] = None,
+                  al_avanzar: Optional[Callable[[float, str], None]] = None, lanzar_errores: bool = False):
+    """
+    Ejecuta la importación desde Dynamics 365
+    modo="delta" (por defecto) solo aplica lo cambiado desde la última ejecución;
+    modo="full" vuelve a descargar todo.
+    Como trabajo en segundo plano (app/modules/trabajos) recibe la sesión, al_avanzar(fracción, mensaje)
+    y lanzar_errores=True para que el fallo quede en el trabajo. Devuelve el ResultadoSync de cada entidad.
+    """
+    sesion_propia = db is None
+    db = db or SessionLocal()
+    al_avanzar = al_avanzar or (lambda fraccion, mensaje: None)
+    resultados = {}
     
     try:
         logger.info("🚀 INICIANDO IMPORTACIÓN DESDE DYNAMICS 365")
@@ -200,12 +111,15 @@ def importar_todo():
         dynamics = Dynamics365Connector()
         
         # Importar cuentas
-        importar_cuentas(dynamics, db)
+        al_avanzar(0.0, "Importando cuentas")
+        resultados["accounts"] = importar_cuentas(dynamics, db, modo)
         
         # Importar contactos
-        importar_contactos(dynamics, db)
+        al_avanzar(0.45, "Importando contactos")
+        resultados["contacts"] = importar_contactos(dynamics, db, modo)
         
         # Importar oportunidades (opcional, solo para mostrar)
+        al_avanzar(0.9, "Consultando oportunidades")
         importar_oportunidades(dynamics, db)
         
         logger.info("\n" + "="*80)
@@ -219,8 +133,12 @@ def importar_todo():
         logger.error("  2. La aplicación tiene permisos en Azure AD")
         logger.error("  3. La URL de Dynamics 365 es correcta")
         logger.error("  4. Tienes conexión a internet")
+        if lanzar_errores:
+            raise
     finally:
-        db.close()
+        if sesion_propia:
+            db.close()
+    return resultados
 
 
 def test_conexion():
@@ -247,11 +165,20 @@ def test_conexion():
 
 
 if __name__ == "__main__":
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Importa cuentas y contactos desde Dynamics 365")
+    parser.add_argument("--test", action="store_true", help="Solo probar la conexión")
+    grupo = parser.add_mutually_exclusive_group()
+    grupo.add_argument("--full", dest="modo", action="store_const", const=MODO_FULL,
+                       help="Descargar todo de nuevo")
+    grupo.add_argument("--delta", dest="modo", action="store_const", const=MODO_DELTA,
+                       help="Solo cambios desde la última sincronización (por defecto)")
+    parser.set_defaults(modo=MODO_DELTA)
+    args = parser.parse_args()
     
-    if len(sys.argv) > 1 and sys.argv[1] == "--test":
+    if args.test:
         # Modo de prueba
         test_conexion()
     else:
-        # Importación completa
-        importar_todo()
+        importar_todo(args.modo)
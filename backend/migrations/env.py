@@ -0,0 +1,76 @@
+"""
+Entorno de Alembic: esquema = modelos de app/modules/crm/models.py, conexión = DATABASE_URL
+Lo usan tanto la línea de comandos (alembic upgrade head) como migrar_bd() al arrancar la API,
+que pasa su propia conexión en config.attributes["connection"].
+Una base de datos de antes de las migraciones (create_all, sin tabla alembic_version) se marca
+con la revisión del esquema inicial y sigue desde ahí.
+"""
+from logging.config import fileConfig
+
+from alembic import context
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect, make_url, text
+
+from app.database import engine, SQLALCHEMY_DATABASE_URL
+from app.modules.crm import models
+
+config = context.config
+if config.config_file_name is not None and not config.attributes.get("connection"):
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = models.Base.metadata
+
+# Si arrancan varios workers a la vez, solo uno migra; el resto espera a que termine
+CLAVE_BLOQUEO_POSTGRES = 7_202_501
+REVISION_INICIAL = "0001"
+
+
+def _configurar(dialecto: str, **opciones):
+    context.configure(
+        target_metadata=target_metadata,
+        # SQLite no sabe hacer la mayoría de ALTER TABLE: Alembic recrea la tabla ("batch")
+        render_as_batch=dialecto == "sqlite",
+        compare_type=True,
+        **opciones,
+    )
+
+
+def run_migrations_offline() -> None:
+    """alembic upgrade head --sql: genera el SQL sin conectarse"""
+    _configurar(make_url(SQLALCHEMY_DATABASE_URL).get_backend_name(), url=SQLALCHEMY_DATABASE_URL,
+                literal_binds=True, dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def _migrar(connection) -> None:
+    postgres = connection.dialect.name == "postgresql"
+    if postgres:
+        connection.execute(text("SELECT pg_advisory_lock(:clave)"), {"clave": CLAVE_BLOQUEO_POSTGRES})
+        connection.commit()
+    try:
+        _configurar(connection.dialect.name, connection=connection)
+        with context.begin_transaction():
+            tablas = inspect(connection).get_table_names()
+            if "alembic_version" not in tablas and "clientes" in tablas:
+                context.get_context().stamp(ScriptDirectory.from_config(config), REVISION_INICIAL)
+            context.run_migrations()
+    finally:
+        if postgres:
+            connection.execute(text("SELECT pg_advisory_unlock(:clave)"), {"clave": CLAVE_BLOQUEO_POSTGRES})
+            connection.commit()
+
+
+def run_migrations_online() -> None:
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _migrar(connection)
+        return
+    with engine.connect() as connection:
+        _migrar(connection)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,202 @@
+"""esquema inicial
+
+Las tablas tal y como las creaba models.Base.metadata.create_all antes de las migraciones
+(el esquema de partida, sin nada de lo añadido después). Es exactamente lo que tiene una
+base de datos de entonces: migrar_bd() la marca con esta revisión (stamp, migrations/env.py)
+en vez de ejecutarla, y sigue desde aquí.
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 00:39:59.462051
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('clientes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('nombre', sa.String(), nullable=True),
+    sa.Column('nif_cif', sa.String(), nullable=True),
+    sa.Column('persona_contacto', sa.String(), nullable=True),
+    sa.Column('email', sa.String(), nullable=True),
+    sa.Column('telefono', sa.String(), nullable=True),
+    sa.Column('iban', sa.String(), nullable=True),
+    sa.Column('tipo_cliente', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_clientes_email'), 'clientes', ['email'], unique=False)
+    op.create_index(op.f('ix_clientes_id'), 'clientes', ['id'], unique=False)
+    op.create_index(op.f('ix_clientes_nif_cif'), 'clientes', ['nif_cif'], unique=True)
+    op.create_index(op.f('ix_clientes_nombre'), 'clientes', ['nombre'], unique=False)
+
+    op.create_table('tarifas',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('nombre', sa.String(), nullable=True),
+    sa.Column('compania', sa.String(), nullable=True),
+    sa.Column('precio_potencia', sa.Float(), nullable=True),
+    sa.Column('precio_energia', sa.Float(), nullable=True),
+    sa.Column('tipo', sa.String(), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_tarifas_compania'), 'tarifas', ['compania'], unique=False)
+    op.create_index(op.f('ix_tarifas_id'), 'tarifas', ['id'], unique=False)
+    op.create_index(op.f('ix_tarifas_nombre'), 'tarifas', ['nombre'], unique=False)
+
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email', sa.String(), nullable=True),
+    sa.Column('hashed_password', sa.String(), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.Column('role', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
+    op.create_index(op.f('ix_users_id'), 'users', ['id'], unique=False)
+
+    op.create_table('documentos',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tipo', sa.String(), nullable=True),
+    sa.Column('nombre_archivo', sa.String(), nullable=True),
+    sa.Column('url_archivo', sa.String(), nullable=True),
+    sa.Column('uploaded_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('cliente_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['cliente_id'], ['clientes.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_documentos_id'), 'documentos', ['id'], unique=False)
+
+    op.create_table('facturas',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('monto', sa.Float(), nullable=True),
+    sa.Column('concepto', sa.String(), nullable=True),
+    sa.Column('estado', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('cliente_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['cliente_id'], ['clientes.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_facturas_id'), 'facturas', ['id'], unique=False)
+
+    op.create_table('puntos_suministro',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cups', sa.String(length=22), nullable=True),
+    sa.Column('direccion', sa.String(), nullable=True),
+    sa.Column('codigo_postal', sa.String(), nullable=True),
+    sa.Column('provincia', sa.String(), nullable=True),
+    sa.Column('tarifa_acceso', sa.String(), nullable=True),
+    sa.Column('distribuidora', sa.String(), nullable=True),
+    sa.Column('cliente_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['cliente_id'], ['clientes.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_puntos_suministro_cups'), 'puntos_suministro', ['cups'], unique=True)
+    op.create_index(op.f('ix_puntos_suministro_id'), 'puntos_suministro', ['id'], unique=False)
+
+    op.create_table('tickets',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('asunto', sa.String(), nullable=True),
+    sa.Column('descripcion', sa.String(), nullable=True),
+    sa.Column('prioridad', sa.String(), nullable=True),
+    sa.Column('estado', sa.String(), nullable=True),
+    sa.Column('fecha_creacion', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('cliente_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['cliente_id'], ['clientes.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_tickets_id'), 'tickets', ['id'], unique=False)
+
+    op.create_table('contratos',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('fecha_firma', sa.Date(), nullable=True),
+    sa.Column('fecha_inicio', sa.Date(), nullable=True),
+    sa.Column('fecha_fin', sa.Date(), nullable=True),
+    sa.Column('comercializadora', sa.String(), nullable=True),
+    sa.Column('producto', sa.String(), nullable=True),
+    sa.Column('p1', sa.Float(), nullable=True),
+    sa.Column('p2', sa.Float(), nullable=True),
+    sa.Column('p3', sa.Float(), nullable=True),
+    sa.Column('p4', sa.Float(), nullable=True),
+    sa.Column('p5', sa.Float(), nullable=True),
+    sa.Column('p6', sa.Float(), nullable=True),
+    sa.Column('estado', sa.String(), nullable=True),
+    sa.Column('punto_suministro_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['punto_suministro_id'], ['puntos_suministro.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_contratos_id'), 'contratos', ['id'], unique=False)
+
+    op.create_table('mensajes_ticket',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('texto', sa.String(), nullable=True),
+    sa.Column('es_interno', sa.Boolean(), nullable=True),
+    sa.Column('autor', sa.String(), nullable=True),
+    sa.Column('fecha', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('ticket_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['ticket_id'], ['tickets.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_mensajes_ticket_id'), 'mensajes_ticket', ['id'], unique=False)
+
+    op.create_table('procesos_atr',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tipo', sa.String(), nullable=True),
+    sa.Column('codigo_solicitud', sa.String(), nullable=True),
+    sa.Column('estado_atr', sa.String(), nullable=True),
+    sa.Column('motivo_rechazo', sa.String(), nullable=True),
+    sa.Column('fecha_solicitud', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('contrato_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['contrato_id'], ['contratos.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_procesos_atr_id'), 'procesos_atr', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_procesos_atr_id'), table_name='procesos_atr')
+    op.drop_table('procesos_atr')
+
+    op.drop_index(op.f('ix_mensajes_ticket_id'), table_name='mensajes_ticket')
+    op.drop_table('mensajes_ticket')
+
+    op.drop_index(op.f('ix_contratos_id'), table_name='contratos')
+    op.drop_table('contratos')
+
+    op.drop_index(op.f('ix_tickets_id'), table_name='tickets')
+    op.drop_table('tickets')
+
+    op.drop_index(op.f('ix_puntos_suministro_id'), table_name='puntos_suministro')
+    op.drop_index(op.f('ix_puntos_suministro_cups'), table_name='puntos_suministro')
+    op.drop_table('puntos_suministro')
+
+    op.drop_index(op.f('ix_facturas_id'), table_name='facturas')
+    op.drop_table('facturas')
+
+    op.drop_index(op.f('ix_documentos_id'), table_name='documentos')
+    op.drop_table('documentos')
+
+    op.drop_index(op.f('ix_users_id'), table_name='users')
+    op.drop_index(op.f('ix_users_email'), table_name='users')
+    op.drop_table('users')
+
+    op.drop_index(op.f('ix_tarifas_nombre'), table_name='tarifas')
+    op.drop_index(op.f('ix_tarifas_id'), table_name='tarifas')
+    op.drop_index(op.f('ix_tarifas_compania'), table_name='tarifas')
+    op.drop_table('tarifas')
+
+    op.drop_index(op.f('ix_clientes_nombre'), table_name='clientes')
+    op.drop_index(op.f('ix_clientes_nif_cif'), table_name='clientes')
+    op.drop_index(op.f('ix_clientes_id'), table_name='clientes')
+    op.drop_index(op.f('ix_clientes_email'), table_name='clientes')
+    op.drop_table('clientes')
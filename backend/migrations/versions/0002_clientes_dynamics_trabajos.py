@@ -0,0 +1,151 @@
+"""clientes dynamics trabajos
+
+Lo que se añadió a los modelos después del esquema inicial, antes de las migraciones:
+  • clientes: dirección, ciudad, código postal, provincia y dynamics_id;
+    contratos.dynamics_id; tarifas.tipo si falta (está en 0001, pero no en todas las bases de
+    datos de antes de las migraciones)
+  • tablas nuevas: cola de escritura y estado de sincronización con Dynamics 365,
+    puntos de control de la importación de cartera y trabajos en segundo plano
+  • índices de los filtros de los listados (facturas, tickets, clientes)
+Una base de datos creada con create_all en algún punto intermedio ya tiene parte de esto:
+las columnas se añaden solo si faltan y tablas e índices llevan if_not_exists.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:40:12.804417
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (tabla, columna)
+COLUMNAS = [
+    ('clientes', 'direccion'),
+    ('clientes', 'ciudad'),
+    ('clientes', 'codigo_postal'),
+    ('clientes', 'provincia'),
+    ('clientes', 'dynamics_id'),
+    ('contratos', 'dynamics_id'),
+    ('tarifas', 'tipo'),
+]
+
+# (nombre, tabla, columnas, único)
+INDICES = [
+    ('ix_clientes_created_at', 'clientes', ['created_at'], False),
+    ('ix_clientes_dynamics_id', 'clientes', ['dynamics_id'], True),
+    ('ix_clientes_tipo_cliente', 'clientes', ['tipo_cliente'], False),
+    ('ix_contratos_dynamics_id', 'contratos', ['dynamics_id'], True),
+    ('ix_facturas_cliente_id', 'facturas', ['cliente_id'], False),
+    ('ix_facturas_created_at', 'facturas', ['created_at'], False),
+    ('ix_facturas_estado', 'facturas', ['estado'], False),
+    ('ix_tickets_cliente_id', 'tickets', ['cliente_id'], False),
+    ('ix_tickets_estado', 'tickets', ['estado'], False),
+    ('ix_tickets_fecha_creacion', 'tickets', ['fecha_creacion'], False),
+    ('ix_cola_dynamics365_estado_siguiente', 'cola_dynamics365', ['estado', 'siguiente_intento'], False),
+    ('ix_cola_dynamics365_id', 'cola_dynamics365', ['id'], False),
+    ('ix_cola_dynamics365_registro_id', 'cola_dynamics365', ['registro_id'], False),
+    ('ix_importaciones_cartera_huella', 'importaciones_cartera', ['huella'], True),
+    ('ix_importaciones_cartera_id', 'importaciones_cartera', ['id'], False),
+    ('ix_sincronizacion_d365_entidad', 'sincronizacion_d365', ['entidad'], True),
+    ('ix_sincronizacion_d365_id', 'sincronizacion_d365', ['id'], False),
+    ('ix_trabajos_estado_created', 'trabajos', ['estado', 'created_at'], False),
+    ('ix_trabajos_id', 'trabajos', ['id'], False),
+    ('ix_trabajos_tipo', 'trabajos', ['tipo'], False),
+]
+
+TABLAS = ['cola_dynamics365', 'importaciones_cartera', 'sincronizacion_d365', 'trabajos']
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for tabla, columna in COLUMNAS:
+        if columna not in {c['name'] for c in inspector.get_columns(tabla)}:
+            op.add_column(tabla, sa.Column(columna, sa.String(), nullable=True))
+
+    op.create_table('cola_dynamics365',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tabla', sa.String(), nullable=True),
+    sa.Column('registro_id', sa.Integer(), nullable=True),
+    sa.Column('operacion', sa.String(), nullable=True),
+    sa.Column('estado', sa.String(), nullable=True),
+    sa.Column('intentos', sa.Integer(), nullable=True),
+    sa.Column('siguiente_intento', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('ultimo_error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('enviado_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+
+    op.create_table('importaciones_cartera',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('archivo', sa.String(), nullable=True),
+    sa.Column('huella', sa.String(length=64), nullable=True),
+    sa.Column('filas_confirmadas', sa.Integer(), nullable=True),
+    sa.Column('estado', sa.String(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+
+    op.create_table('sincronizacion_d365',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entidad', sa.String(), nullable=True),
+    sa.Column('delta_link', sa.String(), nullable=True),
+    sa.Column('ultima_modificacion', sa.String(), nullable=True),
+    sa.Column('ultimo_modo', sa.String(), nullable=True),
+    sa.Column('ultima_ejecucion', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('registros_cambiados', sa.Integer(), nullable=True),
+    sa.Column('registros_borrados', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+
+    op.create_table('trabajos',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tipo', sa.String(), nullable=True),
+    sa.Column('estado', sa.String(), nullable=True),
+    sa.Column('parametros', sa.JSON(), nullable=True),
+    sa.Column('progreso', sa.Float(), nullable=True),
+    sa.Column('mensaje', sa.String(), nullable=True),
+    sa.Column('resultado', sa.JSON(), nullable=True),
+    sa.Column('archivo', sa.String(), nullable=True),
+    sa.Column('archivo_nombre', sa.String(), nullable=True),
+    sa.Column('archivo_tipo', sa.String(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('intentos', sa.Integer(), nullable=True),
+    sa.Column('reservado_hasta', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('usuario_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('iniciado_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('terminado_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['usuario_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+
+    for nombre, tabla, columnas, unico in INDICES:
+        op.create_index(nombre, tabla, columnas, unique=unico, if_not_exists=True)
+
+
+def downgrade() -> None:
+    for nombre, tabla, _, _ in reversed(INDICES):
+        op.drop_index(nombre, table_name=tabla, if_exists=True)
+    for tabla in reversed(TABLAS):
+        op.drop_table(tabla)
+    por_tabla = {}
+    for tabla, columna in COLUMNAS:
+        if tabla != 'tarifas':  # tipo ya está en el esquema inicial
+            por_tabla.setdefault(tabla, []).append(columna)
+    # SQLite no sabe borrar columnas con ALTER TABLE: batch recrea la tabla (una vez por tabla)
+    for tabla, columnas in por_tabla.items():
+        with op.batch_alter_table(tabla) as batch_op:
+            for columna in columnas:
+                batch_op.drop_column(columna)
@@ -0,0 +1,75 @@
+"""indices consultas frecuentes
+
+Índices para las consultas más pedidas (comprobados con EXPLAIN en benchmarks/verificar_indices.py):
+  • ventana de renovaciones y KPIs de contratos: índices parciales sobre los contratos activos
+  • búsquedas por cliente: puntos de suministro, contratos de un CUPS, documentos, facturas
+  • hilo de un ticket (mensajes ordenados por fecha) y proceso ATR de un contrato
+Los índices de facturas por cliente_id y por estado se sustituyen por (cliente_id, id) y
+(estado, id), que además dan el orden de la paginación (ORDER BY id DESC).
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:40:33.305132
+"""
+from contextlib import nullcontext
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SOLO_ACTIVOS = sa.text("estado = 'Activo'")
+
+# (nombre, tabla, columnas, condición del índice parcial)
+NUEVOS = [
+    ("ix_contratos_activos_fecha_fin", "contratos", ["fecha_fin"], SOLO_ACTIVOS),
+    ("ix_contratos_activos_comercializadora", "contratos", ["comercializadora", "fecha_fin"], SOLO_ACTIVOS),
+    ("ix_contratos_punto_suministro_id", "contratos", ["punto_suministro_id"], None),
+    ("ix_puntos_suministro_cliente_id", "puntos_suministro", ["cliente_id"], None),
+    ("ix_documentos_cliente_id", "documentos", ["cliente_id"], None),
+    ("ix_facturas_cliente_id_id", "facturas", ["cliente_id", "id"], None),
+    ("ix_facturas_estado_id", "facturas", ["estado", "id"], None),
+    ("ix_mensajes_ticket_ticket_fecha", "mensajes_ticket", ["ticket_id", "fecha"], None),
+    ("ix_procesos_atr_contrato_id", "procesos_atr", ["contrato_id"], None),
+]
+SUSTITUIDOS = [
+    ("ix_facturas_cliente_id", "facturas", ["cliente_id"], None),
+    ("ix_facturas_estado", "facturas", ["estado"], None),
+]
+
+
+def _sin_transaccion(postgres: bool):
+    # PostgreSQL: CREATE INDEX CONCURRENTLY no bloquea las escrituras mientras se construye el
+    # índice (la tabla de contratos puede tener cientos de miles de filas), pero no admite transacción
+    return op.get_context().autocommit_block() if postgres else nullcontext()
+
+
+def _crear(indices, postgres: bool) -> None:
+    for nombre, tabla, columnas, condicion in indices:
+        # if_not_exists: una base de datos creada con create_all puede tener ya alguno
+        op.create_index(nombre, tabla, columnas, if_not_exists=True, postgresql_concurrently=postgres,
+                        sqlite_where=condicion, postgresql_where=condicion)
+
+
+def _borrar(indices, postgres: bool) -> None:
+    for nombre, tabla, _, _ in indices:
+        op.drop_index(nombre, table_name=tabla, if_exists=True, postgresql_concurrently=postgres)
+
+
+def upgrade() -> None:
+    postgres = op.get_bind().dialect.name == "postgresql"
+    with _sin_transaccion(postgres):
+        _crear(NUEVOS, postgres)
+        _borrar(SUSTITUIDOS, postgres)  # Después de crear los nuevos: nunca se queda sin índice
+
+
+def downgrade() -> None:
+    postgres = op.get_bind().dialect.name == "postgresql"
+    with _sin_transaccion(postgres):
+        _crear(SUSTITUIDOS, postgres)
+        _borrar(NUEVOS, postgres)
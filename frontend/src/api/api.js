@@ -41,4 +41,22 @@ api.interceptors.response.use(
   }
 );
 
+// Listados paginados (/clientes/, /facturas/, /tickets/): el backend devuelve como mucho
+// `limit` filas y la siguiente página en la cabecera X-Next-Cursor. Recorre todas las páginas
+// y devuelve la lista completa, como antes de la paginación.
+export const TAMANO_PAGINA = 1000; // LIMITE_MAXIMO del backend
+
+export async function obtenerTodo(url, params = {}) {
+  const filas = [];
+  let cursor = null;
+  do {
+    const res = await api.get(url, {
+      params: { ...params, limit: TAMANO_PAGINA, ...(cursor ? { cursor } : {}) },
+    });
+    filas.push(...res.data);
+    cursor = res.headers["x-next-cursor"];
+  } while (cursor);
+  return filas;
+}
+
 export default api;
@@ -16,7 +16,7 @@ import {
   UploadCloud,
   File as FileIcon,
 } from "lucide-react";
-import api from "../api/api";
+import api, { obtenerTodo } from "../api/api";
 
 // Componente Helper para Inputs
 const Input = ({
@@ -86,10 +86,9 @@ export default function ClientsList() {
   const [errors, setErrors] = useState({});
 
   const fetchClientes = () => {
-    api
-      .get("/clientes/")
-      .then((res) => {
-        setClientes(res.data);
+    obtenerTodo("/clientes/")
+      .then((data) => {
+        setClientes(data);
         setLoading(false);
       })
       .catch(console.error);
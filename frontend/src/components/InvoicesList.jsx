@@ -8,7 +8,7 @@ import {
   Square,
   Plus,
 } from "lucide-react";
-import api from "../api/api";
+import api, { obtenerTodo } from "../api/api";
 
 export default function InvoicesList() {
   const [facturas, setFacturas] = useState([]);
@@ -26,12 +26,12 @@ export default function InvoicesList() {
   useEffect(() => {
     const loadData = async () => {
       try {
-        const [resFacturas, resClientes] = await Promise.all([
-          api.get("/facturas/"),
-          api.get("/clientes/"),
+        const [facturasTodas, clientesTodos] = await Promise.all([
+          obtenerTodo("/facturas/"),
+          obtenerTodo("/clientes/"),
         ]);
-        setFacturas(resFacturas.data);
-        setClientes(resClientes.data);
+        setFacturas(facturasTodas);
+        setClientes(clientesTodos);
         setLoading(false);
       } catch (err) {
         console.error(err);
@@ -12,7 +12,7 @@ import {
   Search,
   Lock,
 } from "lucide-react";
-import api from "../api/api";
+import api, { obtenerTodo } from "../api/api";
 
 export default function SupportDesk() {
   const [tickets, setTickets] = useState([]);
@@ -37,8 +37,7 @@ export default function SupportDesk() {
     // Cargar Tickets Iniciales
     const fetchTickets = async () => {
       try {
-        const res = await api.get("/tickets/");
-        setTickets(res.data);
+        setTickets(await obtenerTodo("/tickets/"));
       } catch (e) {
         console.error(e);
       }
@@ -46,8 +45,7 @@ export default function SupportDesk() {
 
     // Cargar Clientes (para poder abrir ticket a alguien)
     const fetchClients = async () => {
-      const res = await api.get("/clientes/");
-      setClients(res.data);
+      setClients(await obtenerTodo("/clientes/"));
     };
 
     fetchTickets();
@@ -95,8 +93,7 @@ export default function SupportDesk() {
     });
     setIsModalOpen(false);
     // Recargar tickets
-    const res = await api.get("/tickets/");
-    setTickets(res.data);
+    setTickets(await obtenerTodo("/tickets/"));
     alert("Ticket creado correctamente");
   };
 